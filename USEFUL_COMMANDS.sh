@@ -99,8 +99,8 @@ echo "━━━━━━━━━━━━━━━━━━━━━━━━
 echo "💾 DONNÉES"
 echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
 echo ""
-echo "# Afficher les résultats d'extraction (CSV)"
-echo "head -20 resultats/extractions.csv"
+echo "# Afficher les derniers résultats d'extraction"
+echo "curl 'http://127.0.0.1:8000/api/v1/extractions?limit=20' | jq"
 echo ""
 echo "# Afficher les KPI brutes (JSONL)"
 echo "head -5 resultats/kpi.jsonl | jq ."
@@ -1,186 +1,360 @@
 #!/usr/bin/env python3
 """
-Script d'exemple pour analyser et visualiser les KPI.
-À exécuter après avoir lancé plusieurs tests via le pipeline.
+Analyse des KPI d'extraction : resultats/kpi.jsonl et ses fichiers tournés, compressés ou non
+(kpi.jsonl.1, kpi.jsonl.2.gz, kpi.jsonl-20250226.gz...).
+Les fichiers sont lus en flux, en une seule passe : la mémoire ne dépend pas du nombre d'extractions
+(percentiles par sketches de quantiles, ventilations par modèle et par fenêtre de temps en agrégats).
+
+Usage :
+  python analyze_kpi.py                              # kpi.jsonl et fichiers tournés
+  python analyze_kpi.py --window hour --windows 48   # ventilation par heure (hour, day, month)
+  python analyze_kpi.py archives/kpi-2025-*.jsonl.gz # fichiers explicites
+  python analyze_kpi.py --csv                        # export CSV (resultats/kpi_analysis.csv)
 """
 
+import argparse
+import csv
+import gzip
 import json
+from collections import Counter, defaultdict, deque
+from dataclasses import fields
 from pathlib import Path
-from datetime import datetime
-from collections import defaultdict
-
-
-def load_kpi_data():
-    """Charge les données KPI depuis le fichier JSONL."""
-    kpi_file = Path(__file__).parent / "resultats" / "kpi.jsonl"
-    if not kpi_file.exists():
-        print("Aucune donnée KPI trouvée. Lancez d'abord le pipeline.")
-        return []
-
-    kpis = []
-    with open(kpi_file, "r") as f:
-        for line in f:
-            if line.strip():
-                kpis.append(json.loads(line))
-
-    return kpis
-
-
-def analyze_kpi(kpis):
-    """Analyse les KPI collectées."""
-    if not kpis:
-        print("Pas de données à analyser.")
-        return
+from typing import IO, Iterator, Optional
+
+from pydantic import ValidationError
+
+from app.monitoring.aggregates import QuantileSketch
+from app.monitoring.kpi import ExtractionKPI
+from app.monitoring.pricing import model_entry, usage_cost
+
+KPI_FILE = Path(__file__).parent / "resultats" / "kpi.jsonl"
+CSV_FILE = Path(__file__).parent / "resultats" / "kpi_analysis.csv"
+
+PERCENTILES = (50, 90, 95, 99)
+# Fenêtres de temps : nom -> longueur du préfixe de l'horodatage ISO (2025-02-26T14:05:...)
+WINDOW_PREFIXES = {"hour": 13, "day": 10, "month": 7}
+# Nombre de fichiers listés (les plus récents) pour les échecs et les revues manuelles
+LISTED_FILES = 5
+CSV_COLUMNS = [f.name for f in fields(ExtractionKPI)]
+_TOKEN_KEYS = ("prompt_tokens", "completion_tokens", "cached_tokens")
+
+
+def kpi_files(kpi_file: Path) -> list[Path]:
+    """Fichier KPI et fichiers tournés (numérotés ou datés, .gz ou non), du plus ancien au plus récent."""
+    numbered, dated = [], []
+    for candidate in kpi_file.parent.glob(f"{kpi_file.name}[.-]*"):
+        suffix = candidate.name[len(kpi_file.name) + 1:].removesuffix(".gz")
+        if candidate.name[len(kpi_file.name)] == "-":
+            dated.append(candidate)
+        elif suffix.isdigit():
+            numbered.append((int(suffix), candidate))
+    files = [path for _, path in sorted(numbered, reverse=True)] + sorted(dated)
+    if kpi_file.exists():
+        files.append(kpi_file)
+    return files
+
+
+def _open(path: Path) -> IO[str]:
+    if path.name.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def iter_lines(files: list[Path]) -> Iterator[str]:
+    """Lignes non vides des fichiers KPI, lues fichier par fichier."""
+    for path in files:
+        with _open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield line
+
+
+def load_prices() -> dict[str, dict[str, float]]:
+    """Table LLM_PRICES de la configuration (table par défaut si l'environnement est incomplet)."""
+    from app.core.config import Settings, get_settings
+
+    try:
+        return get_settings().llm_prices
+    except ValidationError:
+        return Settings.model_fields["llm_prices"].default
+
+
+def _percentiles(sketch: QuantileSketch) -> dict[int, Optional[float]]:
+    return {p: sketch.quantile(p) for p in PERCENTILES}
+
+
+class _Group:
+    """Agrégats d'un groupe d'extractions (un modèle ou une fenêtre de temps)."""
+
+    def __init__(self):
+        self.count = 0
+        self.successes = 0
+        self.reviews = 0
+        self.duration_sum = 0.0
+        self.cost_usd = 0.0
+        self.latency = QuantileSketch()
+
+    def add(self, duration_ms: float, cost_usd: float, success: bool, review: bool) -> None:
+        self.count += 1
+        self.successes += success
+        self.reviews += review
+        self.duration_sum += duration_ms
+        self.cost_usd += cost_usd
+        self.latency.add(duration_ms)
+
+
+class KPIReport:
+    """Agrégats des KPI en une passe (mémoire bornée : aucune extraction n'est conservée en liste)."""
+
+    def __init__(self, window: str = "day", prices: Optional[dict[str, dict[str, float]]] = None):
+        self.window = window
+        self._prefix = WINDOW_PREFIXES[window]
+        self.prices = prices if prices is not None else {}
+        self.invalid_lines = 0
+        self.all = _Group()
+        self.by_model: dict[str, _Group] = defaultdict(_Group)
+        self.windows: dict[str, _Group] = defaultdict(_Group)
+        self.call_counts: Counter = Counter()
+        self.error_types: Counter = Counter()
+        self.failed_files: deque = deque(maxlen=LISTED_FILES)
+        self.review_files: deque = deque(maxlen=LISTED_FILES)
+        self.last: deque = deque(maxlen=3)
+        self.attempts: dict[str, dict] = defaultdict(
+            lambda: {"calls": 0, "prompt": 0, "completion": 0, "cached": 0, "cost": 0.0}
+        )
+        self.cost = {"metered": 0, "measured_usd": 0.0, "incomplete": 0, "estimated": 0, "estimated_usd": 0.0}
+
+    def add_line(self, line: str) -> Optional[dict]:
+        """Intègre une ligne de kpi.jsonl ; retourne le KPI (None si la ligne est invalide)."""
+        try:
+            k = json.loads(line)
+            self.add(k)
+        except (ValueError, TypeError, KeyError, AttributeError):
+            self.invalid_lines += 1
+            return None
+        return k
+
+    def add(self, k: dict) -> None:
+        duration_ms = float(k["total_duration_ms"])
+        cost_usd = self._add_cost(k)
+        model = k.get("final_model_used") or "unknown"
+        success = bool(k.get("success"))
+        review = bool(k.get("needs_human_review"))
+
+        self.all.add(duration_ms, cost_usd, success, review)
+        self.by_model[model].add(duration_ms, cost_usd, success, review)
+        timestamp = k.get("timestamp")
+        if isinstance(timestamp, str) and len(timestamp) >= self._prefix:
+            self.windows[timestamp[: self._prefix]].add(duration_ms, cost_usd, success, review)
+
+        self.call_counts[k.get("llm_call_count") or 0] += 1
+        if k.get("error_type"):
+            self.error_types[k["error_type"]] += 1
+        if not success:
+            self.failed_files.append(k.get("filename"))
+        elif review:
+            self.review_files.append(k.get("filename"))
+        self.last.append((success, k.get("filename"), duration_ms, k.get("llm_call_count"), model, review))
+
+    def _add_cost(self, k: dict) -> float:
+        """
+        Coût de l'extraction : coût mesuré (cost_usd) s'il est enregistré, sinon estimé à partir des
+        tokens consommés et de LLM_PRICES (KPI antérieurs à la mesure du coût).
+        """
+        measured = "cost_usd" in k
+        attempts = k.get("llm_attempts") or []
+        if not attempts and not measured and k.get("prompt_tokens"):
+            # KPI sans détail par appel : tokens de l'extraction attribués au modèle final
+            attempts = [{key: k.get(key) for key in _TOKEN_KEYS} | {"model": k.get("final_model_used") or "unknown"}]
+
+        estimated_usd = 0.0
+        for attempt in attempts:
+            stats = self.attempts[attempt["model"]]
+            prompt, completion, cached = (attempt.get(key) or 0 for key in _TOKEN_KEYS)
+            stats["calls"] += 1
+            stats["prompt"] += prompt
+            stats["completion"] += completion
+            stats["cached"] += cached
+            cost = attempt.get("cost_usd")
+            if cost is None and model_entry(attempt["model"], self.prices) is not None:
+                cost = usage_cost(attempt["model"], prompt, completion, cached, self.prices)
+                estimated_usd += cost
+            stats["cost"] += cost or 0.0
+
+        if measured:
+            self.cost["metered"] += 1
+            self.cost["measured_usd"] += k["cost_usd"]
+            self.cost["incomplete"] += not k.get("cost_complete", True)
+            return k["cost_usd"]
+        if estimated_usd:
+            self.cost["estimated"] += 1
+            self.cost["estimated_usd"] += estimated_usd
+        return estimated_usd
+
+
+def _ms(value: Optional[float]) -> str:
+    return f"{value:.0f}" if value is not None else "-"
+
+
+def print_report(report: KPIReport, windows_shown: int = 14) -> None:
+    """Affiche l'analyse (statistiques globales, latence, modèles, fenêtres, erreurs, coûts)."""
+    total = report.all.count
+    successes = report.all.successes
+    reviews = report.all.reviews
 
     print("\n" + "=" * 60)
     print("ANALYSE DES KPI")
     print("=" * 60)
 
-    # Statistiques globales
-    total = len(kpis)
-    successes = sum(1 for k in kpis if k["success"])
-    reviews = sum(1 for k in kpis if k["needs_human_review"])
-    failures = sum(1 for k in kpis if not k["success"])
-
     print(f"\nSTATISTIQUES GLOBALES")
     print(f"  Total extractions          : {total}")
     print(f"  Succès                     : {successes}/{total} ({100*successes/total:.1f}%)")
-    print(f"  Écheccs                    : {failures}/{total}")
+    print(f"  Échecs                     : {total - successes}/{total}")
     print(f"  Revue manuelle requise     : {reviews}/{total} ({100*reviews/total:.1f}%)")
+    if report.invalid_lines:
+        print(f"  Lignes invalides ignorées  : {report.invalid_lines}")
 
-    # Latence
-    durations = [k["total_duration_ms"] for k in kpis]
-    print(f"\n⏱LATENCE (en ms)")
-    print(f"  Moyenne                    : {sum(durations)/len(durations):.0f} ms")
-    print(f"  Minimum                    : {min(durations):.0f} ms")
-    print(f"  Maximum                    : {max(durations):.0f} ms")
-    print(f"  Médiane                    : {sorted(durations)[len(durations)//2]:.0f} ms")
+    latency = report.all.latency
+    print(f"\n⏱LATENCE (en ms, percentiles à 1 % près)")
+    print(f"  Moyenne                    : {report.all.duration_sum/total:.0f} ms")
+    print(f"  Minimum                    : {latency.min:.0f} ms")
+    print(f"  Maximum                    : {latency.max:.0f} ms")
+    for p, value in _percentiles(latency).items():
+        print(f"  p{p:<26d}: {_ms(value)} ms")
 
-    # Appels LLM
     print(f"\nAPPELS LLM")
-    call_counts = defaultdict(int)
-    for k in kpis:
-        call_counts[k["llm_call_count"]] += 1
-
-    for call_count in sorted(call_counts.keys()):
-        percent = 100 * call_counts[call_count] / total
-        print(f"  {call_count} appel{'s' if call_count > 1 else ''}            : {call_counts[call_count]:3d} ({percent:5.1f}%)")
-
-    # Modèles utilisés
-    print(f"\nMODÈLES UTILISÉS")
-    models = defaultdict(int)
-    for k in kpis:
-        models[k["final_model_used"]] += 1
-
-    for model in sorted(models.keys()):
-        percent = 100 * models[model] / total
-        print(f"  {model:20s} : {models[model]:3d} ({percent:5.1f}%)")
-
-    # Erreurs
-    errors = [k for k in kpis if k["error_type"]]
-    if errors:
+    for call_count in sorted(report.call_counts):
+        percent = 100 * report.call_counts[call_count] / total
+        print(f"  {call_count} appel{'s' if call_count > 1 else ''}            : {report.call_counts[call_count]:3d} ({percent:5.1f}%)")
+
+    print(f"\nMODÈLES UTILISÉS (modèle final)")
+    for model in sorted(report.by_model):
+        group = report.by_model[model]
+        p = _percentiles(group.latency)
+        print(
+            f"  {model:20s} : {group.count:6d} ({100*group.count/total:5.1f}%) | succès {100*group.successes/group.count:5.1f}% "
+            f"| p50 {_ms(p[50])} ms | p95 {_ms(p[95])} ms | p99 {_ms(p[99])} ms | ${group.cost_usd:.4f}"
+        )
+
+    if report.windows:
+        keys = sorted(report.windows)[-windows_shown:]
+        print(f"\nPAR FENÊTRE ({report.window}, {len(keys)} dernières sur {len(report.windows)})")
+        for key in keys:
+            group = report.windows[key]
+            p = _percentiles(group.latency)
+            print(
+                f"  {key:13s} : {group.count:6d} | succès {100*group.successes/group.count:5.1f}% "
+                f"| revue {100*group.reviews/group.count:5.1f}% | p50 {_ms(p[50])} ms | p95 {_ms(p[95])} ms | ${group.cost_usd:.4f}"
+            )
+
+    if report.error_types:
         print(f"\nERREURS RENCONTRÉES")
-        error_types = defaultdict(int)
-        for err in errors:
-            error_types[err["error_type"]] += 1
-
-        for error_type in sorted(error_types.keys()):
-            print(f"  {error_type:30s} : {error_types[error_type]:3d}")
-
-    # Fichiers problématiques
-    failed_files = [k["filename"] for k in kpis if not k["success"]]
-    if failed_files:
-        print(f"\nFICHIERS ÉCHOUÉS")
-        for filename in failed_files:
+        for error_type in sorted(report.error_types):
+            print(f"  {error_type:30s} : {report.error_types[error_type]:3d}")
+
+    if report.failed_files:
+        print(f"\nFICHIERS ÉCHOUÉS ({len(report.failed_files)} derniers)")
+        for filename in report.failed_files:
             print(f"  - {filename}")
 
-    review_files = [k["filename"] for k in kpis if k["needs_human_review"] and k["success"]]
-    if review_files:
-        print(f"\n🔍 FICHIERS EN REVUE MANUELLE")
-        for filename in review_files[:5]:  # Affiche les 5 premiers
+    if report.review_files:
+        print(f"\n🔍 FICHIERS EN REVUE MANUELLE ({len(report.review_files)} derniers)")
+        for filename in report.review_files:
             print(f"  - {filename}")
 
-    # Dernières extractions
     print(f"\nDERNIÈRES EXTRACTIONS")
-    for k in kpis[-3:]:
-        status = "Yes" if k["success"] else "No"
-        review = " (revue)" if k["needs_human_review"] else ""
-        print(f"  {status} {k['filename']:30s} - {k['total_duration_ms']:6.0f}ms - {k['llm_call_count']}x {k['final_model_used']}{review}")
+    for success, filename, duration_ms, llm_call_count, model, needs_review in report.last:
+        status = "Yes" if success else "No"
+        review = " (revue)" if needs_review else ""
+        print(f"  {status} {filename!s:30s} - {duration_ms:6.0f}ms - {llm_call_count}x {model}{review}")
 
     print("\n" + "=" * 60)
+    print_cost(report)
 
 
-def cost_analysis(kpis):
-    """Analyse le coût OpenAI."""
-    if not kpis:
-        return
-
+def print_cost(report: KPIReport) -> None:
+    """Coût par modèle (tokens réellement consommés par appel) et coût total mesuré ou estimé."""
     print("\n" + "=" * 60)
     print("ANALYSE DES COÛTS")
     print("=" * 60)
 
-    # Répartition des appels
-    mini_calls = sum(1 for k in kpis if k["final_model_used"] == "gpt-4o-mini" or k["llm_call_count"] >= 1)
-    heavy_calls = sum(1 for k in kpis if k["final_model_used"] == "gpt-4o")
-
-    # Estimation tokens (approximatif)
-    print(f"\nRÉPARTITION DES MODÈLES")
-    print(f"  gpt-4o-mini appels         : ~{mini_calls} (économique)")
-    print(f"  gpt-4o appels (fallback)   : ~{heavy_calls} (coûteux)")
-
-    # Coûts (tarif avril 2024)
-    mini_input_cost_per_million = 0.15  # $ pour 1M tokens
-    mini_output_cost_per_million = 0.60
-
-    heavy_input_cost_per_million = 5.00
-    heavy_output_cost_per_million = 15.00
-
-    # Estimation : ~500 tokens par requête en moyenne
-    avg_tokens = 500
-
-    mini_estimated = (mini_calls * avg_tokens / 1_000_000) * (mini_input_cost_per_million + mini_output_cost_per_million)
-    heavy_estimated = (heavy_calls * avg_tokens / 1_000_000) * (heavy_input_cost_per_million + heavy_output_cost_per_million)
-    total_cost = mini_estimated + heavy_estimated
-
-    print(f"\nESTIMATION DE COÛTS")
-    print(f"  gpt-4o-mini                : ${mini_estimated:.3f}")
-    print(f"  gpt-4o (fallback)          : ${heavy_estimated:.3f}")
-    print(f"  TOTAL ESTIMÉ               : ${total_cost:.3f}")
-
-    print(f"\nCOÛT PAR EXTRACTION")
-    print(f"  Coût moyen                 : ${total_cost / len(kpis):.4f}/extraction")
+    print(f"\nAPPELS ET TOKENS PAR MODÈLE")
+    for model in sorted(report.attempts):
+        stats = report.attempts[model]
+        print(
+            f"  {model:20s} : {stats['calls']:4d} appels | prompt {stats['prompt']:9d} "
+            f"(cache {stats['cached']:8d}) | complétion {stats['completion']:8d} | ${stats['cost']:.4f}"
+        )
+
+    cost = report.cost
+    total_cost = cost["measured_usd"] + cost["estimated_usd"]
+    priced = cost["metered"] + cost["estimated"]
+    print(f"\nCOÛT")
+    print(f"  TOTAL                      : ${total_cost:.4f}")
+    if priced:
+        print(f"  Coût moyen                 : ${total_cost / priced:.5f}/extraction")
+    if cost["estimated"]:
+        print(
+            f"  Dont estimé (tokens × LLM_PRICES, KPI antérieurs) : ${cost['estimated_usd']:.4f} "
+            f"sur {cost['estimated']} extraction(s)"
+        )
+    if cost["incomplete"]:
+        print(f"  Coût partiel (modèle sans prix) : {cost['incomplete']} extraction(s)")
+    unpriced = report.all.count - priced
+    if unpriced:
+        print(f"  Extractions sans coût mesuré ni tokens : {unpriced}")
 
     print("\n" + "=" * 60)
 
 
-def export_csv(kpis):
-    """Exporte les KPI en CSV pour analyse."""
-    if not kpis:
-        return
-
-    csv_file = Path(__file__).parent / "resultats" / "kpi_analysis.csv"
-    csv_file.parent.mkdir(exist_ok=True)
-
-    import csv
-    with open(csv_file, "w", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=kpis[0].keys())
-        writer.writeheader()
-        writer.writerows(kpis)
+def _csv_row(k: dict) -> dict:
+    # Listes et dictionnaires (llm_attempts, stage_ms...) sérialisés en JSON
+    return {key: json.dumps(value, ensure_ascii=False) if isinstance(value, (list, dict)) else value for key, value in k.items()}
 
-    print(f"\nDonnées exportées en CSV : {csv_file}")
 
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Analyse des KPI d'extraction (lecture en flux).")
+    parser.add_argument("files", nargs="*", type=Path, help="Fichiers KPI (.jsonl ou .jsonl.gz) ; défaut : kpi.jsonl et fichiers tournés")
+    parser.add_argument("--file", type=Path, default=KPI_FILE, help="Fichier KPI courant (défaut : resultats/kpi.jsonl)")
+    parser.add_argument("--window", choices=sorted(WINDOW_PREFIXES), default="day", help="Granularité des fenêtres de temps")
+    parser.add_argument("--windows", type=int, default=14, help="Nombre de fenêtres affichées (les plus récentes)")
+    parser.add_argument("--csv", nargs="?", type=Path, const=CSV_FILE, help="Exporte les KPI en CSV (défaut : resultats/kpi_analysis.csv)")
+    args = parser.parse_args(argv)
 
-if __name__ == "__main__":
     print("\nAnalyse des KPI - AZO OCR Prototype\n")
-
-    kpis = load_kpi_data()
-
-    if kpis:
-        analyze_kpi(kpis)
-        cost_analysis(kpis)
-        export_csv(kpis)
-        print("\nConseil : Ouvrez 'resultats/kpi_analysis.csv' dans Excel pour plus d'analyse.")
-    else:
+    files = args.files or kpi_files(args.file)
+    if not files:
         print("Aucune donnée KPI disponible.")
         print("Lancez d'abord le pipeline :")
         print("  python test/test_pipeline.py")
+        return
+
+    report = KPIReport(window=args.window, prices=load_prices())
+    csv_out = None
+    if args.csv:
+        args.csv.parent.mkdir(parents=True, exist_ok=True)
+        csv_out = open(args.csv, "w", newline="", encoding="utf-8")
+    try:
+        # Colonnes du dataclass ExtractionKPI : les champs absents des KPI anciens restent vides
+        writer = csv.DictWriter(csv_out, fieldnames=CSV_COLUMNS, extrasaction="ignore") if csv_out else None
+        if writer:
+            writer.writeheader()
+        for line in iter_lines(files):
+            k = report.add_line(line)
+            if writer and k is not None:
+                writer.writerow(_csv_row(k))
+    finally:
+        if csv_out:
+            csv_out.close()
+
+    if not report.all.count:
+        print("Pas de données à analyser.")
+        return
+    print_report(report, args.windows)
+    if args.csv:
+        print(f"\nDonnées exportées en CSV : {args.csv}")
+        print("\nConseil : Ouvrez le CSV dans Excel pour plus d'analyse.")
+
+
+if __name__ == "__main__":
+    main()
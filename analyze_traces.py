@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Affiche les traces d'extraction les plus lentes en cascade (waterfall), à partir de
+resultats/traces.jsonl et de ses fichiers tournés (traces.jsonl.1, .2...).
+
+Usage :
+  python analyze_traces.py                 # 5 traces les plus lentes
+  python analyze_traces.py --top 10 --width 60
+  python analyze_traces.py --trace <trace_id ou X-Request-ID>
+"""
+
+import argparse
+import heapq
+import json
+from pathlib import Path
+from typing import Iterator, Optional
+
+TRACE_FILE = Path(__file__).parent / "resultats" / "traces.jsonl"
+
+
+def trace_files(trace_file: Path) -> list[Path]:
+    """Fichier de traces et fichiers tournés, du plus ancien au plus récent."""
+    rotated = []
+    for candidate in trace_file.parent.glob(f"{trace_file.name}.*"):
+        suffix = candidate.name[len(trace_file.name) + 1:]
+        if suffix.isdigit():
+            rotated.append((int(suffix), candidate))
+    files = [path for _, path in sorted(rotated, reverse=True)]
+    if trace_file.exists():
+        files.append(trace_file)
+    return files
+
+
+def iter_traces(files: list[Path]) -> Iterator[list[dict]]:
+    """Spans de chaque trace (une ligne OTLP/JSON par trace), lus fichier par fichier."""
+    for path in files:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    payload = json.loads(line)
+                except ValueError:
+                    continue  # ligne tronquée (écriture en cours)
+                spans = [
+                    span
+                    for resource in payload.get("resourceSpans", [])
+                    for scope in resource.get("scopeSpans", [])
+                    for span in scope.get("spans", [])
+                ]
+                if spans:
+                    yield spans
+
+
+def trace_duration_ms(spans: list[dict]) -> float:
+    start = min(int(span["startTimeUnixNano"]) for span in spans)
+    end = max(int(span["endTimeUnixNano"]) for span in spans)
+    return (end - start) / 1e6
+
+
+def _attributes(span: dict) -> dict:
+    values = {}
+    for attribute in span.get("attributes", []):
+        value = attribute.get("value", {})
+        values[attribute["key"]] = next(iter(value.values()), None)
+    return values
+
+
+def _request_id(spans: list[dict]) -> Optional[str]:
+    for span in spans:
+        request_id = _attributes(span).get("request.id")
+        if request_id:
+            return request_id
+    return None
+
+
+def slowest_traces(files: list[Path], top: int) -> list[tuple[float, list[dict]]]:
+    """Les top traces les plus longues (tas borné : mémoire constante quel que soit le volume)."""
+    heap: list[tuple[float, int, list[dict]]] = []
+    for index, spans in enumerate(iter_traces(files)):
+        item = (trace_duration_ms(spans), index, spans)
+        if len(heap) < top:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+    return [(duration, spans) for duration, _, spans in sorted(heap, reverse=True)]
+
+
+def find_trace(files: list[Path], trace_id: str) -> Optional[list[dict]]:
+    """Trace désignée par son trace_id ou son X-Request-ID."""
+    for spans in iter_traces(files):
+        if spans[0]["traceId"] == trace_id or _request_id(spans) == trace_id:
+            return spans
+    return None
+
+
+def render_waterfall(spans: list[dict], width: int = 40) -> str:
+    """Spans en arbre (parent puis enfants par ordre de début), avec barre positionnée dans la trace."""
+    start = min(int(span["startTimeUnixNano"]) for span in spans)
+    total_ns = max(max(int(span["endTimeUnixNano"]) for span in spans) - start, 1)
+    span_ids = {span["spanId"] for span in spans}
+    children: dict[str, list[dict]] = {}
+    roots = []
+    for span in sorted(spans, key=lambda s: int(s["startTimeUnixNano"])):
+        parent = span.get("parentSpanId") or ""
+        if parent in span_ids:
+            children.setdefault(parent, []).append(span)
+        else:
+            roots.append(span)
+
+    lines = [
+        f"Trace {spans[0]['traceId']}  request_id={_request_id(spans) or '-'}  durée {total_ns / 1e6:.0f} ms"
+    ]
+
+    def visit(span: dict, depth: int) -> None:
+        offset_ns = int(span["startTimeUnixNano"]) - start
+        duration_ns = int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])
+        begin = min(int(offset_ns / total_ns * width), width - 1)
+        length = max(1, round(duration_ns / total_ns * width))
+        bar = " " * begin + "#" * min(length, width - begin)
+        attributes = _attributes(span)
+        details = " ".join(
+            f"{key}={attributes[key]}" for key in ("model", "input_mode", "retry", "error_type") if key in attributes
+        )
+        status = " ERREUR" if span.get("status", {}).get("code") == 2 else ""
+        label = ("  " * depth + span["name"])[:40]
+        lines.append(
+            f"  {label:40s} {offset_ns / 1e6:8.0f} ms |{bar:{width}s}| {duration_ns / 1e6:8.0f} ms{status} {details}".rstrip()
+        )
+        for child in children.get(span["spanId"], []):
+            visit(child, depth + 1)
+
+    for root in roots:
+        visit(root, 0)
+    return "\n".join(lines)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Traces d'extraction les plus lentes (waterfall).")
+    parser.add_argument("--file", type=Path, default=TRACE_FILE, help="Fichier de traces (défaut : resultats/traces.jsonl)")
+    parser.add_argument("--top", type=int, default=5, help="Nombre de traces affichées")
+    parser.add_argument("--width", type=int, default=40, help="Largeur des barres")
+    parser.add_argument("--trace", help="Affiche une seule trace (trace_id ou X-Request-ID)")
+    args = parser.parse_args(argv)
+
+    files = trace_files(args.file)
+    if not files:
+        print("Aucune trace trouvée. Lancez d'abord des extractions (TRACING_ENABLED=true).")
+        return
+
+    if args.trace:
+        spans = find_trace(files, args.trace)
+        if spans is None:
+            print(f"Trace {args.trace} introuvable.")
+            return
+        print(render_waterfall(spans, args.width))
+        return
+
+    for _, spans in slowest_traces(files, args.top):
+        print(render_waterfall(spans, args.width))
+        print()
+
+
+if __name__ == "__main__":
+    main()
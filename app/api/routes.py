@@ -2,46 +2,48 @@
 Routes API pour l'extraction de données facture.
 """
 
-import base64
+import asyncio
 import csv
 import io
+import json
 import logging
+import time
+import zipfile
+from dataclasses import dataclass
 from datetime import datetime
-from pathlib import Path
-from typing import Any
+from pathlib import PurePosixPath
+from typing import Any, AsyncIterator, Callable, Iterator, Literal, Optional
 
-from fastapi import APIRouter, File, HTTPException, UploadFile
-from pdf2image import convert_from_bytes
+from fastapi import APIRouter, File, Header, HTTPException, Query, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
-from app.monitoring.kpi import kpi_tracker
-from app.services.ocr_pipeline import run_extraction_pipeline
+from app.core.config import get_settings
+from app.monitoring.tracing import get_tracer
+from app.monitoring.writer import get_record_writer
+from app.services.cache import get_extraction_cache
+from app.services.coalescing import extraction_flights
+from app.services.deadline import DEADLINE_HEADER, Deadline, request_deadline
+from app.services.extraction_service import (
+    ALLOWED_IMAGE_TYPES,
+    ALLOWED_PDF_TYPE,
+    DocumentConversionError,
+    extract_document,
+)
+from app.services.hedging import latency_tracker
+from app.services.jobs import Job, get_job_store
+from app.services.routing import get_model_router
+from app.services.ocr_pipeline import ExtractionResult
+from app.services.rate_limit import rate_limit_stats
+from app.services.results import get_result_store
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/v1", tags=["extract"])
 
-
-# Types MIME acceptés
-ALLOWED_IMAGE_TYPES = {"image/jpeg", "image/png", "image/webp", "image/gif"}
-ALLOWED_PDF_TYPE = "application/pdf"
-
-
-def _file_to_image_base64(content: bytes, content_type: str) -> str:
-    """
-    Convertit le contenu du fichier en image base64.
-    Si PDF, prend la première page uniquement.
-    """
-    if content_type == ALLOWED_PDF_TYPE:
-        images = convert_from_bytes(content, first_page=1, last_page=1)
-        if not images:
-            raise HTTPException(status_code=400, detail="Impossible de convertir le PDF en image.")
-        buffer = io.BytesIO()
-        images[0].save(buffer, format="PNG")
-        buffer.seek(0)
-        return base64.b64encode(buffer.read()).decode("ascii")
-    # Déjà une image
-    return base64.b64encode(content).decode("ascii")
+# Intervalle de vérification de la déconnexion du client pendant une extraction (secondes)
+DISCONNECT_POLL_S = 0.5
 
 
 class ExtractResponse(BaseModel):
@@ -50,6 +52,51 @@ class ExtractResponse(BaseModel):
     data: dict[str, Any] | None = Field(None, description="Données facture extraites (null si échec + revue manuelle)")
     needs_human_review: bool = Field(False, description="True si extraction incertaine ou échouée")
     error_message: str | None = Field(None, description="Message d'erreur lorsque needs_human_review=True")
+    locally_repaired: bool = Field(False, description="True si les montants ont été corrigés par réconciliation arithmétique locale")
+
+
+def _to_response(result: ExtractionResult) -> ExtractResponse:
+    """Convertit le résultat du pipeline en réponse API."""
+    if result.data is not None:
+        return ExtractResponse(
+            data=result.data.model_dump(),
+            needs_human_review=result.needs_human_review,
+            error_message=result.error_message,
+            locally_repaired=result.locally_repaired,
+        )
+    return ExtractResponse(
+        data=None,
+        needs_human_review=True,
+        error_message=result.error_message,
+    )
+
+
+def _parse_deadline(header_value: Optional[str]) -> Deadline:
+    """Échéance de la requête (en-tête X-Request-Timeout ou défaut serveur) ; 400 si l'en-tête est invalide."""
+    try:
+        return request_deadline(header_value, get_settings())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+
+async def _cancel_on_disconnect(request: Request, coro):
+    """
+    Exécute coro en surveillant la connexion : si le client se déconnecte, l'extraction est annulée
+    (appels LLM en cours compris) au lieu de consommer du budget pour une réponse que personne ne lira.
+    """
+    task = asyncio.create_task(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_S)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                logger.info("Client déconnecté : extraction annulée")
+                task.cancel()
+                # 499 : convention nginx pour une requête fermée par le client
+                raise HTTPException(status_code=499, detail="Requête annulée par le client.")
+    finally:
+        task.cancel()
 
 
 @router.get(
@@ -61,7 +108,17 @@ async def get_kpi_stats():
     """Retourne les statistiques KPI agrégées."""
     from app.monitoring.kpi import get_kpi_stats
 
-    stats = get_kpi_stats()
+    stats = await run_in_threadpool(get_kpi_stats)
+    stats["cache"] = get_extraction_cache().stats()
+    stats["coalescing"] = extraction_flights.stats()
+    stats["jobs"] = await run_in_threadpool(get_job_store().stats)
+    stats["llm_latency"] = latency_tracker.stats()
+    stats["rate_limits"] = rate_limit_stats()
+    stats["log_writer"] = get_record_writer().stats()
+    stats["tracing"] = get_tracer().stats()
+    stats["results_store"] = get_result_store().stats()
+    if get_settings().routing_enabled:
+        stats["router"] = get_model_router().stats()
     return stats
 
 
@@ -69,13 +126,22 @@ async def get_kpi_stats():
     "/extract",
     response_model=ExtractResponse,
     summary="Extraire les données d'une facture",
-    description="Accepte une image ou un PDF (première page), renvoie les données structurées (fournisseur, montants, lignes).",
+    description=(
+        "Accepte une image ou un PDF (multi-pages : 1ère page + page des totaux), renvoie les données structurées "
+        "(fournisseur, montants, lignes). L'en-tête X-Request-Timeout (secondes) fixe le budget de la requête."
+    ),
 )
-async def extract(file: UploadFile = File(...)) -> ExtractResponse:
+async def extract(
+    request: Request,
+    file: UploadFile = File(...),
+    request_timeout: Optional[str] = Header(None, alias=DEADLINE_HEADER),
+) -> ExtractResponse:
     """
-    Reçoit un fichier image ou PDF, le convertit en image (1ère page pour PDF),
+    Reçoit un fichier image ou PDF, le convertit en image(s) (pages pertinentes pour un PDF),
     lance le pipeline d'extraction (LLM + validation + fallback) et retourne le résultat.
+    L'extraction est bornée par l'échéance de la requête et annulée si le client se déconnecte.
     """
+    deadline = _parse_deadline(request_timeout)
     content_type = file.content_type or ""
     if content_type not in ALLOWED_IMAGE_TYPES and content_type != ALLOWED_PDF_TYPE:
         raise HTTPException(
@@ -83,97 +149,521 @@ async def extract(file: UploadFile = File(...)) -> ExtractResponse:
             detail=f"Type de fichier non supporté. Attendu: image (JPEG, PNG, WebP, GIF) ou PDF, reçu: {content_type}",
         )
 
+    read_started = time.perf_counter()
     try:
         body = await file.read()
     except Exception as e:
         logger.exception("Erreur lecture fichier uploadé")
         raise HTTPException(status_code=400, detail="Impossible de lire le fichier.") from e
+    upload_read_ms = (time.perf_counter() - read_started) * 1000
 
     if not body:
         raise HTTPException(status_code=400, detail="Fichier vide.")
 
     try:
-        image_base64 = _file_to_image_base64(body, content_type)
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.exception("Conversion fichier -> image échouée")
-        raise HTTPException(status_code=400, detail="Conversion du fichier en image impossible.") from e
-
-    # Lancer le pipeline avec KPI tracking
-    kpi_tracker.start_extraction()
-    result = run_extraction_pipeline(image_base64)
-    
-    # Enregistrer KPI
-    kpi = kpi_tracker.end_extraction(
-        filename=file.filename or "unknown",
-        success=result.data is not None,
-        needs_human_review=result.needs_human_review,
-        error_type=type(result.error_message).__name__ if result.error_message else None,
-        error_message=result.error_message,
+        result = await _cancel_on_disconnect(
+            request,
+            extract_document(
+                body,
+                content_type,
+                file.filename or "unknown",
+                deadline=deadline,
+                upload_read_ms=upload_read_ms,
+            ),
+        )
+    except DocumentConversionError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+    return _to_response(result)
+
+
+# --- Extraction par lot ------------------------------------------------------
+
+ZIP_CONTENT_TYPES = {"application/zip", "application/x-zip-compressed"}
+CONTENT_TYPES_BY_EXTENSION = {
+    ".pdf": ALLOWED_PDF_TYPE,
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".gif": "image/gif",
+}
+
+
+class BatchItemResponse(BaseModel):
+    """Une ligne NDJSON du flux /extract/batch (un fichier du lot)."""
+
+    index: int = Field(..., description="Position du fichier dans le lot (ordre d'upload / de l'archive)")
+    filename: str = Field(..., description="Nom du fichier (chemin dans l'archive pour un zip)")
+    status: Literal["ok", "review", "error"] = Field(
+        ..., description="ok : extrait ; review : revue manuelle requise ; error : fichier non traité"
     )
+    result: ExtractResponse | None = Field(None, description="Résultat d'extraction (null si status=error)")
+    error_message: str | None = Field(None, description="Raison de l'échec lorsque status=error")
 
-    if result.data is not None:
-        response_data = result.data.model_dump()
-        _save_extraction_to_csv(file.filename or "unknown", response_data, result.needs_human_review)
-        return ExtractResponse(
-            data=response_data,
-            needs_human_review=result.needs_human_review,
-            error_message=result.error_message,
+
+@dataclass
+class _BatchEntry:
+    """Fichier du lot ; le contenu des entrées zip n'est lu qu'au moment de son traitement."""
+
+    filename: str
+    content_type: str
+    load: Callable[[], bytes]
+
+
+def _is_zip(file: UploadFile) -> bool:
+    """True si le fichier uploadé est une archive zip."""
+    return file.content_type in ZIP_CONTENT_TYPES or (file.filename or "").lower().endswith(".zip")
+
+
+def _zip_entries(body: bytes, archive_name: str, budget_bytes: int) -> tuple[list[_BatchEntry], int]:
+    """
+    Liste les factures d'une archive zip (dossiers et fichiers cachés ignorés).
+    La taille décompressée déclarée est vérifiée avant toute lecture (protection zip bomb).
+
+    Returns:
+        (entrées, taille décompressée totale en octets)
+    """
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(body))
+    except zipfile.BadZipFile as e:
+        raise HTTPException(status_code=400, detail=f"Archive zip invalide : {archive_name}") from e
+
+    infos = [
+        info
+        for info in archive.infolist()
+        if not info.is_dir()
+        and not any(part.startswith((".", "__MACOSX")) for part in PurePosixPath(info.filename).parts)
+    ]
+    uncompressed = sum(info.file_size for info in infos)
+    if uncompressed > budget_bytes:
+        raise HTTPException(status_code=400, detail=f"Archive {archive_name} trop volumineuse une fois décompressée.")
+
+    entries = [
+        _BatchEntry(
+            filename=info.filename,
+            content_type=CONTENT_TYPES_BY_EXTENSION.get(PurePosixPath(info.filename).suffix.lower(), ""),
+            load=lambda info=info: archive.read(info),
         )
+        for info in infos
+    ]
+    return entries, uncompressed
 
-    _save_extraction_to_csv(
-        file.filename or "unknown",
-        None,
-        True,
-        error_message=result.error_message,
-    )
-    return ExtractResponse(
-        data=None,
-        needs_human_review=True,
-        error_message=result.error_message,
+
+async def _collect_batch_entries(files: list[UploadFile]) -> list[_BatchEntry]:
+    """Lit les fichiers uploadés et développe les archives zip en une liste d'entrées."""
+    settings = get_settings()
+    budget_bytes = int(settings.batch_max_uncompressed_mb * 1024 * 1024)
+    entries: list[_BatchEntry] = []
+
+    for file in files:
+        try:
+            body = await file.read()
+        except Exception as e:
+            logger.exception("Erreur lecture fichier uploadé")
+            raise HTTPException(status_code=400, detail=f"Impossible de lire le fichier {file.filename}.") from e
+
+        if _is_zip(file):
+            zip_entries, uncompressed = _zip_entries(body, file.filename or "archive.zip", budget_bytes)
+            budget_bytes -= uncompressed
+            entries.extend(zip_entries)
+        else:
+            entries.append(
+                _BatchEntry(
+                    filename=file.filename or "unknown",
+                    content_type=file.content_type or "",
+                    load=lambda body=body: body,
+                )
+            )
+
+        if len(entries) > settings.batch_max_files:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Lot trop volumineux : {settings.batch_max_files} fichiers maximum.",
+            )
+    return entries
+
+
+async def _extract_batch_entry(
+    index: int,
+    entry: _BatchEntry,
+    semaphore: asyncio.Semaphore,
+    deadline: Optional[Deadline] = None,
+) -> BatchItemResponse:
+    """
+    Traite une entrée du lot sous la limite de concurrence ; toute erreur devient un statut d'item.
+    deadline : échéance commune au lot, sinon budget par défaut propre à chaque fichier.
+    """
+
+    def error(message: str) -> BatchItemResponse:
+        return BatchItemResponse(index=index, filename=entry.filename, status="error", error_message=message)
+
+    if entry.content_type not in ALLOWED_IMAGE_TYPES and entry.content_type != ALLOWED_PDF_TYPE:
+        return error(f"Type de fichier non supporté : {entry.content_type or 'inconnu'}")
+
+    async with semaphore:
+        try:
+            read_started = time.perf_counter()
+            body = await run_in_threadpool(entry.load)
+            if not body:
+                return error("Fichier vide.")
+            result = await extract_document(
+                body,
+                entry.content_type,
+                entry.filename,
+                deadline=deadline,
+                upload_read_ms=(time.perf_counter() - read_started) * 1000,
+            )
+        except DocumentConversionError as e:
+            return error(str(e))
+        except Exception as e:
+            logger.exception("Extraction échouée pour %s (lot)", entry.filename)
+            return error(f"Erreur inattendue : {e}")
+
+    response = _to_response(result)
+    status = "review" if response.needs_human_review else "ok"
+    return BatchItemResponse(index=index, filename=entry.filename, status=status, result=response)
+
+
+async def _stream_batch(
+    entries: list[_BatchEntry],
+    concurrency: int,
+    deadline: Optional[Deadline] = None,
+) -> AsyncIterator[str]:
+    """Lance les extractions (concurrence bornée) et émet chaque résultat dès qu'il est prêt."""
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = [
+        asyncio.create_task(_extract_batch_entry(index, entry, semaphore, deadline))
+        for index, entry in enumerate(entries)
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            item = await next_done
+            yield item.model_dump_json() + "\n"
+    finally:
+        # Client déconnecté : les extractions non démarrées sont abandonnées
+        for task in tasks:
+            task.cancel()
+
+
+@router.post(
+    "/extract/batch",
+    summary="Extraire les données d'un lot de factures",
+    description=(
+        "Accepte plusieurs fichiers (images, PDF) et/ou des archives zip. Les extractions tournent en parallèle "
+        "(concurrence bornée) et chaque résultat est renvoyé en NDJSON dès qu'il est prêt, avec un statut par fichier. "
+        "L'en-tête X-Request-Timeout (secondes) fixe un budget commun à tout le lot."
+    ),
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+)
+async def extract_batch(
+    files: list[UploadFile] = File(...),
+    concurrency: Optional[int] = Query(None, ge=1, description="Concurrence souhaitée (plafonnée par BATCH_CONCURRENCY)"),
+    request_timeout: Optional[str] = Header(None, alias=DEADLINE_HEADER),
+) -> StreamingResponse:
+    """
+    Reçoit un lot de fichiers, développe les archives zip et diffuse un BatchItemResponse par ligne
+    (ordre d'achèvement, champ index pour retrouver l'ordre d'origine).
+    """
+    settings = get_settings()
+    # Sans en-tête, chaque fichier reçoit le budget par défaut au début de son traitement
+    deadline = _parse_deadline(request_timeout) if request_timeout is not None else None
+    entries = await _collect_batch_entries(files)
+    if not entries:
+        raise HTTPException(status_code=400, detail="Aucun fichier à traiter.")
+
+    limit = min(concurrency or settings.batch_concurrency, settings.batch_concurrency)
+    logger.info("Lot de %d fichier(s), concurrence %d", len(entries), limit)
+    return StreamingResponse(_stream_batch(entries, limit, deadline), media_type="application/x-ndjson")
+
+
+# --- API asynchrone par jobs -------------------------------------------------
+
+
+class JobResponse(BaseModel):
+    """État d'un job d'extraction asynchrone."""
+
+    job_id: str = Field(..., description="Identifiant du job (à interroger via GET /api/v1/jobs/{job_id})")
+    status: Literal["queued", "running", "done", "failed"] = Field(..., description="État du job")
+    filename: str = Field(..., description="Nom du fichier soumis")
+    created_at: str = Field(..., description="Date de soumission (ISO 8601)")
+    started_at: str | None = Field(None, description="Début du dernier traitement (ISO 8601)")
+    finished_at: str | None = Field(None, description="Fin du traitement (ISO 8601)")
+    attempts: int = Field(0, description="Nombre de prises du job par un worker")
+    wait_ms: float | None = Field(None, description="Temps passé dans la file avant traitement (ms)")
+    service_ms: float | None = Field(None, description="Durée du traitement (ms)")
+    result: ExtractResponse | None = Field(None, description="Résultat d'extraction lorsque status=done")
+    error_message: str | None = Field(None, description="Raison de l'échec lorsque status=failed")
+
+
+def _iso(timestamp: float | None) -> str | None:
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp is not None else None
+
+
+def _to_job_response(job: Job) -> JobResponse:
+    """Convertit un job du store en réponse API."""
+    return JobResponse(
+        job_id=job.id,
+        status=job.status,
+        filename=job.filename,
+        created_at=_iso(job.created_at),
+        started_at=_iso(job.started_at),
+        finished_at=_iso(job.finished_at),
+        attempts=job.attempts,
+        wait_ms=job.wait_ms,
+        service_ms=job.service_ms,
+        result=ExtractResponse(**job.result) if job.result is not None else None,
+        error_message=job.error,
     )
 
 
-def _save_extraction_to_csv(
-    filename: str,
-    data: dict[str, Any] | None,
-    needs_human_review: bool,
-    error_message: str | None = None,
-) -> None:
-    """Sauvegarde le résultat d'extraction dans un CSV dans le dossier resultats/."""
-    results_dir = Path(__file__).parent.parent.parent / "resultats"
-    results_dir.mkdir(exist_ok=True)
+@router.post(
+    "/jobs",
+    response_model=JobResponse,
+    status_code=202,
+    summary="Soumettre une facture en traitement asynchrone",
+    description=(
+        "Accepte une image ou un PDF, l'enregistre dans la file persistante et répond immédiatement "
+        "avec un identifiant de job. L'extraction est réalisée par les workers (python -m app.worker)."
+    ),
+)
+async def submit_job(file: UploadFile = File(...)) -> JobResponse:
+    """Enregistre le fichier dans la file de jobs ; le résultat est à récupérer via GET /jobs/{job_id}."""
+    content_type = file.content_type or ""
+    if content_type not in ALLOWED_IMAGE_TYPES and content_type != ALLOWED_PDF_TYPE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Type de fichier non supporté. Attendu: image (JPEG, PNG, WebP, GIF) ou PDF, reçu: {content_type}",
+        )
+
+    try:
+        body = await file.read()
+    except Exception as e:
+        logger.exception("Erreur lecture fichier uploadé")
+        raise HTTPException(status_code=400, detail="Impossible de lire le fichier.") from e
 
-    csv_file = results_dir / "extractions.csv"
-    file_exists = csv_file.exists()
+    if not body:
+        raise HTTPException(status_code=400, detail="Fichier vide.")
 
-    timestamp = datetime.now().isoformat()
+    job = await run_in_threadpool(get_job_store().submit, body, content_type, file.filename or "unknown")
+    logger.info("Job %s en file (%s)", job.id, job.filename)
+    return _to_job_response(job)
+
+
+@router.get(
+    "/jobs/{job_id}",
+    response_model=JobResponse,
+    summary="Consulter un job d'extraction",
+    description="Retourne l'état du job et, une fois terminé, le résultat d'extraction.",
+)
+async def get_job(job_id: str) -> JobResponse:
+    """Retourne l'état d'un job soumis via POST /jobs."""
+    job = await run_in_threadpool(get_job_store().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job introuvable.")
+    return _to_job_response(job)
 
-    # Préparer les données à écrire
-    row = {
-        "timestamp": timestamp,
-        "fichier_source": filename,
-        "statut": "succès" if data is not None else "erreur",
+
+# --- Résultats d'extraction enregistrés --------------------------------------
+
+DATE_PATTERN = r"^\d{4}-\d{2}-\d{2}$"
+
+
+class ExtractionSummary(BaseModel):
+    """Une extraction enregistrée (champs indexés et montants, sans les lignes de détail)."""
+
+    id: int = Field(..., description="Identifiant de l'extraction (GET /api/v1/extractions/{id})")
+    created_at: str = Field(..., description="Date de l'extraction (ISO 8601)")
+    filename: str = Field(..., description="Nom du fichier source")
+    content_hash: str | None = Field(None, description="Empreinte SHA-256 du fichier")
+    status: Literal["success", "error"] = Field(..., description="success : données extraites ; error : échec")
+    needs_human_review: bool = Field(..., description="True si extraction incertaine ou échouée")
+    locally_repaired: bool = Field(False, description="True si les montants ont été corrigés localement")
+    fournisseur: str | None = None
+    numero_facture: str | None = None
+    date: str | None = Field(None, description="Date de la facture (YYYY-MM-DD)")
+    montant_ht: float | None = None
+    montant_tva: float | None = None
+    montant_ttc: float | None = None
+    devise: str | None = None
+    ifu_fournisseur: str | None = None
+    code_mecef: str | None = None
+    confiance: float | None = None
+    nombre_lignes: int = Field(0, description="Nombre de lignes de détail")
+    error_message: str | None = Field(None, description="Raison de l'échec lorsque status=error")
+    trace_id: str | None = Field(None, description="Trace de l'extraction (resultats/traces.jsonl)")
+
+
+class ExtractionRecord(ExtractionSummary):
+    """Une extraction enregistrée avec ses données complètes."""
+
+    data: dict[str, Any] | None = Field(None, description="Données facture complètes, lignes de détail comprises")
+
+
+class ExtractionPage(BaseModel):
+    """Une page de résultats de recherche."""
+
+    items: list[ExtractionSummary]
+    next_cursor: str | None = Field(None, description="Curseur de la page suivante (null : dernière page)")
+
+
+@router.get(
+    "/extractions",
+    response_model=ExtractionPage,
+    summary="Rechercher les extractions enregistrées",
+    description=(
+        "Filtre par IFU fournisseur, numéro de facture, empreinte du fichier, plage de dates de facture, "
+        "revue manuelle ou statut. Pagination par curseur : passer next_cursor pour obtenir la page suivante. "
+        "Tri : dernières extractions d'abord ; par date de facture décroissante avec un filtre de date seul."
+    ),
+)
+async def list_extractions(
+    ifu_fournisseur: Optional[str] = Query(None, description="IFU du fournisseur"),
+    numero_facture: Optional[str] = Query(None, description="Numéro de facture"),
+    content_hash: Optional[str] = Query(None, description="Empreinte SHA-256 du fichier"),
+    date_from: Optional[str] = Query(None, pattern=DATE_PATTERN, description="Date de facture minimale (YYYY-MM-DD)"),
+    date_to: Optional[str] = Query(None, pattern=DATE_PATTERN, description="Date de facture maximale (YYYY-MM-DD)"),
+    needs_human_review: Optional[bool] = Query(None, description="Filtre sur la revue manuelle"),
+    status: Optional[Literal["success", "error"]] = Query(None, description="Filtre sur le statut"),
+    cursor: Optional[str] = Query(None, description="Curseur renvoyé par la page précédente"),
+    limit: int = Query(50, ge=1, le=500, description="Taille de la page"),
+) -> ExtractionPage:
+    """Une page d'extractions enregistrées (recherche indexée)."""
+    store = get_result_store()
+    # Résultats encore en file d'insertion dans ce processus : visibles dès la recherche
+    await run_in_threadpool(store.flush)
+    try:
+        items, next_cursor = await run_in_threadpool(
+            store.query,
+            ifu_fournisseur=ifu_fournisseur,
+            numero_facture=numero_facture,
+            content_hash=content_hash,
+            date_from=date_from,
+            date_to=date_to,
+            needs_human_review=needs_human_review,
+            status=status,
+            cursor=cursor,
+            limit=limit,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    return ExtractionPage(items=[ExtractionSummary(**item) for item in items], next_cursor=next_cursor)
+
+
+# Colonnes de l'export CSV (ordre des colonnes du fichier)
+EXPORT_COLUMNS = (
+    "id",
+    "created_at",
+    "filename",
+    "status",
+    "needs_human_review",
+    "locally_repaired",
+    "fournisseur",
+    "numero_facture",
+    "date",
+    "montant_ht",
+    "montant_tva",
+    "montant_ttc",
+    "devise",
+    "ifu_fournisseur",
+    "code_mecef",
+    "confiance",
+    "nombre_lignes",
+    "error_message",
+    "content_hash",
+    "trace_id",
+    "cursor",
+)
+# Lignes lues (et envoyées) par page de l'export
+EXPORT_PAGE_SIZE = 500
+
+
+def _export_csv(pages: Iterator[list[dict]], resumed: bool) -> Iterator[str]:
+    """
+    Export CSV page par page. Un export complet commence par le BOM UTF-8 (accents lisibles sous Excel)
+    et l'en-tête ; une reprise (resumed) n'envoie que les lignes, à concaténer au fichier interrompu.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if not resumed:
+        buffer.write("\ufeff")
+        writer.writerow(EXPORT_COLUMNS)
+    for page in pages:
+        writer.writerows([item[column] for column in EXPORT_COLUMNS] for item in page)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _export_ndjson(pages: Iterator[list[dict]]) -> Iterator[str]:
+    """Export NDJSON page par page (une extraction par ligne)."""
+    for page in pages:
+        yield "".join(json.dumps(item, ensure_ascii=False) + "\n" for item in page)
+
+
+@router.get(
+    "/extractions/export",
+    summary="Exporter les extractions enregistrées (CSV ou NDJSON)",
+    description=(
+        "Diffuse toutes les extractions correspondant aux filtres, page par page : la mémoire reste constante "
+        "quel que soit le volume exporté. Chaque ligne porte son curseur (colonne cursor) ; un export interrompu "
+        "reprend avec cursor=<curseur de la dernière ligne reçue>."
+    ),
+    response_class=StreamingResponse,
+    responses={200: {"content": {"text/csv": {}, "application/x-ndjson": {}}}},
+)
+async def export_extractions(
+    format: Literal["csv", "ndjson"] = Query("csv", description="Format de l'export"),
+    ifu_fournisseur: Optional[str] = Query(None, description="IFU du fournisseur"),
+    date_from: Optional[str] = Query(None, pattern=DATE_PATTERN, description="Date de facture minimale (YYYY-MM-DD)"),
+    date_to: Optional[str] = Query(None, pattern=DATE_PATTERN, description="Date de facture maximale (YYYY-MM-DD)"),
+    needs_human_review: Optional[bool] = Query(None, description="Filtre sur la revue manuelle"),
+    status: Optional[Literal["success", "error"]] = Query(None, description="Filtre sur le statut"),
+    cursor: Optional[str] = Query(None, description="Reprise après la ligne portant ce curseur"),
+) -> StreamingResponse:
+    """Exporte les extractions filtrées en flux (pagination par curseur côté base)."""
+    store = get_result_store()
+    await run_in_threadpool(store.flush)
+    filters = {
+        "ifu_fournisseur": ifu_fournisseur,
+        "date_from": date_from,
+        "date_to": date_to,
         "needs_human_review": needs_human_review,
-        "fournisseur": data.get("fournisseur", "") if data else "",
-        "numero_facture": data.get("numero_facture", "") if data else "",
-        "date": data.get("date", "") if data else "",
-        "montant_ht": data.get("montant_ht", "") if data else "",
-        "montant_tva": data.get("montant_tva", "") if data else "",
-        "montant_ttc": data.get("montant_ttc", "") if data else "",
-        "devise": data.get("devise", "") if data else "",
-        "ifu_fournisseur": data.get("ifu_fournisseur", "") if data else "",
-        "code_mecef": data.get("code_mecef", "") if data else "",
-        "confiance": data.get("confiance", "") if data else "",
-        "nombre_lignes": len(data.get("lignes_detail", [])) if data else 0,
-        "error_message": error_message or "",
+        "status": status,
     }
+    # Curseur validé avant l'envoi des en-têtes (une erreur en cours de flux ne peut plus être signalée)
+    try:
+        store.build_query(cursor=cursor, **filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+    pages = store.iter_export(page_size=EXPORT_PAGE_SIZE, cursor=cursor, **filters)
+    if format == "ndjson":
+        body, media_type = _export_ndjson(pages), "application/x-ndjson"
+    else:
+        body, media_type = _export_csv(pages, resumed=cursor is not None), "text/csv; charset=utf-8"
+    # Générateur synchrone : exécuté page par page dans le threadpool par StreamingResponse
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="extractions.{format}"'},
+    )
 
-    with open(csv_file, mode="a", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=row.keys())
-        if not file_exists:
-            writer.writeheader()
-        writer.writerow(row)
 
-    logger.info("Résultat extraction sauvegardé dans %s", csv_file)
+@router.get(
+    "/extractions/{extraction_id}",
+    response_model=ExtractionRecord,
+    summary="Consulter une extraction enregistrée",
+    description="Retourne l'extraction avec ses données complètes (lignes de détail comprises).",
+)
+async def get_extraction(extraction_id: int) -> ExtractionRecord:
+    """Retourne une extraction enregistrée."""
+    store = get_result_store()
+    await run_in_threadpool(store.flush)
+    record = await run_in_threadpool(store.get, extraction_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Extraction introuvable.")
+    return ExtractionRecord(**record)
@@ -3,6 +3,9 @@ Configuration de l'application via variables d'environnement.
 Utilise Pydantic BaseSettings pour le chargement et la validation.
 """
 
+from functools import lru_cache
+from typing import Optional
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -26,7 +29,268 @@ class Settings(BaseSettings):
     llm_model_heavy: str = "gpt-4o"
     """Modèle plus capable utilisé en fallback en cas d'échec de validation."""
 
+    llm_prices: dict[str, dict[str, float]] = {
+        "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+        "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+    }
+    """Prix par modèle en $ pour 1M de tokens (input, cached_input, output) ; nom exact ou préfixe."""
+
+    # Pool de connexions HTTP vers l'API OpenAI (clients partagés, un par modèle)
+    openai_max_connections: int = 100
+    """Nombre maximal de connexions simultanées par client (par modèle)."""
+
+    openai_max_keepalive_connections: int = 20
+    """Nombre de connexions inactives conservées ouvertes (keep-alive) pour réutilisation."""
+
+    openai_keepalive_expiry_s: float = 60.0
+    """Durée (secondes) avant fermeture d'une connexion keep-alive inutilisée."""
+
+    # Limitation de débit côté client (limites RPM / TPM du compte OpenAI)
+    rate_limit_enabled: bool = True
+    """Régule les appels par modèle : seaux de requêtes et de tokens, concurrence adaptative (AIMD)."""
+
+    rate_limits: dict[str, dict[str, float]] = {
+        "gpt-4o-mini": {"rpm": 500, "tpm": 200000},
+        "gpt-4o": {"rpm": 500, "tpm": 30000},
+    }
+    """Limites initiales par modèle (nom exact ou préfixe) ; ajustées d'après les en-têtes x-ratelimit-* des réponses."""
+
+    rate_limit_headroom: float = 0.9
+    """Fraction des limites du compte visée, pour rester juste en dessous."""
+
+    rate_limit_max_queue_s: float = 30.0
+    """Attente maximale d'un appel dans le limiteur (429 compris) avant abandon."""
+
+    rate_limit_initial_concurrency: int = 16
+    """Nombre initial d'appels simultanés par modèle (augmenté sur succès, divisé par 2 sur 429)."""
+
+    rate_limit_max_concurrency: int = 64
+    """Nombre maximal d'appels simultanés par modèle."""
+
+    rate_limit_completion_tokens: int = 1000
+    """Estimation des tokens de complétion d'un appel, réservée avant l'appel puis corrigée par l'usage réel."""
+
+    # Échéance de bout en bout des extractions
+    request_timeout_s: float = 120.0
+    """Budget par défaut d'une extraction (sans en-tête X-Request-Timeout), conversion et cascade comprises."""
+
+    request_timeout_max_s: float = 600.0
+    """Plafond du budget demandé par l'en-tête X-Request-Timeout."""
+
+    deadline_min_attempt_s: float = 2.0
+    """Budget restant minimal pour lancer une tentative de la cascade (sans historique de latence)."""
+
+    # Nouvelles tentatives sur erreur transitoire et disjoncteur par modèle
+    llm_transient_retries: int = 2
+    """Nouveaux essais d'un appel sur le même modèle après une erreur transitoire (réseau, timeout, 5xx)."""
+
+    llm_backoff_base_s: float = 0.5
+    """Base du backoff exponentiel (jitter complet) entre deux essais."""
+
+    llm_backoff_max_s: float = 8.0
+    """Délai maximal entre deux essais (Retry-After compris)."""
+
+    circuit_failure_threshold: int = 5
+    """Erreurs transitoires consécutives d'un modèle avant ouverture de son disjoncteur."""
+
+    circuit_open_s: float = 30.0
+    """Durée d'ouverture du disjoncteur avant un appel de test."""
+
+    # Écriture des journaux de résultats (kpi.jsonl, traces.jsonl) et de la base des résultats (lots)
+    log_writer_background: bool = True
+    """Écrit les journaux depuis un thread d'arrière-plan (file bornée, lots) plutôt que sur le chemin de la requête."""
+
+    log_writer_queue_size: int = 10000
+    """Nombre maximal de lignes en attente ; file pleine : la ligne est écrite directement par la requête."""
+
+    log_writer_batch_size: int = 256
+    """Nombre de lignes déclenchant l'écriture d'un lot."""
+
+    log_writer_flush_interval_s: float = 1.0
+    """Délai maximal entre le dépôt d'une ligne et son écriture."""
+
+    log_writer_fsync: str = "interval"
+    """Politique de fsync : "always" (chaque lot), "interval" (toutes les log_writer_fsync_interval_s) ou "never"."""
+
+    log_writer_fsync_interval_s: float = 5.0
+    """Intervalle minimal entre deux fsync avec la politique "interval"."""
+
+    # Traces des extractions (resultats/traces.jsonl, format OTLP/JSON)
+    tracing_enabled: bool = True
+    """Enregistre les spans de chaque requête / extraction et exporte les traces retenues."""
+
+    trace_sample_rate: float = 0.1
+    """Part des traces exportées (décision à la racine ; un traceparent entrant impose la sienne)."""
+
+    trace_slow_ms: Optional[float] = 20000.0
+    """Trace exportée même non échantillonnée si elle dure au moins ce temps (None : désactivé)."""
+
+    trace_max_bytes: int = 50 * 1024 * 1024
+    """Taille de traces.jsonl déclenchant une rotation (traces.jsonl.1, .2...)."""
+
+    trace_backup_count: int = 5
+    """Nombre de fichiers de traces tournés conservés."""
+
+    # Cache des résultats d'extraction (clé = hash du fichier + prompt + modèles)
+    cache_enabled: bool = True
+    """Active le cache des résultats pour les fichiers déjà traités."""
+
+    cache_max_entries: int = 1024
+    """Nombre maximal de résultats gardés en mémoire (LRU)."""
+
+    cache_ttl_s: float = 7 * 24 * 3600
+    """Durée de validité (secondes) d'un résultat en cache."""
+
+    cache_disk_enabled: bool = True
+    """Active le niveau disque du cache (persistant entre redémarrages)."""
+
+    cache_dir: Optional[str] = None
+    """Dossier du cache disque (défaut : resultats/cache/)."""
+
+    cache_disk_max_mb: float = 512.0
+    """Taille maximale du cache disque (Mo) ; les entrées les plus anciennes sont évincées."""
+
+    # Prétraitement des images envoyées au modèle Vision
+    image_max_long_edge: int = 2048
+    """Grand côté maximal (px) ; l'API ramène de toute façon l'image dans 2048x2048."""
+
+    image_max_short_edge: int = 768
+    """Petit côté maximal (px) ; l'API (detail=high) réduit le petit côté à 768 px avant découpage en tuiles."""
+
+    image_format: str = "jpeg"
+    """Format de ré-encodage : "jpeg" ou "webp"."""
 
+    image_quality: int = 85
+    """Qualité de compression JPEG/WebP (1-100)."""
+
+    image_auto_grayscale: bool = True
+    """Convertit en niveaux de gris les images dont la couleur ne porte pas d'information."""
+
+    image_grayscale_threshold: float = 12.0
+    """Saturation moyenne (0-255) sous laquelle une image est considérée sans couleur."""
+
+    pdf_dpi: int = 100
+    """Résolution de rendu des pages PDF (suffisante pour un petit côté A4 de ~830 px)."""
+
+    # PDF multi-pages
+    pdf_max_pages: int = 50
+    """Nombre maximal de pages considérées par document (les suivantes sont ignorées)."""
+
+    pdf_max_selected_pages: int = 3
+    """Au-delà de ce nombre de pages, seules la 1ère page et la page des totaux sont envoyées au LLM."""
+
+    pdf_render_workers: int = 4
+    """Nombre de processus du pool de rasterisation des pages PDF."""
+
+    # Chemin texte : PDF numérique avec couche texte (pdftotext), sans rasterisation ni Vision
+    text_layer_enabled: bool = True
+    """Utilise la couche texte du PDF quand elle est exploitable."""
+
+    text_layer_min_chars: int = 200
+    """Nombre minimal de caractères visibles sur la 1ère page pour considérer la couche texte exploitable."""
+
+    text_layer_max_chars: int = 30000
+    """Taille maximale du texte envoyé au LLM (au-delà : pages sélectionnées uniquement)."""
+
+    # Extraction par lot (/api/v1/extract/batch)
+    batch_concurrency: int = 8
+    """Nombre maximal d'extractions simultanées pour un lot."""
+
+    batch_max_files: int = 1000
+    """Nombre maximal de fichiers par lot (fichiers uploadés + entrées d'archives zip)."""
+
+    batch_max_uncompressed_mb: float = 1024.0
+    """Taille décompressée maximale (Mo) du contenu des archives zip d'un lot."""
+
+    # Base des résultats d'extraction (/api/v1/extractions)
+    results_db_path: Optional[str] = None
+    """Fichier SQLite des résultats (défaut : resultats/results.sqlite3), écrit par lots, partagé API / workers."""
+
+    # API asynchrone par jobs (/api/v1/jobs) et workers (python -m app.worker)
+    jobs_db_path: Optional[str] = None
+    """Fichier SQLite de la file de jobs (défaut : resultats/jobs.sqlite3), partagé API / workers."""
+
+    jobs_lease_s: float = 120.0
+    """Durée du bail d'un job pris par un worker ; renouvelé tant que le traitement est en cours."""
+
+    jobs_max_attempts: int = 3
+    """Nombre maximal de prises d'un job (worker perdu, erreur transitoire) avant échec définitif."""
+
+    worker_concurrency: int = 4
+    """Nombre d'extractions simultanées par processus worker."""
+
+    worker_poll_interval_s: float = 1.0
+    """Délai d'attente d'un worker entre deux consultations d'une file vide."""
+
+    # Requêtes de couverture (hedging) sur la 1ère tentative de la cascade
+    hedge_enabled: bool = False
+    """Lance une 2e requête en parallèle si la 1ère tentative tarde au-delà du seuil."""
+
+    hedge_percentile: float = 95.0
+    """Percentile des latences récentes du modèle light utilisé comme seuil de déclenchement."""
+
+    hedge_min_samples: int = 20
+    """Nombre minimal de latences observées avant d'utiliser le percentile (sinon hedge_default_delay_s)."""
+
+    hedge_default_delay_s: float = 10.0
+    """Seuil de déclenchement tant que l'historique de latences est insuffisant."""
+
+    hedge_min_delay_s: float = 1.0
+    """Seuil plancher, pour ne pas doubler les requêtes lorsque les latences sont très basses."""
+
+    hedge_use_heavy: bool = False
+    """Requête de couverture envoyée au modèle lourd au lieu du modèle light."""
+
+    # Cascade : réaction selon la nature de l'échec de la 1ère tentative
+    cascade_repair_enabled: bool = True
+    """Sur écart HT + TVA != TTC, renvoie le JSON et l'écart au modèle light au lieu de refaire la requête."""
+
+    cascade_skip_deterministic_retry: bool = True
+    """Sur réponse invalide (JSON, schéma, calcul) non réparable, passe directement au modèle lourd."""
+
+    # Réconciliation arithmétique locale (avant toute relance LLM)
+    reconciliation_enabled: bool = True
+    """Tente de corriger localement un écart HT + TVA != TTC (séparateurs, inversion HT/TTC, recalcul)."""
+
+    reconciliation_vat_rates: list[float] = [0.18, 0.1925, 0.19, 0.189, 0.10]
+    """Taux de TVA admis pour valider une correction (UEMOA 18 %, Cameroun 19,25 %, RCA 19 %, Congo 18,9 %, réduit 10 %)."""
+
+    reconciliation_rounding_tolerance: float = 0.5
+    """
+    Écart absolu admis entre la TVA et HT x taux, et entre le total des lignes et HT / TTC (arrondis à
+    l'unité sur les factures XOF/XAF). HT + TVA == TTC reste vérifié avec la tolérance de la validation.
+    """
+
+    # Routage prédictif : démarrage direct sur le modèle lourd pour les factures difficiles
+    routing_enabled: bool = False
+    """Active le routeur appris sur l'historique kpi.jsonl."""
+
+    routing_threshold: float = 0.6
+    """Probabilité d'échec du modèle light au-delà de laquelle la cascade démarre sur le modèle lourd."""
+
+    routing_min_samples: int = 10
+    """Nombre minimal d'extractions comparables dans l'historique pour faire confiance à une statistique."""
+
+    routing_exploration_rate: float = 0.05
+    """Part des documents prédits difficiles tout de même envoyés au modèle light (mesure du taux de réussite)."""
+
+    routing_refresh_s: float = 300.0
+    """Intervalle de réapprentissage du routeur sur l'historique."""
+
+    routing_history_max: int = 20000
+    """Nombre maximal d'extractions récentes lues dans kpi.jsonl pour l'apprentissage."""
+
+
+@lru_cache(maxsize=1)
 def get_settings() -> Settings:
-    """Retourne l'instance des settings (singleton implicite via dépendance FastAPI)."""
+    """
+    Retourne l'instance des settings, mise en cache pour le processus.
+    Le fichier .env n'est lu qu'une fois ; utiliser reload_settings() pour le relire.
+    """
     return Settings()
+
+
+def reload_settings() -> Settings:
+    """Invalide le cache et recharge les settings depuis l'environnement / .env."""
+    get_settings.cache_clear()
+    return get_settings()
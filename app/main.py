@@ -4,11 +4,22 @@ Application FastAPI : microservice d'extraction de données facture (zone OHADA)
 
 import logging
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from app.api.routes import router
 from app.core.config import get_settings
+from app.monitoring.aggregates import get_kpi_aggregates
+from app.monitoring.metrics import CONTENT_TYPE, render_metrics, requests_in_flight
+from app.monitoring.tracing import REQUEST_ID_HEADER, SPAN_KIND_SERVER, TRACEPARENT_HEADER, get_tracer
+from app.monitoring.writer import close_record_writer
+from app.services.openai_clients import close_openai_clients
+from app.services.pdf import shutdown_render_pool
+from app.services.resilience import CIRCUIT_CLOSED, circuit_breaker_states
+from app.services.results import close_result_store
 
 logging.basicConfig(
     level=logging.INFO,
@@ -18,12 +29,28 @@ logger = logging.getLogger(__name__)
 
 
 def startup():
-    """Vérification de la config au démarrage."""
+    """Vérification de la config au démarrage, puis chargement unique de l'historique KPI."""
     try:
         get_settings()
         logger.info("Configuration chargée (OPENAI_API_KEY présente).")
     except Exception as e:
         logger.warning("Configuration incomplète au démarrage: %s", e)
+    try:
+        loaded = get_kpi_aggregates().refresh()
+        logger.info("Historique KPI chargé : %d extraction(s)", loaded)
+    except OSError as e:
+        logger.warning("Historique KPI illisible : %s", e)
+
+
+async def shutdown():
+    """
+    Ferme les clients OpenAI partagés (pool de connexions) et le pool de rasterisation à l'arrêt,
+    puis écrit les journaux et résultats encore en file (KPI, traces, base des résultats).
+    """
+    await close_openai_clients()
+    shutdown_render_pool()
+    close_record_writer()
+    close_result_store()
 
 
 app = FastAPI(
@@ -40,11 +67,79 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+
+@app.middleware("http")
+async def count_in_flight(request: Request, call_next):
+    """Jauge des requêtes HTTP en cours (les collectes /metrics ne sont pas comptées)."""
+    if request.url.path == "/metrics":
+        return await call_next(request)
+    requests_in_flight.inc()
+    try:
+        return await call_next(request)
+    finally:
+        requests_in_flight.dec()
+
+
+class TraceRequestsMiddleware:
+    """
+    Span racine de chaque requête API : reprend traceparent / X-Request-ID entrants et les renvoie
+    dans la réponse (corrélation avec les journaux du client et resultats/traces.jsonl).
+    Middleware ASGI pur : le span reste ouvert jusqu'au dernier morceau du corps, si bien que les spans
+    ouverts pendant une réponse en flux (/extract/batch, /extractions/export) sont exportés avec la trace.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not scope["path"].startswith(router.prefix):
+            await self.app(scope, receive, send)
+            return
+        request = Request(scope)
+        with get_tracer().start_span(
+            f"{request.method} {request.url.path}",
+            traceparent=request.headers.get(TRACEPARENT_HEADER),
+            request_id=request.headers.get(REQUEST_ID_HEADER),
+            kind=SPAN_KIND_SERVER,
+            **{"http.method": request.method, "http.target": request.url.path},
+        ) as span:
+
+            async def send_with_trace_headers(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.status_code", message["status"])
+                    if span.request_id is not None:
+                        headers = MutableHeaders(scope=message)
+                        headers[REQUEST_ID_HEADER] = span.request_id
+                        headers[TRACEPARENT_HEADER] = span.traceparent
+                await send(message)
+
+            await self.app(scope, receive, send_with_trace_headers)
+
+
+app.add_middleware(TraceRequestsMiddleware)
+
+
 app.add_event_handler("startup", startup)
+app.add_event_handler("shutdown", shutdown)
 app.include_router(router)
 
 
 @app.get("/health")
 def health():
-    """Endpoint de santé pour vérifier que le service répond."""
-    return {"status": "ok"}
+    """
+    Endpoint de santé : le service répond ; "degraded" si le disjoncteur d'un modèle n'est pas fermé
+    (la cascade contourne alors ce modèle ou échoue immédiatement).
+    """
+    breakers = circuit_breaker_states()
+    degraded = any(breaker["state"] != CIRCUIT_CLOSED for breaker in breakers.values())
+    return {"status": "degraded" if degraded else "ok", "circuit_breakers": breakers}
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics():
+    """
+    Métriques au format texte Prometheus (histogrammes par étape et par appel LLM, issues de la cascade,
+    erreurs de parsing et de calcul, requêtes en cours). Tenues en mémoire : aucune lecture de fichier.
+    """
+    return PlainTextResponse(render_metrics(), media_type=CONTENT_TYPE)
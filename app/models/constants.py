@@ -7,4 +7,6 @@ class MathValidationError(ValueError):
         self.montant_ht = montant_ht
         self.montant_tva = montant_tva
         self.montant_ttc = montant_ttc
+        self.raw_json: str | None = None
+        """JSON renvoyé par le LLM (renseigné par le client LLM), pour la tentative de réparation."""
         super().__init__(message)
@@ -0,0 +1,415 @@
+"""
+Agrégats KPI incrémentaux pour GET /api/v1/kpi.
+Le fichier kpi.jsonl est lu une seule fois (au démarrage), puis suivi comme un journal : chaque
+consultation n'analyse que les lignes ajoutées depuis la précédente, par ce processus ou par les
+autres workers. Les percentiles de latence viennent de sketches de quantiles fusionnables
+(erreur relative bornée), globaux, par modèle et par fenêtre de temps (5 min / 1 h / 24 h) :
+le coût d'une consultation ne dépend pas de la taille de l'historique.
+"""
+
+import json
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from app.monitoring.tail import JsonlTail
+
+logger = logging.getLogger(__name__)
+
+# Fenêtres de temps exposées : nom -> (durée en secondes, granularité des seaux en secondes)
+WINDOWS = {
+    "5m": (300, 60),
+    "1h": (3600, 60),
+    "24h": (86400, 3600),
+}
+
+# Valeur en dessous de laquelle une durée (ms) est comptée comme nulle par les sketches
+_SKETCH_MIN_VALUE = 1e-3
+
+
+class QuantileSketch:
+    """
+    Sketch de quantiles à erreur relative bornée (seaux logarithmiques, type DDSketch).
+    Deux sketches de même précision se fusionnent par addition des seaux ; la mémoire dépend de
+    l'étendue des valeurs (quelques centaines de seaux pour des latences de 1 ms à 1 h), pas de leur nombre.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._buckets: dict[int, int] = defaultdict(int)
+        self._zero_count = 0
+        self.count = 0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def add(self, value: float) -> None:
+        if value < _SKETCH_MIN_VALUE:
+            self._zero_count += 1
+        else:
+            self._buckets[math.ceil(math.log(value) / self._log_gamma)] += 1
+        self.count += 1
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other: "QuantileSketch") -> None:
+        """Ajoute les valeurs de other (même précision) à ce sketch."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Fusion de sketches de précisions différentes")
+        for index, count in other._buckets.items():
+            self._buckets[index] += count
+        self._zero_count += other._zero_count
+        self.count += other.count
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def quantile(self, percentile: float) -> Optional[float]:
+        """Percentile (0-100, rang le plus proche) ; None si le sketch est vide."""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(percentile / 100 * self.count))
+        seen = self._zero_count
+        if rank <= seen:
+            return 0.0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen >= rank:
+                value = 2 * self._gamma**index / (self._gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+
+def _latency_summary(sketch: QuantileSketch) -> dict:
+    """p50 / p95 / p99 (ms) d'un sketch de durées."""
+    return {
+        f"p{p}_duration_ms": round(value, 2) if (value := sketch.quantile(p)) is not None else None
+        for p in (50, 95, 99)
+    }
+
+
+def _light_failed(k: dict) -> bool:
+    # Parti sur le modèle light, terminé sur un autre modèle (fallback) ou en échec
+    return k.get("final_model_used") != k.get("route_start_model") or not k.get("success")
+
+
+class _WindowBucket:
+    """Agrégats d'un seau de temps (une minute ou une heure)."""
+
+    def __init__(self):
+        self.count = 0
+        self.successes = 0
+        self.reviews = 0
+        self.duration_sum = 0.0
+        self.cost_usd = 0.0
+        self.latency = QuantileSketch()
+        self.latency_by_model: dict[str, QuantileSketch] = defaultdict(QuantileSketch)
+
+    def add(self, k: dict, duration_ms: float) -> None:
+        self.count += 1
+        self.successes += bool(k.get("success"))
+        self.reviews += bool(k.get("needs_human_review"))
+        self.duration_sum += duration_ms
+        self.cost_usd += k.get("cost_usd") or 0.0
+        self.latency.add(duration_ms)
+        self.latency_by_model[k.get("final_model_used") or "unknown"].add(duration_ms)
+
+
+class KPIAggregates:
+    """Agrégats KPI tenus à jour en suivant kpi.jsonl (lecture incrémentale)."""
+
+    def __init__(self, kpi_file: Path):
+        self.kpi_file = Path(kpi_file)
+        self._lock = threading.Lock()
+        # Rotation de kpi.jsonl : les agrégats sont recalculés sur le nouveau fichier
+        self._tail = JsonlTail(self.kpi_file, on_reset=self._reset)
+        self._reset()
+
+    def _reset(self) -> None:
+        self.invalid_lines = 0
+        self.total = 0
+        self.successes = 0
+        self.reviews = 0
+        self.duration_sum = 0.0
+        self.duration_min: Optional[float] = None
+        self.duration_max: Optional[float] = None
+        self.llm_calls = 0
+        self.latency = QuantileSketch()
+        self.by_model: dict[str, dict] = defaultdict(lambda: {"count": 0, "successes": 0, "latency": QuantileSketch()})
+        self.llm_call_latency: dict[str, QuantileSketch] = defaultdict(QuantileSketch)
+        self.hedging = {"hedged_count": 0, "primary_wins": 0, "hedge_wins": 0}
+        self.cascade = {"repair_attempted": 0, "repair_succeeded": 0, "retries_skipped": 0, "locally_repaired": 0}
+        self.routing = {"routed_count": 0, "started_heavy": 0, "predicted_easy": 0, "easy_hits": 0, "explored": 0, "hard_hits": 0}
+        self.stages: dict[str, dict] = defaultdict(lambda: {"count": 0, "sum_ms": 0.0, "sketch": QuantileSketch()})
+        self.tokens = {"prompt": 0, "completion": 0, "cached": 0}
+        self.cost = {"metered": 0, "total_usd": 0.0, "incomplete": 0}
+        self.cost_by_model: dict[str, dict] = defaultdict(
+            lambda: {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "cost_usd": 0.0}
+        )
+        self.by_input_mode: dict[str, dict] = defaultdict(
+            lambda: {"count": 0, "duration_sum": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0}
+        )
+        # Seaux des fenêtres de temps : granularité (s) -> {début du seau (epoch) -> agrégats}
+        self._buckets: dict[int, dict[int, _WindowBucket]] = {
+            granularity: {} for granularity in {granularity for _, granularity in WINDOWS.values()}
+        }
+
+    def refresh(self) -> int:
+        """
+        Intègre les lignes ajoutées à kpi.jsonl depuis le dernier appel ; retourne leur nombre.
+        Un fichier remplacé ou tronqué (rotation) est relu depuis le début.
+        """
+        with self._lock:
+            added = 0
+            for raw in self._tail.read_new():
+                try:
+                    self._add(json.loads(raw))
+                except (ValueError, TypeError, KeyError):
+                    self.invalid_lines += 1
+                    continue
+                added += 1
+            return added
+
+    def _add(self, k: dict) -> None:
+        duration_ms = float(k["total_duration_ms"])
+        model = k.get("final_model_used") or "unknown"
+        self.total += 1
+        self.successes += bool(k.get("success"))
+        self.reviews += bool(k.get("needs_human_review"))
+        self.duration_sum += duration_ms
+        self.duration_min = duration_ms if self.duration_min is None else min(self.duration_min, duration_ms)
+        self.duration_max = duration_ms if self.duration_max is None else max(self.duration_max, duration_ms)
+        self.llm_calls += k.get("llm_call_count") or 0
+        self.latency.add(duration_ms)
+
+        model_stats = self.by_model[model]
+        model_stats["count"] += 1
+        model_stats["successes"] += bool(k.get("success"))
+        model_stats["latency"].add(duration_ms)
+        for timing in k.get("llm_timings") or []:
+            if timing.get("outcome") == "ok":
+                self.llm_call_latency[timing["model"]].add(timing["duration_ms"])
+
+        if k.get("hedged"):
+            self.hedging["hedged_count"] += 1
+            if k.get("hedge_winner") == "primary":
+                self.hedging["primary_wins"] += 1
+            elif k.get("hedge_winner") == "hedge":
+                self.hedging["hedge_wins"] += 1
+        self.cascade["repair_attempted"] += bool(k.get("repair_attempted"))
+        self.cascade["repair_succeeded"] += bool(k.get("repair_succeeded"))
+        self.cascade["retries_skipped"] += bool(k.get("retry_skipped"))
+        self.cascade["locally_repaired"] += bool(k.get("locally_repaired"))
+
+        if k.get("route_start_model"):
+            self.routing["routed_count"] += 1
+            if k.get("route_predicted_hard") and not k.get("route_explored"):
+                self.routing["started_heavy"] += 1
+            if not k.get("route_predicted_hard"):
+                self.routing["predicted_easy"] += 1
+                self.routing["easy_hits"] += not _light_failed(k)
+            if k.get("route_explored"):
+                self.routing["explored"] += 1
+                self.routing["hard_hits"] += _light_failed(k)
+
+        for name, stage_ms in (k.get("stage_ms") or {}).items():
+            stage = self.stages[name]
+            stage["count"] += 1
+            stage["sum_ms"] += stage_ms
+            stage["sketch"].add(stage_ms)
+
+        self.tokens["prompt"] += k.get("prompt_tokens", 0)
+        self.tokens["completion"] += k.get("completion_tokens", 0)
+        self.tokens["cached"] += k.get("cached_tokens", 0)
+        if "cost_usd" in k:
+            self.cost["metered"] += 1
+            self.cost["total_usd"] += k["cost_usd"]
+            self.cost["incomplete"] += not k.get("cost_complete", True)
+        for attempt in k.get("llm_attempts") or []:
+            attempt_stats = self.cost_by_model[attempt["model"]]
+            attempt_stats["calls"] += 1
+            for key in ("prompt_tokens", "completion_tokens", "cached_tokens"):
+                attempt_stats[key] += attempt.get(key) or 0
+            attempt_stats["cost_usd"] += attempt.get("cost_usd") or 0.0
+
+        if k.get("input_mode"):
+            mode = self.by_input_mode[k["input_mode"]]
+            mode["count"] += 1
+            mode["duration_sum"] += duration_ms
+            mode["prompt_tokens"] += k.get("prompt_tokens", 0)
+            mode["completion_tokens"] += k.get("completion_tokens", 0)
+            mode["cost_usd"] += k.get("cost_usd", 0.0)
+
+        self._add_to_windows(k, duration_ms)
+
+    def _add_to_windows(self, k: dict, duration_ms: float) -> None:
+        try:
+            timestamp = datetime.fromisoformat(k["timestamp"]).timestamp()
+        except (KeyError, TypeError, ValueError):
+            return
+        now = time.time()
+        for granularity, buckets in self._buckets.items():
+            horizon = max(duration for duration, g in WINDOWS.values() if g == granularity)
+            if timestamp < now - horizon - granularity:
+                continue
+            start = int(timestamp // granularity * granularity)
+            bucket = buckets.get(start)
+            if bucket is None:
+                bucket = buckets[start] = _WindowBucket()
+                self._prune(granularity, horizon, now)
+            bucket.add(k, duration_ms)
+
+    def _prune(self, granularity: int, horizon: int, now: float) -> None:
+        buckets = self._buckets[granularity]
+        for start in [start for start in buckets if start + granularity <= now - horizon]:
+            del buckets[start]
+
+    def _window_stats(self, duration_s: int, granularity: int, now: float) -> dict:
+        """Agrégats des seaux couvrant les duration_s dernières secondes (au seau près)."""
+        self._prune(granularity, max(d for d, g in WINDOWS.values() if g == granularity), now)
+        merged = _WindowBucket()
+        for start, bucket in self._buckets[granularity].items():
+            if start + granularity > now - duration_s:
+                merged.count += bucket.count
+                merged.successes += bucket.successes
+                merged.reviews += bucket.reviews
+                merged.duration_sum += bucket.duration_sum
+                merged.cost_usd += bucket.cost_usd
+                merged.latency.merge(bucket.latency)
+                for model, sketch in bucket.latency_by_model.items():
+                    merged.latency_by_model[model].merge(sketch)
+        if not merged.count:
+            return {"count": 0}
+        return {
+            "count": merged.count,
+            "success_rate": round(merged.successes / merged.count * 100, 2),
+            "review_rate": round(merged.reviews / merged.count * 100, 2),
+            "avg_duration_ms": round(merged.duration_sum / merged.count, 2),
+            **_latency_summary(merged.latency),
+            "cost_usd": round(merged.cost_usd, 6),
+            "by_model": {
+                model: {"count": sketch.count, **_latency_summary(sketch)}
+                for model, sketch in merged.latency_by_model.items()
+            },
+        }
+
+    def stats(self) -> dict:
+        """Statistiques agrégées (même forme que l'ancien calcul sur le fichier complet)."""
+        with self._lock:
+            total = self.total
+            if not total:
+                return {"total": 0, "success_rate": 0, "avg_duration_ms": 0, "review_rate": 0}
+            now = time.time()
+            routing = self.routing
+            metered = self.cost["metered"]
+            return {
+                "total_extractions": total,
+                "success_rate": round((self.successes / total) * 100, 2),
+                "failed_count": total - self.successes,
+                "human_review_count": self.reviews,
+                "review_rate": round((self.reviews / total) * 100, 2),
+                "avg_duration_ms": round(self.duration_sum / total, 2),
+                "min_duration_ms": self.duration_min,
+                "max_duration_ms": self.duration_max,
+                "avg_llm_calls": round(self.llm_calls / total, 2),
+                **_latency_summary(self.latency),
+                "latency_by_model": {
+                    model: {
+                        "count": model_stats["count"],
+                        "success_rate": round(model_stats["successes"] / model_stats["count"] * 100, 2),
+                        **_latency_summary(model_stats["latency"]),
+                    }
+                    for model, model_stats in self.by_model.items()
+                },
+                "llm_call_latency_by_model": {
+                    model: {"count": sketch.count, **_latency_summary(sketch)}
+                    for model, sketch in self.llm_call_latency.items()
+                },
+                "windows": {
+                    name: self._window_stats(duration_s, granularity, now)
+                    for name, (duration_s, granularity) in WINDOWS.items()
+                },
+                "hedging": {
+                    "hedged_count": self.hedging["hedged_count"],
+                    "hedge_rate": round((self.hedging["hedged_count"] / total) * 100, 2),
+                    "primary_wins": self.hedging["primary_wins"],
+                    "hedge_wins": self.hedging["hedge_wins"],
+                },
+                "cascade": dict(self.cascade),
+                "routing": {
+                    "routed_count": routing["routed_count"],
+                    "started_heavy": routing["started_heavy"],
+                    "predicted_easy": routing["predicted_easy"],
+                    "predicted_easy_hit_rate": (
+                        round(routing["easy_hits"] / routing["predicted_easy"] * 100, 2)
+                        if routing["predicted_easy"]
+                        else None
+                    ),
+                    "explored": routing["explored"],
+                    "predicted_hard_hit_rate": (
+                        round(routing["hard_hits"] / routing["explored"] * 100, 2) if routing["explored"] else None
+                    ),
+                },
+                "stages": {
+                    name: {
+                        "count": stage["count"],
+                        "avg_ms": round(stage["sum_ms"] / stage["count"], 2),
+                        "p95_ms": round(stage["sketch"].quantile(95), 2),
+                    }
+                    for name, stage in self.stages.items()
+                },
+                "tokens": {
+                    **self.tokens,
+                    "cached_rate": (
+                        round(self.tokens["cached"] / self.tokens["prompt"] * 100, 2) if self.tokens["prompt"] else 0
+                    ),
+                },
+                "cost": {
+                    "total_usd": round(self.cost["total_usd"], 6),
+                    "avg_usd_per_extraction": round(self.cost["total_usd"] / metered, 6) if metered else None,
+                    "incomplete_count": self.cost["incomplete"],
+                    "unmetered_count": total - metered,
+                    "by_model": {
+                        model: dict(model_stats, cost_usd=round(model_stats["cost_usd"], 6))
+                        for model, model_stats in self.cost_by_model.items()
+                    },
+                },
+                "by_input_mode": {
+                    mode: {
+                        "count": items["count"],
+                        "avg_duration_ms": round(items["duration_sum"] / items["count"], 2),
+                        "avg_prompt_tokens": round(items["prompt_tokens"] / items["count"], 1),
+                        "avg_completion_tokens": round(items["completion_tokens"] / items["count"], 1),
+                        "avg_cost_usd": round(items["cost_usd"] / items["count"], 6),
+                    }
+                    for mode, items in self.by_input_mode.items()
+                },
+            }
+
+
+_kpi_aggregates: Optional[KPIAggregates] = None
+_kpi_aggregates_lock = threading.Lock()
+
+
+def get_kpi_aggregates() -> KPIAggregates:
+    """Retourne les agrégats process-wide de resultats/kpi.jsonl (lu en entier à la 1ère consultation seulement)."""
+    global _kpi_aggregates
+    with _kpi_aggregates_lock:
+        if _kpi_aggregates is None:
+            from app.monitoring.kpi import KPI_FILE  # import local : kpi importe ce module
+
+            _kpi_aggregates = KPIAggregates(KPI_FILE)
+        return _kpi_aggregates
+
+
+def reset_kpi_aggregates(aggregates: Optional[KPIAggregates] = None) -> None:
+    """Remplace les agrégats process-wide (None : reconstruits au prochain appel)."""
+    global _kpi_aggregates
+    with _kpi_aggregates_lock:
+        _kpi_aggregates = aggregates
@@ -1,17 +1,37 @@
 """
 Module de monitoring et KPI pour le microservice AZO OCR.
 Traçabilité des performances et métriques business.
+Chaque extraction a son propre KPITracker, porté par une variable de contexte : les requêtes
+concurrentes ne partagent aucun compteur ni chronomètre.
 """
 
 import logging
 import time
-from dataclasses import dataclass, asdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, asdict, field
 from datetime import datetime
 from pathlib import Path
 from typing import Optional
 
+from app.monitoring.aggregates import get_kpi_aggregates
+from app.monitoring.metrics import observe_extraction
+from app.monitoring.writer import get_record_writer
+
 logger = logging.getLogger(__name__)
 
+KPI_FILE = Path(__file__).parent.parent.parent / "resultats" / "kpi.jsonl"
+
+
+def _model_label(cache_hit: bool, coalesced: bool) -> str:
+    """
+    Modèle final d'une extraction sans appel LLM : servie par le cache, ou par l'extraction identique
+    déjà en cours (coalescing : les appels et la latence du modèle sont comptés chez le premier appelant).
+    """
+    if cache_hit:
+        return "cache"
+    return "coalesced" if coalesced else "unknown"
+
 
 @dataclass
 class ExtractionKPI:
@@ -25,7 +45,56 @@ class ExtractionKPI:
     success: bool
     needs_human_review: bool
     error_type: Optional[str] = None
+    error_kind: Optional[str] = None
+    """Nature de l'erreur finale : "transient", "validation" ou "permanent"."""
     error_message: Optional[str] = None
+    cache_hit: bool = False
+    coalesced: bool = False
+    image_bytes_in: Optional[int] = None
+    image_bytes_out: Optional[int] = None
+    page_count: Optional[int] = None
+    pages_sent: Optional[int] = None
+    input_mode: Optional[str] = None
+    """Chemin d'extraction : "vision" (images) ou "text" (couche texte PDF)."""
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    """Tokens de prompt servis par le cache de prompt de l'API (inclus dans prompt_tokens)."""
+    cost_usd: float = 0.0
+    """Coût des appels LLM de l'extraction (table de prix LLM_PRICES)."""
+    cost_complete: bool = True
+    """False si un appel a utilisé un modèle absent de la table de prix (cost_usd sous-estimé)."""
+    llm_attempts: list[dict] = field(default_factory=list)
+    """Détail par appel LLM ayant répondu : model, prompt_tokens, completion_tokens, cached_tokens, cost_usd."""
+    llm_timings: list[dict] = field(default_factory=list)
+    """Durée de chaque appel LLM, y compris sans réponse : model, duration_ms, outcome ("ok" ou classe d'erreur)."""
+    stage_ms: dict[str, float] = field(default_factory=dict)
+    """
+    Durée par étape (ms) : upload_read, cache_lookup, convert (conversion, mur), rasterize et encode
+    (cumul sur les pages, rendues en parallèle), rate_limit_wait, llm (cumul des appels), validation, persistence.
+    """
+    hedged: bool = False
+    """True si une requête de couverture a été lancée sur la 1ère tentative."""
+    hedge_winner: Optional[str] = None
+    """Requête gagnante lorsque hedged : "primary" ou "hedge" (None si les deux ont échoué)."""
+    repair_attempted: bool = False
+    """True si une relance de réparation (JSON + écart HT/TVA/TTC) a été envoyée."""
+    repair_succeeded: bool = False
+    retry_skipped: bool = False
+    """True si le retry identique a été évité (échec déterministe) au profit du modèle lourd."""
+    locally_repaired: bool = False
+    """True si les montants ont été corrigés par réconciliation locale (sans appel LLM supplémentaire)."""
+    supplier_hash: Optional[str] = None
+    """Empreinte du fournisseur extrait (caractéristique du routeur prédictif)."""
+    route_start_model: Optional[str] = None
+    """Modèle de départ choisi par le routeur (None : routage désactivé)."""
+    route_p_hard: Optional[float] = None
+    """Probabilité d'échec du modèle light estimée par le routeur."""
+    route_predicted_hard: Optional[bool] = None
+    route_explored: bool = False
+    """True si le document, prédit difficile, a tout de même été envoyé au modèle light."""
+    trace_id: Optional[str] = None
+    """Identifiant de la trace de l'extraction (resultats/traces.jsonl si la trace a été exportée)."""
 
     def to_dict(self):
         """Convertit en dictionnaire pour logging/CSV."""
@@ -33,21 +102,44 @@ class ExtractionKPI:
 
 
 class KPITracker:
-    """Suivi des KPI pour l'extraction de données."""
+    """Suivi des KPI d'une extraction (une instance par extraction, voir ScopedKPITracker)."""
 
-    def __init__(self):
+    def __init__(self, kpi_file: Path = KPI_FILE):
         """Initialise le tracker."""
         self.start_time: Optional[float] = None
         self.llm_call_count: int = 0
         self.current_model: Optional[str] = None
-        self.kpi_file = Path(__file__).parent.parent.parent / "resultats" / "kpi.jsonl"
-        self.kpi_file.parent.mkdir(exist_ok=True)
+        self.prompt_tokens: int = 0
+        self.completion_tokens: int = 0
+        self.cached_tokens: int = 0
+        self.llm_attempts: list[dict] = []
+        self.llm_timings: list[dict] = []
+        self.stage_ms: dict[str, float] = {}
+        self.hedged: bool = False
+        self.hedge_winner: Optional[str] = None
+        self.repair_attempted: bool = False
+        self.repair_succeeded: bool = False
+        self.retry_skipped: bool = False
+        self.local_repair: bool = False
+        self.kpi_file = kpi_file
 
     def start_extraction(self):
         """Démarre le chronomètre pour une extraction."""
-        self.start_time = time.time()
+        self.start_time = time.perf_counter()
         self.llm_call_count = 0
         self.current_model = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.llm_attempts = []
+        self.llm_timings = []
+        self.stage_ms = {}
+        self.hedged = False
+        self.hedge_winner = None
+        self.repair_attempted = False
+        self.repair_succeeded = False
+        self.retry_skipped = False
+        self.local_repair = False
 
     def record_llm_call(self, model: str):
         """Enregistre un appel LLM et met à jour le modèle courant."""
@@ -55,91 +147,225 @@ class KPITracker:
         self.current_model = model
         logger.debug("LLM call #%d with model %s", self.llm_call_count, model)
 
+    def record_token_usage(
+        self,
+        model: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        cached_tokens: int = 0,
+        cost_usd: Optional[float] = None,
+    ):
+        """Enregistre les tokens et le coût d'un appel LLM de l'extraction en cours."""
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cached_tokens += cached_tokens
+        self.llm_attempts.append(
+            {
+                "model": model,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "cached_tokens": cached_tokens,
+                "cost_usd": round(cost_usd, 8) if cost_usd is not None else None,
+            }
+        )
+
+    def record_stage(self, name: str, duration_ms: float):
+        """Ajoute une durée (ms) à l'étape name ; une étape répétée (pages, appels) est cumulée."""
+        self.stage_ms[name] = self.stage_ms.get(name, 0.0) + duration_ms
+
+    @contextmanager
+    def stage(self, name: str):
+        """Chronomètre le bloc et l'ajoute à l'étape name (même en cas d'exception)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(name, (time.perf_counter() - started) * 1000)
+
+    def record_llm_attempt(self, model: str, duration_ms: float, outcome: str):
+        """Enregistre la durée d'un appel LLM et son issue ("ok" ou classe de l'erreur)."""
+        self.llm_timings.append({"model": model, "duration_ms": round(duration_ms, 2), "outcome": outcome})
+        self.record_stage("llm", duration_ms)
+
+    def record_hedge_launched(self, model: str):
+        """Note le lancement d'une requête de couverture (l'appel est compté par record_llm_call)."""
+        self.hedged = True
+        logger.debug("Hedge request launched with model %s", model)
+
+    def record_hedge_winner(self, winner: str, model: str):
+        """Enregistre la requête gagnante d'une tentative couverte et son modèle."""
+        self.hedge_winner = winner
+        self.current_model = model
+
+    def record_repair_attempt(self):
+        """Note l'envoi d'une relance de réparation (l'appel est compté par record_llm_call)."""
+        self.repair_attempted = True
+
+    def record_repair_success(self):
+        """Note qu'une relance de réparation a produit une facture valide."""
+        self.repair_succeeded = True
+
+    def record_retry_skipped(self):
+        """Note qu'un retry identique a été évité (échec déterministe)."""
+        self.retry_skipped = True
+
+    def record_local_repair(self):
+        """Note une réconciliation arithmétique locale réussie."""
+        self.local_repair = True
+
     def end_extraction(
         self,
         filename: str,
         success: bool,
         needs_human_review: bool = False,
         error_type: Optional[str] = None,
+        error_kind: Optional[str] = None,
         error_message: Optional[str] = None,
+        cache_hit: bool = False,
+        coalesced: bool = False,
+        image_bytes_in: Optional[int] = None,
+        image_bytes_out: Optional[int] = None,
+        page_count: Optional[int] = None,
+        pages_sent: Optional[int] = None,
+        input_mode: Optional[str] = None,
+        locally_repaired: bool = False,
+        supplier_hash: Optional[str] = None,
+        route_start_model: Optional[str] = None,
+        route_p_hard: Optional[float] = None,
+        route_predicted_hard: Optional[bool] = None,
+        route_explored: bool = False,
+        trace_id: Optional[str] = None,
     ) -> ExtractionKPI:
         """Termine l'extraction et enregistre les KPI."""
         if self.start_time is None:
             raise ValueError("Extraction non initialisée (appeler start_extraction)")
 
-        duration_ms = (time.time() - self.start_time) * 1000
+        duration_ms = (time.perf_counter() - self.start_time) * 1000
 
         kpi = ExtractionKPI(
             timestamp=datetime.now().isoformat(),
             filename=filename,
             total_duration_ms=round(duration_ms, 2),
             llm_call_count=self.llm_call_count,
-            final_model_used=self.current_model or "unknown",
+            final_model_used=self.current_model or _model_label(cache_hit, coalesced),
             success=success,
             needs_human_review=needs_human_review,
             error_type=error_type,
+            error_kind=error_kind,
             error_message=error_message,
+            cache_hit=cache_hit,
+            coalesced=coalesced,
+            image_bytes_in=image_bytes_in,
+            image_bytes_out=image_bytes_out,
+            page_count=page_count,
+            pages_sent=pages_sent,
+            input_mode=input_mode,
+            prompt_tokens=self.prompt_tokens,
+            completion_tokens=self.completion_tokens,
+            cached_tokens=self.cached_tokens,
+            cost_usd=round(sum(a["cost_usd"] or 0.0 for a in self.llm_attempts), 8),
+            cost_complete=all(a["cost_usd"] is not None for a in self.llm_attempts),
+            llm_attempts=list(self.llm_attempts),
+            llm_timings=list(self.llm_timings),
+            stage_ms={name: round(ms, 2) for name, ms in self.stage_ms.items()},
+            hedged=self.hedged,
+            hedge_winner=self.hedge_winner,
+            repair_attempted=self.repair_attempted,
+            repair_succeeded=self.repair_succeeded,
+            retry_skipped=self.retry_skipped,
+            locally_repaired=locally_repaired or self.local_repair,
+            supplier_hash=supplier_hash,
+            route_start_model=route_start_model,
+            route_p_hard=route_p_hard,
+            route_predicted_hard=route_predicted_hard,
+            route_explored=route_explored,
+            trace_id=trace_id,
         )
 
         # Log KPI
         logger.info(
-            "Extraction KPI - File: %s | Duration: %.2fms | LLM calls: %d | Model: %s | Success: %s | Review: %s",
+            "Extraction KPI - File: %s | Duration: %.2fms | LLM calls: %d | Model: %s | Success: %s | Review: %s | Cache: %s | Coalesced: %s | Image: %s -> %s bytes | Mode: %s | Tokens: %d/%d (cache %d) | Cost: $%.5f | Hedge: %s",
             filename,
             duration_ms,
             self.llm_call_count,
-            self.current_model,
+            kpi.final_model_used,
             success,
             needs_human_review,
+            cache_hit,
+            coalesced,
+            image_bytes_in,
+            image_bytes_out,
+            input_mode,
+            self.prompt_tokens,
+            self.completion_tokens,
+            self.cached_tokens,
+            kpi.cost_usd,
+            self.hedge_winner if self.hedged else None,
         )
 
-        # Enregistrer dans fichier JSONL
+        # Enregistrer dans fichier JSONL et alimenter les métriques /metrics
         self._write_kpi(kpi)
+        observe_extraction(kpi)
 
         return kpi
 
     def _write_kpi(self, kpi: ExtractionKPI):
-        """Écrit le KPI dans le fichier JSONL."""
+        """Confie la ligne JSONL du KPI à l'écrivain en arrière-plan."""
         import json
 
         try:
-            with open(self.kpi_file, "a", encoding="utf-8") as f:
-                f.write(json.dumps(kpi.to_dict()) + "\n")
+            get_record_writer().write(self.kpi_file, json.dumps(kpi.to_dict()))
         except Exception as e:
             logger.error("Erreur écriture KPI: %s", e)
 
 
-# Instance globale du tracker
-kpi_tracker = KPITracker()
+_current_tracker: ContextVar[Optional[KPITracker]] = ContextVar("kpi_tracker", default=None)
+
+
+class ScopedKPITracker:
+    """
+    Point d'accès global aux KPI de l'extraction en cours.
+    start_extraction() crée un KPITracker propre à l'extraction et le rattache au contexte courant ;
+    les autres attributs et méthodes sont délégués à ce tracker. Les tâches asyncio créées ensuite
+    (hedging, coalescing) héritent du contexte et alimentent le même tracker, alors que deux
+    requêtes concurrentes (tâches distinctes) ont chacune le leur.
+    """
+
+    def __init__(self, kpi_file: Path = KPI_FILE):
+        self.kpi_file = kpi_file
+
+    def start_extraction(self) -> KPITracker:
+        """Démarre une extraction dans le contexte courant et retourne son tracker."""
+        tracker = KPITracker(self.kpi_file)
+        tracker.start_extraction()
+        _current_tracker.set(tracker)
+        return tracker
+
+    def current(self) -> KPITracker:
+        """Tracker de l'extraction en cours ; hors extraction (script, test), un tracker jetable."""
+        tracker = _current_tracker.get()
+        return tracker if tracker is not None else KPITracker(self.kpi_file)
+
+    def __getattr__(self, name: str):
+        return getattr(self.current(), name)
+
+
+# Instance globale : délègue au tracker de l'extraction en cours
+kpi_tracker = ScopedKPITracker()
+
+
+def reset_current_kpi_tracker() -> None:
+    """Détache l'extraction en cours du contexte courant (tests)."""
+    _current_tracker.set(None)
 
 
 def get_kpi_stats() -> dict:
-    """Retourne les statistiques KPI agrégées."""
-    import json
-
-    if not kpi_tracker.kpi_file.exists():
-        return {"total": 0, "success_rate": 0, "avg_duration_ms": 0, "review_rate": 0}
-
-    kpis = []
-    with open(kpi_tracker.kpi_file, "r", encoding="utf-8") as f:
-        for line in f:
-            if line.strip():
-                kpis.append(json.loads(line))
-
-    if not kpis:
-        return {"total": 0, "success_rate": 0, "avg_duration_ms": 0, "review_rate": 0}
-
-    total = len(kpis)
-    successes = sum(1 for k in kpis if k["success"])
-    reviews = sum(1 for k in kpis if k["needs_human_review"])
-    avg_duration = sum(k["total_duration_ms"] for k in kpis) / total
-
-    return {
-        "total_extractions": total,
-        "success_rate": round((successes / total) * 100, 2),
-        "failed_count": total - successes,
-        "human_review_count": reviews,
-        "review_rate": round((reviews / total) * 100, 2),
-        "avg_duration_ms": round(avg_duration, 2),
-        "min_duration_ms": min(k["total_duration_ms"] for k in kpis),
-        "max_duration_ms": max(k["total_duration_ms"] for k in kpis),
-    }
+    """
+    Retourne les statistiques KPI agrégées, en temps constant : les agrégats en mémoire
+    n'intègrent que les lignes ajoutées à kpi.jsonl depuis la consultation précédente.
+    Pas de flush sur ce chemin de lecture : les KPI encore en file du writer apparaissent
+    au prochain lot (retard d'au plus un intervalle de flush).
+    """
+    aggregates = get_kpi_aggregates()
+    aggregates.refresh()
+    return aggregates.stats()
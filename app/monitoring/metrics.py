@@ -0,0 +1,264 @@
+"""
+Métriques au format texte Prometheus, exposées par GET /metrics.
+Compteurs, jauges et histogrammes tenus en mémoire (par processus) et mis à jour au fil des
+extractions : une collecte ne lit aucun fichier et ne coûte qu'un parcours des séries.
+"""
+
+import abc
+import math
+import threading
+from typing import Iterable
+
+# Type MIME du format d'exposition texte Prometheus
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Bornes des histogrammes (secondes)
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LLM_BUCKETS = (0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0, 120.0)
+EXTRACTION_BUCKETS = (0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0, 120.0, 300.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(abc.ABC):
+    """Série de métriques nommée, déclinée par combinaison de valeurs de labels."""
+
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Labels attendus pour {self.name} : {self.labelnames}, reçus : {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return lines
+
+    @abc.abstractmethod
+    def _samples(self) -> list[str]:
+        """Lignes d'échantillons de la série (appelé sous self._lock)."""
+
+
+class Counter(_Metric):
+    """Compteur monotone."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in self._values.items()
+        ]
+
+
+class Gauge(Counter):
+    """Valeur instantanée (peut diminuer)."""
+
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Histogramme à bornes fixes (buckets cumulés, somme et nombre d'observations)."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = STAGE_BUCKETS,
+    ):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Par série : [compte par borne (non cumulé)..., compte au-delà], somme
+        self._series: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            counts, total = self._series.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return sum(series[0]) if series else 0
+
+    def _samples(self) -> list[str]:
+        lines = []
+        for key, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Ensemble des métriques d'un processus."""
+
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+
+    def counter(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = STAGE_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Exposition texte de toutes les métriques."""
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+stage_duration = registry.histogram(
+    "azo_stage_duration_seconds",
+    "Durée des étapes d'une extraction (rasterize, encode : ré-encodage + base64, validation, persistence...).",
+    ("stage",),
+)
+llm_attempt_duration = registry.histogram(
+    "azo_llm_attempt_duration_seconds",
+    "Durée de chaque appel LLM, par modèle et issue (ok ou classe d'erreur).",
+    ("model", "outcome"),
+    LLM_BUCKETS,
+)
+extraction_duration = registry.histogram(
+    "azo_extraction_duration_seconds",
+    "Durée totale d'une extraction, par modèle final.",
+    ("model",),
+    EXTRACTION_BUCKETS,
+)
+extractions_total = registry.counter(
+    "azo_extractions_total",
+    "Extractions terminées, par issue de la cascade (success, review, failed, cache) et modèle final.",
+    ("outcome", "model"),
+)
+cascade_events_total = registry.counter(
+    "azo_cascade_events_total",
+    "Événements de la cascade : repair_attempted, repair_succeeded, retry_skipped, local_repair, hedged.",
+    ("event",),
+)
+math_validation_errors_total = registry.counter(
+    "azo_math_validation_errors_total",
+    "Réponses LLM rejetées pour incohérence HT + TVA != TTC, par modèle.",
+    ("model",),
+)
+json_parse_failures_total = registry.counter(
+    "azo_json_parse_failures_total",
+    "Réponses LLM dont aucun JSON n'a pu être extrait, par modèle.",
+    ("model",),
+)
+requests_in_flight = registry.gauge(
+    "azo_http_requests_in_flight",
+    "Requêtes HTTP en cours de traitement.",
+)
+extractions_in_flight = registry.gauge(
+    "azo_extractions_in_flight",
+    "Extractions en cours (endpoint unitaire, lots et workers).",
+)
+
+
+def observe_extraction(kpi) -> None:
+    """Alimente les métriques à partir du KPI d'une extraction terminée (ExtractionKPI)."""
+    for name, duration_ms in kpi.stage_ms.items():
+        # Les appels LLM ont leur propre histogramme, par modèle
+        if name != "llm":
+            stage_duration.observe(duration_ms / 1000, stage=name)
+    for timing in kpi.llm_timings:
+        llm_attempt_duration.observe(timing["duration_ms"] / 1000, model=timing["model"], outcome=timing["outcome"])
+    extraction_duration.observe(kpi.total_duration_ms / 1000, model=kpi.final_model_used)
+
+    if kpi.cache_hit:
+        outcome = "cache"
+    elif not kpi.success:
+        outcome = "failed"
+    elif kpi.needs_human_review:
+        outcome = "review"
+    else:
+        outcome = "success"
+    extractions_total.inc(outcome=outcome, model=kpi.final_model_used)
+
+    events = {
+        "repair_attempted": kpi.repair_attempted,
+        "repair_succeeded": kpi.repair_succeeded,
+        "retry_skipped": kpi.retry_skipped,
+        "local_repair": kpi.locally_repaired,
+        "hedged": kpi.hedged,
+    }
+    for event, happened in events.items():
+        if happened:
+            cascade_events_total.inc(event=event)
+
+
+def render_metrics() -> str:
+    """Exposition texte des métriques du processus."""
+    return registry.render()
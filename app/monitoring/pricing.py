@@ -0,0 +1,49 @@
+"""
+Coût des appels LLM à partir des tokens réellement consommés et d'une table de prix par modèle.
+Les prix sont exprimés en dollars pour 1M de tokens : "input" (prompt hors cache),
+"cached_input" (prompt servi par le cache de prompt de l'API) et "output" (complétion).
+"""
+
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+_TOKENS_PER_UNIT = 1_000_000
+
+
+def model_entry(model: str, table: dict[str, dict[str, float]]) -> Optional[dict[str, float]]:
+    """
+    Entrée d'une table par modèle (prix, limites) : nom exact, sinon plus long préfixe connu
+    (ex : "gpt-4o-mini-2024-07-18" → "gpt-4o-mini").
+    """
+    if model in table:
+        return table[model]
+    prefixes = [name for name in table if model.startswith(name)]
+    return table[max(prefixes, key=len)] if prefixes else None
+
+
+def usage_cost(
+    model: str,
+    prompt_tokens: int,
+    completion_tokens: int,
+    cached_tokens: int,
+    prices: dict[str, dict[str, float]],
+) -> Optional[float]:
+    """
+    Coût (dollars) d'un appel LLM ; None si le modèle est absent de la table de prix.
+    Les tokens de prompt servis par le cache sont facturés au tarif cached_input (input à défaut).
+    """
+    price = model_entry(model, prices)
+    if price is None:
+        logger.warning("Pas de prix configuré pour le modèle %s : coût non calculé", model)
+        return None
+
+    cached = min(cached_tokens, prompt_tokens)
+    input_price = price.get("input", 0.0)
+    cost = (
+        (prompt_tokens - cached) * input_price
+        + cached * price.get("cached_input", input_price)
+        + completion_tokens * price.get("output", 0.0)
+    )
+    return cost / _TOKENS_PER_UNIT
@@ -0,0 +1,54 @@
+"""
+Suivi incrémental d'un fichier JSON Lines (kpi.jsonl) écrit par ce processus ou par d'autres :
+chaque lecture ne renvoie que les lignes complètes ajoutées depuis la précédente.
+"""
+
+import logging
+import os
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class JsonlTail:
+    """Curseur (inode, offset) sur un fichier JSON Lines suivi comme un journal."""
+
+    def __init__(self, path: Path, on_reset: Optional[Callable[[], None]] = None):
+        """
+        Args:
+            path: Fichier suivi (peut ne pas encore exister).
+            on_reset: Appelé quand le fichier déjà suivi a été remplacé ou tronqué (rotation),
+                avant sa relecture depuis le début.
+        """
+        self.path = Path(path)
+        self.on_reset = on_reset
+        self._offset = 0
+        self._inode: Optional[int] = None
+
+    def read_new(self) -> Iterator[bytes]:
+        """
+        Lignes complètes et non vides ajoutées depuis la lecture précédente. Une ligne en cours
+        d'écriture (sans fin de ligne) est laissée pour la lecture suivante.
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            if self._inode is not None:
+                logger.info("%s remplacé ou tronqué : relecture depuis le début", self.path.name)
+                if self.on_reset is not None:
+                    self.on_reset()
+            self._inode = stat.st_ino
+            self._offset = 0
+        if stat.st_size == self._offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break
+                self._offset += len(raw)
+                if raw.strip():
+                    yield raw
@@ -0,0 +1,406 @@
+"""
+Traces des extractions : spans imbriqués (requête → conversion → cascade → appels LLM), pour savoir
+où est passé le temps d'une facture lente (rendu poppler, 1er appel light, retry, fallback gpt-4o...).
+Chaque trace terminée est exportée en une ligne de resultats/traces.jsonl au format OTLP/JSON
+(ExportTraceServiceRequest), avec rotation par taille ; `python analyze_traces.py` affiche les
+traces les plus lentes en cascade.
+
+Le span courant est porté par une variable de contexte (suivi à travers les tâches asyncio et le
+threadpool). L'identifiant de trace entrant (en-tête W3C traceparent) et X-Request-ID sont repris
+et renvoyés dans la réponse. Échantillonnage décidé à la racine (TRACE_SAMPLE_RATE ou drapeau
+« sampled » du traceparent entrant) ; une trace non échantillonnée est tout de même exportée si
+elle est lente (TRACE_SLOW_MS) ou en erreur.
+"""
+
+import json
+import logging
+import os
+import random
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+from app.core.config import Settings, get_settings
+from app.monitoring.writer import get_record_writer
+
+try:
+    import fcntl
+except ImportError:  # Windows : rotation sans verrou inter-processus (un seul worker)
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+TRACE_FILE = Path(__file__).parent.parent.parent / "resultats" / "traces.jsonl"
+
+TRACEPARENT_HEADER = "traceparent"
+REQUEST_ID_HEADER = "X-Request-ID"
+
+SERVICE_NAME = "azo-ocr"
+
+# Codes de statut et types de span OTLP
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[tuple[str, str, bool]]:
+    """(trace_id, span_id parent, sampled) d'un en-tête traceparent W3C ; None si absent ou invalide."""
+    if not value:
+        return None
+    match = _TRACEPARENT_RE.match(value.strip().lower())
+    if match is None:
+        return None
+    trace_id, parent_id, flags = match.groups()
+    if trace_id == "0" * 32 or parent_id == "0" * 16:
+        return None
+    return trace_id, parent_id, bool(int(flags, 16) & 1)
+
+
+def _otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        # OTLP/JSON : entiers 64 bits encodés en chaîne
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: dict[str, Any]) -> list[dict]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+class _TraceState:
+    """Spans terminés d'une trace, exportés ensemble à la fin du span racine."""
+
+    __slots__ = ("trace_id", "sampled", "request_id", "spans")
+
+    def __init__(self, trace_id: str, sampled: bool, request_id: str):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.request_id = request_id
+        self.spans: list[Span] = []
+
+
+class Span:
+    """Opération chronométrée d'une trace (horodatage mur pour l'export, durée monotone)."""
+
+    __slots__ = (
+        "name",
+        "span_id",
+        "parent_span_id",
+        "kind",
+        "attributes",
+        "start_ns",
+        "end_ns",
+        "status",
+        "status_message",
+        "_trace",
+        "_started",
+    )
+
+    def __init__(self, name: str, trace: _TraceState, parent_span_id: str, kind: int, attributes: dict):
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent_span_id
+        self.kind = kind
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.status = STATUS_UNSET
+        self.status_message = ""
+        self._trace = trace
+        self._started = time.perf_counter_ns()
+
+    @property
+    def trace_id(self) -> str:
+        return self._trace.trace_id
+
+    @property
+    def request_id(self) -> str:
+        return self._trace.request_id
+
+    @property
+    def traceparent(self) -> str:
+        """En-tête traceparent W3C désignant ce span (à propager vers l'aval ou renvoyer au client)."""
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self._trace.sampled else '00'}"
+
+    @property
+    def duration_ms(self) -> float:
+        end = self._started + (self.end_ns - self.start_ns) if self.end_ns is not None else time.perf_counter_ns()
+        return (end - self._started) / 1e6
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def add_to_attribute(self, key: str, amount: float) -> None:
+        """Cumule amount dans l'attribut key (ex. attente du limiteur sur plusieurs remises en file)."""
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def record_error(self, error: BaseException) -> None:
+        self.set_error(f"{type(error).__name__}: {error}")
+
+    def set_error(self, message: str) -> None:
+        """Marque le span en erreur (la trace sera exportée même non échantillonnée)."""
+        self.status = STATUS_ERROR
+        self.status_message = message[:500]
+
+    def _end(self) -> None:
+        self.end_ns = self.start_ns + (time.perf_counter_ns() - self._started)
+        if self.status == STATUS_UNSET:
+            self.status = STATUS_OK
+        self._trace.spans.append(self)
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "status": {"code": self.status},
+        }
+        if self.status_message:
+            span["status"]["message"] = self.status_message
+        return span
+
+
+class _NoopSpan:
+    """Span inerte (traçage désactivé, ou aucun span en cours pour current_span)."""
+
+    trace_id = None
+    request_id = None
+    traceparent = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def add_to_attribute(self, key: str, amount: float) -> None:
+        pass
+
+    def record_error(self, error: BaseException) -> None:
+        pass
+
+    def set_error(self, message: str) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """Crée les spans, décide de l'échantillonnage et exporte les traces terminées (JSONL tournant)."""
+
+    def __init__(
+        self,
+        *,
+        enabled: bool = True,
+        sample_rate: float = 1.0,
+        slow_ms: Optional[float] = None,
+        trace_file: Path = TRACE_FILE,
+        max_bytes: int = 50 * 1024 * 1024,
+        backup_count: int = 5,
+    ):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.trace_file = Path(trace_file)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._rotate_lock = threading.Lock()
+        self.exported = 0
+        self.exported_slow = 0
+        self.dropped = 0
+        self.rotations = 0
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "Tracer":
+        return cls(
+            enabled=settings.tracing_enabled,
+            sample_rate=settings.trace_sample_rate,
+            slow_ms=settings.trace_slow_ms,
+            max_bytes=settings.trace_max_bytes,
+            backup_count=settings.trace_backup_count,
+        )
+
+    @contextmanager
+    def start_span(
+        self,
+        name: str,
+        *,
+        traceparent: Optional[str] = None,
+        request_id: Optional[str] = None,
+        kind: int = SPAN_KIND_INTERNAL,
+        **attributes: Any,
+    ) -> Iterator[Any]:
+        """
+        Span enfant du span courant, ou racine d'une nouvelle trace (reprenant traceparent / request_id
+        entrants s'ils sont fournis). L'exception qui traverse le span le marque en erreur.
+        """
+        if not self.enabled:
+            yield NOOP_SPAN
+            return
+        parent = _current_span.get()
+        if parent is not None:
+            span = Span(name, parent._trace, parent.span_id, kind, attributes)
+        else:
+            trace = self._new_trace(traceparent, request_id)
+            span = Span(name, trace, self._remote_parent_id(traceparent), kind, attributes)
+            span.set_attribute("request.id", trace.request_id)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_error(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span._end()
+            if parent is None:
+                self._finish_trace(span)
+
+    def _new_trace(self, traceparent: Optional[str], request_id: Optional[str]) -> _TraceState:
+        remote = parse_traceparent(traceparent)
+        if remote is not None:
+            trace_id, _, sampled = remote
+        else:
+            trace_id = secrets.token_hex(16)
+            sampled = random.random() < self.sample_rate
+        return _TraceState(trace_id, sampled, (request_id or "").strip()[:128] or trace_id)
+
+    @staticmethod
+    def _remote_parent_id(traceparent: Optional[str]) -> str:
+        remote = parse_traceparent(traceparent)
+        return remote[1] if remote is not None else ""
+
+    def _finish_trace(self, root: Span) -> None:
+        """Exporte la trace si elle est échantillonnée, lente ou en erreur."""
+        trace = root._trace
+        slow = self.slow_ms is not None and root.duration_ms >= self.slow_ms
+        failed = any(span.status == STATUS_ERROR for span in trace.spans)
+        if not (trace.sampled or slow or failed):
+            self.dropped += 1
+            return
+        try:
+            self._export(trace)
+        except (OSError, TypeError, ValueError) as e:
+            logger.error("Export de la trace %s impossible : %s", trace.trace_id, e)
+            return
+        self.exported += 1
+        if slow and not trace.sampled:
+            self.exported_slow += 1
+
+    def _export(self, trace: _TraceState) -> None:
+        spans = sorted(trace.spans, key=lambda span: span.start_ns)
+        payload = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": _otlp_attributes({"service.name": SERVICE_NAME, "process.pid": os.getpid()})
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": __name__},
+                            "spans": [span.to_otlp() for span in spans],
+                        }
+                    ],
+                }
+            ],
+        }
+        self._rotate_if_needed()
+        get_record_writer().write(self.trace_file, json.dumps(payload, ensure_ascii=False, separators=(",", ":")))
+
+    def _rotate_if_needed(self) -> None:
+        """
+        Renomme traces.jsonl en traces.jsonl.1 (décalant les précédents jusqu'à backup_count) une fois
+        max_bytes atteint. La taille est relue sous verrou de fichier : un seul worker fait la rotation,
+        et l'écrivain rouvre le fichier dès qu'il a été remplacé.
+        """
+        try:
+            if os.stat(self.trace_file).st_size < self.max_bytes:
+                return
+        except FileNotFoundError:
+            return
+        with self._rotate_lock:
+            try:
+                handle = open(self.trace_file, "a", encoding="utf-8")
+            except OSError as e:
+                logger.error("Rotation de %s impossible : %s", self.trace_file, e)
+                return
+            with handle:
+                if fcntl is not None:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+                if os.fstat(handle.fileno()).st_size < self.max_bytes:
+                    return
+                if self.backup_count <= 0:
+                    os.remove(self.trace_file)
+                else:
+                    for index in range(self.backup_count - 1, 0, -1):
+                        source = self.trace_file.with_name(f"{self.trace_file.name}.{index}")
+                        if source.exists():
+                            os.replace(source, self.trace_file.with_name(f"{self.trace_file.name}.{index + 1}"))
+                    os.replace(self.trace_file, self.trace_file.with_name(f"{self.trace_file.name}.1"))
+                self.rotations += 1
+                logger.info("Rotation du journal de traces %s", self.trace_file)
+
+    def stats(self) -> dict:
+        """Compteurs exposés par /kpi."""
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "exported": self.exported,
+            "exported_slow": self.exported_slow,
+            "dropped": self.dropped,
+            "rotations": self.rotations,
+        }
+
+
+def current_span():
+    """Span en cours dans ce contexte (span inerte si aucun)."""
+    return _current_span.get() or NOOP_SPAN
+
+
+def current_trace_id() -> Optional[str]:
+    """Identifiant de la trace en cours (None hors trace)."""
+    span = _current_span.get()
+    return span.trace_id if span is not None else None
+
+
+def start_span(name: str, **kwargs):
+    """Raccourci : span du traceur process-wide."""
+    return get_tracer().start_span(name, **kwargs)
+
+
+_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """Retourne le traceur process-wide (construit depuis les settings au premier appel)."""
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer.from_settings(get_settings())
+        return _tracer
+
+
+def reset_tracer(tracer: Optional[Tracer] = None) -> None:
+    """Remplace le traceur (None : reconstruit depuis les settings au prochain appel)."""
+    global _tracer
+    with _tracer_lock:
+        _tracer = tracer
@@ -0,0 +1,317 @@
+"""
+Écriture en arrière-plan des journaux de résultats (resultats/kpi.jsonl, resultats/traces.jsonl).
+Les requêtes déposent leurs lignes dans une file bornée ; un thread les regroupe par lots et les
+ajoute aux fichiers dès que la taille de lot ou l'intervalle de flush est atteint, avec une
+politique de fsync configurable. Chaque lot est écrit sous verrou de fichier (flock) : plusieurs
+workers uvicorn partagent les mêmes fichiers sans entrelacer leurs lignes.
+La mise en lots (BatchingWriter) sert aussi au stockage SQLite des résultats d'extraction.
+"""
+
+import abc
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import IO, Optional
+
+from app.core.config import Settings, get_settings
+
+try:
+    import fcntl
+except ImportError:  # Windows : pas de verrou inter-processus (un seul worker)
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Politiques de fsync
+FSYNC_ALWAYS = "always"
+"""fsync après chaque lot : aucune ligne perdue sur coupure, débit réduit."""
+FSYNC_INTERVAL = "interval"
+"""fsync au plus toutes les log_writer_fsync_interval_s secondes."""
+FSYNC_NEVER = "never"
+"""Flush seulement : la persistance sur disque est laissée au système."""
+
+# Marqueur d'arrêt du thread d'écriture
+_STOP = object()
+
+
+class _Record:
+    """Ligne à ajouter à un fichier ; header est écrit d'abord si le fichier est vide (en-tête CSV)."""
+
+    __slots__ = ("path", "line", "header")
+
+    def __init__(self, path: Path, line: str, header: Optional[str]):
+        self.path = path
+        self.line = line
+        self.header = header
+
+
+class BatchingWriter(abc.ABC):
+    """
+    Base des écrivains par lots. En mode background, les éléments déposés par _submit() sont regroupés
+    par un thread et passés à _write_batch() dès batch_size éléments, flush_interval_s écoulé ou flush
+    demandé ; si la file est pleine, l'élément est écrit directement par l'appelant (contre-pression,
+    aucune perte).
+    """
+
+    thread_name = "batching-writer"
+
+    def __init__(self, *, background: bool, queue_size: int, batch_size: int, flush_interval_s: float):
+        self.background = background
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._closed = False
+        self.overflow_writes = 0
+        self._thread: Optional[threading.Thread] = None
+        if background:
+            self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+            self._thread.start()
+
+    def _submit(self, item) -> None:
+        if self.background and not self._closed:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                self.overflow_writes += 1
+        self._write_batch([item])
+
+    def flush(self, timeout: Optional[float] = 5.0) -> bool:
+        """Attend l'écriture des éléments déjà en file ; False si le délai est dépassé."""
+        if self._thread is None or self._closed:
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def _stop(self, timeout: Optional[float]) -> bool:
+        """Arrête le thread après écriture de la file ; False si déjà fermé."""
+        if self._closed:
+            return False
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+            # Éléments déposés pendant l'arrêt : écrits directement
+            leftovers = []
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not _STOP and not isinstance(item, threading.Event):
+                    leftovers.append(item)
+            if leftovers:
+                self._write_batch(leftovers)
+        return True
+
+    def _run(self) -> None:
+        """Boucle du thread : lot écrit dès batch_size éléments, flush_interval_s écoulé ou flush demandé."""
+        batch: list = []
+        waiters: list[threading.Event] = []
+        batch_deadline = 0.0
+        while True:
+            timeout = max(batch_deadline - time.monotonic(), 0.0) if batch else None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if isinstance(item, threading.Event):
+                waiters.append(item)
+            elif item is not None and item is not _STOP:
+                if not batch:
+                    batch_deadline = time.monotonic() + self.flush_interval_s
+                batch.append(item)
+                if len(batch) < self.batch_size:
+                    continue
+            if batch:
+                self._write_batch(batch)
+                batch = []
+            for waiter in waiters:
+                waiter.set()
+            waiters = []
+            if item is _STOP:
+                return
+
+    @abc.abstractmethod
+    def _write_batch(self, items: list) -> None:
+        """Écrit un lot d'éléments (thread d'écriture, ou appelant si la file est pleine)."""
+
+
+class RecordWriter(BatchingWriter):
+    """
+    Écrivain de lignes en ajout (append) vers un ou plusieurs fichiers.
+    En mode background, write() ne fait que déposer la ligne dans la file ; si la file est pleine,
+    la ligne est écrite directement par l'appelant (contre-pression, aucune perte).
+    """
+
+    thread_name = "record-writer"
+
+    def __init__(
+        self,
+        *,
+        background: bool = True,
+        queue_size: int = 10000,
+        batch_size: int = 256,
+        flush_interval_s: float = 1.0,
+        fsync: str = FSYNC_INTERVAL,
+        fsync_interval_s: float = 5.0,
+    ):
+        if fsync not in (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER):
+            raise ValueError(f"Politique de fsync inconnue : {fsync!r}")
+        self.fsync = fsync
+        self.fsync_interval_s = fsync_interval_s
+        self._lock = threading.Lock()
+        self._files: dict[Path, IO[str]] = {}
+        self._last_fsync = time.monotonic()
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+        super().__init__(
+            background=background,
+            queue_size=queue_size,
+            batch_size=batch_size,
+            flush_interval_s=flush_interval_s,
+        )
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "RecordWriter":
+        return cls(
+            background=settings.log_writer_background,
+            queue_size=settings.log_writer_queue_size,
+            batch_size=settings.log_writer_batch_size,
+            flush_interval_s=settings.log_writer_flush_interval_s,
+            fsync=settings.log_writer_fsync,
+            fsync_interval_s=settings.log_writer_fsync_interval_s,
+        )
+
+    def write(self, path: Path, line: str, header: Optional[str] = None) -> None:
+        """
+        Ajoute line (sans saut de ligne final) au fichier path.
+        header : ligne écrite avant la première ligne d'un fichier vide ou absent.
+        """
+        self._submit(_Record(Path(path), line, header))
+
+    def close(self, timeout: Optional[float] = 10.0) -> None:
+        """Écrit les lignes en attente, synchronise les fichiers sur disque et les ferme."""
+        if not self._stop(timeout):
+            return
+        with self._lock:
+            for handle in self._files.values():
+                try:
+                    handle.flush()
+                    if self.fsync != FSYNC_NEVER:
+                        os.fsync(handle.fileno())
+                    handle.close()
+                except OSError as e:
+                    logger.error("Fermeture du journal %s impossible : %s", handle.name, e)
+            self._files.clear()
+
+    def stats(self) -> dict:
+        """Compteurs exposés par /kpi."""
+        return {
+            "background": self.background,
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "overflow_writes": self.overflow_writes,
+            "errors": self.errors,
+            "fsync": self.fsync,
+        }
+
+    def _write_batch(self, records: list[_Record]) -> None:
+        """Ajoute les lignes, fichier par fichier, en une écriture sous verrou exclusif."""
+        by_path: dict[Path, list[_Record]] = {}
+        for record in records:
+            by_path.setdefault(record.path, []).append(record)
+        with self._lock:
+            for path, items in by_path.items():
+                try:
+                    self._append(path, items)
+                    self.written += len(items)
+                except OSError as e:
+                    self.errors += 1
+                    logger.error("Écriture de %d ligne(s) dans %s impossible : %s", len(items), path, e)
+            self.batches += 1
+            if self.fsync == FSYNC_INTERVAL and time.monotonic() - self._last_fsync >= self.fsync_interval_s:
+                self._sync_all()
+
+    def _append(self, path: Path, items: list[_Record]) -> None:
+        handle = self._handle(path)
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+        try:
+            # Taille lue sous verrou : un seul processus écrit l'en-tête d'un fichier neuf
+            header = items[0].header if os.fstat(handle.fileno()).st_size == 0 else None
+            lines = ([header] if header is not None else []) + [item.line for item in items]
+            handle.write("\n".join(lines) + "\n")
+            handle.flush()
+            if self.fsync == FSYNC_ALWAYS:
+                os.fsync(handle.fileno())
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+    def _handle(self, path: Path) -> IO[str]:
+        """Descripteur ouvert en ajout, rouvert si le fichier a été supprimé ou remplacé (rotation)."""
+        handle = self._files.get(path)
+        if handle is not None:
+            try:
+                if os.stat(path).st_ino == os.fstat(handle.fileno()).st_ino:
+                    return handle
+            except FileNotFoundError:
+                pass
+            handle.close()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        handle = open(path, "a", encoding="utf-8", newline="")
+        self._files[path] = handle
+        return handle
+
+    def _sync_all(self) -> None:
+        for handle in self._files.values():
+            try:
+                os.fsync(handle.fileno())
+            except OSError as e:
+                logger.error("fsync de %s impossible : %s", handle.name, e)
+        self._last_fsync = time.monotonic()
+
+
+_record_writer: Optional[RecordWriter] = None
+_record_writer_lock = threading.Lock()
+
+
+def get_record_writer() -> RecordWriter:
+    """Retourne l'écrivain process-wide (construit depuis les settings au premier appel)."""
+    global _record_writer
+    with _record_writer_lock:
+        if _record_writer is None:
+            _record_writer = RecordWriter.from_settings(get_settings())
+        return _record_writer
+
+
+def close_record_writer() -> None:
+    """Vide la file et ferme les journaux (arrêt de l'application, fin de processus)."""
+    global _record_writer
+    with _record_writer_lock:
+        writer, _record_writer = _record_writer, None
+    if writer is not None:
+        writer.close()
+
+
+def reset_record_writer(writer: Optional[RecordWriter] = None) -> None:
+    """Ferme l'écrivain courant et le remplace (None : reconstruit depuis les settings au prochain appel)."""
+    global _record_writer
+    close_record_writer()
+    with _record_writer_lock:
+        _record_writer = writer
+
+
+# Processus sans hook d'arrêt (worker, scripts) : les lignes en file sont écrites à la sortie
+atexit.register(close_record_writer)
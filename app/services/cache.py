@@ -0,0 +1,303 @@
+"""
+Cache des résultats d'extraction adressé par contenu.
+Clé = hash SHA-256 du fichier uploadé + empreinte du prompt système + configuration de la cascade de modèles
++ empreinte des réglages de prétraitement (images, rendu PDF, couche texte).
+Deux niveaux : LRU borné en mémoire, puis fichiers JSON sur disque (persistants entre redémarrages),
+avec expiration (TTL) et éviction par taille.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from app.core.config import Settings, get_settings
+from app.models.schemas import InvoiceData
+from app.services.llm_client import prompt_fingerprint
+from app.services.ocr_pipeline import ExtractionResult
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = Path(__file__).parent.parent.parent / "resultats" / "cache"
+
+
+def content_hash(content: bytes) -> str:
+    """Hash SHA-256 (hex) du contenu brut d'un fichier uploadé."""
+    return hashlib.sha256(content).hexdigest()
+
+
+# Réglages qui changent ce qui est envoyé au LLM pour un même fichier
+_PREPROCESSING_SETTINGS = (
+    "image_max_long_edge",
+    "image_max_short_edge",
+    "image_format",
+    "image_quality",
+    "image_auto_grayscale",
+    "image_grayscale_threshold",
+    "pdf_dpi",
+    "pdf_max_pages",
+    "pdf_max_selected_pages",
+    "text_layer_enabled",
+    "text_layer_min_chars",
+    "text_layer_max_chars",
+)
+
+
+def preprocessing_fingerprint(settings: Settings) -> str:
+    """Empreinte des réglages de prétraitement des images et des PDF."""
+    values = {name: getattr(settings, name) for name in _PREPROCESSING_SETTINGS}
+    return hashlib.sha256(json.dumps(values, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def make_cache_key(file_hash: str, settings: Optional[Settings] = None) -> str:
+    """
+    Construit la clé de cache : le même fichier traité avec un autre prompt, une autre cascade
+    de modèles ou un autre prétraitement (résolution, format, sélection de pages...) donne une clé différente.
+    """
+    settings = settings or get_settings()
+    config = "|".join(
+        [
+            file_hash,
+            prompt_fingerprint(),
+            settings.llm_model_light,
+            settings.llm_model_heavy,
+            preprocessing_fingerprint(settings),
+        ]
+    )
+    return hashlib.sha256(config.encode("utf-8")).hexdigest()
+
+
+def _serialize(result: ExtractionResult) -> dict:
+    """Convertit un ExtractionResult en dict JSON-sérialisable."""
+    return {
+        "data": result.data.model_dump() if result.data is not None else None,
+        "needs_human_review": result.needs_human_review,
+        "error_message": result.error_message,
+        "locally_repaired": result.locally_repaired,
+    }
+
+
+def _deserialize(payload: dict) -> ExtractionResult:
+    """Reconstruit un ExtractionResult depuis sa forme JSON."""
+    data = payload.get("data")
+    return ExtractionResult(
+        data=InvoiceData.model_validate(data) if data is not None else None,
+        needs_human_review=payload.get("needs_human_review", False),
+        error_message=payload.get("error_message"),
+        locally_repaired=payload.get("locally_repaired", False),
+    )
+
+
+class ExtractionCache:
+    """Cache LRU mémoire + disque des résultats d'extraction (thread-safe)."""
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_s: float = 7 * 24 * 3600,
+        disk_dir: Optional[Path] = None,
+        disk_max_bytes: int = 512 * 1024 * 1024,
+    ):
+        """
+        Args:
+            max_entries: Taille maximale du LRU mémoire.
+            ttl_s: Durée de validité d'une entrée (mémoire et disque).
+            disk_dir: Dossier du niveau disque ; None désactive le disque.
+            disk_max_bytes: Taille maximale cumulée des fichiers du niveau disque.
+        """
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.disk_dir = Path(disk_dir) if disk_dir is not None else None
+        self.disk_max_bytes = disk_max_bytes
+
+        self._lock = threading.Lock()
+        self._memory: OrderedDict[str, tuple[float, ExtractionResult]] = OrderedDict()
+        # Index du niveau disque : clé -> taille, du plus ancien au plus récent
+        self._disk_index: Optional[OrderedDict[str, int]] = None
+        self._disk_bytes = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "ExtractionCache":
+        """Construit le cache à partir des settings."""
+        disk_dir = None
+        if settings.cache_disk_enabled:
+            disk_dir = Path(settings.cache_dir) if settings.cache_dir else DEFAULT_CACHE_DIR
+        return cls(
+            max_entries=settings.cache_max_entries,
+            ttl_s=settings.cache_ttl_s,
+            disk_dir=disk_dir,
+            disk_max_bytes=int(settings.cache_disk_max_mb * 1024 * 1024),
+        )
+
+    def get(self, key: str) -> Optional[ExtractionResult]:
+        """Retourne le résultat en cache (mémoire puis disque) ou None."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                stored_at, result = entry
+                if now - stored_at <= self.ttl_s:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return result
+                del self._memory[key]
+
+            result = self._disk_get(key, now)
+            if result is None:
+                self.misses += 1
+                return None
+
+            self.disk_hits += 1
+            self._memory_put(key, result, now)
+            return result
+
+    def put(self, key: str, result: ExtractionResult) -> None:
+        """
+        Enregistre un résultat. Seuls les résultats avec données sont mis en cache :
+        un échec peut venir d'une erreur transitoire de l'API et doit pouvoir être retenté.
+        """
+        if result.data is None:
+            return
+        now = time.time()
+        with self._lock:
+            self._memory_put(key, result, now)
+            self._disk_put(key, result, now)
+
+    def clear(self) -> None:
+        """Vide les deux niveaux du cache."""
+        with self._lock:
+            self._memory.clear()
+            for key in list(self._load_disk_index()):
+                self._disk_remove(key)
+
+    def stats(self) -> dict:
+        """Compteurs hit/miss et occupation, exposés à côté des KPI."""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "hits": hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((hits / lookups) * 100, 2) if lookups else 0,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "disk_entries": len(self._disk_index) if self._disk_index is not None else None,
+                "disk_bytes": self._disk_bytes if self._disk_index is not None else None,
+            }
+
+    # --- Niveau mémoire -------------------------------------------------
+
+    def _memory_put(self, key: str, result: ExtractionResult, now: float) -> None:
+        self._memory[key] = (now, result)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    # --- Niveau disque --------------------------------------------------
+
+    def _path(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.json"
+
+    def _load_disk_index(self) -> OrderedDict:
+        """Construit l'index du niveau disque au premier accès (tri par date de modification)."""
+        if self._disk_index is not None:
+            return self._disk_index
+        index: OrderedDict[str, int] = OrderedDict()
+        self._disk_bytes = 0
+        if self.disk_dir is not None and self.disk_dir.exists():
+            files = []
+            for path in self.disk_dir.glob("*/*.json"):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, path.stem, stat.st_size))
+            for _, key, size in sorted(files):
+                index[key] = size
+                self._disk_bytes += size
+        self._disk_index = index
+        return index
+
+    def _disk_get(self, key: str, now: float) -> Optional[ExtractionResult]:
+        if self.disk_dir is None:
+            return None
+        path = self._path(key)
+        try:
+            payload = json.loads(path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("Entrée de cache illisible %s: %s", path, e)
+            self._disk_remove(key)
+            return None
+
+        if now - payload.get("stored_at", 0) > self.ttl_s:
+            self._disk_remove(key)
+            return None
+        try:
+            return _deserialize(payload["result"])
+        except Exception as e:
+            logger.warning("Entrée de cache invalide %s: %s", path, e)
+            self._disk_remove(key)
+            return None
+
+    def _disk_put(self, key: str, result: ExtractionResult, now: float) -> None:
+        if self.disk_dir is None:
+            return
+        index = self._load_disk_index()
+        path = self._path(key)
+        content = json.dumps({"stored_at": now, "result": _serialize(result)}, ensure_ascii=False)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_text(content, encoding="utf-8")
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Écriture cache disque échouée %s: %s", path, e)
+            return
+
+        size = len(content.encode("utf-8"))
+        self._disk_bytes += size - index.pop(key, 0)
+        index[key] = size
+        while self._disk_bytes > self.disk_max_bytes and len(index) > 1:
+            oldest = next(iter(index))
+            self._disk_remove(oldest)
+            self.evictions += 1
+
+    def _disk_remove(self, key: str) -> None:
+        index = self._load_disk_index()
+        self._disk_bytes -= index.pop(key, 0)
+        try:
+            self._path(key).unlink()
+        except OSError:
+            pass
+
+
+_extraction_cache: Optional[ExtractionCache] = None
+
+
+def get_extraction_cache() -> ExtractionCache:
+    """Retourne le cache process-wide (construit depuis les settings au premier appel)."""
+    global _extraction_cache
+    if _extraction_cache is None:
+        _extraction_cache = ExtractionCache.from_settings(get_settings())
+    return _extraction_cache
+
+
+def reset_extraction_cache(cache: Optional[ExtractionCache] = None) -> None:
+    """Remplace le cache process-wide (None : reconstruit depuis les settings au prochain appel)."""
+    global _extraction_cache
+    _extraction_cache = cache
@@ -0,0 +1,77 @@
+"""
+Coalescing (single-flight) des extractions identiques en cours.
+Si une extraction pour la même clé (hash du fichier + config) est déjà en cours,
+les requêtes suivantes attendent son résultat au lieu de relancer toute la cascade LLM.
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Partage une exécution asynchrone en cours entre tous les appelants d'une même clé."""
+
+    def __init__(self):
+        """Initialise le registre des exécutions en cours et les compteurs."""
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._waiters: dict[str, int] = {}
+        self.leader_count = 0
+        self.coalesced_count = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]], timeout: Optional[float] = None) -> tuple[T, bool]:
+        """
+        Exécute fn() une seule fois par clé parmi les appels concurrents.
+
+        Le travail tourne dans une tâche dédiée : l'annulation d'un appelant (client déconnecté)
+        n'interrompt pas l'extraction attendue par les autres. Quand le dernier appelant abandonne
+        (annulation ou timeout), l'extraction devenue inutile est annulée.
+
+        Args:
+            timeout: Attente maximale de cet appelant (son échéance) ; lève asyncio.TimeoutError.
+
+        Returns:
+            (résultat, coalesced) — coalesced=True si le résultat provient d'une exécution
+            lancée par un autre appelant.
+        """
+        task = self._inflight.get(key)
+        coalesced = task is not None
+        if coalesced:
+            self.coalesced_count += 1
+            logger.info("Extraction identique déjà en cours (clé %s…), attente du résultat partagé", key[:12])
+        else:
+            self.leader_count += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout), coalesced
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            if self._waiters[key] == 1 and not task.done():
+                logger.info("Plus aucun appelant pour l'extraction %s… : annulation", key[:12])
+                task.cancel()
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+
+    def stats(self) -> dict:
+        """Compteurs exposés à côté des KPI."""
+        total = self.leader_count + self.coalesced_count
+        return {
+            "in_flight": len(self._inflight),
+            "executed": self.leader_count,
+            "coalesced": self.coalesced_count,
+            "coalesced_rate": round((self.coalesced_count / total) * 100, 2) if total else 0,
+        }
+
+
+# Instance globale (une par worker)
+extraction_flights = SingleFlight()
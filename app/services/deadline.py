@@ -0,0 +1,67 @@
+"""
+Échéance (deadline) de bout en bout d'une extraction.
+Fixée à l'arrivée de la requête (en-tête X-Request-Timeout ou REQUEST_TIMEOUT_S), elle est
+propagée à la rasterisation, à chaque appel LLM et à la cascade : le budget restant décide si
+une nouvelle tentative vaut la peine, et aucun travail ne continue après l'abandon du client.
+"""
+
+import math
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from app.core.config import Settings
+
+# En-tête HTTP portant le budget de la requête, en secondes
+DEADLINE_HEADER = "X-Request-Timeout"
+
+
+class DeadlineExceeded(TimeoutError):
+    """Le budget de temps de la requête est épuisé."""
+
+
+@dataclass(frozen=True)
+class Deadline:
+    """Échéance absolue (horloge monotone) d'une extraction."""
+
+    expires_at: float
+    budget_s: float
+    """Budget initial (secondes), pour les logs."""
+
+    @classmethod
+    def after(cls, seconds: float) -> "Deadline":
+        """Échéance dans seconds secondes."""
+        return cls(expires_at=time.monotonic() + seconds, budget_s=seconds)
+
+    def remaining(self) -> float:
+        """Secondes restantes (0 si dépassée)."""
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def check(self, stage: str) -> None:
+        """Lève DeadlineExceeded si l'échéance est dépassée avant l'étape stage."""
+        if self.expired:
+            raise DeadlineExceeded(f"Délai de {self.budget_s:.1f}s dépassé ({stage})")
+
+    def cap(self, timeout_s: Optional[float] = None) -> float:
+        """Timeout d'une opération borné par le temps restant."""
+        return min(timeout_s if timeout_s is not None else math.inf, self.remaining())
+
+
+def request_deadline(header_value: Optional[str], settings: Settings) -> Deadline:
+    """
+    Échéance d'une requête : budget de l'en-tête X-Request-Timeout (secondes, plafonné par
+    REQUEST_TIMEOUT_MAX_S) ou REQUEST_TIMEOUT_S. Lève ValueError si l'en-tête est invalide.
+    """
+    if header_value is None or not header_value.strip():
+        return Deadline.after(settings.request_timeout_s)
+    try:
+        seconds = float(header_value)
+    except ValueError:
+        raise ValueError(f"{DEADLINE_HEADER} invalide : {header_value!r} (secondes attendues)") from None
+    if not math.isfinite(seconds) or seconds <= 0:
+        raise ValueError(f"{DEADLINE_HEADER} doit être un nombre de secondes positif")
+    return Deadline.after(min(seconds, settings.request_timeout_max_s))
@@ -0,0 +1,210 @@
+"""
+Service d'extraction d'un document uploadé, partagé par l'endpoint unitaire, le batch et les workers.
+Enchaîne : cache adressé par contenu → coalescing des extractions identiques → conversion
+(threadpool) → pipeline LLM → base des résultats → KPI (durées par étape comprises).
+"""
+
+import asyncio
+import logging
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import Settings, get_settings
+from app.monitoring.kpi import kpi_tracker
+from app.monitoring.metrics import extractions_in_flight
+from app.monitoring.tracing import current_span, current_trace_id, start_span
+from app.services.cache import content_hash, get_extraction_cache, make_cache_key
+from app.services.coalescing import extraction_flights
+from app.services.deadline import Deadline, DeadlineExceeded
+from app.services.ocr_pipeline import ExtractionResult, failed_result, run_extraction_pipeline
+from app.services.pdf import prepare_pdf
+from app.services.preprocessing import PreparedDocument, prepare_image_document
+from app.services.results import get_result_store
+from app.services.routing import RouteDecision, RouteFeatures, get_model_router, supplier_hash
+
+logger = logging.getLogger(__name__)
+
+# Types MIME acceptés
+ALLOWED_IMAGE_TYPES = {"image/jpeg", "image/png", "image/webp", "image/gif"}
+ALLOWED_PDF_TYPE = "application/pdf"
+
+
+class DocumentConversionError(ValueError):
+    """Erreur levée lorsque le fichier ne peut pas être converti en entrée pour le LLM."""
+
+
+def prepare_document(content: bytes, content_type: str, deadline: Optional[Deadline] = None) -> PreparedDocument:
+    """
+    Convertit le contenu du fichier en entrée pour le LLM (images prétraitées ou couche texte).
+    Si PDF, ne garde que les pages pertinentes (1ère page + page des totaux), rendues en parallèle.
+    """
+    settings = get_settings()
+    if content_type == ALLOWED_PDF_TYPE:
+        return prepare_pdf(content, settings, deadline)
+    # Déjà une image : redressement, redimensionnement, ré-encodage
+    return prepare_image_document(content, settings)
+
+
+async def _convert_upload(content: bytes, content_type: str, deadline: Optional[Deadline] = None) -> PreparedDocument:
+    """
+    Convertit le fichier uploadé dans le threadpool
+    (rasterisation PDF / encodage : CPU-bound, hors de la boucle d'événements).
+    """
+    try:
+        with start_span("convert", content_type=content_type, bytes_in=len(content)) as span:
+            prepared = await run_in_threadpool(prepare_document, content, content_type, deadline)
+            span.set_attribute("input_mode", prepared.input_mode)
+            span.set_attribute("pages_sent", len(prepared.pages_sent))
+            # Pages rendues en parallèle dans le pool : cumuls par page, pas de span par page
+            for name, duration_ms in prepared.stage_ms.items():
+                span.set_attribute(f"{name}_ms", round(duration_ms, 2))
+            return prepared
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        logger.exception("Conversion fichier -> image échouée")
+        raise DocumentConversionError("Conversion du fichier en image impossible.") from e
+
+
+async def extract_document(
+    content: bytes,
+    content_type: str,
+    filename: str,
+    *,
+    deadline: Optional[Deadline] = None,
+    upload_read_ms: Optional[float] = None,
+    settings: Optional[Settings] = None,
+) -> ExtractionResult:
+    """
+    Extrait les données d'un fichier (image ou PDF) déjà validé et non vide.
+    Lève DocumentConversionError si le fichier ne peut pas être converti.
+    deadline : échéance de la requête (défaut : REQUEST_TIMEOUT_S à partir de maintenant) ;
+    une fois dépassée, le résultat est un échec DeadlineExceeded (revue manuelle).
+    upload_read_ms : durée de lecture de l'upload par l'appelant, reportée dans les KPI.
+    """
+    extractions_in_flight.inc()
+    try:
+        with start_span("extract_document", filename=filename) as span:
+            result = await _extract_document(content, content_type, filename, deadline, upload_read_ms, settings)
+            span.set_attribute("success", result.data is not None)
+            span.set_attribute("needs_human_review", result.needs_human_review)
+            if result.data is None:
+                span.set_error(f"{result.error_type}: {result.error_message}")
+            return result
+    finally:
+        extractions_in_flight.dec()
+
+
+async def _extract_document(
+    content: bytes,
+    content_type: str,
+    filename: str,
+    deadline: Optional[Deadline],
+    upload_read_ms: Optional[float],
+    settings: Optional[Settings],
+) -> ExtractionResult:
+    settings = settings or get_settings()
+    deadline = deadline or Deadline.after(settings.request_timeout_s)
+
+    # KPI propres à cette extraction (contexte de la tâche courante)
+    tracker = kpi_tracker.start_extraction()
+    if upload_read_ms is not None:
+        tracker.record_stage("upload_read", upload_read_ms)
+
+    # Cache adressé par contenu : un fichier déjà traité ne repasse pas par le LLM
+    cache = get_extraction_cache()
+    file_hash = content_hash(content)
+    cache_key = make_cache_key(file_hash, settings)
+    cached = None
+    if settings.cache_enabled:
+        with tracker.stage("cache_lookup"):
+            cached = await run_in_threadpool(cache.get, cache_key)
+
+    prepared: Optional[PreparedDocument] = None
+    route: Optional[RouteDecision] = None
+
+    async def run_uncached() -> ExtractionResult:
+        nonlocal prepared, route
+        try:
+            with tracker.stage("convert"):
+                prepared = await _convert_upload(content, content_type, deadline)
+        except DeadlineExceeded as e:
+            logger.warning("%s : %s", filename, e)
+            return failed_result(e)
+        for name, duration_ms in prepared.stage_ms.items():
+            tracker.record_stage(name, duration_ms)
+        if settings.routing_enabled:
+            # Routage prédictif : les documents prédits difficiles démarrent sur le modèle lourd
+            route = await run_in_threadpool(get_model_router().decide, RouteFeatures.from_document(prepared))
+        start_heavy = route is not None and route.start_heavy
+        with start_span("run_extraction_pipeline", input_mode=prepared.input_mode, start_heavy=start_heavy) as span:
+            result = await run_extraction_pipeline(
+                prepared.images,
+                text=prepared.text,
+                start_heavy=start_heavy,
+                deadline=deadline,
+                settings=settings,
+            )
+            span.set_attribute("llm_call_count", tracker.llm_call_count)
+            span.set_attribute("final_model", tracker.current_model)
+        if settings.cache_enabled:
+            with tracker.stage("persistence"):
+                await run_in_threadpool(cache.put, cache_key, result)
+        return result
+
+    coalesced = False
+    if cached is not None:
+        logger.info("Résultat servi depuis le cache pour %s", filename)
+        result = cached
+    else:
+        # Single-flight : une extraction identique déjà en cours est partagée au lieu d'être relancée
+        try:
+            result, coalesced = await extraction_flights.do(cache_key, run_uncached, timeout=deadline.remaining())
+        except asyncio.TimeoutError:
+            error = DeadlineExceeded(f"Délai de {deadline.budget_s:.1f}s dépassé (extraction)")
+            logger.warning("%s : %s", filename, error)
+            result = failed_result(error)
+
+    current_span().set_attribute("cache_hit", cached is not None)
+    current_span().set_attribute("coalesced", coalesced)
+
+    response_data = result.data.model_dump() if result.data is not None else None
+    with tracker.stage("persistence"):
+        # Base des résultats : dépôt dans la file d'insertion par lots (insertion directe si file pleine)
+        await run_in_threadpool(
+            get_result_store().save,
+            filename,
+            response_data,
+            result.needs_human_review if response_data is not None else True,
+            error_message=result.error_message if response_data is None else None,
+            locally_repaired=result.locally_repaired,
+            content_hash=file_hash,
+            trace_id=current_trace_id(),
+        )
+
+    # Enregistrer KPI (écriture fichier hors de la boucle)
+    await run_in_threadpool(
+        tracker.end_extraction,
+        filename=filename,
+        success=result.data is not None,
+        needs_human_review=result.needs_human_review,
+        error_type=result.error_type,
+        error_kind=result.error_kind,
+        error_message=result.error_message,
+        cache_hit=cached is not None,
+        coalesced=coalesced,
+        image_bytes_in=prepared.bytes_in if prepared else None,
+        image_bytes_out=prepared.bytes_out if prepared else None,
+        page_count=prepared.page_count if prepared else None,
+        pages_sent=len(prepared.pages_sent) if prepared else None,
+        input_mode=prepared.input_mode if prepared else None,
+        locally_repaired=result.locally_repaired,
+        supplier_hash=supplier_hash(result.data.fournisseur) if result.data is not None else None,
+        route_start_model=route.start_model if route else None,
+        route_p_hard=route.p_hard if route else None,
+        route_predicted_hard=route.predicted_hard if route else None,
+        route_explored=route.explored if route else False,
+        trace_id=current_trace_id(),
+    )
+    return result
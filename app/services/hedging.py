@@ -0,0 +1,153 @@
+"""
+Requêtes de couverture (hedging) pour réduire la latence de queue de la cascade.
+Si la 1ère tentative n'a pas répondu au-delà d'un seuil dérivé des latences récentes (p95 par défaut),
+une 2e requête est lancée en parallèle : le premier résultat valide l'emporte, l'autre est annulée.
+"""
+
+import asyncio
+import logging
+import math
+import threading
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Generic, Optional, TypeVar
+
+from app.core.config import Settings
+from app.models.constants import MathValidationError
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Issue de la course entre requête principale et requête de couverture
+HEDGE_PRIMARY = "primary"
+HEDGE_BACKUP = "hedge"
+
+
+class LatencyTracker:
+    """Fenêtre glissante des latences d'appel LLM (secondes), par modèle."""
+
+    def __init__(self, window: int = 500):
+        self._lock = threading.Lock()
+        self._samples: dict[str, deque] = defaultdict(lambda: deque(maxlen=window))
+
+    def observe(self, model: str, seconds: float) -> None:
+        """Enregistre la durée d'un appel (réponse, ou échec par timeout / erreur transitoire)."""
+        with self._lock:
+            self._samples[model].append(seconds)
+
+    def percentile(self, model: str, percentile: float, min_samples: int = 1) -> Optional[float]:
+        """Percentile (rang le plus proche) des latences du modèle ; None si moins de min_samples."""
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if not samples or len(samples) < min_samples:
+            return None
+        rank = max(1, math.ceil(percentile / 100 * len(samples)))
+        return samples[rank - 1]
+
+    def stats(self) -> dict:
+        """Nombre d'échantillons et p50 / p95 / p99 (ms) par modèle."""
+        with self._lock:
+            models = list(self._samples)
+
+        def ms(model: str, percentile: float) -> Optional[float]:
+            value = self.percentile(model, percentile)
+            return round(value * 1000, 2) if value is not None else None
+
+        return {
+            model: {
+                "samples": len(self._samples[model]),
+                "p50_ms": ms(model, 50),
+                "p95_ms": ms(model, 95),
+                "p99_ms": ms(model, 99),
+            }
+            for model in models
+        }
+
+    def clear(self) -> None:
+        """Vide l'historique (tests)."""
+        with self._lock:
+            self._samples.clear()
+
+
+# Instance globale : latences observées par le pipeline
+latency_tracker = LatencyTracker()
+
+
+def _preferred_error(errors: list[BaseException]) -> BaseException:
+    """
+    Erreur propagée quand les deux requêtes échouent : de préférence un écart HT + TVA != TTC portant
+    le JSON de la réponse (réconciliation locale ou relance de réparation possible), sinon la dernière.
+    """
+    math_errors = [error for error in errors if isinstance(error, MathValidationError)]
+    with_json = [error for error in math_errors if error.raw_json]
+    return (with_json or math_errors or errors)[-1]
+
+
+def hedge_delay(model: str, settings: Settings, tracker: Optional[LatencyTracker] = None) -> float:
+    """Délai (secondes) avant de lancer la requête de couverture pour une tentative sur model."""
+    tracker = tracker or latency_tracker
+    observed = tracker.percentile(model, settings.hedge_percentile, settings.hedge_min_samples)
+    if observed is None:
+        return settings.hedge_default_delay_s
+    return max(settings.hedge_min_delay_s, observed)
+
+
+@dataclass
+class HedgeOutcome(Generic[T]):
+    """Résultat d'une tentative couverte."""
+
+    result: T
+    model: str
+    """Modèle de la requête gagnante."""
+    winner: str
+    """HEDGE_PRIMARY ou HEDGE_BACKUP."""
+    hedged: bool
+    """True si la requête de couverture a été lancée."""
+
+
+async def run_hedged(
+    call: Callable[[str], Awaitable[T]],
+    primary_model: str,
+    hedge_model: str,
+    delay_s: float,
+    on_hedge: Optional[Callable[[str], None]] = None,
+) -> HedgeOutcome[T]:
+    """
+    Exécute call(primary_model) ; sans réponse après delay_s, lance call(hedge_model) en parallèle.
+    Le premier résultat valide l'emporte et l'autre requête est annulée. Si la requête principale
+    échoue avant delay_s, ou si les deux échouent, l'erreur est propagée (la cascade prend le relais) ;
+    entre deux erreurs, un écart HT + TVA != TTC réparable l'emporte (voir _preferred_error).
+
+    Args:
+        on_hedge: Appelé avec hedge_model au lancement de la requête de couverture (KPI).
+    """
+    primary = asyncio.ensure_future(call(primary_model))
+    labels = {primary: (HEDGE_PRIMARY, primary_model)}
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=delay_s)
+        if done:
+            return HedgeOutcome(primary.result(), primary_model, HEDGE_PRIMARY, hedged=False)
+
+        logger.info("Pas de réponse de %s après %.2fs : requête de couverture vers %s", primary_model, delay_s, hedge_model)
+        if on_hedge is not None:
+            on_hedge(hedge_model)
+        backup = asyncio.ensure_future(call(hedge_model))
+        labels[backup] = (HEDGE_BACKUP, hedge_model)
+
+        pending = set(labels)
+        errors: list[BaseException] = []
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    winner, model = labels[task]
+                    logger.info("Requête %s (%s) gagnante", winner, model)
+                    return HedgeOutcome(task.result(), model, winner, hedged=True)
+                errors.append(task.exception())
+        raise _preferred_error(errors)
+    finally:
+        # Requête perdante (ou appelant annulé) : annulation de ce qui tourne encore
+        for task in labels:
+            if not task.done():
+                task.cancel()
@@ -0,0 +1,276 @@
+"""
+File de jobs d'extraction persistante (SQLite) pour l'API asynchrone submit/poll.
+Les workers (python -m app.worker) prennent les jobs avec un bail (lease) renouvelé pendant le traitement :
+un job dont le worker a disparu (crash, redémarrage) redevient disponible à l'expiration du bail.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from app.core.config import Settings, get_settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOBS_DB = Path(__file__).parent.parent.parent / "resultats" / "jobs.sqlite3"
+
+# Statuts d'un job
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    content_type TEXT NOT NULL,
+    content BLOB,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    lease_expires_at REAL,
+    worker_id TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (finished_at);
+"""
+
+
+@dataclass
+class Job:
+    """Un job d'extraction et son état."""
+
+    id: str
+    status: str
+    filename: str
+    content_type: str
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    attempts: int = 0
+    result: Optional[dict] = None
+    """Réponse d'extraction (data / needs_human_review / error_message) une fois le job terminé."""
+    error: Optional[str] = None
+    content: Optional[bytes] = None
+    """Contenu du fichier ; chargé uniquement lors de la prise du job par un worker."""
+
+    @property
+    def wait_ms(self) -> Optional[float]:
+        """Temps d'attente dans la file (soumission → début du traitement)."""
+        if self.started_at is None:
+            return None
+        return round((self.started_at - self.created_at) * 1000, 2)
+
+    @property
+    def service_ms(self) -> Optional[float]:
+        """Temps de traitement (début → fin) de la dernière tentative."""
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return round((self.finished_at - self.started_at) * 1000, 2)
+
+
+def _row_to_job(row: sqlite3.Row, with_content: bool = False) -> Job:
+    return Job(
+        id=row["id"],
+        status=row["status"],
+        filename=row["filename"],
+        content_type=row["content_type"],
+        created_at=row["created_at"],
+        started_at=row["started_at"],
+        finished_at=row["finished_at"],
+        attempts=row["attempts"],
+        result=json.loads(row["result"]) if row["result"] else None,
+        error=row["error"],
+        content=row["content"] if with_content else None,
+    )
+
+
+class JobStore:
+    """Stockage SQLite (mode WAL) des jobs, partagé par l'API et les processus workers."""
+
+    def __init__(self, db_path: Path, max_attempts: int = 3):
+        """
+        Args:
+            db_path: Fichier SQLite (créé si absent).
+            max_attempts: Nombre maximal de prises d'un job avant échec définitif.
+        """
+        self.db_path = Path(db_path)
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "JobStore":
+        """Construit le store à partir des settings."""
+        db_path = Path(settings.jobs_db_path) if settings.jobs_db_path else DEFAULT_JOBS_DB
+        return cls(db_path, max_attempts=settings.jobs_max_attempts)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Connexion par thread (sqlite3 n'autorise pas le partage entre threads)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def submit(self, content: bytes, content_type: str, filename: str) -> Job:
+        """Ajoute un job en file d'attente."""
+        job = Job(
+            id=uuid.uuid4().hex,
+            status=JOB_QUEUED,
+            filename=filename,
+            content_type=content_type,
+            created_at=time.time(),
+        )
+        self._connect().execute(
+            "INSERT INTO jobs (id, status, filename, content_type, content, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job.id, job.status, job.filename, job.content_type, content, job.created_at),
+        )
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Retourne un job (sans son contenu) ou None."""
+        row = self._connect().execute(
+            "SELECT id, status, filename, content_type, created_at, started_at, finished_at, attempts, result, error "
+            "FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        return _row_to_job(row) if row else None
+
+    def lease(self, worker_id: str, lease_s: float) -> Optional[Job]:
+        """
+        Prend le plus ancien job disponible (en file, ou en cours avec un bail expiré) pour lease_s secondes.
+        Un job déjà pris max_attempts fois est marqué en échec au lieu d'être relancé.
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            while True:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? OR (status = ? AND lease_expires_at < ?) "
+                    "ORDER BY created_at LIMIT 1",
+                    (JOB_QUEUED, JOB_RUNNING, now),
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                if row["attempts"] >= self.max_attempts:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, finished_at = ?, content = NULL, error = ? WHERE id = ?",
+                        (JOB_FAILED, now, "Nombre maximal de tentatives atteint (worker perdu).", row["id"]),
+                    )
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET status = ?, started_at = ?, lease_expires_at = ?, worker_id = ?, "
+                    "attempts = attempts + 1 WHERE id = ?",
+                    (JOB_RUNNING, now, now + lease_s, worker_id, row["id"]),
+                )
+                conn.execute("COMMIT")
+                job = _row_to_job(row, with_content=True)
+                job.status, job.started_at, job.attempts = JOB_RUNNING, now, row["attempts"] + 1
+                return job
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_s: float) -> bool:
+        """Prolonge le bail ; False si le job a été repris par un autre worker entre-temps."""
+        cursor = self._connect().execute(
+            "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND worker_id = ? AND status = ?",
+            (time.time() + lease_s, job_id, worker_id, JOB_RUNNING),
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id: str, worker_id: str, result: dict) -> None:
+        """Enregistre le résultat et libère le contenu du fichier."""
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, finished_at = ?, result = ?, content = NULL, lease_expires_at = NULL "
+            "WHERE id = ? AND worker_id = ?",
+            (JOB_DONE, time.time(), json.dumps(result, ensure_ascii=False), job_id, worker_id),
+        )
+
+    def fail(self, job_id: str, worker_id: str, error: str, retry: bool = False) -> None:
+        """Marque le job en échec, ou le remet en file si retry et qu'il reste des tentatives."""
+        conn = self._connect()
+        if retry:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, lease_expires_at = NULL, worker_id = NULL, error = ? "
+                "WHERE id = ? AND worker_id = ? AND attempts < ?",
+                (JOB_QUEUED, error, job_id, worker_id, self.max_attempts),
+            )
+            if cursor.rowcount == 1:
+                return
+        conn.execute(
+            "UPDATE jobs SET status = ?, finished_at = ?, error = ?, content = NULL, lease_expires_at = NULL "
+            "WHERE id = ? AND worker_id = ?",
+            (JOB_FAILED, time.time(), error, job_id, worker_id),
+        )
+
+    def stats(self, window_s: float = 3600, sample_size: int = 1000) -> dict:
+        """
+        Profondeur de file et temps d'attente / de service des derniers jobs terminés sur la fenêtre.
+        Coût borné quelle que soit la taille de la table : les comptages ne portent que sur les jobs
+        en file ou en cours (index status, created_at) et les temps sur au plus sample_size jobs
+        terminés (index finished_at) ; pas de total historique done / failed.
+        """
+        conn = self._connect()
+        now = time.time()
+        queued, oldest = conn.execute(
+            "SELECT COUNT(*), MIN(created_at) FROM jobs WHERE status = ?", (JOB_QUEUED,)
+        ).fetchone()
+        running = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (JOB_RUNNING,)).fetchone()[0]
+        # finished_at n'est renseigné que pour les jobs terminés (done / failed)
+        timings = conn.execute(
+            "SELECT COUNT(*), AVG(started_at - created_at), MAX(started_at - created_at), AVG(finished_at - started_at) "
+            "FROM (SELECT created_at, started_at, finished_at FROM jobs WHERE finished_at >= ? "
+            "ORDER BY finished_at DESC LIMIT ?)",
+            (now - window_s, sample_size),
+        ).fetchone()
+        finished, avg_wait, max_wait, avg_service = timings
+
+        def ms(value: Optional[float]) -> Optional[float]:
+            return round(value * 1000, 2) if value is not None else None
+
+        return {
+            "queue_depth": queued,
+            "running": running,
+            "oldest_queued_age_ms": ms(now - oldest) if oldest is not None else None,
+            "window_s": window_s,
+            "finished_in_window": finished,
+            "avg_wait_ms": ms(avg_wait),
+            "max_wait_ms": ms(max_wait),
+            "avg_service_ms": ms(avg_service),
+        }
+
+_job_store: Optional[JobStore] = None
+
+
+def get_job_store() -> JobStore:
+    """Retourne le store process-wide (construit depuis les settings au premier appel)."""
+    global _job_store
+    if _job_store is None:
+        _job_store = JobStore.from_settings(get_settings())
+    return _job_store
+
+
+def reset_job_store(store: Optional[JobStore] = None) -> None:
+    """Remplace le store process-wide (None : reconstruit depuis les settings au prochain appel)."""
+    global _job_store
+    _job_store = store
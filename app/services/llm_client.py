@@ -3,16 +3,28 @@ Client OpenAI pour l'extraction structurée de données facture via Vision.
 Utilise les Structured Outputs (response_format) pour obtenir du JSON conforme au schéma.
 """
 
+import hashlib
 import json
 import logging
 import re
+import time
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Sequence, Union
 
-from openai import OpenAI
+from openai import RateLimitError
+from pydantic import ValidationError
 
 from app.core.config import Settings, get_settings
+from app.models.constants import MathValidationError
 from app.models.schemas import InvoiceData
+from app.monitoring.kpi import kpi_tracker
+from app.monitoring.metrics import json_parse_failures_total, math_validation_errors_total
+from app.monitoring.tracing import current_span, start_span
+from app.monitoring.pricing import usage_cost
+from app.services.openai_clients import get_async_openai_client, get_openai_client
+from app.services.preprocessing import PreparedImage
+from app.services.deadline import DeadlineExceeded
+from app.services.rate_limit import estimate_request_tokens, get_rate_limiter, retry_after_s
 
 logger = logging.getLogger(__name__)
 
@@ -42,8 +54,23 @@ def _load_system_prompt(prompt_version: str = "v1") -> str:
     return "Extrait les données de cette facture au format JSON demandé."
 
 
-# Charge le prompt système depuis le fichier (version v1 par défaut)
-SYSTEM_PROMPT = _load_system_prompt("v2")
+# Version du prompt système utilisée par le pipeline
+PROMPT_VERSION = "v2"
+
+# Charge le prompt système depuis le fichier
+SYSTEM_PROMPT = _load_system_prompt(PROMPT_VERSION)
+
+# Complément du prompt système pour le chemin texte (PDF numérique avec couche texte)
+TEXT_PROMPT_ADDENDUM = _load_system_prompt("text_v1")
+
+
+def prompt_fingerprint() -> str:
+    """
+    Identifiant du prompt système courant (version + hash du contenu).
+    Change dès que le fichier prompt est modifié : sert à invalider les résultats mis en cache.
+    """
+    digest = hashlib.sha256((SYSTEM_PROMPT + TEXT_PROMPT_ADDENDUM).encode("utf-8")).hexdigest()[:12]
+    return f"{PROMPT_VERSION}:{digest}"
 
 
 def _clean_json_response(raw: str) -> str:
@@ -101,10 +128,204 @@ def _clean_json_response(raw: str) -> str:
     raise ValueError(f"Impossible d'extraire du JSON valide de la réponse: {raw[:100]}")
 
 
+def _build_messages(
+    images: Union[str, Sequence[PreparedImage]],
+    mime_type: str = "image/jpeg",
+) -> list[dict]:
+    """
+    Construit les messages (prompt système + image(s)) envoyés au modèle.
+    images : une image base64 (de type mime_type) ou les pages prétraitées d'un document.
+    """
+    if isinstance(images, str):
+        urls = [f"data:{mime_type};base64,{images}"]
+    else:
+        urls = [image.data_url for image in images]
+
+    instruction = "Extrais les données de cette facture (fournisseur, numéro, date YYYY-MM-DD, montants HT/TVA/TTC, devise, lignes de détail)."
+    if len(urls) > 1:
+        instruction += f" Les {len(urls)} images sont des pages d'une même facture (première page et page des totaux)."
+
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT or "Extrait les données de la facture au format demandé."},
+        {
+            "role": "user",
+            "content": [
+                *({"type": "image_url", "image_url": {"url": url}} for url in urls),
+                {"type": "text", "text": instruction},
+            ],
+        },
+    ]
+
+
+def _build_text_messages(document_text: str) -> list[dict]:
+    """Construit les messages du chemin texte : prompt système + complément texte, puis le texte du PDF."""
+    system_prompt = SYSTEM_PROMPT or "Extrait les données de la facture au format demandé."
+    return [
+        {"role": "system", "content": f"{system_prompt}\n\n{TEXT_PROMPT_ADDENDUM}"},
+        {
+            "role": "user",
+            "content": (
+                "Extrais les données de cette facture (fournisseur, numéro, date YYYY-MM-DD, montants HT/TVA/TTC, "
+                "devise, lignes de détail) à partir de son texte :\n\n"
+                f"{document_text}"
+            ),
+        },
+    ]
+
+
+def _build_repair_messages(base_messages: list[dict], previous_json: str, discrepancy: str) -> list[dict]:
+    """
+    Messages de la tentative de réparation : la conversation initiale (même préfixe, donc servi
+    par le cache de prompt côté API), la réponse JSON incohérente, puis une relance texte courte.
+    """
+    return [
+        *base_messages,
+        {"role": "assistant", "content": previous_json},
+        {
+            "role": "user",
+            "content": (
+                f"Ce JSON est incohérent : {discrepancy}. Relis sur la facture les montants HT, TVA et TTC "
+                "(attention aux séparateurs de milliers et décimaux, et à ne pas inverser HT et TTC) "
+                "et renvoie le JSON complet corrigé."
+            ),
+        },
+    ]
+
+
+def _math_error(error: ValidationError) -> Optional[MathValidationError]:
+    """Retrouve la MathValidationError encapsulée par Pydantic dans une ValidationError."""
+    for detail in error.errors():
+        cause = (detail.get("ctx") or {}).get("error")
+        if isinstance(cause, MathValidationError):
+            return cause
+    return None
+
+
+def _token_count(value) -> int:
+    """Nombre de tokens d'un champ usage (0 si absent ou non renseigné)."""
+    return value if isinstance(value, int) else 0
+
+
+def _record_usage(response, model: str, settings: Settings) -> None:
+    """
+    Enregistre dans les KPI les tokens consommés par un appel (prompt, complétion, prompt servi
+    par le cache de l'API) et son coût. Appelé avant le parsing : une réponse invalide est aussi facturée.
+    """
+    usage = getattr(response, "usage", None)
+    if not usage:
+        return
+    prompt_tokens = _token_count(usage.prompt_tokens)
+    completion_tokens = _token_count(usage.completion_tokens)
+    cached_tokens = _token_count(getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None))
+    cost_usd = usage_cost(model, prompt_tokens, completion_tokens, cached_tokens, settings.llm_prices)
+    logger.info(
+        "Token usage %s - prompt: %s (cache: %s) | completion: %s | coût: %s $",
+        model,
+        prompt_tokens,
+        cached_tokens,
+        completion_tokens,
+        f"{cost_usd:.6f}" if cost_usd is not None else "?",
+    )
+    kpi_tracker.record_token_usage(model, prompt_tokens, completion_tokens, cached_tokens, cost_usd)
+    span = current_span()
+    span.set_attribute("prompt_tokens", prompt_tokens)
+    span.set_attribute("completion_tokens", completion_tokens)
+
+
+def _parse_response(response, model: str = "unknown") -> InvoiceData:
+    """
+    Transforme la réponse brute de l'API en InvoiceData validé.
+    Lève ValueError (réponse vide / JSON invalide / schéma) ou MathValidationError
+    (portant le JSON reçu dans raw_json). Sa durée alimente l'étape "validation" des KPI ;
+    les JSON introuvables et les écarts de calcul sont comptés par modèle dans /metrics.
+    """
+    with kpi_tracker.stage("validation"):
+        choice = response.choices[0]
+        if not choice.message.content:
+            raise ValueError("Réponse LLM vide")
+
+        raw = choice.message.content.strip()
+
+        # Nettoyer la réponse JSON (enlever markdown, texte avant/après, etc.)
+        try:
+            cleaned = _clean_json_response(raw)
+            data = json.loads(cleaned)
+        except ValueError:
+            json_parse_failures_total.inc(model=model)
+            raise
+        try:
+            return InvoiceData.model_validate(data)
+        except ValidationError as e:
+            math_error = _math_error(e)
+            if math_error is None:
+                raise
+            math_validation_errors_total.inc(model=model)
+            math_error.raw_json = cleaned
+            raise math_error from e
+
+
+async def _chat_completion_async(
+    model: str,
+    messages: list[dict],
+    settings: Settings,
+    timeout: Optional[float] = None,
+):
+    """
+    Appel Structured Output via le client async partagé du modèle, régulé par le limiteur de débit
+    (RATE_LIMIT_ENABLED) : l'appel attend son tour sous les limites RPM / TPM et, sur 429, est remis
+    en file jusqu'à rate_limit_max_queue_s au lieu d'échouer (et de faire escalader la cascade).
+    timeout : budget total de l'appel (attente dans le limiteur comprise), reporté sur la requête HTTP.
+    """
+    client = get_async_openai_client(model, settings)
+    request = {
+        "model": model,
+        "messages": messages,
+        "response_format": {"type": "json_schema", "json_schema": _invoice_json_schema()},
+    }
+    expires_at = time.monotonic() + timeout if timeout is not None else None
+
+    def request_timeout() -> dict:
+        if expires_at is None:
+            return {}
+        remaining = expires_at - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Délai dépassé avant l'appel {model}")
+        return {"timeout": remaining}
+
+    if not settings.rate_limit_enabled:
+        return await client.chat.completions.create(**request, **request_timeout())
+
+    limiter = get_rate_limiter(model, settings)
+    estimated_tokens = estimate_request_tokens(messages, settings)
+    queue_deadline = time.monotonic() + settings.rate_limit_max_queue_s
+    if expires_at is not None:
+        queue_deadline = min(queue_deadline, expires_at)
+    while True:
+        queued = time.perf_counter()
+        async with limiter.slot(estimated_tokens, queue_deadline):
+            waited_ms = (time.perf_counter() - queued) * 1000
+            kpi_tracker.record_stage("rate_limit_wait", waited_ms)
+            current_span().add_to_attribute("rate_limit_wait_ms", round(waited_ms, 2))
+            try:
+                response = await client.chat.completions.create(**request, **request_timeout())
+            except RateLimitError as e:
+                # Quota épuisé (facturation) : attendre ne servirait à rien
+                if getattr(e, "code", None) == "insufficient_quota":
+                    raise
+                limiter.on_rate_limited(retry_after_s(e.response.headers))
+                current_span().add_to_attribute("rate_limited", 1)
+                logger.warning("429 pour %s : appel remis en file d'attente du limiteur", model)
+                continue
+        usage = getattr(response, "usage", None)
+        limiter.settle(estimated_tokens, _token_count(getattr(usage, "total_tokens", None)) or None)
+        return response
+
+
 def extract_invoice_from_image(
     image_base64: str,
     *,
     model: str,
+    mime_type: str = "image/jpeg",
     settings: Optional[Settings] = None,
 ) -> InvoiceData:
     """
@@ -112,49 +333,82 @@ def extract_invoice_from_image(
     Utilise le schéma InvoiceData en Structured Output ; lève en cas d'échec de l'API ou de parsing.
     """
     settings = settings or get_settings()
-    client = OpenAI(api_key=settings.openai_api_key)
-
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT or "Extrait les données de la facture au format demandé."},
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"},
-                    },
-                    {
-                        "type": "text",
-                        "text": "Extrais les données de cette facture (fournisseur, numéro, date YYYY-MM-DD, montants HT/TVA/TTC, devise, lignes de détail).",
-                    },
-                ],
-            },
-        ],
-        response_format={"type": "json_schema", "json_schema": _invoice_json_schema()},
-    )
+    client = get_openai_client(model, settings)
 
-    # Log token usage
-    if response.usage:
-        logger.info(
-            "Token usage - prompt: %s | completion: %s | total: %s",
-            response.usage.prompt_tokens,
-            response.usage.completion_tokens,
-            response.usage.total_tokens,
+    with start_span("extract_invoice_from_image", model=model):
+        response = client.chat.completions.create(
+            model=model,
+            messages=_build_messages(image_base64, mime_type),
+            response_format={"type": "json_schema", "json_schema": _invoice_json_schema()},
         )
+        _record_usage(response, model, settings)
+        return _parse_response(response, model)
 
-    choice = response.choices[0]
-    if not choice.message.content:
-        raise ValueError("Réponse LLM vide")
 
-    raw = choice.message.content.strip()
-    
-    # Nettoyer la réponse JSON (enlever markdown, texte avant/après, etc.)
-    cleaned = _clean_json_response(raw)
-    
-    data = json.loads(cleaned)
-    return InvoiceData.model_validate(data)
+async def extract_invoice_from_image_async(
+    images: Union[str, Sequence[PreparedImage]],
+    *,
+    model: str,
+    mime_type: str = "image/jpeg",
+    timeout: Optional[float] = None,
+    settings: Optional[Settings] = None,
+) -> InvoiceData:
+    """
+    Version asynchrone de extract_invoice_from_image (client AsyncOpenAI).
+    N'occupe pas la boucle d'événements pendant l'appel réseau : à utiliser depuis les routes FastAPI.
+    Accepte une image base64 ou plusieurs pages prétraitées (PDF multi-pages).
+    timeout : budget de l'appel en secondes (échéance de la requête), attente du limiteur comprise.
+    """
+    settings = settings or get_settings()
+    pages = 1 if isinstance(images, str) else len(images)
+    with start_span("extract_invoice_from_image", model=model, pages=pages):
+        response = await _chat_completion_async(model, _build_messages(images, mime_type), settings, timeout)
+        _record_usage(response, model, settings)
+        return _parse_response(response, model)
+
+
+async def extract_invoice_from_text_async(
+    document_text: str,
+    *,
+    model: str,
+    timeout: Optional[float] = None,
+    settings: Optional[Settings] = None,
+) -> InvoiceData:
+    """
+    Extraction à partir de la couche texte d'un PDF numérique (requête texte seule, sans Vision).
+    Plus rapide et moins coûteuse en tokens que le chemin image.
+    """
+    settings = settings or get_settings()
+    with start_span("extract_invoice_from_text", model=model, text_chars=len(document_text)):
+        response = await _chat_completion_async(model, _build_text_messages(document_text), settings, timeout)
+        _record_usage(response, model, settings)
+        return _parse_response(response, model)
+
+
+async def repair_invoice_async(
+    images: Union[str, Sequence[PreparedImage]],
+    previous_json: str,
+    discrepancy: str,
+    *,
+    model: str,
+    mime_type: str = "image/jpeg",
+    text: Optional[str] = None,
+    timeout: Optional[float] = None,
+    settings: Optional[Settings] = None,
+) -> InvoiceData:
+    """
+    Tentative de réparation après une MathValidationError : renvoie la réponse précédente et
+    l'écart constaté au modèle, qui corrige son JSON au lieu de refaire l'extraction à l'aveugle.
+    Le préfixe (prompt système + image(s) ou texte) est identique à la 1ère requête.
+    """
+    settings = settings or get_settings()
+    base_messages = _build_text_messages(text) if text is not None else _build_messages(images, mime_type)
+    with start_span("repair_invoice", model=model, input_mode="text" if text is not None else "vision"):
+        response = await _chat_completion_async(
+            model, _build_repair_messages(base_messages, previous_json, discrepancy), settings, timeout
+        )
+        _record_usage(response, model, settings)
+        return _parse_response(response, model)
 
 
 def _invoice_json_schema() -> dict:
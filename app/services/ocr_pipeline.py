@@ -1,22 +1,50 @@
 """
-Orchestration du pipeline d'extraction : appel LLM, validation Pydantic, fallback en cas d'échec.
-Étape 1 : gpt-4o-mini → validation.
-Étape 2 (fallback) : si échec (MathValidationError ou parsing), relance avec gpt-4o.
+Orchestration du pipeline d'extraction (asynchrone) : appel LLM, validation Pydantic, fallback en cas d'échec.
+Étape 1 : gpt-4o-mini → validation ; un écart HT + TVA != TTC est d'abord réconcilié localement si possible.
+Étape 2 : selon l'échec — réparation (écart HT + TVA != TTC renvoyé au modèle) ou rien (réponse invalide
+non réparable, erreur transitoire déjà retentée avec backoff, disjoncteur ouvert).
+Chaque appel passe par le disjoncteur de son modèle ; une erreur permanente arrête la cascade.
+Étape 3 (fallback) : relance avec gpt-4o.
 Retourne un résultat avec flag needs_human_review si le modèle lourd échoue aussi.
 """
 
+import asyncio
 import logging
+import time
 from dataclasses import dataclass
-from typing import Optional
+from typing import Optional, Sequence, Union
 
 from app.core.config import Settings, get_settings
 from app.models.schemas import InvoiceData
 from app.models.constants import MathValidationError
-from app.services.llm_client import extract_invoice_from_image
+from app.services.deadline import Deadline, DeadlineExceeded
+from app.services.hedging import hedge_delay, latency_tracker, run_hedged
+from app.services.llm_client import (
+    extract_invoice_from_image_async,
+    extract_invoice_from_text_async,
+    repair_invoice_async,
+)
+from app.services.preprocessing import PreparedImage
+from app.services.reconciliation import reconcile_raw_json
+from app.services.resilience import (
+    ERROR_PERMANENT,
+    ERROR_TRANSIENT,
+    CircuitOpenError,
+    call_with_retries,
+    classify_error,
+)
 from app.monitoring.kpi import kpi_tracker
 
 logger = logging.getLogger(__name__)
 
+# Latences observées nécessaires pour estimer la durée d'une tentative (sinon deadline_min_attempt_s)
+_LATENCY_MIN_SAMPLES = 10
+
+# Actions possibles pour la 2e étape de la cascade
+STEP_RETRY = "retry"
+STEP_REPAIR = "repair"
+STEP_SKIP = "skip"
+
 
 @dataclass
 class ExtractionResult:
@@ -27,20 +55,81 @@ class ExtractionResult:
     """True si le fallback gpt-4o a aussi échoué ; data peut être None."""
     error_message: Optional[str] = None
     """Message d'erreur lorsque needs_human_review=True et data est None."""
+    locally_repaired: bool = False
+    """True si les montants ont été corrigés par la réconciliation arithmétique locale."""
+    error_type: Optional[str] = None
+    """Classe de la dernière erreur lorsque data est None (ex : "APITimeoutError")."""
+    error_kind: Optional[str] = None
+    """Nature de cette erreur : "transient", "validation" ou "permanent" (voir resilience.classify_error)."""
+
+
+def _second_step(error: Optional[Exception], settings: Settings) -> str:
+    """
+    Choisit la 2e étape selon l'échec de la 1ère tentative.
+    - Écart HT + TVA != TTC avec JSON disponible : réparation (relance texte courte).
+    - Réponse invalide (JSON, schéma, calcul) : déterministe, un retry identique est inutile.
+    - Disjoncteur du modèle ouvert : passage direct au modèle suivant.
+    - Erreur transitoire (réseau, timeout, 5xx) déjà retentée avec backoff : modèle suivant.
+    - Sinon (aucun nouvel essai configuré) : retry identique.
+    """
+    if isinstance(error, MathValidationError) and settings.cascade_repair_enabled and error.raw_json:
+        return STEP_REPAIR
+    if isinstance(error, ValueError) and settings.cascade_skip_deterministic_retry:
+        return STEP_SKIP
+    if isinstance(error, CircuitOpenError):
+        return STEP_SKIP
+    if error is not None and settings.llm_transient_retries > 0 and classify_error(error) == ERROR_TRANSIENT:
+        return STEP_SKIP
+    return STEP_RETRY
+
+
+def _worth_trying(model: str, deadline: Deadline, settings: Settings) -> bool:
+    """
+    True si le budget restant couvre la durée attendue d'une tentative sur model
+    (latence médiane observée, ou deadline_min_attempt_s sans historique suffisant).
+    """
+    expected = latency_tracker.percentile(model, 50, _LATENCY_MIN_SAMPLES)
+    return deadline.remaining() >= max(expected or 0.0, settings.deadline_min_attempt_s)
+
+
+def failed_result(error: Exception) -> ExtractionResult:
+    """Résultat en échec (revue manuelle) portant l'erreur et sa nature."""
+    return ExtractionResult(
+        data=None,
+        needs_human_review=True,
+        error_message=str(error),
+        error_type=type(error).__name__,
+        error_kind=classify_error(error),
+    )
 
 
-def run_extraction_pipeline(
-    image_base64: str,
+async def run_extraction_pipeline(
+    images: Union[str, Sequence[PreparedImage]],
     *,
+    mime_type: str = "image/jpeg",
+    text: Optional[str] = None,
+    start_heavy: bool = False,
+    deadline: Optional[Deadline] = None,
     settings: Optional[Settings] = None,
 ) -> ExtractionResult:
     """
     Exécute le pipeline en cascading :
     1. Extraction avec gpt-4o-mini (tentative 1).
     2. Validation Pydantic (dont HT + TVA == TTC).
-    3. En cas d'échec : retry avec gpt-4o-mini (tentative 2).
+    3. En cas d'échec, tentative 2 avec gpt-4o-mini selon la nature de l'échec (voir _second_step) :
+       réparation à partir du JSON et de l'écart constaté, retry identique, ou passage direct à l'étape 4.
     4. Si toujours échoué : fallback vers gpt-4o (modèle lourd).
     5. Si gpt-4o échoue aussi : retourne needs_human_review=True avec données partielles.
+
+    Avec HEDGE_ENABLED, la tentative 1 est couverte : sans réponse au-delà du percentile de latence
+    configuré, une 2e requête est lancée en parallèle et la première réponse valide l'emporte.
+
+    Coroutine : les appels LLM passent par le client asynchrone et ne bloquent pas la boucle.
+    images : image base64 (de type mime_type) ou pages prétraitées d'un document.
+    text : couche texte d'un PDF numérique ; si fournie, chaque tentative est une requête texte seule.
+    start_heavy : décision du routeur prédictif ; la cascade se réduit alors au modèle lourd.
+    deadline : échéance de la requête ; chaque appel est borné par le temps restant et une tentative
+    n'est lancée que si ce temps couvre sa durée attendue (sinon échec DeadlineExceeded).
     """
     settings = settings or get_settings()
 
@@ -50,18 +139,135 @@ def run_extraction_pipeline(
         settings.llm_model_light,
         settings.llm_model_heavy,
     ]
+    if start_heavy:
+        models_to_try = [settings.llm_model_heavy]
 
-    for index, model_name in enumerate(models_to_try, start=1):
+    async def bounded(operation, model_name: str):
+        """
+        Exécute operation(timeout) borné par le temps restant avant l'échéance.
+        La durée et l'issue de l'appel sont enregistrées dans les KPI de l'extraction.
+        """
+        if deadline is not None:
+            deadline.check(f"appel {model_name}")
+        started = time.perf_counter()
+        outcome = "ok"
         try:
-            kpi_tracker.record_llm_call(model_name)
-            data = extract_invoice_from_image(
-                image_base64,
+            if deadline is None:
+                return await operation(None)
+            try:
+                return await asyncio.wait_for(operation(deadline.remaining()), deadline.remaining())
+            except asyncio.TimeoutError as e:
+                if isinstance(e, DeadlineExceeded):
+                    raise
+                raise DeadlineExceeded(f"Délai de {deadline.budget_s:.1f}s dépassé (appel {model_name})") from None
+        except BaseException as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            kpi_tracker.record_llm_attempt(model_name, (time.perf_counter() - started) * 1000, outcome)
+
+    async def call(model_name: str) -> InvoiceData:
+        """Un appel LLM ; sa durée (réponse, timeout ou erreur transitoire) alimente le seuil de hedging."""
+        if deadline is not None:
+            # Échéance déjà dépassée : échec immédiat, sans latence à retenir
+            deadline.check(f"appel {model_name}")
+        kpi_tracker.record_llm_call(model_name)
+        started = time.perf_counter()
+
+        async def operation(timeout: Optional[float]) -> InvoiceData:
+            if text is not None:
+                return await extract_invoice_from_text_async(text, model=model_name, timeout=timeout, settings=settings)
+            return await extract_invoice_from_image_async(
+                images,
                 model=model_name,
+                mime_type=mime_type,
+                timeout=timeout,
                 settings=settings,
             )
 
+        try:
+            data = await bounded(operation, model_name)
+        except CircuitOpenError:
+            # Rejet immédiat par le disjoncteur : aucun appel, aucune latence à retenir
+            raise
+        except Exception as e:
+            # Timeouts et erreurs transitoires comptent aussi (durée jusqu'à l'échec, borne basse
+            # de la latence) : sinon le seuil de hedging ne voit que les appels rapides
+            if classify_error(e) != ERROR_PERMANENT:
+                latency_tracker.observe(model_name, time.perf_counter() - started)
+            raise
+        latency_tracker.observe(model_name, time.perf_counter() - started)
+        return data
+
+    async def attempt(model_name: str) -> InvoiceData:
+        """Une tentative : appel sous disjoncteur, erreurs transitoires retentées avec backoff."""
+        return await call_with_retries(lambda: call(model_name), model_name, settings, deadline)
+
+    async def repair(model_name: str, error: MathValidationError) -> InvoiceData:
+        """Relance de réparation : même préfixe de conversation + JSON précédent + écart constaté."""
+        kpi_tracker.record_repair_attempt()
+
+        async def operation(timeout: Optional[float]) -> InvoiceData:
+            return await repair_invoice_async(
+                images,
+                error.raw_json,
+                str(error),
+                model=model_name,
+                mime_type=mime_type,
+                text=text,
+                timeout=timeout,
+                settings=settings,
+            )
+
+        async def repair_call() -> InvoiceData:
+            kpi_tracker.record_llm_call(model_name)
+            return await bounded(operation, model_name)
+
+        return await call_with_retries(repair_call, model_name, settings, deadline)
+
+    last_error: Optional[Exception] = None
+    step = STEP_RETRY
+    for index, model_name in enumerate(models_to_try, start=1):
+        if index == 2:
+            step = _second_step(last_error, settings)
+            if step == STEP_SKIP:
+                logger.info("Échec déterministe (%s) : retry identique ignoré, passage au modèle lourd", last_error)
+                kpi_tracker.record_retry_skipped()
+                continue
+
+        # Budget restant insuffisant pour cette tentative : inutile de la lancer
+        if deadline is not None and not _worth_trying(model_name, deadline, settings):
+            error = DeadlineExceeded(
+                f"Délai de {deadline.budget_s:.1f}s : {deadline.remaining():.1f}s restantes, "
+                f"insuffisantes pour une tentative {model_name}"
+            )
+            logger.warning("%s (dernière erreur : %s)", error, last_error)
+            return failed_result(error)
+
+        try:
+            if index == 2 and step == STEP_REPAIR:
+                data = await repair(model_name, last_error)
+                kpi_tracker.record_repair_success()
+            elif index == 1 and settings.hedge_enabled:
+                hedge_model = settings.llm_model_heavy if settings.hedge_use_heavy else model_name
+                outcome = await run_hedged(
+                    attempt,
+                    model_name,
+                    hedge_model,
+                    hedge_delay(model_name, settings),
+                    on_hedge=kpi_tracker.record_hedge_launched,
+                )
+                data = outcome.result
+                if outcome.hedged:
+                    kpi_tracker.record_hedge_winner(outcome.winner, outcome.model)
+                model_name = outcome.model
+            else:
+                data = await attempt(model_name)
+
             if model_name == settings.llm_model_heavy:
                 logger.info("Extraction réussie avec %s (fallback)", model_name)
+            elif index == 2 and step == STEP_REPAIR:
+                logger.info("Extraction réparée avec %s (tentative 2)", model_name)
             else:
                 logger.info(
                     "Extraction réussie avec %s (tentative %s)",
@@ -82,44 +288,63 @@ def run_extraction_pipeline(
             )
 
         except (MathValidationError, ValueError) as e:
+            last_error = e
+            # Écart mécanique (séparateur, inversion HT/TTC...) : corrigé sans nouvel appel LLM
+            if isinstance(e, MathValidationError) and settings.reconciliation_enabled and e.raw_json:
+                reconciliation = reconcile_raw_json(e.raw_json, settings)
+                if reconciliation is not None:
+                    kpi_tracker.record_local_repair()
+                    logger.info("Extraction %s (tentative %s) réparée localement : %s", model_name, index, reconciliation.corrections)
+                    return ExtractionResult(
+                        data=reconciliation.data,
+                        needs_human_review=reconciliation.data.montant_tva == 0.0,
+                        locally_repaired=True,
+                    )
+
             if model_name == settings.llm_model_heavy:
                 logger.warning(
                     "Fallback %s: validation/parsing échoué: %s",
                     model_name,
                     e,
                 )
-                return ExtractionResult(
-                    data=None,
-                    needs_human_review=True,
-                    error_message=str(e),
-                )
+                return failed_result(e)
 
             logger.warning(
-                "Validation ou parsing échoué avec %s (tentative %s): %s. Retry...",
+                "Validation ou parsing échoué avec %s (tentative %s): %s",
                 model_name,
                 index,
                 e,
             )
 
         except Exception as e:
+            last_error = e
+            # Échéance atteinte (appel interrompu ou refusé) : aucune autre tentative possible
+            if isinstance(e, DeadlineExceeded) or (deadline is not None and deadline.expired):
+                logger.warning("Extraction abandonnée avec %s : %s", model_name, e)
+                return failed_result(e if isinstance(e, DeadlineExceeded) else DeadlineExceeded(str(e)))
+
+            # Requête refusée (authentification, requête invalide, quota) : aucun modèle n'y changera rien
+            if classify_error(e) == ERROR_PERMANENT:
+                logger.error("Erreur permanente avec %s: %s. Nécessite revue manuelle.", model_name, e)
+                return failed_result(e)
+
             if model_name == settings.llm_model_heavy:
                 logger.error(
                     "Fallback %s échoué: %s. Nécessite revue manuelle.",
                     model_name,
                     e,
                 )
-                return ExtractionResult(
-                    data=None,
-                    needs_human_review=True,
-                    error_message=str(e),
-                )
+                return failed_result(e)
 
-            logger.warning(
-                "Erreur inattendue avec %s (tentative %s): %s. Retry...",
-                model_name,
-                index,
-                e,
-            )
+            if isinstance(e, CircuitOpenError):
+                logger.warning("%s indisponible (disjoncteur ouvert) : passage au modèle suivant", model_name)
+            else:
+                logger.warning(
+                    "Erreur avec %s (tentative %s): %s",
+                    model_name,
+                    index,
+                    e,
+                )
 
     # Sécurité théorique (ne devrait pas arriver)
     return ExtractionResult(
@@ -0,0 +1,103 @@
+"""
+Registre process-wide des clients OpenAI.
+Un client par modèle, partagé entre les requêtes, avec un pool de connexions HTTP (keep-alive)
+configurable : évite un handshake TLS et une ouverture de connexion à chaque appel LLM.
+"""
+
+import asyncio
+import logging
+import threading
+import weakref
+from typing import Optional
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+from app.core.config import Settings, get_settings
+from app.services.rate_limit import get_rate_limiter, reset_rate_limiters
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_sync_clients: dict[tuple[str, str], OpenAI] = {}
+# Les clients async (httpx.AsyncClient) sont liés à la boucle d'événements qui les a créés
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[tuple[str, str], AsyncOpenAI]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _http_limits(settings: Settings) -> httpx.Limits:
+    """Construit les limites du pool de connexions à partir des settings."""
+    return httpx.Limits(
+        max_connections=settings.openai_max_connections,
+        max_keepalive_connections=settings.openai_max_keepalive_connections,
+        keepalive_expiry=settings.openai_keepalive_expiry_s,
+    )
+
+
+def get_openai_client(model: str, settings: Optional[Settings] = None) -> OpenAI:
+    """Retourne le client OpenAI synchrone partagé pour ce modèle (créé au premier appel)."""
+    settings = settings or get_settings()
+    key = (model, settings.openai_api_key)
+    with _lock:
+        client = _sync_clients.get(key)
+        if client is None:
+            client = OpenAI(
+                api_key=settings.openai_api_key,
+                http_client=DefaultHttpxClient(limits=_http_limits(settings)),
+            )
+            _sync_clients[key] = client
+            logger.info("Client OpenAI (sync) créé pour le modèle %s", model)
+    return client
+
+
+def get_async_openai_client(model: str, settings: Optional[Settings] = None) -> AsyncOpenAI:
+    """
+    Retourne le client AsyncOpenAI partagé pour ce modèle et la boucle d'événements courante.
+    Doit être appelé depuis une coroutine.
+    """
+    settings = settings or get_settings()
+    loop = asyncio.get_running_loop()
+    key = (model, settings.openai_api_key)
+    with _lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None:
+            # Nouvelles tentatives gérées par resilience.call_with_retries (disjoncteur, échéance) et, sur 429,
+            # par le limiteur : pas de retry interne du SDK, qui les multiplierait hors de tout contrôle
+            hooks = {"response": [get_rate_limiter(model, settings).on_response]} if settings.rate_limit_enabled else {}
+            client = AsyncOpenAI(
+                api_key=settings.openai_api_key,
+                max_retries=0,
+                http_client=DefaultAsyncHttpxClient(limits=_http_limits(settings), event_hooks=hooks),
+            )
+            clients[key] = client
+            logger.info("Client OpenAI (async) créé pour le modèle %s", model)
+    return client
+
+
+async def close_openai_clients() -> None:
+    """Ferme tous les clients (et leurs connexions) ; à appeler à l'arrêt de l'application."""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        sync_clients = list(_sync_clients.values())
+        _sync_clients.clear()
+        async_clients = list(_async_clients.pop(loop, {}).values())
+
+    for client in sync_clients:
+        client.close()
+    for client in async_clients:
+        await client.close()
+
+
+def reset_openai_clients() -> None:
+    """
+    Oublie les clients enregistrés (ex: après reload_settings() ou dans les tests).
+    Les clients async sont seulement déréférencés : close_openai_clients() les ferme proprement.
+    """
+    with _lock:
+        for client in _sync_clients.values():
+            client.close()
+        _sync_clients.clear()
+        _async_clients.clear()
+    reset_rate_limiters()
@@ -0,0 +1,215 @@
+"""
+Traitement des PDF multi-pages : lecture de la couche texte (poppler), sélection des pages utiles
+et rasterisation parallèle dans un pool de processus.
+Seules les pages qui comptent (1ère page + page des totaux) sont rendues et envoyées au LLM,
+ce qui permet de traiter des relevés de 20-50 pages sans exploser mémoire ni latence.
+"""
+
+import logging
+import re
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from pathlib import Path
+from typing import Optional
+
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+from app.core.config import Settings, get_settings
+from app.services.deadline import Deadline, DeadlineExceeded
+from app.services.preprocessing import PreparedDocument, PreparedImage, prepare_image
+
+logger = logging.getLogger(__name__)
+
+# Libellés de totaux courants sur les factures OHADA (francophones)
+_TOTALS_PATTERN = re.compile(
+    r"total\s*(g[ée]n[ée]ral\s*)?t\.?t\.?c|montant\s*t\.?t\.?c|net\s*[àa]\s*payer|total\s*[àa]\s*payer",
+    re.IGNORECASE,
+)
+
+# Durée maximale de lecture de la couche texte (pdftotext), bornée par l'échéance de la requête
+_PDFTOTEXT_TIMEOUT_S = 30
+
+_pool_lock = threading.Lock()
+_render_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_render_pool(settings: Settings) -> ProcessPoolExecutor:
+    """Pool de processus partagé pour la rasterisation (créé au premier PDF multi-pages)."""
+    global _render_pool
+    with _pool_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(max_workers=settings.pdf_render_workers)
+        return _render_pool
+
+
+def shutdown_render_pool() -> None:
+    """Arrête le pool de rasterisation (à l'arrêt de l'application)."""
+    global _render_pool
+    with _pool_lock:
+        if _render_pool is not None:
+            _render_pool.shutdown(wait=False, cancel_futures=True)
+            _render_pool = None
+
+
+def page_count(pdf_path: Path) -> int:
+    """Nombre de pages du PDF (pdfinfo)."""
+    return int(pdfinfo_from_path(str(pdf_path))["Pages"])
+
+
+def extract_page_texts(pdf_path: Path, last_page: int, deadline: Optional[Deadline] = None) -> list[str]:
+    """
+    Extrait la couche texte des pages 1..last_page avec pdftotext (poppler).
+    Retourne une chaîne par page (vide pour une page scannée sans texte).
+    Avec une échéance, pdftotext est interrompu au plus tard lorsqu'elle est atteinte.
+    """
+    completed = subprocess.run(
+        ["pdftotext", "-layout", "-f", "1", "-l", str(last_page), str(pdf_path), "-"],
+        capture_output=True,
+        check=True,
+        timeout=deadline.cap(_PDFTOTEXT_TIMEOUT_S) if deadline else _PDFTOTEXT_TIMEOUT_S,
+    )
+    pages = completed.stdout.decode("utf-8", errors="replace").split("\f")
+    # pdftotext termine chaque page par un saut de page : le dernier élément est vide
+    return (pages + [""] * last_page)[:last_page]
+
+
+def select_pages(page_texts: list[str], total_pages: int, max_selected: int) -> list[int]:
+    """
+    Heuristique de sélection des pages (numéros 1-based) à envoyer au LLM.
+    Un document de max_selected pages ou moins est envoyé en entier ; au-delà : la 1ère page
+    (en-tête, fournisseur, numéro) plus la dernière page contenant un libellé de totaux.
+    Sans couche texte exploitable : 1ère + dernière page.
+    """
+    if total_pages <= max_selected:
+        return list(range(1, total_pages + 1))
+
+    totals_pages = [index for index, text in enumerate(page_texts, start=1) if _TOTALS_PATTERN.search(text)]
+    # Les totaux finaux sont en général sur la dernière page qui en contient
+    return sorted({1, totals_pages[-1] if totals_pages else total_pages})
+
+
+def has_usable_text_layer(page_texts: list[str], min_chars: int) -> bool:
+    """
+    True si la couche texte est exploitable : la 1ère page (en-tête, fournisseur, montants)
+    contient au moins min_chars caractères visibles, majoritairement alphanumériques
+    (exclut les scans avec un filigrane et les polices mal encodées).
+    """
+    if not page_texts:
+        return False
+    visible = [char for char in page_texts[0] if not char.isspace()]
+    if len(visible) < min_chars:
+        return False
+    alnum_ratio = sum(char.isalnum() for char in visible) / len(visible)
+    return alnum_ratio >= 0.5
+
+
+def build_document_text(page_texts: list[str], pages: list[int], max_chars: int) -> tuple[str, list[int]]:
+    """
+    Assemble le texte envoyé au LLM : toutes les pages si elles tiennent dans max_chars,
+    sinon uniquement les pages sélectionnées (tronquées à max_chars).
+
+    Returns:
+        (texte, numéros des pages incluses)
+    """
+    if sum(len(text) for text in page_texts) > max_chars:
+        included = pages
+    else:
+        included = list(range(1, len(page_texts) + 1))
+    parts = [f"--- Page {page} ---\n{page_texts[page - 1].rstrip()}" for page in included]
+    return "\n\n".join(parts)[:max_chars], included
+
+
+def _render_page(pdf_path: str, page: int, bytes_in: int, settings: Settings) -> PreparedImage:
+    """Rend et prétraite une page (exécuté dans un processus du pool)."""
+    started = time.perf_counter()
+    images = convert_from_path(pdf_path, dpi=settings.pdf_dpi, first_page=page, last_page=page)
+    if not images:
+        raise ValueError(f"Page {page} du PDF impossible à rendre")
+    rasterize_ms = (time.perf_counter() - started) * 1000
+    prepared = prepare_image(images[0], bytes_in=bytes_in, settings=settings)
+    prepared.rasterize_ms = rasterize_ms
+    return prepared
+
+
+def rasterize_pages(
+    pdf_path: Path,
+    pages: list[int],
+    bytes_in: int,
+    settings: Settings,
+    deadline: Optional[Deadline] = None,
+) -> list[PreparedImage]:
+    """
+    Rend les pages demandées en parallèle (une tâche par page dans le pool de processus).
+    Chaque processus renvoie directement l'image prétraitée (JPEG base64) et non le bitmap brut.
+    Avec une échéance, les rendus encore en attente sont annulés lorsqu'elle est dépassée.
+    """
+    if len(pages) == 1:
+        return [_render_page(str(pdf_path), pages[0], bytes_in, settings)]
+
+    # La taille d'entrée est répartie entre les pages pour que la somme corresponde au fichier
+    share = bytes_in // len(pages)
+    pool = _get_render_pool(settings)
+    futures = [pool.submit(_render_page, str(pdf_path), page, share, settings) for page in pages]
+    try:
+        return [future.result(timeout=deadline.cap() if deadline else None) for future in futures]
+    except FutureTimeoutError:
+        for future in futures:
+            future.cancel()
+        raise DeadlineExceeded(f"Délai de {deadline.budget_s:.1f}s dépassé (rasterisation)") from None
+
+
+def prepare_pdf(
+    content: bytes,
+    settings: Optional[Settings] = None,
+    deadline: Optional[Deadline] = None,
+) -> PreparedDocument:
+    """
+    Convertit un PDF en document prêt pour le LLM.
+    PDF numérique avec couche texte exploitable : chemin texte, aucune rasterisation.
+    Sinon (scan, couche texte vide) : images prétraitées des pages pertinentes.
+    deadline : échéance de la requête, qui borne la lecture de la couche texte, vérifiée avant la rasterisation
+    et pendant le rendu des pages.
+    """
+    settings = settings or get_settings()
+    with tempfile.TemporaryDirectory(prefix="azo-pdf-") as tmp_dir:
+        pdf_path = Path(tmp_dir) / "document.pdf"
+        pdf_path.write_bytes(content)
+
+        total_pages = page_count(pdf_path)
+        if total_pages < 1:
+            raise ValueError("PDF sans page")
+        scanned_pages = min(total_pages, settings.pdf_max_pages)
+        if total_pages > settings.pdf_max_pages:
+            logger.warning("PDF de %d pages : seules les %d premières sont considérées", total_pages, scanned_pages)
+
+        page_texts: list[str] = []
+        if settings.text_layer_enabled or scanned_pages > settings.pdf_max_selected_pages:
+            try:
+                page_texts = extract_page_texts(pdf_path, scanned_pages, deadline)
+            except (OSError, subprocess.SubprocessError) as e:
+                logger.warning("Lecture de la couche texte impossible (%s) : sélection 1ère + dernière page", e)
+
+        pages = select_pages(page_texts, scanned_pages, settings.pdf_max_selected_pages)
+
+        if settings.text_layer_enabled and has_usable_text_layer(page_texts, settings.text_layer_min_chars):
+            text, included = build_document_text(page_texts, pages, settings.text_layer_max_chars)
+            logger.info("PDF %d page(s) avec couche texte : chemin texte (pages %s)", total_pages, included)
+            return PreparedDocument(
+                images=[],
+                page_count=total_pages,
+                pages_sent=included,
+                text=text,
+                source_bytes=len(content),
+            )
+
+        logger.info("PDF %d page(s) : pages envoyées au LLM %s", total_pages, pages)
+        if deadline is not None:
+            deadline.check("rasterisation")
+        return PreparedDocument(
+            images=rasterize_pages(pdf_path, pages, len(content), settings, deadline),
+            page_count=total_pages,
+            pages_sent=pages,
+        )
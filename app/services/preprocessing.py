@@ -0,0 +1,212 @@
+"""
+Prétraitement des images avant envoi au modèle Vision.
+Redresse (EXIF), redimensionne selon le découpage en tuiles de l'API, passe en niveaux de gris
+quand la couleur n'apporte rien, puis ré-encode (JPEG/WebP) avec le bon type MIME.
+Objectif : réduire la taille des requêtes, le temps d'upload et les tokens d'image.
+"""
+
+import base64
+import io
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from PIL import Image, ImageOps, ImageStat
+
+from app.core.config import Settings, get_settings
+
+logger = logging.getLogger(__name__)
+
+# Formats que l'on peut renvoyer tels quels si le ré-encodage n'apporte rien
+_PASSTHROUGH_MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+_EXIF_ORIENTATION = 0x0112
+_OUTPUT_FORMATS = {"jpeg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp")}
+
+
+@dataclass
+class PreparedImage:
+    """Image prête à être envoyée au LLM, avec les métriques de prétraitement."""
+
+    base64: str
+    mime_type: str
+    width: int
+    height: int
+    bytes_in: int
+    """Taille (octets) de l'entrée : fichier uploadé ou rendu PDF brut."""
+    bytes_out: int
+    """Taille (octets) de l'image encodée envoyée au modèle (avant base64)."""
+    rasterize_ms: float = 0.0
+    """Durée du rendu de la page PDF (0 pour une image uploadée)."""
+    encode_ms: float = 0.0
+    """Durée du prétraitement et du ré-encodage."""
+
+    @property
+    def data_url(self) -> str:
+        """URL data: utilisable dans un message image_url."""
+        return f"data:{self.mime_type};base64,{self.base64}"
+
+
+@dataclass
+class PreparedDocument:
+    """
+    Document uploadé prêt pour l'extraction : une image par page envoyée au LLM (chemin vision)
+    ou le texte de la couche texte du PDF (chemin texte, sans image).
+    """
+
+    images: list[PreparedImage]
+    page_count: int = 1
+    """Nombre total de pages du document source."""
+    pages_sent: list[int] = field(default_factory=lambda: [1])
+    """Numéros (1-based) des pages retenues pour le LLM."""
+    text: Optional[str] = None
+    """Texte extrait (chemin texte) ; None pour le chemin vision."""
+    source_bytes: int = 0
+    """Taille du fichier source (octets), utilisée pour le chemin texte."""
+
+    @property
+    def input_mode(self) -> str:
+        """Chemin d'extraction : "text" ou "vision"."""
+        return "text" if self.text is not None else "vision"
+
+    @property
+    def stage_ms(self) -> dict[str, float]:
+        """Durées cumulées sur les pages (ms) des étapes rasterize et encode, pour les KPI."""
+        if not self.images:
+            return {}
+        return {
+            "rasterize": sum(image.rasterize_ms for image in self.images),
+            "encode": sum(image.encode_ms for image in self.images),
+        }
+
+    @property
+    def bytes_in(self) -> int:
+        """Taille cumulée des entrées (octets)."""
+        if self.text is not None:
+            return self.source_bytes
+        return sum(image.bytes_in for image in self.images)
+
+    @property
+    def bytes_out(self) -> int:
+        """Taille cumulée de ce qui est envoyé au LLM (images encodées ou texte UTF-8, en octets)."""
+        if self.text is not None:
+            return len(self.text.encode("utf-8"))
+        return sum(image.bytes_out for image in self.images)
+
+
+def _target_size(width: int, height: int, settings: Settings) -> tuple[int, int]:
+    """
+    Taille cible : l'API (detail=high) ramène l'image dans 2048x2048 puis son petit côté à 768 px
+    avant de la découper en tuiles de 512 px. Au-delà, les pixels envoyés sont perdus.
+    """
+    long_edge, short_edge = max(width, height), min(width, height)
+    scale = min(
+        1.0,
+        settings.image_max_long_edge / long_edge,
+        settings.image_max_short_edge / short_edge,
+    )
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _is_colorless(image: Image.Image, settings: Settings) -> bool:
+    """True si la saturation moyenne (mesurée sur une vignette) est sous le seuil configuré."""
+    thumbnail = image.copy()
+    thumbnail.thumbnail((64, 64))
+    saturation = thumbnail.convert("HSV").getchannel("S")
+    return ImageStat.Stat(saturation).mean[0] < settings.image_grayscale_threshold
+
+
+def _flatten(image: Image.Image) -> Image.Image:
+    """Convertit vers un mode encodable en JPEG/WebP (fond blanc pour la transparence)."""
+    if image.mode in ("RGB", "L"):
+        return image
+    if image.mode in ("RGBA", "LA", "P"):
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def prepare_image(
+    image: Image.Image,
+    *,
+    bytes_in: int,
+    original: Optional[bytes] = None,
+    settings: Optional[Settings] = None,
+) -> PreparedImage:
+    """
+    Applique le prétraitement à une image PIL.
+
+    Args:
+        image: Image source (fichier ouvert ou page PDF rendue).
+        bytes_in: Taille de l'entrée, pour les métriques.
+        original: Octets du fichier source ; renvoyés tels quels si aucun redimensionnement
+            n'est nécessaire et que le ré-encodage ne les réduit pas.
+        settings: Settings (défaut : get_settings()).
+    """
+    settings = settings or get_settings()
+    started = time.perf_counter()
+    source_format = image.format
+
+    # GIF animé / multi-frame : première image uniquement
+    if getattr(image, "n_frames", 1) > 1:
+        image.seek(0)
+        source_format = None
+
+    # Redressement selon l'orientation EXIF (photos de téléphone)
+    transformed = source_format is None or image.getexif().get(_EXIF_ORIENTATION, 1) != 1
+    oriented = ImageOps.exif_transpose(image)
+
+    size = _target_size(oriented.width, oriented.height, settings)
+    if size != oriented.size:
+        oriented = oriented.resize(size, Image.Resampling.LANCZOS)
+        transformed = True
+
+    oriented = _flatten(oriented)
+    if settings.image_auto_grayscale and oriented.mode != "L" and _is_colorless(oriented, settings):
+        oriented = oriented.convert("L")
+
+    pil_format, mime_type = _OUTPUT_FORMATS.get(settings.image_format.lower(), _OUTPUT_FORMATS["jpeg"])
+    buffer = io.BytesIO()
+    oriented.save(buffer, format=pil_format, quality=settings.image_quality, optimize=True)
+    encoded = buffer.getvalue()
+
+    if (
+        original is not None
+        and not transformed
+        and source_format in _PASSTHROUGH_MIME_TYPES
+        and len(original) <= len(encoded)
+    ):
+        encoded, mime_type = original, _PASSTHROUGH_MIME_TYPES[source_format]
+
+    logger.info(
+        "Prétraitement image : %dx%d -> %dx%d | %d -> %d octets (%s)",
+        image.width,
+        image.height,
+        oriented.width,
+        oriented.height,
+        bytes_in,
+        len(encoded),
+        mime_type,
+    )
+    return PreparedImage(
+        base64=base64.b64encode(encoded).decode("ascii"),
+        mime_type=mime_type,
+        width=oriented.width,
+        height=oriented.height,
+        bytes_in=bytes_in,
+        bytes_out=len(encoded),
+        encode_ms=(time.perf_counter() - started) * 1000,
+    )
+
+
+def prepare_image_bytes(content: bytes, settings: Optional[Settings] = None) -> PreparedImage:
+    """Prétraite un fichier image uploadé (JPEG, PNG, WebP, GIF)."""
+    with Image.open(io.BytesIO(content)) as image:
+        return prepare_image(image, bytes_in=len(content), original=content, settings=settings)
+
+
+def prepare_image_document(content: bytes, settings: Optional[Settings] = None) -> PreparedDocument:
+    """Prétraite un fichier image uploadé en document d'une page."""
+    return PreparedDocument(images=[prepare_image_bytes(content, settings)])
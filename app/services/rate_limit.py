@@ -0,0 +1,333 @@
+"""
+Limitation de débit côté client des appels OpenAI, par modèle.
+Deux seaux à jetons (requêtes par minute, tokens par minute) régulent le débit sous les limites
+du compte, et une concurrence adaptative AIMD (augmentation additive sur succès, division par 2
+sur 429) borne les appels simultanés. Les en-têtes x-ratelimit-* des réponses recalent les seaux
+sur l'état réel du compte (partagé entre processus). Un appel en excès attend brièvement son tour
+au lieu d'échouer et de faire escalader la cascade vers le modèle lourd.
+"""
+
+import asyncio
+import logging
+import math
+import re
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import httpx
+
+from app.core.config import Settings, get_settings
+from app.monitoring.pricing import model_entry
+
+logger = logging.getLogger(__name__)
+
+# Rafale autorisée : capacité des seaux en secondes de débit
+_BURST_S = 10.0
+# Délai minimal entre deux réductions de concurrence (une rafale de 429 ne divise qu'une fois)
+_DECREASE_COOLDOWN_S = 2.0
+# Pause par défaut après un 429 sans indication de délai
+_DEFAULT_RETRY_AFTER_S = 1.0
+# Tokens de prompt estimés par caractère de texte, et tuile d'image (detail=high : 85 + 170 par tuile de 512 px)
+_CHARS_PER_TOKEN = 4
+_IMAGE_BASE_TOKENS = 85
+_IMAGE_TILE_TOKENS = 170
+_IMAGE_TILE_PX = 512
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+class RateLimitQueueTimeout(Exception):
+    """L'appel aurait attendu plus de rate_limit_max_queue_s dans le limiteur."""
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Durée des en-têtes OpenAI ("20ms", "1s", "6m0s", "1h2m3.5s") ou nombre de secondes."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def _header_int(headers: httpx.Headers, name: str) -> Optional[int]:
+    try:
+        return int(headers[name])
+    except (KeyError, ValueError):
+        return None
+
+
+def retry_after_s(headers: httpx.Headers) -> Optional[float]:
+    """Délai demandé par une réponse 429 (retry-after-ms, retry-after, sinon reset du seau épuisé)."""
+    if "retry-after-ms" in headers:
+        value = parse_duration(headers["retry-after-ms"])
+        return value / 1000 if value is not None else None
+    for name in ("retry-after", "x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+        value = parse_duration(headers.get(name))
+        if value is not None:
+            return value
+    return None
+
+
+def estimate_request_tokens(messages: list[dict], settings: Settings) -> int:
+    """
+    Estimation prudente des tokens d'un appel (prompt + complétion), comptée dans le seau TPM
+    avant l'appel. Une image coûte au plus le nombre de tuiles de la taille maximale de prétraitement.
+    """
+    tiles = math.ceil(settings.image_max_long_edge / _IMAGE_TILE_PX) * math.ceil(
+        settings.image_max_short_edge / _IMAGE_TILE_PX
+    )
+    image_tokens = _IMAGE_BASE_TOKENS + _IMAGE_TILE_TOKENS * tiles
+
+    tokens = settings.rate_limit_completion_tokens
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += len(content) // _CHARS_PER_TOKEN
+            continue
+        for part in content or []:
+            if part.get("type") == "image_url":
+                tokens += image_tokens
+            else:
+                tokens += len(part.get("text", "")) // _CHARS_PER_TOKEN
+    return tokens
+
+
+class TokenBucket:
+    """
+    Seau à jetons par réservation : une demande est débitée immédiatement (le niveau peut devenir
+    négatif) et l'appelant attend que le seau soit revenu à zéro, ce qui sert les demandes dans l'ordre.
+    """
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * _BURST_S)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float, max_wait_s: float) -> float:
+        """Débite amount et retourne l'attente nécessaire ; lève RateLimitQueueTimeout au-delà de max_wait_s."""
+        now = time.monotonic()
+        self._refill(now)
+        self.level -= amount
+        wait = max(-self.level / self.rate, 0.0)
+        if wait > max_wait_s:
+            self.level += amount
+            raise RateLimitQueueTimeout(f"attente estimée {wait:.1f}s > {max_wait_s:.1f}s")
+        return wait
+
+    def refund(self, amount: float) -> None:
+        """Recrédite une réservation non consommée (ou surestimée)."""
+        self._refill(time.monotonic())
+        self.level = min(self.capacity, self.level + amount)
+
+    def set_limit(self, per_minute: float) -> None:
+        """Ajuste le débit (limite annoncée par l'API), en conservant le niveau courant."""
+        self._refill(time.monotonic())
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * _BURST_S)
+        self.level = min(self.level, self.capacity)
+
+    def sync_remaining(self, remaining: float) -> None:
+        """Recale le niveau sur le reste annoncé par l'API (consommation des autres processus comprise)."""
+        self._refill(time.monotonic())
+        self.level = min(self.level, remaining)
+
+
+class AdaptiveConcurrency:
+    """Borne AIMD du nombre d'appels simultanés : +1/limite par succès, x0,5 sur 429."""
+
+    def __init__(self, initial: int, maximum: int):
+        self.maximum = maximum
+        self.limit = float(min(initial, maximum))
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+        self._last_decrease = float("-inf")
+
+    async def acquire(self, timeout_s: float) -> None:
+        async with self._condition:
+            if self.in_flight >= int(self.limit):
+                try:
+                    await asyncio.wait_for(
+                        self._condition.wait_for(lambda: self.in_flight < int(self.limit)),
+                        timeout=max(timeout_s, 0.0),
+                    )
+                except asyncio.TimeoutError:
+                    raise RateLimitQueueTimeout(
+                        f"{self.in_flight} appel(s) en cours pour une limite de {int(self.limit)}"
+                    ) from None
+            self.in_flight += 1
+
+    async def release(self) -> None:
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def increase(self) -> None:
+        """Augmentation additive : environ +1 après `limite` succès consécutifs."""
+        self.limit = min(float(self.maximum), self.limit + 1.0 / self.limit)
+
+    def decrease(self) -> bool:
+        """Diminution multiplicative (au plus une par période de refroidissement)."""
+        now = time.monotonic()
+        if now - self._last_decrease < _DECREASE_COOLDOWN_S:
+            return False
+        self._last_decrease = now
+        self.limit = max(1.0, self.limit / 2)
+        return True
+
+
+class ModelRateLimiter:
+    """Limiteur d'un modèle : seaux RPM / TPM et concurrence adaptative."""
+
+    def __init__(self, model: str, settings: Settings):
+        self.model = model
+        self.headroom = settings.rate_limit_headroom
+        limits = model_entry(model, settings.rate_limits) or {}
+        self.requests: Optional[TokenBucket] = (
+            TokenBucket(limits["rpm"] * self.headroom) if limits.get("rpm") else None
+        )
+        self.tokens: Optional[TokenBucket] = (
+            TokenBucket(limits["tpm"] * self.headroom) if limits.get("tpm") else None
+        )
+        self.concurrency = AdaptiveConcurrency(
+            settings.rate_limit_initial_concurrency, settings.rate_limit_max_concurrency
+        )
+        self.paused_until = 0.0
+        self.throttled_count = 0
+        self.rate_limited_count = 0
+
+    def pause(self, seconds: float) -> None:
+        """Suspend les appels du modèle pendant seconds (429, limite du compte épuisée)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens: int, deadline: float) -> AsyncIterator[None]:
+        """
+        Réserve une requête et estimated_tokens dans les seaux, attend le débit disponible puis une
+        place de concurrence. Lève RateLimitQueueTimeout si l'attente dépasserait deadline (monotonic).
+        """
+        reserved: list[tuple[TokenBucket, float]] = []
+        try:
+            wait = max(self.paused_until - time.monotonic(), 0.0)
+            if wait > deadline - time.monotonic():
+                raise RateLimitQueueTimeout(f"{self.model} suspendu encore {wait:.1f}s (429)")
+            for bucket, amount in ((self.requests, 1), (self.tokens, estimated_tokens)):
+                if bucket is not None:
+                    wait = max(wait, bucket.reserve(amount, deadline - time.monotonic()))
+                    reserved.append((bucket, amount))
+            if wait > 0:
+                self.throttled_count += 1
+                logger.info("Limiteur %s : appel mis en attente %.2fs (débit)", self.model, wait)
+                await asyncio.sleep(wait)
+            await self.concurrency.acquire(deadline - time.monotonic())
+        except BaseException:
+            for bucket, amount in reserved:
+                bucket.refund(amount)
+            raise
+
+        try:
+            yield
+        finally:
+            await self.concurrency.release()
+
+    def settle(self, estimated_tokens: int, actual_tokens: Optional[int]) -> None:
+        """Corrige le seau TPM avec l'usage réel de l'appel."""
+        if self.tokens is not None and actual_tokens is not None:
+            # Montant négatif si l'estimation était trop basse : débit complémentaire
+            self.tokens.refund(estimated_tokens - actual_tokens)
+
+    def on_rate_limited(self, delay_s: Optional[float]) -> None:
+        """Réponse 429 : pause des seaux et division de la concurrence."""
+        self.rate_limited_count += 1
+        delay_s = delay_s if delay_s is not None else _DEFAULT_RETRY_AFTER_S
+        self.pause(delay_s)
+        if self.concurrency.decrease():
+            logger.warning(
+                "429 pour %s : concurrence réduite à %d, pause %.2fs",
+                self.model,
+                int(self.concurrency.limit),
+                delay_s,
+            )
+
+    def on_headers(self, headers: httpx.Headers) -> None:
+        """Recale les seaux sur les limites et restes annoncés par les en-têtes x-ratelimit-*."""
+        for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+            limit = _header_int(headers, f"x-ratelimit-limit-{kind}")
+            remaining = _header_int(headers, f"x-ratelimit-remaining-{kind}")
+            if limit is None:
+                continue
+            if bucket is None:
+                bucket = TokenBucket(limit * self.headroom)
+                if kind == "requests":
+                    self.requests = bucket
+                else:
+                    self.tokens = bucket
+            elif abs(bucket.rate * 60 - limit * self.headroom) > 1e-6:
+                bucket.set_limit(limit * self.headroom)
+            if remaining is not None:
+                # Marge réservée aux autres processus : le reste annoncé moins (1 - headroom) de la limite
+                bucket.sync_remaining(remaining - limit * (1 - self.headroom))
+                if remaining == 0:
+                    reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                    self.pause(reset if reset is not None else _DEFAULT_RETRY_AFTER_S)
+
+    async def on_response(self, response: httpx.Response) -> None:
+        """Hook httpx de chaque réponse du client OpenAI de ce modèle (les 429 sont traités par l'appelant)."""
+        self.on_headers(response.headers)
+        if response.status_code < 400:
+            self.concurrency.increase()
+
+    def stats(self) -> dict:
+        """État du limiteur (exposé dans /api/v1/kpi)."""
+        return {
+            "concurrency_limit": int(self.concurrency.limit),
+            "in_flight": self.concurrency.in_flight,
+            "rpm": round(self.requests.rate * 60) if self.requests else None,
+            "tpm": round(self.tokens.rate * 60) if self.tokens else None,
+            "throttled_count": self.throttled_count,
+            "rate_limited_count": self.rate_limited_count,
+        }
+
+
+# Limiteurs par boucle d'événements (primitives asyncio), comme les clients async
+_limiters: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, ModelRateLimiter]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_rate_limiter(model: str, settings: Optional[Settings] = None) -> ModelRateLimiter:
+    """Retourne le limiteur du modèle pour la boucle d'événements courante (créé au premier appel)."""
+    settings = settings or get_settings()
+    limiters = _limiters.setdefault(asyncio.get_running_loop(), {})
+    limiter = limiters.get(model)
+    if limiter is None:
+        limiter = ModelRateLimiter(model, settings)
+        limiters[model] = limiter
+    return limiter
+
+
+def rate_limit_stats() -> dict:
+    """État des limiteurs de la boucle courante, par modèle."""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return {}
+    return {model: limiter.stats() for model, limiter in _limiters.get(loop, {}).items()}
+
+
+def reset_rate_limiters() -> None:
+    """Oublie tous les limiteurs (tests, reload_settings())."""
+    _limiters.clear()
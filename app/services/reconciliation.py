@@ -0,0 +1,157 @@
+"""
+Réconciliation arithmétique locale des montants d'une facture, avant toute relance LLM.
+Beaucoup d'écarts HT + TVA != TTC sont mécaniques : séparateur de milliers mal lu (300.000 → 300.0),
+HT et TTC inversés, un montant mal lu alors que les deux autres sont corrects.
+Les corrections candidates ne sont retenues que si HT, TVA, TTC, le taux de TVA (taux OHADA usuels)
+et le total des lignes de détail deviennent cohérents, et qu'une seule correction y parvient.
+"""
+
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Iterator, Optional
+
+from app.core.config import Settings, get_settings
+from app.models.constants import MONTANT_TOLERANCE
+from app.models.schemas import InvoiceData
+
+logger = logging.getLogger(__name__)
+
+# Erreurs de lecture de séparateur : milliers lus comme décimales (x1000) ou l'inverse,
+# virgule décimale ignorée (x0.01) ou ajoutée (x100)
+SCALE_FACTORS = (1000.0, 0.001, 100.0, 0.01)
+
+_AMOUNT_FIELDS = ("montant_ht", "montant_tva", "montant_ttc")
+# Écart relatif admis entre grands montants (TVA arrondie, lignes arrondies) : 0,05 %
+_RELATIVE_TOLERANCE = 0.0005
+
+
+@dataclass
+class Reconciliation:
+    """Facture réconciliée localement et corrections appliquées."""
+
+    data: InvoiceData
+    corrections: list[str] = field(default_factory=list)
+    """Description des corrections (ex : "montant_ttc x1000")."""
+
+
+def _close(a: float, b: float, tolerance: float) -> bool:
+    """Égalité de montants à l'arrondi près (tolerance, ou 0,05 % pour les grands montants)."""
+    return abs(a - b) <= max(tolerance, _RELATIVE_TOLERANCE * max(abs(a), abs(b)))
+
+
+def _matches_vat_rate(ht: float, tva: float, rates: list[float], tolerance: float) -> bool:
+    """True si la TVA correspond à l'un des taux configurés appliqué au HT."""
+    return any(_close(tva, ht * rate, tolerance) for rate in rates)
+
+
+def _line_total(raw: dict) -> Optional[float]:
+    """Somme des montants des lignes de détail (None si pas de ligne exploitable)."""
+    amounts = [
+        line.get("montant_ligne")
+        for line in raw.get("lignes_detail") or []
+        if isinstance(line, dict) and isinstance(line.get("montant_ligne"), (int, float))
+    ]
+    total = sum(amounts)
+    return total if amounts and total > 0 else None
+
+
+def _candidates(ht: float, tva: float, ttc: float, line_total: Optional[float]) -> Iterator[tuple[str, tuple]]:
+    """Corrections candidates (description, (ht, tva, ttc)), des plus simples aux plus fortes."""
+    values = {"montant_ht": ht, "montant_tva": tva, "montant_ttc": ttc}
+
+    # Un seul montant mal lu (séparateur)
+    for name in _AMOUNT_FIELDS:
+        for factor in SCALE_FACTORS:
+            scaled = dict(values, **{name: values[name] * factor})
+            yield f"{name} x{factor:g}", tuple(scaled[key] for key in _AMOUNT_FIELDS)
+
+    # HT et TTC inversés
+    yield "inversion montant_ht / montant_ttc", (ttc, tva, ht)
+
+    # Un montant faux, les deux autres justes : recalcul
+    yield "montant_tva = TTC - HT", (ht, ttc - ht, ttc)
+    yield "montant_ht = TTC - TVA", (ttc - tva, tva, ttc)
+
+    if line_total is not None:
+        # TTC recalculé : HT et TVA cohérents entre eux ne suffisent pas, les lignes doivent le confirmer
+        yield "montant_ttc = HT + TVA", (ht, tva, ht + tva)
+        # HT lu de travers mais lignes de détail fiables
+        yield "montant_ht = total des lignes", (line_total, tva, ttc)
+
+
+def _is_consistent(
+    ht: float, tva: float, ttc: float, line_total: Optional[float], rates: list[float], tolerance: float
+) -> bool:
+    """
+    Vérifie la cohérence complète d'une correction : montants positifs, HT + TVA == TTC (tolérance
+    stricte de la validation), TVA conforme à un taux usuel et total des lignes égal au HT (ou au TTC
+    si lignes TTC), à l'arrondi près.
+    """
+    if min(ht, tva, ttc) < 0 or ht <= 0:
+        return False
+    if abs(ht + tva - ttc) > MONTANT_TOLERANCE:
+        return False
+    if tva > 0 and not _matches_vat_rate(ht, tva, rates, tolerance):
+        return False
+    if line_total is not None and not (_close(line_total, ht, tolerance) or _close(line_total, ttc, tolerance)):
+        return False
+    return True
+
+
+def reconcile_amounts(raw: dict, settings: Optional[Settings] = None) -> Optional[Reconciliation]:
+    """
+    Cherche une correction locale des montants d'une réponse LLM incohérente.
+
+    Args:
+        raw: JSON renvoyé par le LLM (déjà décodé).
+
+    Returns:
+        La facture corrigée et validée, ou None si aucune correction (ou plusieurs corrections
+        concurrentes) ne rend la facture cohérente.
+    """
+    settings = settings or get_settings()
+    try:
+        ht, tva, ttc = (float(raw[name]) for name in _AMOUNT_FIELDS)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+    line_total = _line_total(raw)
+    rates = settings.reconciliation_vat_rates
+    tolerance = settings.reconciliation_rounding_tolerance
+
+    accepted: dict[tuple, list[str]] = {}
+    for description, (new_ht, new_tva, new_ttc) in _candidates(ht, tva, ttc, line_total):
+        if _is_consistent(new_ht, new_tva, new_ttc, line_total, rates, tolerance):
+            key = (round(new_ht, 2), round(new_tva, 2), round(new_ttc, 2))
+            accepted.setdefault(key, []).append(description)
+
+    if len(accepted) != 1:
+        if accepted:
+            logger.info("Réconciliation ambiguë (%d corrections concurrentes) : abandon", len(accepted))
+        return None
+
+    (new_ht, new_tva, new_ttc), corrections = next(iter(accepted.items()))
+    repaired = dict(raw, montant_ht=new_ht, montant_tva=new_tva, montant_ttc=new_ttc)
+    try:
+        data = InvoiceData.model_validate(repaired)
+    except ValueError:
+        return None
+
+    logger.info(
+        "Montants réconciliés localement (%s) : HT %.2f / TVA %.2f / TTC %.2f",
+        ", ".join(corrections),
+        new_ht,
+        new_tva,
+        new_ttc,
+    )
+    return Reconciliation(data=data, corrections=corrections)
+
+
+def reconcile_raw_json(raw_json: str, settings: Optional[Settings] = None) -> Optional[Reconciliation]:
+    """reconcile_amounts à partir du JSON brut porté par MathValidationError.raw_json."""
+    try:
+        raw = json.loads(raw_json)
+    except (TypeError, json.JSONDecodeError):
+        return None
+    return reconcile_amounts(raw, settings) if isinstance(raw, dict) else None
@@ -0,0 +1,245 @@
+"""
+Résilience des appels LLM : classification des erreurs, backoff exponentiel avec jitter
+(Retry-After respecté) et disjoncteur (circuit breaker) par modèle.
+Pendant une panne partielle du fournisseur, les erreurs transitoires sont retentées avec un délai
+croissant au lieu d'enchaîner immédiatement les tentatives de la cascade, et un modèle en échec
+répété est court-circuité : la cascade passe au modèle suivant ou échoue immédiatement.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Optional
+
+import httpx
+import openai
+from pydantic import ValidationError
+
+from app.core.config import Settings, get_settings
+from app.monitoring.tracing import start_span
+from app.services.deadline import Deadline, DeadlineExceeded
+from app.services.rate_limit import RateLimitQueueTimeout, retry_after_s
+
+logger = logging.getLogger(__name__)
+
+# Nature d'une erreur d'appel LLM
+ERROR_TRANSIENT = "transient"
+"""Réseau, timeout, 5xx, 429 : un nouvel essai plus tard peut réussir."""
+ERROR_VALIDATION = "validation"
+"""Réponse obtenue mais invalide (JSON, schéma, calcul) : l'API fonctionne."""
+ERROR_PERMANENT = "permanent"
+"""Requête refusée (authentification, requête invalide, quota) : réessayer est inutile."""
+
+# États du disjoncteur
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+# Statuts HTTP d'erreur client néanmoins transitoires (timeout, conflit, trop de requêtes)
+_TRANSIENT_STATUS = {408, 409, 429}
+
+
+class CircuitOpenError(Exception):
+    """Le disjoncteur du modèle est ouvert : appel refusé sans contacter l'API."""
+
+    def __init__(self, model: str, retry_in_s: float):
+        super().__init__(f"Disjoncteur ouvert pour {model} (nouvel essai dans {retry_in_s:.1f}s)")
+        self.model = model
+        self.retry_in_s = retry_in_s
+
+
+def classify_error(error: BaseException) -> str:
+    """Classe une erreur d'appel LLM : ERROR_TRANSIENT, ERROR_VALIDATION ou ERROR_PERMANENT."""
+    if isinstance(error, (ValueError, ValidationError)):
+        # MathValidationError et erreurs de parsing JSON / schéma sont des ValueError
+        return ERROR_VALIDATION
+    if isinstance(error, openai.APIStatusError):
+        if getattr(error, "code", None) == "insufficient_quota":
+            return ERROR_PERMANENT
+        if error.status_code in _TRANSIENT_STATUS or error.status_code >= 500:
+            return ERROR_TRANSIENT
+        return ERROR_PERMANENT
+    # Connexion, timeout, disjoncteur ouvert, attente du limiteur ; par défaut : transitoire
+    return ERROR_TRANSIENT
+
+
+def error_retry_after(error: BaseException) -> Optional[float]:
+    """Délai demandé par l'API (Retry-After) pour une erreur HTTP, sinon None."""
+    response = getattr(error, "response", None)
+    if isinstance(response, httpx.Response):
+        return retry_after_s(response.headers)
+    return None
+
+
+def backoff_delay(retry: int, settings: Settings, retry_after: Optional[float] = None) -> float:
+    """
+    Délai avant le nouvel essai n° retry (0 pour le 1er) : full jitter sur un exponentiel borné,
+    ou au moins le Retry-After demandé par l'API (borné par llm_backoff_max_s).
+    """
+    ceiling = min(settings.llm_backoff_max_s, settings.llm_backoff_base_s * 2**retry)
+    delay = random.uniform(0, ceiling)
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, settings.llm_backoff_max_s))
+    return delay
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Erreur transitoire qui mérite un nouvel essai sur le même modèle."""
+    # Disjoncteur ouvert : inutile d'attendre ; attente du limiteur ou échéance : déjà écoulées
+    if isinstance(error, (CircuitOpenError, RateLimitQueueTimeout, DeadlineExceeded)):
+        return False
+    return classify_error(error) == ERROR_TRANSIENT
+
+
+class CircuitBreaker:
+    """
+    Disjoncteur d'un modèle : ouvert après circuit_failure_threshold erreurs transitoires consécutives,
+    il refuse les appels pendant circuit_open_s, puis laisse passer un seul appel de test (half_open) :
+    un succès le referme, un échec le rouvre.
+    """
+
+    def __init__(self, model: str, failure_threshold: int, open_s: float):
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.open_s = open_s
+        self._lock = threading.Lock()
+        self._state = CIRCUIT_CLOSED
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+        self.open_count = 0
+
+    def before_call(self) -> None:
+        """Autorise un appel ou lève CircuitOpenError."""
+        with self._lock:
+            if self._state == CIRCUIT_CLOSED:
+                return
+            elapsed = time.monotonic() - self._opened_at
+            if self._state == CIRCUIT_OPEN and elapsed >= self.open_s:
+                self._state = CIRCUIT_HALF_OPEN
+                self._probe_in_flight = False
+            if self._state == CIRCUIT_HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                logger.info("Disjoncteur %s semi-ouvert : appel de test", self.model)
+                return
+            raise CircuitOpenError(self.model, max(self.open_s - elapsed, 0.0))
+
+    def record_success(self) -> None:
+        """L'API a répondu (même avec une réponse invalide) : le modèle est sain."""
+        with self._lock:
+            if self._state != CIRCUIT_CLOSED:
+                logger.info("Disjoncteur %s refermé", self.model)
+            self._state = CIRCUIT_CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        """Erreur transitoire : ouvre le disjoncteur au seuil (ou immédiatement si appel de test)."""
+        with self._lock:
+            self._failures += 1
+            if self._state == CIRCUIT_HALF_OPEN or (
+                self._state == CIRCUIT_CLOSED and self._failures >= self.failure_threshold
+            ):
+                self._state = CIRCUIT_OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+                self.open_count += 1
+                logger.warning(
+                    "Disjoncteur %s ouvert après %d erreur(s) transitoire(s) consécutive(s)",
+                    self.model,
+                    self._failures,
+                )
+
+    def release_probe(self) -> None:
+        """Appel de test terminé sans verdict (annulé, erreur non transitoire)."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def state(self) -> dict:
+        """État exposé par /health."""
+        with self._lock:
+            state = self._state
+            if state == CIRCUIT_OPEN and time.monotonic() - self._opened_at >= self.open_s:
+                state = CIRCUIT_HALF_OPEN
+            return {
+                "state": state,
+                "consecutive_failures": self._failures,
+                "open_count": self.open_count,
+                "retry_in_s": (
+                    round(max(self.open_s - (time.monotonic() - self._opened_at), 0.0), 1)
+                    if state == CIRCUIT_OPEN
+                    else None
+                ),
+            }
+
+
+_breakers_lock = threading.Lock()
+_breakers: dict[str, CircuitBreaker] = {}
+
+
+def get_circuit_breaker(model: str, settings: Optional[Settings] = None) -> CircuitBreaker:
+    """Retourne le disjoncteur process-wide du modèle (créé au premier appel)."""
+    with _breakers_lock:
+        breaker = _breakers.get(model)
+        if breaker is None:
+            settings = settings or get_settings()
+            breaker = CircuitBreaker(model, settings.circuit_failure_threshold, settings.circuit_open_s)
+            _breakers[model] = breaker
+        return breaker
+
+
+def circuit_breaker_states() -> dict:
+    """États des disjoncteurs, par modèle."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.model: breaker.state() for breaker in breakers}
+
+
+def reset_circuit_breakers() -> None:
+    """Oublie tous les disjoncteurs (tests, reload_settings())."""
+    with _breakers_lock:
+        _breakers.clear()
+
+
+async def call_with_retries(call, model: str, settings: Settings, deadline: Optional[Deadline] = None):
+    """
+    Exécute call() (coroutine d'un appel LLM sur model) sous le disjoncteur du modèle, en retentant
+    les erreurs transitoires jusqu'à llm_transient_retries fois avec backoff exponentiel et jitter.
+    Les erreurs de validation et permanentes sont propagées immédiatement, de même qu'une erreur
+    transitoire dont le délai de nouvel essai dépasserait l'échéance de la requête.
+    """
+    breaker = get_circuit_breaker(model, settings)
+    retry = 0
+    while True:
+        breaker.before_call()
+        try:
+            result = await call()
+        except BaseException as e:
+            kind = classify_error(e) if isinstance(e, Exception) else None
+            if kind == ERROR_VALIDATION:
+                breaker.record_success()
+            elif kind == ERROR_TRANSIENT and not isinstance(e, (RateLimitQueueTimeout, DeadlineExceeded)):
+                breaker.record_failure()
+            else:
+                breaker.release_probe()
+            if not isinstance(e, Exception) or not is_retryable(e) or retry >= settings.llm_transient_retries:
+                raise
+            delay = backoff_delay(retry, settings, error_retry_after(e))
+            if deadline is not None and delay >= deadline.remaining():
+                raise
+            logger.warning(
+                "Erreur transitoire avec %s (%s) : nouvel essai %d/%d dans %.2fs",
+                model,
+                e,
+                retry + 1,
+                settings.llm_transient_retries,
+                delay,
+            )
+            retry += 1
+            with start_span("backoff", model=model, retry=retry, error_type=type(e).__name__):
+                await asyncio.sleep(delay)
+            continue
+        breaker.record_success()
+        return result
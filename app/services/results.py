@@ -0,0 +1,367 @@
+"""
+Base des résultats d'extraction (SQLite, mode WAL), interrogée par GET /api/v1/extractions.
+Remplace le CSV en ajout seul : chaque extraction garde ses données complètes (InvoiceData, lignes de
+détail comprises) et les colonnes de recherche sont indexées (IFU fournisseur, numéro de facture,
+date, empreinte du fichier). Les insertions sont regroupées par lots dans une transaction par un
+thread d'arrière-plan ; la pagination se fait par curseur (keyset) : une page coûte un parcours
+d'index borné par sa taille, quel que soit le nombre de factures.
+"""
+
+import atexit
+import json
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+from app.core.config import Settings, get_settings
+from app.monitoring.writer import BatchingWriter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESULTS_DB = Path(__file__).parent.parent.parent / "resultats" / "results.sqlite3"
+
+# Statut d'une extraction enregistrée
+RESULT_SUCCESS = "success"
+RESULT_ERROR = "error"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS extractions (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    filename TEXT NOT NULL,
+    content_hash TEXT,
+    status TEXT NOT NULL,
+    needs_human_review INTEGER NOT NULL,
+    locally_repaired INTEGER NOT NULL DEFAULT 0,
+    fournisseur TEXT,
+    numero_facture TEXT,
+    invoice_date TEXT,
+    montant_ht REAL,
+    montant_tva REAL,
+    montant_ttc REAL,
+    devise TEXT,
+    ifu_fournisseur TEXT,
+    code_mecef TEXT,
+    confiance REAL,
+    nombre_lignes INTEGER NOT NULL DEFAULT 0,
+    data TEXT,
+    error_message TEXT,
+    trace_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_extractions_ifu ON extractions (ifu_fournisseur);
+CREATE INDEX IF NOT EXISTS idx_extractions_numero ON extractions (numero_facture);
+CREATE INDEX IF NOT EXISTS idx_extractions_date ON extractions (invoice_date);
+CREATE INDEX IF NOT EXISTS idx_extractions_hash ON extractions (content_hash);
+"""
+
+_INSERT_COLUMNS = (
+    "created_at",
+    "filename",
+    "content_hash",
+    "status",
+    "needs_human_review",
+    "locally_repaired",
+    "fournisseur",
+    "numero_facture",
+    "invoice_date",
+    "montant_ht",
+    "montant_tva",
+    "montant_ttc",
+    "devise",
+    "ifu_fournisseur",
+    "code_mecef",
+    "confiance",
+    "nombre_lignes",
+    "data",
+    "error_message",
+    "trace_id",
+)
+_INSERT_SQL = (
+    f"INSERT INTO extractions ({', '.join(_INSERT_COLUMNS)}) "
+    f"VALUES ({', '.join('?' for _ in _INSERT_COLUMNS)})"
+)
+# Colonnes d'une ligne de résultat de recherche (sans le JSON complet)
+_SUMMARY_COLUMNS = ("id",) + tuple(column for column in _INSERT_COLUMNS if column != "data")
+
+
+def _row_to_dict(row: sqlite3.Row, with_data: bool = False) -> dict:
+    item = {column: row[column] for column in _SUMMARY_COLUMNS}
+    item["created_at"] = datetime.fromtimestamp(row["created_at"]).isoformat()
+    item["date"] = item.pop("invoice_date")
+    item["needs_human_review"] = bool(item["needs_human_review"])
+    item["locally_repaired"] = bool(item["locally_repaired"])
+    if with_data:
+        item["data"] = json.loads(row["data"]) if row["data"] else None
+    return item
+
+
+def encode_cursor(item: dict, by_date: bool) -> str:
+    """Curseur opaque de la page suivante : id, précédé de la date de facture en tri par date."""
+    return f"{item['date'] or ''}|{item['id']}" if by_date else str(item["id"])
+
+
+def _decode_cursor(cursor: str, by_date: bool) -> tuple:
+    try:
+        if by_date:
+            date, _, extraction_id = cursor.rpartition("|")
+            return date, int(extraction_id)
+        return (int(cursor),)
+    except ValueError:
+        raise ValueError(f"Curseur invalide : {cursor!r}") from None
+
+
+class ResultStore(BatchingWriter):
+    """Stockage SQLite (mode WAL) des résultats, partagé par l'API et les processus workers."""
+
+    thread_name = "results-writer"
+
+    def __init__(
+        self,
+        db_path: Path,
+        *,
+        background: bool = True,
+        queue_size: int = 10000,
+        batch_size: int = 256,
+        flush_interval_s: float = 1.0,
+    ):
+        """
+        Args:
+            db_path: Fichier SQLite (créé si absent).
+            background: Insère par lots depuis un thread ; sinon chaque résultat est inséré par l'appelant.
+        """
+        self.db_path = Path(db_path)
+        self._local = threading.local()
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._connect().executescript(_SCHEMA)
+        super().__init__(
+            background=background,
+            queue_size=queue_size,
+            batch_size=batch_size,
+            flush_interval_s=flush_interval_s,
+        )
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "ResultStore":
+        """Construit le store à partir des settings (mise en lots : réglages log_writer_*)."""
+        db_path = Path(settings.results_db_path) if settings.results_db_path else DEFAULT_RESULTS_DB
+        return cls(
+            db_path,
+            background=settings.log_writer_background,
+            queue_size=settings.log_writer_queue_size,
+            batch_size=settings.log_writer_batch_size,
+            flush_interval_s=settings.log_writer_flush_interval_s,
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        """Connexion par thread (sqlite3 n'autorise pas le partage entre threads)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def save(
+        self,
+        filename: str,
+        data: Optional[dict[str, Any]],
+        needs_human_review: bool,
+        *,
+        error_message: Optional[str] = None,
+        locally_repaired: bool = False,
+        content_hash: Optional[str] = None,
+        trace_id: Optional[str] = None,
+    ) -> None:
+        """Enregistre le résultat d'une extraction (data : InvoiceData.model_dump(), None si échec)."""
+        fields = data or {}
+        self._submit(
+            (
+                time.time(),
+                filename,
+                content_hash,
+                RESULT_SUCCESS if data is not None else RESULT_ERROR,
+                int(needs_human_review),
+                int(locally_repaired),
+                fields.get("fournisseur"),
+                fields.get("numero_facture"),
+                fields.get("date"),
+                fields.get("montant_ht"),
+                fields.get("montant_tva"),
+                fields.get("montant_ttc"),
+                fields.get("devise"),
+                fields.get("ifu_fournisseur"),
+                fields.get("code_mecef"),
+                fields.get("confiance"),
+                len(fields.get("lignes_detail") or []),
+                json.dumps(data, ensure_ascii=False) if data is not None else None,
+                error_message,
+                trace_id,
+            )
+        )
+
+    def _write_batch(self, rows: list[tuple]) -> None:
+        """Insère le lot en une transaction (un seul verrou d'écriture et un seul commit WAL)."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(_INSERT_SQL, rows)
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            self.errors += 1
+            logger.error("Enregistrement de %d résultat(s) dans %s impossible : %s", len(rows), self.db_path, e)
+            return
+        self.written += len(rows)
+        self.batches += 1
+
+    def get(self, extraction_id: int) -> Optional[dict]:
+        """Résultat complet (données facture et lignes de détail) ou None."""
+        row = self._connect().execute("SELECT * FROM extractions WHERE id = ?", (extraction_id,)).fetchone()
+        return _row_to_dict(row, with_data=True) if row else None
+
+    def build_query(
+        self,
+        *,
+        ifu_fournisseur: Optional[str] = None,
+        numero_facture: Optional[str] = None,
+        content_hash: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        needs_human_review: Optional[bool] = None,
+        status: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> tuple[str, list, bool]:
+        """
+        (requête SQL, paramètres, tri par date) d'une recherche paginée.
+        Tri par id décroissant (dernières extractions d'abord) ; avec un filtre de date sans filtre
+        d'égalité, tri par date de facture décroissante pour parcourir l'index des dates sans tri.
+        Lève ValueError si le curseur est invalide.
+        """
+        clauses: list[str] = []
+        params: list = []
+        for column, value in (
+            ("ifu_fournisseur", ifu_fournisseur),
+            ("numero_facture", numero_facture),
+            ("content_hash", content_hash),
+        ):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        by_date = not clauses and (date_from is not None or date_to is not None)
+        if date_from is not None:
+            clauses.append("invoice_date >= ?")
+            params.append(date_from)
+        if date_to is not None:
+            clauses.append("invoice_date <= ?")
+            params.append(date_to)
+        if needs_human_review is not None:
+            clauses.append("needs_human_review = ?")
+            params.append(int(needs_human_review))
+        if status is not None:
+            clauses.append("status = ?")
+            params.append(status)
+        if cursor is not None:
+            position = _decode_cursor(cursor, by_date)
+            clauses.append("(invoice_date, id) < (?, ?)" if by_date else "id < ?")
+            params.extend(position)
+
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        order = "invoice_date DESC, id DESC" if by_date else "id DESC"
+        sql = f"SELECT {', '.join(_SUMMARY_COLUMNS)} FROM extractions{where} ORDER BY {order}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return sql, params, by_date
+
+    def query(self, *, limit: int = 50, **filters) -> tuple[list[dict], Optional[str]]:
+        """
+        Une page de résultats (sans le JSON complet) et le curseur de la page suivante (None : dernière page).
+        Filtres : voir build_query.
+        """
+        sql, params, by_date = self.build_query(limit=limit + 1, **filters)
+        rows = self._connect().execute(sql, params).fetchall()
+        items = [_row_to_dict(row) for row in rows[:limit]]
+        next_cursor = encode_cursor(items[-1], by_date) if len(rows) > limit else None
+        return items, next_cursor
+
+    def iter_export(self, *, page_size: int = 500, cursor: Optional[str] = None, **filters) -> Iterator[list[dict]]:
+        """
+        Pages successives d'une recherche, jusqu'à la dernière : la mémoire reste bornée par page_size
+        quel que soit le nombre de lignes exportées. Chaque ligne porte son curseur ("cursor") :
+        un export interrompu reprend avec le curseur de la dernière ligne reçue.
+        """
+        while True:
+            sql, params, by_date = self.build_query(cursor=cursor, limit=page_size, **filters)
+            items = [_row_to_dict(row) for row in self._connect().execute(sql, params).fetchall()]
+            for item in items:
+                item["cursor"] = encode_cursor(item, by_date)
+            if items:
+                yield items
+            if len(items) < page_size:
+                return
+            cursor = items[-1]["cursor"]
+
+    def stats(self) -> dict:
+        """Compteurs exposés par /kpi."""
+        return {
+            "background": self.background,
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "overflow_writes": self.overflow_writes,
+            "errors": self.errors,
+        }
+
+    def close(self, timeout: Optional[float] = 10.0) -> None:
+        """Insère les résultats en attente puis ferme la connexion du thread appelant."""
+        if not self._stop(timeout):
+            return
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+_result_store: Optional[ResultStore] = None
+_result_store_lock = threading.Lock()
+
+
+def get_result_store() -> ResultStore:
+    """Retourne le store process-wide (construit depuis les settings au premier appel)."""
+    global _result_store
+    with _result_store_lock:
+        if _result_store is None:
+            _result_store = ResultStore.from_settings(get_settings())
+        return _result_store
+
+
+def close_result_store() -> None:
+    """Insère les résultats en file et ferme le store (arrêt de l'application, fin de processus)."""
+    global _result_store
+    with _result_store_lock:
+        store, _result_store = _result_store, None
+    if store is not None:
+        store.close()
+
+
+def reset_result_store(store: Optional[ResultStore] = None) -> None:
+    """Ferme le store courant et le remplace (None : reconstruit depuis les settings au prochain appel)."""
+    global _result_store
+    close_result_store()
+    with _result_store_lock:
+        _result_store = store
+
+
+# Processus sans hook d'arrêt (worker, scripts) : les résultats en file sont insérés à la sortie
+atexit.register(close_result_store)
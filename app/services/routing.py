@@ -0,0 +1,288 @@
+"""
+Routage prédictif du point de départ de la cascade.
+Certaines factures (fournisseurs, scans volumineux, documents multi-pages...) finissent presque
+toujours sur le modèle lourd après des tentatives light inutiles. Le routeur estime, à partir de
+l'historique kpi.jsonl et de caractéristiques connues avant tout appel LLM, la probabilité que le
+modèle light échoue, et fait démarrer la cascade directement sur le modèle lourd au-delà d'un seuil.
+Une petite part des documents prédits difficiles reste envoyée au modèle light (exploration)
+pour mesurer le taux de réussite des prédictions.
+"""
+
+import hashlib
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterable, Optional
+
+from app.core.config import Settings, get_settings
+from app.monitoring.kpi import kpi_tracker
+from app.monitoring.tail import JsonlTail
+from app.services.preprocessing import PreparedDocument
+
+logger = logging.getLogger(__name__)
+
+# En-tête du document parcouru pour reconnaître un fournisseur connu (chemin texte)
+_HEADER_LINES = 15
+# Colonnes de la mise en page pdftotext -layout : séparées par 2 espaces ou plus
+_LAYOUT_COLUMNS = re.compile(r"\s{2,}")
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+
+def _normalize_supplier(name: str) -> str:
+    """Nom de fournisseur normalisé (minuscules, alphanumérique) pour le hachage."""
+    return _NON_ALNUM.sub(" ", name.lower()).strip()
+
+
+def supplier_hash(name: Optional[str]) -> Optional[str]:
+    """Empreinte courte d'un nom de fournisseur (None si vide)."""
+    normalized = _normalize_supplier(name or "")
+    if not normalized:
+        return None
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:12]
+
+
+def text_supplier_candidates(text: Optional[str]) -> list[str]:
+    """Empreintes des segments de l'en-tête du texte : l'une d'elles est souvent le nom du fournisseur."""
+    if not text:
+        return []
+    lines = [line for line in text.splitlines() if line.strip() and not line.startswith("--- Page")]
+    hashes = []
+    for line in lines[:_HEADER_LINES]:
+        for segment in _LAYOUT_COLUMNS.split(line.strip()):
+            value = supplier_hash(segment)
+            if value is not None:
+                hashes.append(value)
+    return hashes
+
+
+def _page_bucket(page_count: Optional[int]) -> str:
+    if not page_count or page_count <= 1:
+        return "1"
+    return "2-3" if page_count <= 3 else "4+"
+
+
+def _size_bucket(bytes_in: Optional[int]) -> str:
+    if not bytes_in or bytes_in < 200_000:
+        return "<200k"
+    return "<1M" if bytes_in < 1_000_000 else ">=1M"
+
+
+def _feature_keys(input_mode: Optional[str], page_count: Optional[int], bytes_in: Optional[int]) -> list[tuple]:
+    """Clés de statistiques, de la plus spécifique à la plus générale."""
+    mode = input_mode or "vision"
+    return [
+        ("mode_pages_size", mode, _page_bucket(page_count), _size_bucket(bytes_in)),
+        ("mode_pages", mode, _page_bucket(page_count)),
+        ("mode", mode),
+    ]
+
+
+@dataclass
+class RouteFeatures:
+    """Caractéristiques d'un document disponibles avant tout appel LLM."""
+
+    input_mode: str
+    page_count: int
+    bytes_in: int
+    supplier_hashes: list[str] = field(default_factory=list)
+    """Empreintes candidates du fournisseur (chemin texte uniquement)."""
+
+    @classmethod
+    def from_document(cls, prepared: PreparedDocument) -> "RouteFeatures":
+        return cls(
+            input_mode=prepared.input_mode,
+            page_count=prepared.page_count,
+            bytes_in=prepared.bytes_in,
+            supplier_hashes=text_supplier_candidates(prepared.text),
+        )
+
+
+@dataclass
+class RouteDecision:
+    """Décision de routage pour une extraction."""
+
+    start_model: str
+    p_hard: Optional[float] = None
+    """Probabilité estimée d'échec du modèle light (None : historique insuffisant)."""
+    predicted_hard: bool = False
+    explored: bool = False
+    """True si le document, prédit difficile, est tout de même envoyé au modèle light (mesure)."""
+    basis: Optional[str] = None
+    """Statistique utilisée pour la prédiction (ex : "supplier", "mode_pages")."""
+
+    @property
+    def start_heavy(self) -> bool:
+        return self.predicted_hard and not self.explored
+
+
+class ModelRouter:
+    """
+    Estimateur de difficulté appris sur kpi.jsonl (taux d'échec light lissé, par caractéristique).
+    Le fichier est suivi comme un journal : chaque réapprentissage n'intègre que les lignes ajoutées
+    depuis le précédent, dans une fenêtre glissante des routing_history_max dernières extractions.
+    """
+
+    def __init__(self, kpi_file: Path, settings: Optional[Settings] = None):
+        self.kpi_file = Path(kpi_file)
+        self.settings = settings or get_settings()
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._counts: dict[tuple, list[int]] = {}
+        self._window: deque[tuple[list[tuple], bool]] = deque()
+        self._fitted_at: Optional[float] = None
+        self._tail = JsonlTail(self.kpi_file)
+
+    def _is_hard(self, record: dict) -> bool:
+        """Le modèle light n'a pas suffi : fallback vers le modèle lourd ou échec."""
+        return record.get("final_model_used") == self.settings.llm_model_heavy or not record.get("success", False)
+
+    def _sample(self, record: dict) -> Optional[tuple[list[tuple], bool]]:
+        """Clés de statistiques et issue d'une extraction (None si elle n'est pas informative)."""
+        # Seules les extractions ayant réellement commencé sur le modèle light sont informatives
+        if record.get("cache_hit") or record.get("coalesced") or not record.get("llm_call_count"):
+            return None
+        if record.get("route_start_model") == self.settings.llm_model_heavy:
+            return None
+        keys = _feature_keys(record.get("input_mode"), record.get("page_count"), record.get("image_bytes_in"))
+        if record.get("supplier_hash"):
+            keys.append(("supplier", record["supplier_hash"]))
+        return keys, self._is_hard(record)
+
+    def _add_samples(self, records: Iterable[dict], *, replace: bool = False) -> int:
+        """
+        Ajoute des extractions à la fenêtre glissante (les plus anciennes en sortent) ; retourne leur nombre.
+        replace=True remplace l'historique appris.
+        """
+        samples = [sample for sample in map(self._sample, records) if sample is not None]
+        with self._lock:
+            if replace:
+                self._counts = {}
+                self._window.clear()
+            for keys, hard in samples:
+                self._window.append((keys, hard))
+                for key in keys:
+                    counts = self._counts.setdefault(key, [0, 0])
+                    counts[0] += 1
+                    counts[1] += hard
+            while len(self._window) > self.settings.routing_history_max:
+                keys, hard = self._window.popleft()
+                for key in keys:
+                    counts = self._counts[key]
+                    counts[0] -= 1
+                    counts[1] -= hard
+                    if not counts[0]:
+                        del self._counts[key]
+        return len(samples)
+
+    def fit(self, records: Iterable[dict]) -> None:
+        """(Ré)apprend les taux d'échec light à partir d'enregistrements KPI (remplace l'historique)."""
+        self._add_samples(records, replace=True)
+        with self._lock:
+            self._fitted_at = time.monotonic()
+            samples = len(self._window)
+        logger.info("Routeur de modèles réentraîné sur %d extraction(s)", samples)
+
+    def _read_new_records(self) -> list[dict]:
+        """
+        Extractions ajoutées à kpi.jsonl depuis la lecture précédente. Un fichier remplacé ou tronqué
+        (rotation) est relu depuis le début ; l'historique déjà appris est conservé.
+        """
+        records: deque = deque(maxlen=self.settings.routing_history_max)
+        for raw in self._tail.read_new():
+            try:
+                records.append(json.loads(raw))
+            except json.JSONDecodeError:
+                continue
+        return list(records)
+
+    def refresh_if_stale(self) -> None:
+        """
+        Intègre les nouvelles lignes de kpi.jsonl si le dernier apprentissage date de plus de
+        routing_refresh_s. Un seul thread réapprend à la fois ; les autres décident sur le modèle courant.
+        """
+        with self._lock:
+            fitted_at = self._fitted_at
+        if fitted_at is not None and time.monotonic() - fitted_at <= self.settings.routing_refresh_s:
+            return
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            added = self._add_samples(self._read_new_records())
+            with self._lock:
+                self._fitted_at = time.monotonic()
+            if added:
+                logger.info("Routeur de modèles : %d nouvelle(s) extraction(s) apprise(s)", added)
+        finally:
+            self._refresh_lock.release()
+
+    def predict(self, features: RouteFeatures) -> tuple[Optional[float], Optional[str]]:
+        """
+        Probabilité d'échec du modèle light (lissage de Laplace) sur la statistique la plus
+        spécifique disposant d'au moins routing_min_samples extractions.
+        """
+        min_samples = self.settings.routing_min_samples
+        with self._lock:
+            supplier_counts = [self._counts[("supplier", h)] for h in features.supplier_hashes if ("supplier", h) in self._counts]
+            candidates = [("supplier", max(supplier_counts, key=lambda c: c[0]))] if supplier_counts else []
+            for key in _feature_keys(features.input_mode, features.page_count, features.bytes_in):
+                if key in self._counts:
+                    candidates.append((key[0], self._counts[key]))
+
+        for basis, (total, hard) in candidates:
+            if total >= min_samples:
+                return (hard + 1) / (total + 2), basis
+        return None, None
+
+    def decide(self, features: RouteFeatures) -> RouteDecision:
+        """Choisit le modèle de départ de la cascade pour un document."""
+        self.refresh_if_stale()
+        p_hard, basis = self.predict(features)
+        predicted_hard = p_hard is not None and p_hard >= self.settings.routing_threshold
+        explored = predicted_hard and random.random() < self.settings.routing_exploration_rate
+        decision = RouteDecision(
+            start_model=self.settings.llm_model_heavy if predicted_hard and not explored else self.settings.llm_model_light,
+            p_hard=round(p_hard, 3) if p_hard is not None else None,
+            predicted_hard=predicted_hard,
+            explored=explored,
+            basis=basis,
+        )
+        logger.info(
+            "Routage : départ %s (p_échec_light=%s, base=%s%s)",
+            decision.start_model,
+            decision.p_hard,
+            basis,
+            ", exploration" if explored else "",
+        )
+        return decision
+
+    def stats(self) -> dict:
+        """Taille de l'historique appris et âge du modèle."""
+        with self._lock:
+            return {
+                "samples": len(self._window),
+                "keys": len(self._counts),
+                "fitted_age_s": round(time.monotonic() - self._fitted_at, 1) if self._fitted_at is not None else None,
+            }
+
+
+_model_router: Optional[ModelRouter] = None
+
+
+def get_model_router() -> ModelRouter:
+    """Retourne le routeur process-wide (historique : fichier KPI du tracker)."""
+    global _model_router
+    if _model_router is None:
+        _model_router = ModelRouter(kpi_tracker.kpi_file)
+    return _model_router
+
+
+def reset_model_router(router: Optional[ModelRouter] = None) -> None:
+    """Remplace le routeur process-wide (None : reconstruit au prochain appel)."""
+    global _model_router
+    _model_router = router
@@ -0,0 +1,177 @@
+"""
+Worker d'extraction : consomme la file de jobs SQLite alimentée par POST /api/v1/jobs.
+Lancement : python -m app.worker [--processes N] [--concurrency C]
+Plusieurs workers (processus, hôtes partageant le fichier) peuvent tourner en parallèle :
+la prise d'un job est atomique et protégée par un bail.
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import Settings, get_settings
+from app.monitoring.tracing import start_span
+from app.services.extraction_service import DocumentConversionError, extract_document
+from app.services.jobs import Job, JobStore, get_job_store
+from app.services.openai_clients import close_openai_clients
+from app.services.resilience import ERROR_TRANSIENT
+from app.services.pdf import shutdown_render_pool
+
+logger = logging.getLogger(__name__)
+
+
+def _job_result(job_result) -> dict:
+    """Résultat d'extraction sérialisable (même forme que la réponse de /extract)."""
+    if job_result.data is not None:
+        return {
+            "data": job_result.data.model_dump(),
+            "needs_human_review": job_result.needs_human_review,
+            "error_message": job_result.error_message,
+            "locally_repaired": job_result.locally_repaired,
+        }
+    return {"data": None, "needs_human_review": True, "error_message": job_result.error_message}
+
+
+async def _heartbeat(store: JobStore, job: Job, worker_id: str, lease_s: float) -> None:
+    """Renouvelle le bail du job tant que l'extraction est en cours."""
+    while True:
+        await asyncio.sleep(lease_s / 3)
+        if not await run_in_threadpool(store.heartbeat, job.id, worker_id, lease_s):
+            logger.warning("Bail perdu pour le job %s", job.id)
+            return
+
+
+async def process_job(store: JobStore, job: Job, worker_id: str, settings: Settings) -> None:
+    """Exécute l'extraction d'un job et enregistre son résultat (ou son échec)."""
+    heartbeat = asyncio.create_task(_heartbeat(store, job, worker_id, settings.jobs_lease_s))
+    try:
+        # Pas de requête HTTP : le job est la racine de la trace (X-Request-ID = identifiant du job)
+        with start_span("job", request_id=job.id, **{"job.id": job.id, "job.attempts": job.attempts}):
+            result = await extract_document(job.content, job.content_type, job.filename, settings=settings)
+    except DocumentConversionError as e:
+        # Fichier inexploitable : relancer ne changera rien
+        await run_in_threadpool(store.fail, job.id, worker_id, str(e))
+    except Exception as e:
+        logger.exception("Job %s en erreur (tentative %d)", job.id, job.attempts)
+        await run_in_threadpool(store.fail, job.id, worker_id, f"Erreur inattendue : {e}", True)
+    else:
+        if result.data is None and result.error_kind == ERROR_TRANSIENT and job.attempts < store.max_attempts:
+            # Échec transitoire (5xx / timeout épuisés, disjoncteur ouvert) : le job est remis en file
+            logger.warning("Job %s : échec transitoire (tentative %d), remis en file", job.id, job.attempts)
+            await run_in_threadpool(
+                store.fail, job.id, worker_id, f"{result.error_type} : {result.error_message}", True
+            )
+            return
+        await run_in_threadpool(store.complete, job.id, worker_id, _job_result(result))
+        # Depuis la soumission d'origine : started_at est réécrit à chaque reprise du job
+        logger.info(
+            "Job %s terminé %.0f ms après sa soumission (%d tentative(s))",
+            job.id,
+            (time.time() - job.created_at) * 1000,
+            job.attempts,
+        )
+    finally:
+        heartbeat.cancel()
+
+
+async def run_worker(
+    stop: asyncio.Event,
+    *,
+    settings: Optional[Settings] = None,
+    store: Optional[JobStore] = None,
+    concurrency: Optional[int] = None,
+) -> None:
+    """
+    Boucle du worker : prend des jobs tant qu'un slot est libre, jusqu'à ce que stop soit positionné.
+    Les jobs en cours sont menés à terme avant de rendre la main.
+    """
+    settings = settings or get_settings()
+    store = store or get_job_store()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    slots = asyncio.Semaphore(concurrency or settings.worker_concurrency)
+    running: set[asyncio.Task] = set()
+    logger.info("Worker %s démarré (concurrence %d)", worker_id, concurrency or settings.worker_concurrency)
+
+    while not stop.is_set():
+        await slots.acquire()
+        job = await run_in_threadpool(store.lease, worker_id, settings.jobs_lease_s)
+        if job is None:
+            slots.release()
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=settings.worker_poll_interval_s)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        task = asyncio.create_task(process_job(store, job, worker_id, settings))
+        running.add(task)
+        task.add_done_callback(running.discard)
+        task.add_done_callback(lambda _: slots.release())
+
+    if running:
+        logger.info("Arrêt du worker : %d job(s) en cours à terminer", len(running))
+        await asyncio.gather(*running, return_exceptions=True)
+
+
+async def _main(concurrency: Optional[int]) -> None:
+    """Lance le worker et l'arrête proprement sur SIGINT / SIGTERM."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await run_worker(stop, concurrency=concurrency)
+    finally:
+        await close_openai_clients()
+        shutdown_render_pool()
+
+
+def _run_process(concurrency: Optional[int]) -> None:
+    """Point d'entrée d'un processus worker."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+    )
+    asyncio.run(_main(concurrency))
+
+
+def main() -> None:
+    """Point d'entrée CLI : un ou plusieurs processus worker."""
+    parser = argparse.ArgumentParser(description="Worker d'extraction de la file de jobs /api/v1/jobs")
+    parser.add_argument("--processes", type=int, default=1, help="Nombre de processus worker (défaut : 1)")
+    parser.add_argument(
+        "--concurrency", type=int, default=None, help="Extractions simultanées par processus (défaut : WORKER_CONCURRENCY)"
+    )
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        _run_process(args.concurrency)
+        return
+
+    processes = [
+        multiprocessing.Process(target=_run_process, args=(args.concurrency,), name=f"worker-{index}")
+        for index in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    # SIGTERM sur le parent : relayé aux workers, qui terminent leurs jobs en cours
+    signal.signal(signal.SIGTERM, lambda *_: [process.terminate() for process in processes])
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # SIGINT est aussi reçu par les processus enfants, qui terminent leurs jobs en cours
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
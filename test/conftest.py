@@ -3,14 +3,87 @@ Configuration pytest et fixtures partagées pour tous les tests.
 """
 
 import json
+import os
 from pathlib import Path
 from unittest.mock import MagicMock, Mock
 
 import pytest
 
+# Clé fictive pour les settings chargés via get_settings() (routes, cache)
+os.environ.setdefault("OPENAI_API_KEY", "sk-test-key-12345")
+
 from app.core.config import Settings
 from app.models.schemas import InvoiceData, LigneDetail
 from app.models.constants import MathValidationError
+from app.monitoring.kpi import reset_current_kpi_tracker
+from app.monitoring.tracing import Tracer, reset_tracer
+from app.monitoring.writer import RecordWriter, reset_record_writer
+from app.services.cache import ExtractionCache, reset_extraction_cache
+from app.services.jobs import JobStore, reset_job_store
+from app.services.preprocessing import PreparedImage
+from app.services.resilience import reset_circuit_breakers
+from app.services.results import ResultStore, reset_result_store
+
+
+@pytest.fixture(autouse=True)
+def extraction_cache(tmp_path):
+    """Cache d'extraction isolé par test (disque dans tmp_path, jamais resultats/cache)."""
+    cache = ExtractionCache(max_entries=16, ttl_s=3600, disk_dir=tmp_path / "cache")
+    reset_extraction_cache(cache)
+    yield cache
+    reset_extraction_cache()
+
+
+@pytest.fixture(autouse=True)
+def job_store(tmp_path):
+    """File de jobs isolée par test (SQLite dans tmp_path, jamais resultats/jobs.sqlite3)."""
+    store = JobStore(tmp_path / "jobs.sqlite3", max_attempts=2)
+    reset_job_store(store)
+    yield store
+    reset_job_store()
+
+
+@pytest.fixture(autouse=True)
+def circuit_breakers():
+    """Disjoncteurs neufs pour chaque test (l'état est process-wide)."""
+    reset_circuit_breakers()
+    yield
+    reset_circuit_breakers()
+
+
+@pytest.fixture(autouse=True)
+def record_writer():
+    """Écrivain synchrone : les lignes KPI / CSV sont sur disque dès le retour de l'appel."""
+    writer = RecordWriter(background=False)
+    reset_record_writer(writer)
+    yield writer
+    reset_record_writer()
+
+
+@pytest.fixture(autouse=True)
+def result_store(tmp_path):
+    """Base des résultats isolée par test (SQLite dans tmp_path), insertions synchrones."""
+    store = ResultStore(tmp_path / "results.sqlite3", background=False)
+    reset_result_store(store)
+    yield store
+    reset_result_store()
+
+
+@pytest.fixture(autouse=True)
+def tracer(tmp_path):
+    """Traceur isolé par test : toutes les traces exportées dans tmp_path (jamais resultats/traces.jsonl)."""
+    tracer = Tracer(sample_rate=1.0, trace_file=tmp_path / "traces.jsonl")
+    reset_tracer(tracer)
+    yield tracer
+    reset_tracer()
+
+
+@pytest.fixture(autouse=True)
+def kpi_context():
+    """Aucune extraction en cours au début de chaque test (le tracker est porté par le contexte)."""
+    reset_current_kpi_tracker()
+    yield
+    reset_current_kpi_tracker()
 
 
 @pytest.fixture
@@ -146,6 +219,19 @@ def test_image_base64():
     return "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
 
 
+@pytest.fixture
+def prepared_image(test_image_base64):
+    """Fixture pour une image prétraitée (page d'un PreparedDocument)."""
+    return PreparedImage(
+        base64=test_image_base64,
+        mime_type="image/png",
+        width=1,
+        height=1,
+        bytes_in=68,
+        bytes_out=68,
+    )
+
+
 @pytest.fixture
 def temp_csv_file(tmp_path):
     """Fixture pour un fichier CSV temporaire pour les tests."""
@@ -0,0 +1,154 @@
+"""
+Tests unitaires pour les agrégats KPI incrémentaux (aggregates.py).
+"""
+
+import json
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.monitoring.aggregates import KPIAggregates, QuantileSketch
+
+
+def _kpi(duration_ms: float, model: str = "gpt-4o-mini", success: bool = True, age_s: float = 0, **extra) -> dict:
+    return {
+        "timestamp": (datetime.now() - timedelta(seconds=age_s)).isoformat(),
+        "filename": "facture.pdf",
+        "total_duration_ms": duration_ms,
+        "llm_call_count": 1,
+        "final_model_used": model,
+        "success": success,
+        "needs_human_review": not success,
+        **extra,
+    }
+
+
+def _append(path, *kpis: dict, partial: str = "") -> None:
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("".join(json.dumps(k) + "\n" for k in kpis) + partial)
+
+
+@pytest.mark.unit
+class TestQuantileSketch:
+    """Tests pour le sketch de quantiles."""
+
+    def test_quantiles_within_relative_accuracy(self):
+        """Test que p50 / p95 / p99 restent à moins de 1 % des valeurs exactes."""
+        values = [random.uniform(100, 60000) for _ in range(20000)]
+        sketch = QuantileSketch(relative_accuracy=0.01)
+        for value in values:
+            sketch.add(value)
+
+        ordered = sorted(values)
+        for p in (50, 95, 99):
+            exact = ordered[int(p / 100 * len(ordered)) - 1]
+            assert sketch.quantile(p) == pytest.approx(exact, rel=0.02)
+
+    def test_merge_equals_single_sketch(self):
+        """Test que la fusion de deux sketches donne les mêmes quantiles qu'un sketch unique."""
+        left, right, whole = QuantileSketch(), QuantileSketch(), QuantileSketch()
+        for value in range(1, 1001):
+            (left if value % 2 else right).add(value)
+            whole.add(value)
+
+        left.merge(right)
+
+        assert left.count == whole.count == 1000
+        assert [left.quantile(p) for p in (50, 95, 99)] == [whole.quantile(p) for p in (50, 95, 99)]
+
+    def test_empty_sketch(self):
+        """Test qu'un sketch vide n'a pas de quantile."""
+        assert QuantileSketch().quantile(50) is None
+
+
+@pytest.mark.unit
+class TestKPIAggregates:
+    """Tests pour les agrégats suivis sur kpi.jsonl."""
+
+    def test_empty_history(self, tmp_path):
+        """Test que l'absence de fichier donne des statistiques vides."""
+        aggregates = KPIAggregates(tmp_path / "kpi.jsonl")
+
+        assert aggregates.refresh() == 0
+        assert aggregates.stats()["total"] == 0
+
+    def test_refresh_reads_only_new_complete_lines(self, tmp_path):
+        """Test que seules les lignes ajoutées et complètes sont intégrées à chaque consultation."""
+        path = tmp_path / "kpi.jsonl"
+        aggregates = KPIAggregates(path)
+        _append(path, _kpi(1000), _kpi(3000, model="gpt-4o", success=False))
+        assert aggregates.refresh() == 2
+
+        partial = json.dumps(_kpi(2000))
+        _append(path, _kpi(5000), partial=partial[:10])
+        assert aggregates.refresh() == 1
+        _append(path, partial=partial[10:] + "\n")
+        assert aggregates.refresh() == 1
+        assert aggregates.refresh() == 0
+
+        stats = aggregates.stats()
+        assert stats["total_extractions"] == 4
+        assert stats["success_rate"] == 75.0
+        assert stats["avg_duration_ms"] == 2750.0
+        assert (stats["min_duration_ms"], stats["max_duration_ms"]) == (1000, 5000)
+        assert stats["latency_by_model"]["gpt-4o"]["count"] == 1
+        assert stats["latency_by_model"]["gpt-4o-mini"]["p99_duration_ms"] == pytest.approx(5000, rel=0.01)
+
+    def test_time_windows(self, tmp_path):
+        """Test que les fenêtres 5 min / 1 h / 24 h ne retiennent que les extractions récentes."""
+        path = tmp_path / "kpi.jsonl"
+        _append(path, _kpi(1000), _kpi(2000, age_s=1800), _kpi(4000, age_s=7200), _kpi(8000, age_s=3 * 86400))
+        aggregates = KPIAggregates(path)
+        aggregates.refresh()
+
+        windows = aggregates.stats()["windows"]
+
+        assert windows["5m"]["count"] == 1
+        assert windows["1h"]["count"] == 2
+        assert windows["24h"]["count"] == 3
+        assert windows["5m"]["by_model"]["gpt-4o-mini"]["p50_duration_ms"] == pytest.approx(1000, rel=0.01)
+
+    def test_breakdowns_match_records(self, tmp_path):
+        """Test des ventilations coût, étapes, cascade et routage."""
+        path = tmp_path / "kpi.jsonl"
+        _append(
+            path,
+            _kpi(
+                1000,
+                cost_usd=0.002,
+                prompt_tokens=1000,
+                cached_tokens=500,
+                input_mode="text",
+                stage_ms={"convert": 10.0, "llm": 900.0},
+                llm_attempts=[{"model": "gpt-4o-mini", "prompt_tokens": 1000, "cost_usd": 0.002}],
+                repair_attempted=True,
+                route_start_model="gpt-4o-mini",
+            ),
+            _kpi(2000, success=False, route_start_model="gpt-4o-mini", route_explored=True, route_predicted_hard=True),
+        )
+        aggregates = KPIAggregates(path)
+        aggregates.refresh()
+
+        stats = aggregates.stats()
+
+        assert stats["cost"]["total_usd"] == 0.002
+        assert stats["cost"]["unmetered_count"] == 1
+        assert stats["tokens"]["cached_rate"] == 50.0
+        assert stats["stages"]["llm"]["avg_ms"] == 900.0
+        assert stats["cascade"]["repair_attempted"] == 1
+        assert stats["by_input_mode"]["text"]["count"] == 1
+        assert stats["routing"]["predicted_easy_hit_rate"] == 100.0
+        assert stats["routing"]["predicted_hard_hit_rate"] == 100.0
+
+    def test_truncated_file_is_reloaded(self, tmp_path):
+        """Test qu'un fichier tronqué (rotation) est relu depuis le début."""
+        path = tmp_path / "kpi.jsonl"
+        _append(path, _kpi(1000), _kpi(2000), _kpi(3000))
+        aggregates = KPIAggregates(path)
+        aggregates.refresh()
+
+        path.write_text(json.dumps(_kpi(500)) + "\n")
+        aggregates.refresh()
+
+        assert aggregates.stats()["total_extractions"] == 1
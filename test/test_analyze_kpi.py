@@ -0,0 +1,146 @@
+"""
+Tests unitaires pour l'analyse des KPI en flux (analyze_kpi.py).
+"""
+
+import csv
+import gzip
+import json
+import random
+
+import pytest
+
+import analyze_kpi
+from analyze_kpi import KPIReport
+
+PRICES = {"gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60}}
+
+
+def _kpi(index: int, duration_ms: float = 1000.0, model: str = "gpt-4o-mini", **fields) -> dict:
+    kpi = {
+        "timestamp": f"2025-02-{1 + index % 3:02d}T10:00:00",
+        "filename": f"facture_{index}.pdf",
+        "total_duration_ms": duration_ms,
+        "llm_call_count": 1,
+        "final_model_used": model,
+        "success": True,
+        "needs_human_review": False,
+        "error_type": None,
+    }
+    kpi.update(fields)
+    return kpi
+
+
+def _write(path, kpis, compress=False):
+    opener = gzip.open if compress else open
+    with opener(path, "wt", encoding="utf-8") as f:
+        for kpi in kpis:
+            f.write(json.dumps(kpi) + "\n")
+
+
+@pytest.mark.unit
+class TestKPIFiles:
+    """Tests pour la découverte et la lecture des fichiers tournés."""
+
+    def test_rotated_and_compressed_shards(self, tmp_path):
+        """Test que kpi.jsonl, ses fichiers numérotés et compressés sont lus du plus ancien au plus récent."""
+        kpi_file = tmp_path / "kpi.jsonl"
+        _write(tmp_path / "kpi.jsonl.2.gz", [_kpi(0)], compress=True)
+        _write(tmp_path / "kpi.jsonl.1", [_kpi(1)])
+        _write(kpi_file, [_kpi(2)])
+        (tmp_path / "kpi.jsonl.lock").touch()
+
+        files = analyze_kpi.kpi_files(kpi_file)
+        lines = list(analyze_kpi.iter_lines(files))
+
+        assert [path.name for path in files] == ["kpi.jsonl.2.gz", "kpi.jsonl.1", "kpi.jsonl"]
+        assert [json.loads(line)["filename"] for line in lines] == [f"facture_{i}.pdf" for i in range(3)]
+
+    def test_dated_shards(self, tmp_path):
+        """Test des fichiers datés (logrotate dateext), triés par date."""
+        kpi_file = tmp_path / "kpi.jsonl"
+        _write(tmp_path / "kpi.jsonl-20250202.gz", [_kpi(1)], compress=True)
+        _write(tmp_path / "kpi.jsonl-20250201.gz", [_kpi(0)], compress=True)
+
+        files = analyze_kpi.kpi_files(kpi_file)
+
+        assert [path.name for path in files] == ["kpi.jsonl-20250201.gz", "kpi.jsonl-20250202.gz"]
+
+
+@pytest.mark.unit
+class TestKPIReport:
+    """Tests pour les agrégats en une passe."""
+
+    def test_percentiles_within_sketch_accuracy(self):
+        """Test que les percentiles restent à 1 % des percentiles exacts."""
+        random.seed(7)
+        durations = [random.lognormvariate(7, 0.8) for _ in range(5000)]
+        report = KPIReport()
+        for index, duration in enumerate(durations):
+            report.add(_kpi(index, duration))
+
+        ordered = sorted(durations)
+        for p in (50, 95, 99):
+            exact = ordered[max(1, -(-p * len(ordered) // 100)) - 1]
+            assert report.all.latency.quantile(p) == pytest.approx(exact, rel=0.01)
+
+    def test_model_and_window_breakdowns(self):
+        """Test des ventilations par modèle final et par jour."""
+        report = KPIReport(window="day")
+        report.add(_kpi(0, 1000, "gpt-4o-mini"))
+        report.add(_kpi(1, 3000, "gpt-4o", success=False, error_type="ValidationError"))
+        report.add(_kpi(3, 2000, "gpt-4o-mini", needs_human_review=True))
+
+        assert report.by_model["gpt-4o-mini"].count == 2
+        assert report.by_model["gpt-4o"].successes == 0
+        assert sorted(report.windows) == ["2025-02-01", "2025-02-02"]
+        assert report.windows["2025-02-01"].count == 2
+        assert report.windows["2025-02-01"].reviews == 1
+        assert report.error_types == {"ValidationError": 1}
+        assert list(report.failed_files) == ["facture_1.pdf"]
+
+    def test_measured_and_estimated_cost(self):
+        """Test que le coût mesuré est repris et que les KPI antérieurs sont estimés à partir des tokens."""
+        report = KPIReport(prices=PRICES)
+        attempt = {"model": "gpt-4o-mini", "prompt_tokens": 1000, "completion_tokens": 100, "cached_tokens": 0}
+        report.add(_kpi(0, cost_usd=0.5, llm_attempts=[dict(attempt, cost_usd=0.5)]))
+        report.add(_kpi(1, llm_attempts=[attempt]))
+        report.add(_kpi(2, prompt_tokens=1_000_000, completion_tokens=0))
+        report.add(_kpi(3, model="modele-inconnu", prompt_tokens=1000))
+
+        assert report.cost["measured_usd"] == 0.5
+        assert report.cost["estimated"] == 2
+        assert report.cost["estimated_usd"] == pytest.approx(0.00021 + 0.15)
+        assert report.attempts["gpt-4o-mini"]["calls"] == 3
+        assert report.attempts["modele-inconnu"]["cost"] == 0.0
+
+    def test_invalid_lines_skipped(self):
+        """Test qu'une ligne tronquée ou incomplète est comptée et ignorée."""
+        report = KPIReport()
+
+        assert report.add_line('{"filename": "tronq') is None
+        assert report.add_line('{"filename": "sans_duree.pdf"}') is None
+        assert report.add_line(json.dumps(_kpi(0))) is not None
+        assert report.invalid_lines == 2
+        assert report.all.count == 1
+
+
+@pytest.mark.unit
+class TestMain:
+    """Tests pour le script complet (rapport et export CSV en flux)."""
+
+    def test_report_and_csv_export(self, tmp_path, capsys):
+        """Test du rapport sur des fichiers explicites et de l'export CSV (listes sérialisées en JSON)."""
+        shard = tmp_path / "kpi-2025-02.jsonl.gz"
+        attempts = [{"model": "gpt-4o-mini", "prompt_tokens": 10, "completion_tokens": 5, "cached_tokens": 0, "cost_usd": 0.001}]
+        _write(shard, [_kpi(i, 1000 + i, llm_attempts=attempts, cost_usd=0.001) for i in range(10)], compress=True)
+        csv_file = tmp_path / "kpi_analysis.csv"
+
+        analyze_kpi.main([str(shard), "--csv", str(csv_file)])
+
+        output = capsys.readouterr().out
+        rows = list(csv.DictReader(csv_file.read_text(encoding="utf-8").splitlines()))
+        assert "Total extractions          : 10" in output
+        assert "PAR FENÊTRE (day, 3 dernières sur 3)" in output
+        assert len(rows) == 10
+        assert json.loads(rows[0]["llm_attempts"]) == attempts
+        assert rows[0]["trace_id"] == ""
@@ -0,0 +1,111 @@
+"""
+Tests unitaires pour le cache des résultats d'extraction (cache.py).
+"""
+
+import time
+
+import pytest
+
+from app.services.cache import ExtractionCache, content_hash, make_cache_key
+from app.services.ocr_pipeline import ExtractionResult
+
+
+@pytest.mark.unit
+class TestCacheKey:
+    """Tests pour content_hash() / make_cache_key()."""
+
+    def test_same_content_same_key(self, settings):
+        """Test qu'un même fichier donne la même clé."""
+        key1 = make_cache_key(content_hash(b"%PDF-1.4 facture"), settings)
+        key2 = make_cache_key(content_hash(b"%PDF-1.4 facture"), settings)
+        assert key1 == key2
+
+    def test_model_cascade_changes_key(self, settings):
+        """Test qu'un changement de modèle invalide la clé."""
+        file_hash = content_hash(b"%PDF-1.4 facture")
+        key1 = make_cache_key(file_hash, settings)
+        settings.llm_model_heavy = "gpt-4.1"
+        assert make_cache_key(file_hash, settings) != key1
+
+    @pytest.mark.parametrize(
+        "name, value",
+        [
+            ("image_max_long_edge", 1024),
+            ("image_auto_grayscale", False),
+            ("image_format", "webp"),
+            ("image_quality", 60),
+            ("pdf_dpi", 150),
+            ("pdf_max_selected_pages", 5),
+            ("text_layer_min_chars", 50),
+        ],
+    )
+    def test_preprocessing_settings_change_key(self, settings, name, value):
+        """Test qu'un changement de prétraitement (image, rendu PDF, couche texte) invalide la clé."""
+        file_hash = content_hash(b"%PDF-1.4 facture")
+        key1 = make_cache_key(file_hash, settings)
+        setattr(settings, name, value)
+        assert make_cache_key(file_hash, settings) != key1
+
+
+@pytest.mark.unit
+class TestExtractionCache:
+    """Tests pour la classe ExtractionCache."""
+
+    def test_miss_then_memory_hit(self, sample_invoice_data, tmp_path):
+        """Test miss puis hit mémoire avec compteurs."""
+        cache = ExtractionCache(disk_dir=tmp_path)
+        assert cache.get("abc") is None
+
+        cache.put("abc", ExtractionResult(data=sample_invoice_data))
+        result = cache.get("abc")
+
+        assert result.data == sample_invoice_data
+        stats = cache.stats()
+        assert stats["memory_hits"] == 1
+        assert stats["misses"] == 1
+
+    def test_disk_tier_survives_restart(self, sample_invoice_data, tmp_path):
+        """Test qu'une nouvelle instance retrouve l'entrée sur disque."""
+        ExtractionCache(disk_dir=tmp_path).put("abc", ExtractionResult(data=sample_invoice_data))
+
+        restarted = ExtractionCache(disk_dir=tmp_path)
+        result = restarted.get("abc")
+
+        assert result.data == sample_invoice_data
+        assert restarted.stats()["disk_hits"] == 1
+
+    def test_lru_eviction(self, sample_invoice_data):
+        """Test que le LRU mémoire évince l'entrée la moins récemment utilisée."""
+        cache = ExtractionCache(max_entries=2, disk_dir=None)
+        for key in ("a", "b"):
+            cache.put(key, ExtractionResult(data=sample_invoice_data))
+        cache.get("a")
+        cache.put("c", ExtractionResult(data=sample_invoice_data))
+
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+
+    def test_ttl_expiration(self, sample_invoice_data, tmp_path, monkeypatch):
+        """Test qu'une entrée expirée n'est plus servie (mémoire et disque)."""
+        cache = ExtractionCache(ttl_s=10, disk_dir=tmp_path)
+        cache.put("abc", ExtractionResult(data=sample_invoice_data))
+
+        now = time.time()
+        monkeypatch.setattr("app.services.cache.time.time", lambda: now + 11)
+        assert cache.get("abc") is None
+        assert not list(tmp_path.glob("*/*.json"))
+
+    def test_disk_size_eviction(self, sample_invoice_data, tmp_path):
+        """Test que le niveau disque reste sous la taille maximale."""
+        cache = ExtractionCache(disk_dir=tmp_path, disk_max_bytes=1000)
+        for key in ("k1", "k2", "k3"):
+            cache.put(key, ExtractionResult(data=sample_invoice_data))
+
+        assert cache.stats()["disk_bytes"] <= 1000
+        assert not (tmp_path / "k1" / "k1.json").exists()
+
+    def test_failed_result_not_cached(self, tmp_path):
+        """Test qu'un échec (data=None) n'est pas mis en cache."""
+        cache = ExtractionCache(disk_dir=tmp_path)
+        cache.put("abc", ExtractionResult(data=None, needs_human_review=True, error_message="timeout"))
+        assert cache.get("abc") is None
@@ -0,0 +1,139 @@
+"""
+Tests unitaires pour le coalescing des extractions identiques (coalescing.py).
+"""
+
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from app.monitoring.kpi import kpi_tracker
+from app.services.coalescing import SingleFlight
+from app.services.extraction_service import extract_document
+from app.services.ocr_pipeline import ExtractionResult
+from app.services.preprocessing import PreparedDocument
+
+
+@pytest.mark.unit
+class TestSingleFlight:
+    """Tests pour la classe SingleFlight."""
+
+    def test_concurrent_same_key_runs_once(self):
+        """Test que des appels concurrents de même clé partagent une seule exécution."""
+        flights = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "résultat"
+
+        async def scenario():
+            return await asyncio.gather(*(flights.do("facture", work) for _ in range(5)))
+
+        results = asyncio.run(scenario())
+
+        assert len(calls) == 1
+        assert [value for value, _ in results] == ["résultat"] * 5
+        assert sum(coalesced for _, coalesced in results) == 4
+        assert flights.stats()["coalesced"] == 4
+        assert flights.stats()["in_flight"] == 0
+
+    def test_different_keys_run_separately(self):
+        """Test que des clés différentes ne sont pas coalescées."""
+        flights = SingleFlight()
+
+        async def scenario():
+            return await asyncio.gather(
+                flights.do("a", lambda: asyncio.sleep(0.01, result="a")),
+                flights.do("b", lambda: asyncio.sleep(0.01, result="b")),
+            )
+
+        results = asyncio.run(scenario())
+
+        assert results == [("a", False), ("b", False)]
+
+    def test_error_shared_by_all_callers(self):
+        """Test qu'une erreur de l'exécution partagée est propagée à tous les appelants."""
+        flights = SingleFlight()
+
+        async def failing():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("API indisponible")
+
+        async def scenario():
+            return await asyncio.gather(
+                flights.do("facture", failing),
+                flights.do("facture", failing),
+                return_exceptions=True,
+            )
+
+        results = asyncio.run(scenario())
+
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+    def test_leader_cancellation_does_not_cancel_followers(self):
+        """Test que l'annulation du premier appelant n'interrompt pas l'extraction partagée."""
+        flights = SingleFlight()
+
+        async def scenario():
+            leader = asyncio.ensure_future(flights.do("facture", lambda: asyncio.sleep(0.02, result="ok")))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(flights.do("facture", lambda: asyncio.sleep(0.02, result="ko")))
+            await asyncio.sleep(0)
+            leader.cancel()
+            return await follower
+
+        assert asyncio.run(scenario()) == ("ok", True)
+
+    def test_last_waiter_timeout_cancels_shared_work(self):
+        """Test qu'un appelant unique dont l'échéance expire annule l'extraction partagée."""
+        flights = SingleFlight()
+        cancelled = []
+
+        async def slow():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def scenario():
+            with pytest.raises(asyncio.TimeoutError):
+                await flights.do("facture", slow, timeout=0.01)
+            await asyncio.sleep(0)
+
+        asyncio.run(scenario())
+
+        assert cancelled == [True]
+
+
+@pytest.mark.integration
+class TestCoalescedExtraction:
+    """Tests pour les KPI d'extractions identiques partagées."""
+
+    @patch("app.services.extraction_service.prepare_document")
+    def test_follower_kpi_labelled_coalesced(self, mock_prepare, prepared_image, sample_invoice_data):
+        """Test que l'appelant servi par l'extraction en cours n'est pas compté sous un modèle « unknown »."""
+        mock_prepare.return_value = PreparedDocument(images=[prepared_image])
+
+        async def pipeline(*args, **kwargs):
+            kpi_tracker.record_llm_call("gpt-4o-mini")
+            await asyncio.sleep(0.02)
+            return ExtractionResult(data=sample_invoice_data)
+
+        async def scenario():
+            return await asyncio.gather(
+                *(extract_document(b"\x89PNG identique", "image/png", f"f{i}.png") for i in range(2))
+            )
+
+        with patch("app.services.extraction_service.run_extraction_pipeline", side_effect=pipeline), patch(
+            "app.monitoring.kpi.observe_extraction"
+        ) as observe:
+            asyncio.run(scenario())
+
+        kpis = sorted((call.args[0] for call in observe.call_args_list), key=lambda k: k.coalesced)
+        assert [(k.coalesced, k.final_model_used, k.llm_call_count) for k in kpis] == [
+            (False, "gpt-4o-mini", 1),
+            (True, "coalesced", 0),
+        ]
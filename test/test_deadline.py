@@ -0,0 +1,53 @@
+"""
+Tests unitaires pour l'échéance de bout en bout (deadline.py).
+"""
+
+import pytest
+
+from app.services.deadline import Deadline, DeadlineExceeded, request_deadline
+
+
+@pytest.mark.unit
+class TestRequestDeadline:
+    """Tests pour le calcul de l'échéance d'une requête."""
+
+    def test_default_budget_without_header(self, settings):
+        """Test que l'absence d'en-tête donne le budget REQUEST_TIMEOUT_S."""
+        deadline = request_deadline(None, settings)
+
+        assert deadline.budget_s == settings.request_timeout_s
+        assert 0 < deadline.remaining() <= settings.request_timeout_s
+
+    def test_header_budget_is_capped(self, settings):
+        """Test que le budget demandé est plafonné par REQUEST_TIMEOUT_MAX_S."""
+        assert request_deadline("12.5", settings).budget_s == 12.5
+        assert request_deadline("100000", settings).budget_s == settings.request_timeout_max_s
+
+    @pytest.mark.parametrize("value", ["abc", "0", "-3", "nan", "inf"])
+    def test_invalid_header_raises(self, settings, value):
+        """Test qu'un en-tête non numérique, nul, négatif ou infini est refusé."""
+        with pytest.raises(ValueError):
+            request_deadline(value, settings)
+
+
+@pytest.mark.unit
+class TestDeadline:
+    """Tests pour Deadline."""
+
+    def test_expired_deadline_raises_on_check(self):
+        """Test qu'une échéance dépassée lève DeadlineExceeded (un TimeoutError)."""
+        deadline = Deadline.after(-1)
+
+        assert deadline.expired
+        assert deadline.remaining() == 0
+        with pytest.raises(TimeoutError, match="rasterisation"):
+            deadline.check("rasterisation")
+        assert issubclass(DeadlineExceeded, TimeoutError)
+
+    def test_cap_bounds_timeout_by_remaining(self):
+        """Test que cap() borne un timeout par le temps restant."""
+        deadline = Deadline.after(10)
+
+        assert deadline.cap(2) == 2
+        assert 9 < deadline.cap() <= 10
+        assert 9 < deadline.cap(60) <= 10
@@ -0,0 +1,131 @@
+"""
+Tests unitaires pour les requêtes de couverture (hedging.py).
+"""
+
+import asyncio
+
+import pytest
+
+from app.models.constants import MathValidationError
+from app.services.hedging import HEDGE_BACKUP, HEDGE_PRIMARY, LatencyTracker, hedge_delay, run_hedged
+
+
+@pytest.mark.unit
+class TestLatencyTracker:
+    """Tests pour LatencyTracker et le seuil de déclenchement."""
+
+    def test_percentile_nearest_rank(self):
+        """Test du percentile au rang le plus proche."""
+        tracker = LatencyTracker()
+        for value in range(1, 101):
+            tracker.observe("gpt-4o-mini", value / 100)
+
+        assert tracker.percentile("gpt-4o-mini", 95) == 0.95
+        assert tracker.percentile("gpt-4o-mini", 50) == 0.5
+
+    def test_percentile_none_below_min_samples(self):
+        """Test qu'un historique insuffisant ne donne pas de percentile."""
+        tracker = LatencyTracker()
+        tracker.observe("gpt-4o-mini", 1.0)
+
+        assert tracker.percentile("gpt-4o-mini", 95, min_samples=5) is None
+
+    def test_hedge_delay_uses_default_then_percentile(self, settings):
+        """Test du seuil : défaut sans historique, puis percentile borné par le plancher."""
+        tracker = LatencyTracker()
+        settings.hedge_min_samples = 3
+        settings.hedge_default_delay_s = 10.0
+        settings.hedge_min_delay_s = 1.0
+
+        assert hedge_delay("gpt-4o-mini", settings, tracker) == 10.0
+
+        for value in (2.0, 3.0, 4.0):
+            tracker.observe("gpt-4o-mini", value)
+        assert hedge_delay("gpt-4o-mini", settings, tracker) == 4.0
+
+        tracker.clear()
+        for value in (0.1, 0.2, 0.3):
+            tracker.observe("gpt-4o-mini", value)
+        assert hedge_delay("gpt-4o-mini", settings, tracker) == 1.0
+
+
+@pytest.mark.unit
+class TestRunHedged:
+    """Tests pour run_hedged (course entre requête principale et couverture)."""
+
+    def test_fast_primary_is_not_hedged(self):
+        """Test qu'une réponse avant le seuil ne déclenche pas de couverture."""
+        calls = []
+
+        async def call(model):
+            calls.append(model)
+            return model
+
+        outcome = asyncio.run(run_hedged(call, "light", "heavy", delay_s=1.0))
+
+        assert outcome.winner == HEDGE_PRIMARY
+        assert outcome.hedged is False
+        assert calls == ["light"]
+
+    def test_slow_primary_loses_and_is_cancelled(self):
+        """Test que la couverture gagne face à une requête principale lente, annulée ensuite."""
+        cancelled = []
+        launched = []
+
+        async def call(model):
+            if model == "light":
+                try:
+                    await asyncio.sleep(5)
+                except asyncio.CancelledError:
+                    cancelled.append(model)
+                    raise
+            return model
+
+        outcome = asyncio.run(run_hedged(call, "light", "heavy", delay_s=0.01, on_hedge=launched.append))
+
+        assert outcome.winner == HEDGE_BACKUP
+        assert outcome.model == "heavy"
+        assert outcome.hedged is True
+        assert launched == ["heavy"]
+        assert cancelled == ["light"]
+
+    def test_invalid_first_response_waits_for_other(self):
+        """Test que le premier résultat *valide* l'emporte (une réponse en erreur ne gagne pas)."""
+
+        async def call(model):
+            if model == "backup":
+                raise ValueError("JSON invalide")
+            await asyncio.sleep(0.05)
+            return model
+
+        outcome = asyncio.run(run_hedged(call, "primary", "backup", delay_s=0.01))
+
+        assert outcome.winner == HEDGE_PRIMARY
+        assert outcome.result == "primary"
+
+    def test_both_fail_raises(self):
+        """Test que l'erreur est propagée si les deux requêtes échouent."""
+
+        async def call(model):
+            await asyncio.sleep(0.02)
+            raise ValueError(model)
+
+        with pytest.raises(ValueError):
+            asyncio.run(run_hedged(call, "light", "heavy", delay_s=0.01))
+
+    @pytest.mark.parametrize("math_error_model", ["light", "heavy"])
+    def test_both_fail_prefers_repairable_math_error(self, math_error_model):
+        """Test que l'écart HT + TVA != TTC portant le JSON est propagé, quelle que soit la requête finie en dernier."""
+
+        async def call(model):
+            await asyncio.sleep(0.02 if model == "light" else 0.04)
+            if model == math_error_model:
+                error = MathValidationError("HT + TVA != TTC", 100.0, 18.0, 150.0)
+                error.raw_json = '{"montant_ht": 100.0}'
+                raise error
+            raise TimeoutError(model)
+
+        with pytest.raises(MathValidationError) as excinfo:
+            asyncio.run(run_hedged(call, "light", "heavy", delay_s=0.01))
+
+        assert excinfo.value.raw_json == '{"montant_ht": 100.0}'
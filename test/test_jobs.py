@@ -0,0 +1,197 @@
+"""
+Tests unitaires pour la file de jobs persistante (jobs.py) et le worker (worker.py).
+"""
+
+import asyncio
+import time
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from app.services.extraction_service import DocumentConversionError
+from app.services.jobs import JOB_DONE, JOB_FAILED, JOB_QUEUED, JOB_RUNNING, JobStore
+from app.services.ocr_pipeline import ExtractionResult
+from app.worker import process_job, run_worker
+
+
+@pytest.mark.unit
+class TestJobStore:
+    """Tests pour JobStore (soumission, bail, reprise, statistiques)."""
+
+    def test_submit_and_lease_oldest_first(self, job_store):
+        """Test que les jobs sont pris dans l'ordre de soumission, avec leur contenu."""
+        first = job_store.submit(b"un", "image/png", "a.png")
+        job_store.submit(b"deux", "image/png", "b.png")
+
+        job = job_store.lease("worker-1", lease_s=60)
+
+        assert job.id == first.id
+        assert job.content == b"un"
+        assert job.status == JOB_RUNNING
+        assert job.attempts == 1
+        assert job_store.get(first.id).status == JOB_RUNNING
+
+    def test_lease_returns_none_when_queue_empty(self, job_store):
+        """Test qu'une file vide ne renvoie aucun job."""
+        assert job_store.lease("worker-1", lease_s=60) is None
+
+    def test_running_job_not_leased_twice(self, job_store):
+        """Test qu'un job sous bail n'est pas pris par un second worker."""
+        job_store.submit(b"un", "image/png", "a.png")
+        job_store.lease("worker-1", lease_s=60)
+
+        assert job_store.lease("worker-2", lease_s=60) is None
+
+    def test_expired_lease_is_taken_over(self, job_store):
+        """Test qu'un job dont le worker a disparu est repris à l'expiration du bail."""
+        job = job_store.submit(b"un", "image/png", "a.png")
+        job_store.lease("worker-1", lease_s=-1)
+
+        retaken = job_store.lease("worker-2", lease_s=60)
+
+        assert retaken.id == job.id
+        assert retaken.attempts == 2
+        # L'ancien worker ne peut plus enregistrer de résultat ni renouveler le bail
+        assert job_store.heartbeat(job.id, "worker-1", 60) is False
+        job_store.complete(job.id, "worker-1", {"data": None})
+        assert job_store.get(job.id).status == JOB_RUNNING
+
+    def test_job_failed_after_max_attempts(self, job_store):
+        """Test qu'un job perdu trop souvent passe en échec au lieu de boucler."""
+        job = job_store.submit(b"un", "image/png", "a.png")
+        job_store.lease("worker-1", lease_s=-1)
+        job_store.lease("worker-2", lease_s=-1)
+
+        assert job_store.lease("worker-3", lease_s=60) is None
+        assert job_store.get(job.id).status == JOB_FAILED
+
+    def test_fail_with_retry_requeues(self, job_store):
+        """Test qu'une erreur transitoire remet le job en file tant qu'il reste des tentatives."""
+        job = job_store.submit(b"un", "image/png", "a.png")
+        job_store.lease("worker-1", lease_s=60)
+
+        job_store.fail(job.id, "worker-1", "timeout", retry=True)
+
+        assert job_store.get(job.id).status == JOB_QUEUED
+
+    def test_jobs_survive_reopen(self, tmp_path):
+        """Test que la file est persistante (redémarrage de l'API ou du worker)."""
+        db_path = tmp_path / "persist.sqlite3"
+        job = JobStore(db_path).submit(b"un", "image/png", "a.png")
+
+        reopened = JobStore(db_path)
+
+        assert reopened.get(job.id).status == JOB_QUEUED
+        assert reopened.lease("worker-1", lease_s=60).content == b"un"
+
+    def test_stats_queue_depth_and_timings(self, job_store):
+        """Test des mesures de profondeur de file et des temps d'attente / de service."""
+        done = job_store.submit(b"un", "image/png", "a.png")
+        job_store.submit(b"deux", "image/png", "b.png")
+        job_store.lease("worker-1", lease_s=60)
+        time.sleep(0.01)
+        job_store.complete(done.id, "worker-1", {"data": None})
+
+        stats = job_store.stats()
+
+        assert stats["queue_depth"] == 1
+        assert stats["running"] == 0
+        assert stats["finished_in_window"] == 1
+        assert stats["avg_wait_ms"] >= 0
+        assert stats["avg_service_ms"] > 0
+        assert stats["oldest_queued_age_ms"] > 0
+
+    def test_stats_timings_bounded_by_sample_size(self, job_store):
+        """Test que les temps ne portent que sur les derniers jobs terminés, sans total historique."""
+        for index in range(5):
+            job_store.submit(b"image", "image/png", f"{index}.png")
+            job = job_store.lease("worker-1", lease_s=60)
+            job_store.complete(job.id, "worker-1", {"data": None})
+
+        stats = job_store.stats(sample_size=2)
+
+        assert stats["finished_in_window"] == 2
+        assert "done" not in stats
+
+
+@pytest.mark.unit
+@pytest.mark.mock_llm
+class TestWorker:
+    """Tests pour le worker (traitement d'un job, boucle de consommation)."""
+
+    @patch("app.worker.extract_document", new_callable=AsyncMock)
+    def test_process_job_stores_result(self, mock_extract, job_store, settings, sample_invoice_data):
+        """Test qu'un job traité enregistre le résultat d'extraction."""
+        mock_extract.return_value = ExtractionResult(data=sample_invoice_data)
+        submitted = job_store.submit(b"image", "image/png", "a.png")
+        job = job_store.lease("worker-1", lease_s=60)
+
+        asyncio.run(process_job(job_store, job, "worker-1", settings))
+
+        stored = job_store.get(submitted.id)
+        assert stored.status == JOB_DONE
+        assert stored.result["data"]["fournisseur"] == "Entreprise Test SARL"
+        mock_extract.assert_awaited_once_with(b"image", "image/png", "a.png", settings=settings)
+
+    @patch("app.worker.extract_document", new_callable=AsyncMock)
+    def test_conversion_error_fails_without_retry(self, mock_extract, job_store, settings):
+        """Test qu'un fichier inexploitable passe directement en échec."""
+        mock_extract.side_effect = DocumentConversionError("Conversion du fichier en image impossible.")
+        submitted = job_store.submit(b"image", "image/png", "a.png")
+        job = job_store.lease("worker-1", lease_s=60)
+
+        asyncio.run(process_job(job_store, job, "worker-1", settings))
+
+        stored = job_store.get(submitted.id)
+        assert stored.status == JOB_FAILED
+        assert "Conversion" in stored.error
+
+    @patch("app.worker.extract_document", new_callable=AsyncMock)
+    def test_transient_failure_requeued_until_max_attempts(self, mock_extract, job_store, settings):
+        """Test qu'un échec transitoire remet le job en file, puis est enregistré à la dernière tentative."""
+        mock_extract.return_value = ExtractionResult(
+            needs_human_review=True, error_message="503", error_type="InternalServerError", error_kind="transient"
+        )
+        submitted = job_store.submit(b"image", "image/png", "a.png")
+
+        asyncio.run(process_job(job_store, job_store.lease("worker-1", lease_s=60), "worker-1", settings))
+        requeued = job_store.get(submitted.id)
+        asyncio.run(process_job(job_store, job_store.lease("worker-1", lease_s=60), "worker-1", settings))
+
+        assert requeued.status == JOB_QUEUED
+        assert "InternalServerError" in requeued.error
+        stored = job_store.get(submitted.id)
+        assert stored.status == JOB_DONE
+        assert stored.attempts == 2
+        assert stored.result["needs_human_review"] is True
+
+    @patch("app.worker.extract_document", new_callable=AsyncMock)
+    def test_validation_failure_not_retried(self, mock_extract, job_store, settings):
+        """Test qu'un échec de validation (déterministe) termine le job dès la 1re tentative."""
+        mock_extract.return_value = ExtractionResult(
+            needs_human_review=True, error_message="HT + TVA != TTC", error_kind="validation"
+        )
+        submitted = job_store.submit(b"image", "image/png", "a.png")
+
+        asyncio.run(process_job(job_store, job_store.lease("worker-1", lease_s=60), "worker-1", settings))
+
+        assert job_store.get(submitted.id).status == JOB_DONE
+
+    @patch("app.worker.extract_document", new_callable=AsyncMock)
+    def test_run_worker_drains_queue(self, mock_extract, job_store, settings, sample_invoice_data):
+        """Test que la boucle du worker traite tous les jobs en file puis s'arrête proprement."""
+        mock_extract.return_value = ExtractionResult(data=sample_invoice_data)
+        ids = [job_store.submit(b"image", "image/png", f"{index}.png").id for index in range(3)]
+        settings.worker_poll_interval_s = 0.01
+
+        async def scenario():
+            stop = asyncio.Event()
+            worker = asyncio.create_task(run_worker(stop, settings=settings, store=job_store, concurrency=2))
+            while any(job_store.get(job_id).status != JOB_DONE for job_id in ids):
+                await asyncio.sleep(0.01)
+            stop.set()
+            await worker
+
+        asyncio.run(asyncio.wait_for(scenario(), timeout=5))
+
+        assert all(job_store.get(job_id).status == JOB_DONE for job_id in ids)
@@ -0,0 +1,105 @@
+"""
+Tests unitaires pour le suivi des KPI par extraction (kpi.py).
+"""
+
+import asyncio
+import json
+from unittest.mock import patch
+
+import pytest
+
+from app.monitoring.kpi import ScopedKPITracker, get_kpi_stats
+
+
+@pytest.mark.unit
+class TestScopedKPITracker:
+    """Tests pour l'isolation des KPI entre extractions concurrentes."""
+
+    def test_concurrent_extractions_do_not_share_counters(self, tmp_path):
+        """Test que des extractions entrelacées gardent chacune leurs appels, modèle et durée."""
+        scoped = ScopedKPITracker(tmp_path / "kpi.jsonl")
+
+        async def extraction(name: str, calls: int, model: str):
+            scoped.start_extraction()
+            for _ in range(calls):
+                scoped.record_llm_call(model)
+                await asyncio.sleep(0.01)
+            return scoped.end_extraction(filename=name, success=True)
+
+        async def scenario():
+            return await asyncio.gather(
+                *(asyncio.create_task(extraction(f"f{i}.pdf", i, f"model-{i}")) for i in range(1, 6))
+            )
+
+        kpis = asyncio.run(scenario())
+
+        assert [k.llm_call_count for k in kpis] == [1, 2, 3, 4, 5]
+        assert [k.final_model_used for k in kpis] == [f"model-{i}" for i in range(1, 6)]
+        # Chaque durée couvre ses propres appels, pas ceux de l'extraction la plus longue
+        assert kpis[0].total_duration_ms < kpis[4].total_duration_ms
+        lines = (tmp_path / "kpi.jsonl").read_text().splitlines()
+        assert len(lines) == 5
+
+    def test_child_tasks_feed_the_parent_extraction(self, tmp_path):
+        """Test qu'une tâche créée pendant l'extraction (hedging) alimente le tracker de l'extraction."""
+        scoped = ScopedKPITracker(tmp_path / "kpi.jsonl")
+
+        async def scenario():
+            tracker = scoped.start_extraction()
+            await asyncio.gather(
+                asyncio.create_task(asyncio.to_thread(lambda: None)),
+                asyncio.create_task(_record_call(scoped, "gpt-4o")),
+            )
+            return tracker
+
+        tracker = asyncio.run(scenario())
+
+        assert tracker.llm_call_count == 1
+        assert tracker.llm_timings == [{"model": "gpt-4o", "duration_ms": 12.0, "outcome": "ok"}]
+
+    def test_stage_timings_are_recorded(self, tmp_path):
+        """Test que les durées par étape sont cumulées et écrites dans le KPI."""
+        scoped = ScopedKPITracker(tmp_path / "kpi.jsonl")
+        tracker = scoped.start_extraction()
+
+        tracker.record_stage("encode", 4.0)
+        tracker.record_stage("encode", 6.0)
+        with pytest.raises(ValueError):
+            with tracker.stage("validation"):
+                raise ValueError("JSON invalide")
+        kpi = tracker.end_extraction(filename="facture.pdf", success=False)
+
+        assert kpi.stage_ms["encode"] == 10.0
+        assert "validation" in kpi.stage_ms
+        record = json.loads((tmp_path / "kpi.jsonl").read_text())
+        assert record["stage_ms"]["encode"] == 10.0
+
+    def test_outside_extraction_records_are_discarded(self, tmp_path):
+        """Test qu'un enregistrement hors extraction n'affecte aucune extraction."""
+        scoped = ScopedKPITracker(tmp_path / "kpi.jsonl")
+
+        async def outside():
+            scoped.record_llm_call("gpt-4o-mini")
+            return scoped.llm_call_count
+
+        assert asyncio.run(outside()) == 0
+
+
+async def _record_call(scoped: ScopedKPITracker, model: str) -> None:
+    scoped.record_llm_call(model)
+    scoped.record_llm_attempt(model, 12.0, "ok")
+
+
+@pytest.mark.unit
+class TestGetKPIStats:
+    """Tests pour la lecture des KPI agrégés (/kpi)."""
+
+    @patch("app.monitoring.kpi.get_kpi_aggregates")
+    @patch("app.monitoring.kpi.get_record_writer")
+    def test_read_path_does_not_flush_writer(self, mock_writer, mock_aggregates):
+        """Test que la consultation ne force pas l'écriture des KPI en file du writer."""
+        mock_aggregates.return_value.stats.return_value = {"total_extractions": 0}
+
+        assert get_kpi_stats() == {"total_extractions": 0}
+        mock_aggregates.return_value.refresh.assert_called_once_with()
+        mock_writer.return_value.flush.assert_not_called()
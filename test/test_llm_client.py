@@ -4,12 +4,20 @@ Tests unitaires pour le client LLM (llm_client.py).
 Teste l'intégration OpenAI et le parsing de réponses structurées.
 """
 
+import asyncio
 import json
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
-from app.services.llm_client import extract_invoice_from_image, _clean_json_response
+from app.services.llm_client import (
+    extract_invoice_from_image,
+    extract_invoice_from_image_async,
+    extract_invoice_from_text_async,
+    repair_invoice_async,
+    _clean_json_response,
+)
+from app.models.constants import MathValidationError
 
 
 @pytest.mark.unit
@@ -53,11 +61,11 @@ class TestCleanJsonResponse:
 class TestExtractInvoiceFromImage:
     """Tests pour la fonction extract_invoice_from_image()."""
 
-    @patch('app.services.llm_client.OpenAI')
-    def test_successful_extraction(self, mock_openai_class, mock_llm_response_valid, settings, test_image_base64):
+    @patch('app.services.llm_client.get_openai_client')
+    def test_successful_extraction(self, mock_get_client, mock_llm_response_valid, settings, test_image_base64):
         """Test extraction réussie."""
         mock_client = MagicMock()
-        mock_openai_class.return_value = mock_client
+        mock_get_client.return_value = mock_client
         mock_client.chat.completions.create.return_value = mock_llm_response_valid
 
         result = extract_invoice_from_image(test_image_base64, model="gpt-4o-mini", settings=settings)
@@ -67,21 +75,21 @@ class TestExtractInvoiceFromImage:
         assert result.montant_ttc == 1200.0
         assert len(result.lignes_detail) == 1
 
-    @patch('app.services.llm_client.OpenAI')
-    def test_invalid_json_raises_error(self, mock_openai_class, mock_llm_response_invalid_json, settings, test_image_base64):
+    @patch('app.services.llm_client.get_openai_client')
+    def test_invalid_json_raises_error(self, mock_get_client, mock_llm_response_invalid_json, settings, test_image_base64):
         """Test que JSON invalide lève une erreur."""
         mock_client = MagicMock()
-        mock_openai_class.return_value = mock_client
+        mock_get_client.return_value = mock_client
         mock_client.chat.completions.create.return_value = mock_llm_response_invalid_json
 
         with pytest.raises(ValueError):
             extract_invoice_from_image(test_image_base64, model="gpt-4o-mini", settings=settings)
 
-    @patch('app.services.llm_client.OpenAI')
-    def test_empty_response_raises_error(self, mock_openai_class, settings, test_image_base64):
+    @patch('app.services.llm_client.get_openai_client')
+    def test_empty_response_raises_error(self, mock_get_client, settings, test_image_base64):
         """Test que réponse vide lève une erreur."""
         mock_client = MagicMock()
-        mock_openai_class.return_value = mock_client
+        mock_get_client.return_value = mock_client
         mock_response = MagicMock()
         mock_response.choices = [MagicMock()]
         mock_response.choices[0].message.content = ""
@@ -89,3 +97,170 @@ class TestExtractInvoiceFromImage:
 
         with pytest.raises(ValueError, match="Réponse LLM vide"):
             extract_invoice_from_image(test_image_base64, model="gpt-4o-mini", settings=settings)
+
+
+@pytest.mark.unit
+@pytest.mark.mock_llm
+class TestExtractInvoiceFromImageAsync:
+    """Tests pour la fonction extract_invoice_from_image_async()."""
+
+    @patch('app.services.llm_client.get_async_openai_client')
+    def test_successful_extraction(self, mock_get_client, mock_llm_response_valid, settings, test_image_base64):
+        """Test extraction réussie via le client asynchrone."""
+        mock_client = MagicMock()
+        mock_get_client.return_value = mock_client
+        mock_client.chat.completions.create = AsyncMock(return_value=mock_llm_response_valid)
+
+        result = asyncio.run(
+            extract_invoice_from_image_async(test_image_base64, model="gpt-4o-mini", settings=settings)
+        )
+
+        assert result.fournisseur == "Entreprise Test"
+        assert result.montant_ttc == 1200.0
+        mock_client.chat.completions.create.assert_awaited_once()
+
+    @patch('app.services.llm_client.get_async_openai_client')
+    def test_invalid_json_raises_error(self, mock_get_client, mock_llm_response_invalid_json, settings, test_image_base64):
+        """Test que JSON invalide lève une erreur (chemin asynchrone)."""
+        mock_client = MagicMock()
+        mock_get_client.return_value = mock_client
+        mock_client.chat.completions.create = AsyncMock(return_value=mock_llm_response_invalid_json)
+
+        with pytest.raises(ValueError):
+            asyncio.run(
+                extract_invoice_from_image_async(test_image_base64, model="gpt-4o-mini", settings=settings)
+            )
+
+    @patch('app.services.llm_client.get_async_openai_client')
+    def test_data_url_uses_mime_type(self, mock_get_client, mock_llm_response_valid, settings, test_image_base64):
+        """Test que l'URL data: porte le type MIME réel de l'image."""
+        mock_client = MagicMock()
+        mock_get_client.return_value = mock_client
+        mock_client.chat.completions.create = AsyncMock(return_value=mock_llm_response_valid)
+
+        asyncio.run(
+            extract_invoice_from_image_async(
+                test_image_base64, model="gpt-4o-mini", mime_type="image/png", settings=settings
+            )
+        )
+
+        messages = mock_client.chat.completions.create.call_args.kwargs["messages"]
+        image_part = messages[1]["content"][0]
+        assert image_part["image_url"]["url"].startswith("data:image/png;base64,")
+
+    @patch('app.services.llm_client.get_async_openai_client')
+    def test_multi_page_sends_one_image_per_page(self, mock_get_client, mock_llm_response_valid, settings, prepared_image):
+        """Test qu'un document multi-pages envoie une image par page retenue."""
+        mock_client = MagicMock()
+        mock_get_client.return_value = mock_client
+        mock_client.chat.completions.create = AsyncMock(return_value=mock_llm_response_valid)
+
+        asyncio.run(
+            extract_invoice_from_image_async([prepared_image, prepared_image], model="gpt-4o-mini", settings=settings)
+        )
+
+        messages = mock_client.chat.completions.create.call_args.kwargs["messages"]
+        image_parts = [part for part in messages[1]["content"] if part["type"] == "image_url"]
+        assert len(image_parts) == 2
+
+
+@pytest.mark.unit
+@pytest.mark.mock_llm
+class TestExtractInvoiceFromTextAsync:
+    """Tests pour la fonction extract_invoice_from_text_async()."""
+
+    @patch('app.services.llm_client.get_async_openai_client')
+    def test_text_only_request(self, mock_get_client, mock_llm_response_valid, settings):
+        """Test que le chemin texte n'envoie aucune image et inclut le texte du PDF."""
+        mock_client = MagicMock()
+        mock_get_client.return_value = mock_client
+        mock_client.chat.completions.create = AsyncMock(return_value=mock_llm_response_valid)
+
+        result = asyncio.run(
+            extract_invoice_from_text_async("--- Page 1 ---\nTotal TTC 1.200", model="gpt-4o-mini", settings=settings)
+        )
+
+        assert result.numero_facture == "F001"
+        messages = mock_client.chat.completions.create.call_args.kwargs["messages"]
+        assert isinstance(messages[1]["content"], str)
+        assert "Total TTC 1.200" in messages[1]["content"]
+        assert "MODE TEXTE" in messages[0]["content"]
+
+
+@pytest.mark.unit
+@pytest.mark.mock_llm
+class TestRepairInvoiceAsync:
+    """Tests pour la relance de réparation et la remontée de MathValidationError."""
+
+    @patch('app.services.llm_client.get_async_openai_client')
+    def test_math_error_carries_raw_json(self, mock_get_client, mock_llm_response_valid, sample_invoice_invalid_math, settings, test_image_base64):
+        """Test qu'un écart HT + TVA != TTC remonte en MathValidationError avec le JSON reçu."""
+        mock_llm_response_valid.choices[0].message.content = json.dumps(sample_invoice_invalid_math)
+        mock_client = MagicMock()
+        mock_get_client.return_value = mock_client
+        mock_client.chat.completions.create = AsyncMock(return_value=mock_llm_response_valid)
+
+        with pytest.raises(MathValidationError) as exc_info:
+            asyncio.run(extract_invoice_from_image_async(test_image_base64, model="gpt-4o-mini", settings=settings))
+
+        assert json.loads(exc_info.value.raw_json)["montant_ttc"] == 150.0
+
+    @patch('app.services.llm_client.get_async_openai_client')
+    def test_repair_reuses_prefix_and_sends_discrepancy(self, mock_get_client, mock_llm_response_valid, settings, test_image_base64):
+        """Test que la réparation reprend le préfixe image puis ajoute le JSON précédent et l'écart."""
+        mock_client = MagicMock()
+        mock_get_client.return_value = mock_client
+        mock_client.chat.completions.create = AsyncMock(return_value=mock_llm_response_valid)
+
+        result = asyncio.run(
+            repair_invoice_async(
+                test_image_base64,
+                '{"montant_ttc": 150}',
+                "HT + TVA = 120.00 != TTC 150.0",
+                model="gpt-4o-mini",
+                mime_type="image/png",
+                settings=settings,
+            )
+        )
+
+        assert result.numero_facture == "F001"
+        messages = mock_client.chat.completions.create.call_args.kwargs["messages"]
+        assert [message["role"] for message in messages] == ["system", "user", "assistant", "user"]
+        assert messages[1]["content"][0]["type"] == "image_url"
+        assert messages[2]["content"] == '{"montant_ttc": 150}'
+        assert "HT + TVA = 120.00 != TTC 150.0" in messages[3]["content"]
+
+
+@pytest.mark.unit
+@pytest.mark.mock_llm
+class TestTokenUsage:
+    """Tests pour l'enregistrement des tokens et du coût de chaque appel."""
+
+    @patch('app.services.llm_client.kpi_tracker')
+    @patch('app.services.llm_client.get_async_openai_client')
+    def test_usage_and_cost_recorded(self, mock_get_client, mock_tracker, mock_llm_response_valid, settings, test_image_base64):
+        """Test que tokens (dont tokens en cache) et coût de l'appel sont transmis aux KPI."""
+        mock_llm_response_valid.usage.prompt_tokens_details.cached_tokens = 40
+        mock_client = MagicMock()
+        mock_get_client.return_value = mock_client
+        mock_client.chat.completions.create = AsyncMock(return_value=mock_llm_response_valid)
+
+        asyncio.run(extract_invoice_from_image_async(test_image_base64, model="gpt-4o-mini", settings=settings))
+
+        model, prompt, completion, cached, cost = mock_tracker.record_token_usage.call_args.args
+        assert (model, prompt, completion, cached) == ("gpt-4o-mini", 100, 50, 40)
+        assert cost == pytest.approx((60 * 0.15 + 40 * 0.075 + 50 * 0.60) / 1_000_000)
+
+    @patch('app.services.llm_client.kpi_tracker')
+    @patch('app.services.llm_client.get_async_openai_client')
+    def test_usage_recorded_on_invalid_response(self, mock_get_client, mock_tracker, mock_llm_response_invalid_json, settings, test_image_base64):
+        """Test qu'une réponse invalide (facturée) est aussi comptée."""
+        mock_client = MagicMock()
+        mock_get_client.return_value = mock_client
+        mock_client.chat.completions.create = AsyncMock(return_value=mock_llm_response_invalid_json)
+
+        with pytest.raises(ValueError):
+            asyncio.run(extract_invoice_from_image_async(test_image_base64, model="gpt-4o", settings=settings))
+
+        mock_tracker.record_token_usage.assert_called_once()
+        assert mock_tracker.record_token_usage.call_args.args[3] == 0
@@ -0,0 +1,109 @@
+"""
+Tests unitaires pour les métriques Prometheus (metrics.py) et l'endpoint GET /metrics.
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.monitoring.kpi import ExtractionKPI
+from app.monitoring.metrics import (
+    MetricsRegistry,
+    _Metric,
+    extractions_total,
+    llm_attempt_duration,
+    observe_extraction,
+    stage_duration,
+)
+
+
+@pytest.mark.unit
+class TestMetricsRegistry:
+    """Tests pour le format d'exposition texte."""
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Test que les buckets sont cumulés et que _count / _sum sont exposés."""
+        registry = MetricsRegistry()
+        histogram = registry.histogram("test_duration_seconds", "Durée.", ("stage",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.7, 5.0):
+            histogram.observe(value, stage="encode")
+
+        text = registry.render()
+
+        assert "# TYPE test_duration_seconds histogram" in text
+        assert 'test_duration_seconds_bucket{stage="encode",le="0.1"} 1' in text
+        assert 'test_duration_seconds_bucket{stage="encode",le="1"} 3' in text
+        assert 'test_duration_seconds_bucket{stage="encode",le="+Inf"} 4' in text
+        assert 'test_duration_seconds_count{stage="encode"} 4' in text
+        assert 'test_duration_seconds_sum{stage="encode"} 6.25' in text
+
+    def test_counter_and_gauge(self):
+        """Test des compteurs, jauges et de l'échappement des valeurs de labels."""
+        registry = MetricsRegistry()
+        counter = registry.counter("test_total", "Compteur.", ("model",))
+        gauge = registry.gauge("test_in_flight", "Jauge.")
+        counter.inc(model='gpt"4o')
+        counter.inc(2, model='gpt"4o')
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+
+        text = registry.render()
+
+        assert 'test_total{model="gpt\\"4o"} 3' in text
+        assert "test_in_flight 1" in text
+
+    def test_wrong_labels_rejected(self):
+        """Test qu'un jeu de labels incorrect est refusé."""
+        counter = MetricsRegistry().counter("test_total", "Compteur.", ("model",))
+        with pytest.raises(ValueError):
+            counter.inc(outcome="ok")
+
+    def test_metric_without_samples_rejected(self):
+        """Test qu'un type de métrique sans _samples échoue dès son instanciation."""
+
+        class IncompleteMetric(_Metric):
+            kind = "untyped"
+
+        with pytest.raises(TypeError):
+            IncompleteMetric("test_metric", "Métrique.")
+
+
+@pytest.mark.unit
+class TestObserveExtraction:
+    """Tests pour l'alimentation des métriques depuis un KPI."""
+
+    def test_kpi_feeds_histograms_and_outcome(self):
+        """Test qu'un KPI alimente les histogrammes d'étapes, d'appels LLM et l'issue de la cascade."""
+        kpi = ExtractionKPI(
+            timestamp="2026-01-01T00:00:00",
+            filename="facture.pdf",
+            total_duration_ms=2500.0,
+            llm_call_count=1,
+            final_model_used="metrics-test-model",
+            success=True,
+            needs_human_review=False,
+            stage_ms={"rasterize": 120.0, "validation": 2.0, "llm": 2300.0},
+            llm_timings=[{"model": "metrics-test-model", "duration_ms": 2300.0, "outcome": "ok"}],
+        )
+        before = stage_duration.count(stage="rasterize")
+
+        observe_extraction(kpi)
+
+        assert stage_duration.count(stage="rasterize") == before + 1
+        assert llm_attempt_duration.count(model="metrics-test-model", outcome="ok") == 1
+        assert extractions_total.value(outcome="success", model="metrics-test-model") == 1
+
+
+@pytest.mark.integration
+class TestMetricsEndpoint:
+    """Tests pour GET /metrics."""
+
+    def test_metrics_endpoint_exposes_text_format(self):
+        """Test que /metrics répond au format texte Prometheus."""
+        response = TestClient(app).get("/metrics")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        assert "# TYPE azo_stage_duration_seconds histogram" in response.text
+        assert "# TYPE azo_http_requests_in_flight gauge" in response.text
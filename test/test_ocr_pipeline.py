@@ -4,7 +4,8 @@ Tests unitaires pour le pipeline OCR (ocr_pipeline.py).
 Teste l'orchestration et la logique de cascading/fallback.
 """
 
-from unittest.mock import MagicMock, patch
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
@@ -41,19 +42,19 @@ class TestExtractionResult:
 class TestRunExtractionPipeline:
     """Tests pour la fonction run_extraction_pipeline()."""
 
-    @patch('app.services.ocr_pipeline.extract_invoice_from_image')
+    @patch('app.services.ocr_pipeline.extract_invoice_from_image_async', new_callable=AsyncMock)
     def test_first_attempt_success(self, mock_extract, sample_invoice_data, settings, test_image_base64):
         """Test succès à la première tentative (gpt-4o-mini)."""
         mock_extract.return_value = sample_invoice_data
 
-        result = run_extraction_pipeline(test_image_base64, settings=settings)
+        result = asyncio.run(run_extraction_pipeline(test_image_base64, settings=settings))
 
         assert result.data == sample_invoice_data
         assert result.needs_human_review is False
         # Doit être appelé une seule fois (pas de fallback)
         assert mock_extract.call_count == 1
 
-    @patch('app.services.ocr_pipeline.extract_invoice_from_image')
+    @patch('app.services.ocr_pipeline.extract_invoice_from_image_async', new_callable=AsyncMock)
     def test_retry_then_success(self, mock_extract, sample_invoice_data, settings, test_image_base64):
         """Test retry gpt-4o-mini puis succès."""
         from app.models.constants import MathValidationError
@@ -61,37 +62,41 @@ class TestRunExtractionPipeline:
         error = MathValidationError("HT+TVA != TTC", 100, 20, 150)
         mock_extract.side_effect = [error, sample_invoice_data]
 
-        result = run_extraction_pipeline(test_image_base64, settings=settings)
+        result = asyncio.run(run_extraction_pipeline(test_image_base64, settings=settings))
 
         assert result.data == sample_invoice_data
         assert result.needs_human_review is False
         # Doit être appelé 2 fois (1er essai + 1 retry)
         assert mock_extract.call_count == 2
 
-    @patch('app.services.ocr_pipeline.extract_invoice_from_image')
+    @patch('app.services.ocr_pipeline.extract_invoice_from_image_async', new_callable=AsyncMock)
     def test_fallback_success(self, mock_extract, sample_invoice_data, settings, test_image_base64):
-        """Test fallback vers gpt-4o et succès."""
+        """Test fallback vers gpt-4o et succès (politique historique : retry identique)."""
         from app.models.constants import MathValidationError
 
+        settings.cascade_repair_enabled = False
+        settings.cascade_skip_deterministic_retry = False
         error = MathValidationError("HT+TVA != TTC", 100, 20, 150)
         mock_extract.side_effect = [error, error, sample_invoice_data]
 
-        result = run_extraction_pipeline(test_image_base64, settings=settings)
+        result = asyncio.run(run_extraction_pipeline(test_image_base64, settings=settings))
 
         assert result.data == sample_invoice_data
         assert result.needs_human_review is False
         # Doit être appelé 3 fois (1er essai + retry + fallback)
         assert mock_extract.call_count == 3
 
-    @patch('app.services.ocr_pipeline.extract_invoice_from_image')
+    @patch('app.services.ocr_pipeline.extract_invoice_from_image_async', new_callable=AsyncMock)
     def test_all_attempts_fail(self, mock_extract, settings, test_image_base64):
-        """Test que tous les modèles échouent."""
+        """Test que tous les modèles échouent (politique historique : retry identique)."""
         from app.models.constants import MathValidationError
 
+        settings.cascade_repair_enabled = False
+        settings.cascade_skip_deterministic_retry = False
         error = MathValidationError("HT+TVA != TTC", 100, 20, 150)
         mock_extract.side_effect = [error, error, error]
 
-        result = run_extraction_pipeline(test_image_base64, settings=settings)
+        result = asyncio.run(run_extraction_pipeline(test_image_base64, settings=settings))
 
         assert result.data is None
         assert result.needs_human_review is True
@@ -99,12 +104,278 @@ class TestRunExtractionPipeline:
         # Doit être appelé 3 fois (2x mini + 1x 4o)
         assert mock_extract.call_count == 3
 
-    @patch('app.services.ocr_pipeline.extract_invoice_from_image')
+    @patch('app.services.ocr_pipeline.extract_invoice_from_image_async', new_callable=AsyncMock)
     def test_zero_tva_triggers_review(self, mock_extract, sample_invoice_zero_tva, settings, test_image_base64):
         """Test que TVA=0 déclenche le flag human_review."""
         mock_extract.return_value = sample_invoice_zero_tva
 
-        result = run_extraction_pipeline(test_image_base64, settings=settings)
+        result = asyncio.run(run_extraction_pipeline(test_image_base64, settings=settings))
 
         assert result.data == sample_invoice_zero_tva
         assert result.needs_human_review is True  # TVA = 0 requiert revue
+
+    @patch('app.services.ocr_pipeline.extract_invoice_from_image_async', new_callable=AsyncMock)
+    @patch('app.services.ocr_pipeline.extract_invoice_from_text_async', new_callable=AsyncMock)
+    def test_text_layer_uses_text_path(self, mock_text, mock_image, sample_invoice_data, settings):
+        """Test que la couche texte d'un PDF numérique est envoyée sans image."""
+        mock_text.return_value = sample_invoice_data
+
+        result = asyncio.run(run_extraction_pipeline([], text="FACTURE ... Total TTC 1200", settings=settings))
+
+        assert result.data == sample_invoice_data
+        mock_text.assert_awaited_once()
+        mock_image.assert_not_called()
+
+    @patch('app.services.ocr_pipeline.extract_invoice_from_image_async', new_callable=AsyncMock)
+    def test_hedging_records_winner(self, mock_extract, sample_invoice_data, settings, test_image_base64):
+        """Test qu'une 1ère tentative lente est couverte et que la requête gagnante est tracée."""
+        from app.monitoring.kpi import kpi_tracker
+
+        async def slow_then_fast(images, *, model, mime_type, timeout, settings):
+            if mock_extract.call_count == 1:
+                await asyncio.sleep(5)
+            return sample_invoice_data
+
+        mock_extract.side_effect = slow_then_fast
+        settings.hedge_enabled = True
+        settings.hedge_min_samples = 1000
+        settings.hedge_default_delay_s = 0.01
+
+        kpi_tracker.start_extraction()
+        result = asyncio.run(run_extraction_pipeline(test_image_base64, settings=settings))
+
+        assert result.data == sample_invoice_data
+        assert mock_extract.call_count == 2
+        assert kpi_tracker.llm_call_count == 2
+        assert kpi_tracker.hedged is True
+        assert kpi_tracker.hedge_winner == "hedge"
+        assert sorted(t["outcome"] for t in kpi_tracker.llm_timings) == ["CancelledError", "ok"]
+
+
+@pytest.mark.unit
+@pytest.mark.mock_llm
+class TestErrorAwareCascade:
+    """Tests pour la cascade guidée par l'erreur (réparation, retry évité)."""
+
+    @staticmethod
+    def _math_error():
+        from app.models.constants import MathValidationError
+
+        error = MathValidationError("HT + TVA = 120.00 != TTC 150.0 (écart 30.00)", 100, 20, 150)
+        error.raw_json = '{"montant_ht": 100, "montant_tva": 20, "montant_ttc": 150}'
+        return error
+
+    @patch('app.services.ocr_pipeline.repair_invoice_async', new_callable=AsyncMock)
+    @patch('app.services.ocr_pipeline.extract_invoice_from_image_async', new_callable=AsyncMock)
+    def test_math_error_triggers_repair(self, mock_extract, mock_repair, sample_invoice_data, settings, test_image_base64):
+        """Test qu'un écart HT + TVA != TTC déclenche une réparation avec le JSON et l'écart."""
+        from app.monitoring.kpi import kpi_tracker
+
+        error = self._math_error()
+        mock_extract.side_effect = [error]
+        mock_repair.return_value = sample_invoice_data
+
+        kpi_tracker.start_extraction()
+        result = asyncio.run(run_extraction_pipeline(test_image_base64, settings=settings))
+
+        assert result.data == sample_invoice_data
+        assert mock_extract.call_count == 1
+        args, kwargs = mock_repair.call_args
+        assert args == (test_image_base64, error.raw_json, str(error))
+        assert kwargs["model"] == settings.llm_model_light
+        assert kpi_tracker.llm_call_count == 2
+        assert kpi_tracker.repair_attempted is True
+        assert kpi_tracker.repair_succeeded is True
+
+    @patch('app.services.ocr_pipeline.repair_invoice_async', new_callable=AsyncMock)
+    @patch('app.services.ocr_pipeline.extract_invoice_from_image_async', new_callable=AsyncMock)
+    def test_failed_repair_falls_back_to_heavy(self, mock_extract, mock_repair, sample_invoice_data, settings, test_image_base64):
+        """Test qu'une réparation infructueuse passe au modèle lourd."""
+        mock_extract.side_effect = [self._math_error(), sample_invoice_data]
+        mock_repair.side_effect = self._math_error()
+
+        result = asyncio.run(run_extraction_pipeline(test_image_base64, settings=settings))
+
+        assert result.data == sample_invoice_data
+        assert mock_extract.call_args_list[-1].kwargs["model"] == settings.llm_model_heavy
+
+    @patch('app.services.ocr_pipeline.extract_invoice_from_image_async', new_callable=AsyncMock)
+    def test_invalid_response_skips_identical_retry(self, mock_extract, sample_invoice_data, settings, test_image_base64):
+        """Test qu'une réponse invalide ne provoque pas de retry identique sur le modèle light."""
+        from app.monitoring.kpi import kpi_tracker
+
+        mock_extract.side_effect = [ValueError("Impossible d'extraire du JSON valide"), sample_invoice_data]
+
+        kpi_tracker.start_extraction()
+        result = asyncio.run(run_extraction_pipeline(test_image_base64, settings=settings))
+
+        assert result.data == sample_invoice_data
+        models = [call.kwargs["model"] for call in mock_extract.call_args_list]
+        assert models == [settings.llm_model_light, settings.llm_model_heavy]
+        assert kpi_tracker.llm_call_count == 2
+        assert kpi_tracker.retry_skipped is True
+
+    @patch('app.services.ocr_pipeline.extract_invoice_from_image_async', new_callable=AsyncMock)
+    def test_transient_error_is_retried(self, mock_extract, sample_invoice_data, settings, test_image_base64):
+        """Test qu'une erreur transitoire (réseau, API) est retentée sur le modèle light."""
+        mock_extract.side_effect = [TimeoutError("timeout"), sample_invoice_data]
+
+        result = asyncio.run(run_extraction_pipeline(test_image_base64, settings=settings))
+
+        assert result.data == sample_invoice_data
+        models = [call.kwargs["model"] for call in mock_extract.call_args_list]
+        assert models == [settings.llm_model_light, settings.llm_model_light]
+
+    @patch('app.services.ocr_pipeline.repair_invoice_async', new_callable=AsyncMock)
+    @patch('app.services.ocr_pipeline.extract_invoice_from_image_async', new_callable=AsyncMock)
+    def test_local_reconciliation_avoids_llm_call(self, mock_extract, mock_repair, settings, test_image_base64):
+        """Test qu'un écart mécanique (HT/TTC inversés) est corrigé localement, sans autre appel LLM."""
+        from app.models.constants import MathValidationError
+        from app.monitoring.kpi import kpi_tracker
+
+        error = MathValidationError("HT + TVA = 136000.00 != TTC 100000.0", 118000, 18000, 100000)
+        error.raw_json = (
+            '{"fournisseur": "Test", "numero_facture": "F1", "date": "2025-02-26", "devise": "XOF", '
+            '"montant_ht": 118000, "montant_tva": 18000, "montant_ttc": 100000, "lignes_detail": []}'
+        )
+        mock_extract.side_effect = [error]
+
+        kpi_tracker.start_extraction()
+        result = asyncio.run(run_extraction_pipeline(test_image_base64, settings=settings))
+
+        assert result.locally_repaired is True
+        assert result.data.montant_ht == 100000.0
+        assert mock_extract.call_count == 1
+        mock_repair.assert_not_called()
+        assert kpi_tracker.llm_call_count == 1
+        assert kpi_tracker.local_repair is True
+
+    @patch('app.services.ocr_pipeline.extract_invoice_from_image_async', new_callable=AsyncMock)
+    def test_start_heavy_skips_light_model(self, mock_extract, sample_invoice_data, settings, test_image_base64):
+        """Test qu'un document routé vers le modèle lourd n'appelle jamais le modèle light."""
+        mock_extract.return_value = sample_invoice_data
+
+        result = asyncio.run(run_extraction_pipeline(test_image_base64, start_heavy=True, settings=settings))
+
+        assert result.data == sample_invoice_data
+        assert [call.kwargs["model"] for call in mock_extract.call_args_list] == [settings.llm_model_heavy]
+
+
+@pytest.mark.unit
+@pytest.mark.mock_llm
+class TestResilientCascade:
+    """Tests de la cascade face aux erreurs transitoires, permanentes et aux disjoncteurs."""
+
+    @patch('app.services.resilience.asyncio.sleep', new_callable=AsyncMock)
+    @patch('app.services.ocr_pipeline.extract_invoice_from_image_async', new_callable=AsyncMock)
+    def test_transient_errors_exhausted_go_to_heavy(self, mock_extract, mock_sleep, sample_invoice_data, settings, test_image_base64):
+        """Test qu'après les nouveaux essais avec backoff, la cascade passe au modèle lourd sans retry light."""
+        settings.llm_transient_retries = 1
+        mock_extract.side_effect = [TimeoutError("timeout"), TimeoutError("timeout"), sample_invoice_data]
+
+        result = asyncio.run(run_extraction_pipeline(test_image_base64, settings=settings))
+
+        assert result.data == sample_invoice_data
+        models = [call.kwargs["model"] for call in mock_extract.call_args_list]
+        assert models == [settings.llm_model_light, settings.llm_model_light, settings.llm_model_heavy]
+        assert mock_sleep.await_count == 1
+
+    @patch('app.services.resilience.asyncio.sleep', new_callable=AsyncMock)
+    @patch('app.services.ocr_pipeline.extract_invoice_from_image_async', new_callable=AsyncMock)
+    def test_timeouts_feed_latency_tracker(self, mock_extract, mock_sleep, sample_invoice_data, settings, test_image_base64):
+        """Test que la durée des appels en timeout alimente le seuil de hedging, pas les rejets du disjoncteur."""
+        from app.services.hedging import latency_tracker
+        from app.services.resilience import get_circuit_breaker
+
+        settings.llm_transient_retries = 1
+        mock_extract.side_effect = [TimeoutError("timeout"), TimeoutError("timeout"), sample_invoice_data]
+        latency_tracker.clear()
+        try:
+            asyncio.run(run_extraction_pipeline(test_image_base64, settings=settings))
+            light_samples = latency_tracker.stats()[settings.llm_model_light]["samples"]
+
+            breaker = get_circuit_breaker(settings.llm_model_light, settings)
+            for _ in range(settings.circuit_failure_threshold):
+                breaker.record_failure()
+            mock_extract.side_effect = None
+            mock_extract.return_value = sample_invoice_data
+            asyncio.run(run_extraction_pipeline(test_image_base64, settings=settings))
+
+            assert light_samples == 2
+            assert latency_tracker.stats()[settings.llm_model_light]["samples"] == 2
+        finally:
+            latency_tracker.clear()
+
+    @patch('app.services.ocr_pipeline.extract_invoice_from_image_async', new_callable=AsyncMock)
+    def test_open_breaker_reroutes_to_heavy(self, mock_extract, sample_invoice_data, settings, test_image_base64):
+        """Test qu'un modèle light au disjoncteur ouvert est contourné sans appel."""
+        from app.services.resilience import get_circuit_breaker
+
+        breaker = get_circuit_breaker(settings.llm_model_light, settings)
+        for _ in range(settings.circuit_failure_threshold):
+            breaker.record_failure()
+        mock_extract.return_value = sample_invoice_data
+
+        result = asyncio.run(run_extraction_pipeline(test_image_base64, settings=settings))
+
+        assert result.data == sample_invoice_data
+        assert [call.kwargs["model"] for call in mock_extract.call_args_list] == [settings.llm_model_heavy]
+
+    @patch('app.services.ocr_pipeline.extract_invoice_from_image_async', new_callable=AsyncMock)
+    def test_permanent_error_stops_cascade(self, mock_extract, settings, test_image_base64):
+        """Test qu'une erreur permanente (authentification) arrête la cascade sans fallback."""
+        import httpx
+        import openai
+
+        request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+        mock_extract.side_effect = openai.AuthenticationError(
+            "clé invalide", response=httpx.Response(401, request=request), body=None
+        )
+
+        result = asyncio.run(run_extraction_pipeline(test_image_base64, settings=settings))
+
+        assert result.data is None
+        assert result.needs_human_review is True
+        assert (result.error_type, result.error_kind) == ("AuthenticationError", "permanent")
+        assert mock_extract.call_count == 1
+
+
+@pytest.mark.unit
+@pytest.mark.mock_llm
+class TestDeadlineCascade:
+    """Tests de la cascade bornée par l'échéance de la requête."""
+
+    @patch('app.services.ocr_pipeline.extract_invoice_from_image_async', new_callable=AsyncMock)
+    def test_insufficient_budget_skips_attempt(self, mock_extract, settings, test_image_base64):
+        """Test qu'aucune tentative n'est lancée si le budget restant ne couvre pas sa durée attendue."""
+        from app.services.deadline import Deadline
+
+        settings.deadline_min_attempt_s = 5.0
+
+        result = asyncio.run(
+            run_extraction_pipeline(test_image_base64, deadline=Deadline.after(1), settings=settings)
+        )
+
+        assert result.data is None
+        assert result.error_type == "DeadlineExceeded"
+        mock_extract.assert_not_called()
+
+    @patch('app.services.ocr_pipeline.extract_invoice_from_image_async', new_callable=AsyncMock)
+    def test_slow_call_interrupted_at_deadline(self, mock_extract, sample_invoice_data, settings, test_image_base64):
+        """Test qu'un appel trop lent est interrompu à l'échéance, sans basculer vers le modèle lourd."""
+        from app.services.deadline import Deadline
+
+        async def slow(*args, **kwargs):
+            await asyncio.sleep(5)
+            return sample_invoice_data
+
+        mock_extract.side_effect = slow
+        settings.deadline_min_attempt_s = 0.01
+
+        result = asyncio.run(
+            run_extraction_pipeline(test_image_base64, deadline=Deadline.after(0.1), settings=settings)
+        )
+
+        assert result.error_type == "DeadlineExceeded"
+        assert mock_extract.call_count == 1
+        assert 0 < mock_extract.call_args.kwargs["timeout"] <= 0.1
@@ -0,0 +1,89 @@
+"""
+Tests unitaires pour le registre de clients OpenAI (openai_clients.py) et le cache des settings.
+"""
+
+import asyncio
+
+import pytest
+
+from app.core import config
+from app.services.openai_clients import (
+    _http_limits,
+    close_openai_clients,
+    get_async_openai_client,
+    get_openai_client,
+    reset_openai_clients,
+)
+
+
+@pytest.fixture(autouse=True)
+def clean_registry():
+    """Vide le registre avant et après chaque test."""
+    reset_openai_clients()
+    yield
+    reset_openai_clients()
+
+
+@pytest.mark.unit
+class TestOpenAIClientRegistry:
+    """Tests pour get_openai_client() / get_async_openai_client()."""
+
+    def test_same_model_reuses_client(self, settings):
+        """Test qu'un même modèle réutilise le même client (pool partagé)."""
+        first = get_openai_client("gpt-4o-mini", settings)
+        second = get_openai_client("gpt-4o-mini", settings)
+        assert first is second
+
+    def test_one_client_per_model(self, settings):
+        """Test qu'un client distinct est créé par modèle."""
+        light = get_openai_client("gpt-4o-mini", settings)
+        heavy = get_openai_client("gpt-4o", settings)
+        assert light is not heavy
+
+    def test_pool_limits_from_settings(self, settings):
+        """Test que les limites du pool HTTP viennent des settings."""
+        settings.openai_max_connections = 7
+        settings.openai_max_keepalive_connections = 3
+        limits = _http_limits(settings)
+        assert limits.max_connections == 7
+        assert limits.max_keepalive_connections == 3
+
+    def test_async_client_reused_within_loop(self, settings):
+        """Test que le client async est partagé au sein d'une même boucle puis fermé proprement."""
+
+        async def scenario():
+            first = get_async_openai_client("gpt-4o-mini", settings)
+            second = get_async_openai_client("gpt-4o-mini", settings)
+            await close_openai_clients()
+            return first, second
+
+        first, second = asyncio.run(scenario())
+        assert first is second
+
+    @pytest.mark.parametrize("rate_limit_enabled", [True, False])
+    def test_async_client_has_no_sdk_retries(self, settings, rate_limit_enabled):
+        """Test que le SDK ne retente jamais : call_with_retries reste la seule couche de nouvelles tentatives."""
+        settings.rate_limit_enabled = rate_limit_enabled
+
+        async def scenario():
+            client = get_async_openai_client("gpt-4o-mini", settings)
+            await close_openai_clients()
+            return client
+
+        assert asyncio.run(scenario()).max_retries == 0
+
+
+@pytest.mark.unit
+class TestSettingsCache:
+    """Tests pour get_settings() / reload_settings()."""
+
+    def test_settings_cached_and_reloaded(self, monkeypatch):
+        """Test que get_settings() est mis en cache et que reload_settings() relit l'environnement."""
+        monkeypatch.setenv("OPENAI_API_KEY", "sk-first")
+        first = config.reload_settings()
+        assert config.get_settings() is first
+
+        monkeypatch.setenv("OPENAI_API_KEY", "sk-second")
+        assert config.get_settings().openai_api_key == "sk-first"
+        assert config.reload_settings().openai_api_key == "sk-second"
+        config.get_settings.cache_clear()
@@ -0,0 +1,144 @@
+"""
+Tests unitaires pour le traitement des PDF multi-pages (pdf.py).
+"""
+
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.services.deadline import Deadline
+from app.services.pdf import extract_page_texts, has_usable_text_layer, prepare_pdf, select_pages
+
+
+@pytest.mark.unit
+class TestSelectPages:
+    """Tests pour l'heuristique select_pages()."""
+
+    def test_short_document_sent_entirely(self):
+        """Test qu'un document court est envoyé en entier."""
+        assert select_pages([], total_pages=2, max_selected=3) == [1, 2]
+
+    def test_first_page_and_totals_page(self):
+        """Test sélection 1ère page + page contenant les totaux."""
+        texts = ["FACTURE N° 12", "lignes...", "Total TTC : 1 180 000", "conditions générales"]
+        assert select_pages(texts, total_pages=4, max_selected=2) == [1, 3]
+
+    def test_last_totals_page_wins(self):
+        """Test que la dernière page avec des totaux est retenue (sous-totaux intermédiaires)."""
+        texts = ["Relevé", "Montant TTC report", "...", "NET A PAYER 2 500 000", "annexe"]
+        assert select_pages(texts, total_pages=5, max_selected=2) == [1, 4]
+
+    def test_scanned_document_falls_back_to_last_page(self):
+        """Test que sans couche texte, la 1ère et la dernière page sont retenues."""
+        assert select_pages(["", "", "", ""], total_pages=4, max_selected=2) == [1, 4]
+
+
+@pytest.mark.unit
+class TestExtractPageTexts:
+    """Tests pour extract_page_texts() (pdftotext mocké)."""
+
+    @patch('app.services.pdf.subprocess.run')
+    def test_deadline_caps_pdftotext_timeout(self, mock_run):
+        """Test que le timeout de pdftotext est borné par le temps restant avant l'échéance."""
+        mock_run.return_value = MagicMock(stdout="page 1\fpage 2\f".encode("utf-8"))
+
+        texts = extract_page_texts(Path("document.pdf"), 2, Deadline.after(5))
+        extract_page_texts(Path("document.pdf"), 2)
+
+        assert texts == ["page 1", "page 2"]
+        capped, default = (call.kwargs["timeout"] for call in mock_run.call_args_list)
+        assert 0 < capped <= 5
+        assert default == 30
+
+
+@pytest.mark.unit
+class TestPreparePdf:
+    """Tests pour prepare_pdf() (poppler mocké)."""
+
+    @patch('app.services.pdf.rasterize_pages')
+    @patch('app.services.pdf.extract_page_texts')
+    @patch('app.services.pdf.page_count')
+    def test_only_selected_pages_rasterized(self, mock_count, mock_texts, mock_rasterize, settings, prepared_image):
+        """Test que seules les pages sélectionnées d'un long relevé sont rasterisées."""
+        settings.pdf_max_selected_pages = 2
+        mock_count.return_value = 30
+        mock_texts.return_value = ["En-tête"] + [""] * 27 + ["Total TTC 100", ""]
+        mock_rasterize.return_value = [prepared_image, prepared_image]
+
+        document = prepare_pdf(b"%PDF-1.4", settings)
+
+        assert mock_rasterize.call_args.args[1] == [1, 29]
+        assert document.page_count == 30
+        assert document.pages_sent == [1, 29]
+        assert len(document.images) == 2
+
+    @patch('app.services.pdf.rasterize_pages')
+    @patch('app.services.pdf.extract_page_texts')
+    @patch('app.services.pdf.page_count')
+    def test_page_cap_applied(self, mock_count, mock_texts, mock_rasterize, settings, prepared_image):
+        """Test que seules les pdf_max_pages premières pages sont lues."""
+        settings.pdf_max_pages = 10
+        settings.pdf_max_selected_pages = 2
+        mock_count.return_value = 200
+        mock_texts.return_value = [""] * 10
+        mock_rasterize.return_value = [prepared_image, prepared_image]
+
+        prepare_pdf(b"%PDF-1.4", settings)
+
+        assert mock_texts.call_args.args[1] == 10
+        assert mock_rasterize.call_args.args[1] == [1, 10]
+
+
+DIGITAL_PAGE = (
+    "SOCIETE BENINOISE DE DISTRIBUTION SARL     IFU 3202357630374\n"
+    "FACTURE N° FA-2025-0042                     Date : 07/03/2025\n"
+    "Désignation                 Qté     PU          Montant\n"
+    "Fourniture de bureau        10      25.000      250.000\n"
+    "Client : AZO CONSULTING      Adresse : Cotonou, Bénin   RCCM RB/COT/21 B 12345\n"
+    "Conditions de paiement : 30 jours fin de mois   Code MECeF/DGI : VEY-LZ3YE-R5RZ-MOPB\n"
+    "Total HT 250.000   TVA 18% 45.000   Total TTC 295.000 XOF\n"
+)
+
+
+@pytest.mark.unit
+class TestTextLayer:
+    """Tests pour la détection de la couche texte et le chemin texte de prepare_pdf()."""
+
+    def test_digital_page_is_usable(self):
+        """Test qu'une page numérique suffisamment remplie est exploitable."""
+        assert has_usable_text_layer([DIGITAL_PAGE], min_chars=200)
+
+    def test_scanned_or_garbage_text_not_usable(self):
+        """Test qu'une couche vide ou illisible (polices mal encodées) est rejetée."""
+        assert not has_usable_text_layer(["", ""], min_chars=200)
+        assert not has_usable_text_layer(["\x01\x02 ~~~~ ####" * 50], min_chars=200)
+
+    @patch('app.services.pdf.rasterize_pages')
+    @patch('app.services.pdf.extract_page_texts')
+    @patch('app.services.pdf.page_count')
+    def test_digital_pdf_skips_rasterization(self, mock_count, mock_texts, mock_rasterize, settings):
+        """Test qu'un PDF numérique passe par le chemin texte sans rasterisation."""
+        mock_count.return_value = 1
+        mock_texts.return_value = [DIGITAL_PAGE]
+
+        document = prepare_pdf(b"%PDF-1.4 digital", settings)
+
+        mock_rasterize.assert_not_called()
+        assert document.input_mode == "text"
+        assert "Total TTC 295.000" in document.text
+        assert document.bytes_in == len(b"%PDF-1.4 digital")
+
+    @patch('app.services.pdf.rasterize_pages')
+    @patch('app.services.pdf.extract_page_texts')
+    @patch('app.services.pdf.page_count')
+    def test_scanned_pdf_falls_back_to_vision(self, mock_count, mock_texts, mock_rasterize, settings, prepared_image):
+        """Test qu'un scan (couche texte vide) passe par le chemin vision."""
+        mock_count.return_value = 1
+        mock_texts.return_value = [""]
+        mock_rasterize.return_value = [prepared_image]
+
+        document = prepare_pdf(b"%PDF-1.4 scan", settings)
+
+        assert document.input_mode == "vision"
+        assert document.images == [prepared_image]
@@ -1,6 +1,6 @@
 """
 Script de test du pipeline d'extraction sur les factures du dossier sample_invoices/.
-Lance l'endpoint /api/v1/extract pour chaque fichier et sauvegarde les résultats dans resultats/extractions.csv
+Lance l'endpoint /api/v1/extract pour chaque fichier et enregistre les résultats dans resultats/results.sqlite3
 """
 
 import os
@@ -20,7 +20,7 @@ API_ENDPOINT = "http://127.0.0.1:8000/api/v1/extract"
 def test_extract_all_invoices():
     """
     Parcourt tous les fichiers du dossier sample_invoices/ et appelle l'endpoint d'extraction.
-    Les résultats sont automatiquement sauvegardés dans resultats/extractions.csv par le serveur.
+    Les résultats sont automatiquement enregistrés dans resultats/results.sqlite3 par le serveur.
     """
     if not SAMPLE_INVOICES_DIR.exists():
         print(f"Dossier sample_invoices/ introuvable à : {SAMPLE_INVOICES_DIR}")
@@ -44,7 +44,12 @@ def test_extract_all_invoices():
             try:
                 with open(file_path, "rb") as f:
                     files_payload = {"file": (file_path.name, f, "application/pdf")}
-                    response = requests.post(API_ENDPOINT, files=files_payload, timeout=60)
+                    response = requests.post(
+                        API_ENDPOINT,
+                        files=files_payload,
+                        headers={"X-Request-Timeout": "55"},  # budget serveur < timeout client
+                        timeout=60,
+                    )
 
                 if response.status_code == 200:
                     result = response.json()
@@ -60,7 +65,7 @@ def test_extract_all_invoices():
             except Exception as e:
                 print(f"Erreur : {e}")
 
-    print(f"\nTraitement terminé. Les résultats sont dans resultats/extractions.csv")
+    print(f"\nTraitement terminé. Les résultats sont consultables via GET /api/v1/extractions")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,91 @@
+"""
+Tests unitaires pour le prétraitement des images (preprocessing.py).
+"""
+
+import base64
+import io
+
+import pytest
+from PIL import Image
+
+from app.services.preprocessing import prepare_image_bytes
+
+
+def _encode(image: Image.Image, fmt: str, **kwargs) -> bytes:
+    """Encode une image PIL dans le format demandé."""
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **kwargs)
+    return buffer.getvalue()
+
+
+def _decode(prepared) -> Image.Image:
+    """Relit l'image prétraitée depuis son base64."""
+    return Image.open(io.BytesIO(base64.b64decode(prepared.base64)))
+
+
+@pytest.mark.unit
+class TestPrepareImage:
+    """Tests pour prepare_image_bytes()."""
+
+    def test_large_photo_downscaled_to_tiling_limits(self, settings):
+        """Test qu'une photo 12 MP est ramenée dans les limites de tuilage (768 px petit côté)."""
+        photo = Image.new("RGB", (3000, 4000), (200, 30, 30))
+        content = _encode(photo, "JPEG", quality=95)
+
+        prepared = prepare_image_bytes(content, settings)
+
+        assert (prepared.width, prepared.height) == (768, 1024)
+        assert prepared.mime_type == "image/jpeg"
+        assert prepared.bytes_in == len(content)
+        assert prepared.bytes_out < prepared.bytes_in
+
+    def test_exif_orientation_applied(self, settings):
+        """Test que l'orientation EXIF est appliquée (photo prise en portrait)."""
+        photo = Image.new("RGB", (400, 200), (200, 30, 30))
+        exif = photo.getexif()
+        exif[0x0112] = 6  # Rotation 90° horaire
+        content = _encode(photo, "JPEG", exif=exif)
+
+        prepared = prepare_image_bytes(content, settings)
+
+        assert (prepared.width, prepared.height) == (200, 400)
+
+    def test_colorless_scan_converted_to_grayscale(self, settings):
+        """Test qu'un scan sans couleur est ré-encodé en niveaux de gris."""
+        scan = Image.new("RGB", (1200, 1600), (250, 250, 250))
+        scan.paste((20, 20, 20), (100, 100, 1100, 140))
+        content = _encode(scan, "PNG")
+
+        prepared = prepare_image_bytes(content, settings)
+
+        assert _decode(prepared).mode == "L"
+
+    def test_png_mime_type_preserved_when_passthrough(self, settings, test_image_base64):
+        """Test qu'un petit PNG déjà optimal est renvoyé tel quel avec le bon type MIME."""
+        content = base64.b64decode(test_image_base64)
+
+        prepared = prepare_image_bytes(content, settings)
+
+        assert prepared.mime_type == "image/png"
+        assert prepared.base64 == test_image_base64
+
+    def test_animated_gif_first_frame(self, settings):
+        """Test qu'un GIF animé est réduit à sa première image, ré-encodée en JPEG."""
+        frames = [Image.new("RGB", (100, 100), color) for color in ((255, 0, 0), (0, 0, 255))]
+        content = _encode(frames[0], "GIF", save_all=True, append_images=frames[1:])
+
+        prepared = prepare_image_bytes(content, settings)
+
+        assert prepared.mime_type == "image/jpeg"
+        red, _, blue = _decode(prepared).convert("RGB").getpixel((50, 50))
+        assert red > blue
+
+    def test_webp_output_format(self, settings):
+        """Test que le format de sortie WebP est respecté."""
+        settings.image_format = "webp"
+        photo = Image.new("RGB", (3000, 2000), (30, 120, 200))
+
+        prepared = prepare_image_bytes(_encode(photo, "PNG"), settings)
+
+        assert prepared.mime_type == "image/webp"
+        assert _decode(prepared).format == "WEBP"
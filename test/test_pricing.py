@@ -0,0 +1,39 @@
+"""
+Tests unitaires pour le calcul du coût des appels LLM (pricing.py).
+"""
+
+import pytest
+
+from app.monitoring.pricing import usage_cost
+
+PRICES = {
+    "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+    "gpt-4o": {"input": 2.50, "output": 10.00},
+}
+
+
+@pytest.mark.unit
+class TestUsageCost:
+    """Tests pour usage_cost()."""
+
+    def test_cost_per_million_tokens(self):
+        """Test du coût prompt + complétion au tarif du modèle."""
+        assert usage_cost("gpt-4o", 1_000_000, 100_000, 0, PRICES) == pytest.approx(2.50 + 1.00)
+
+    def test_cached_tokens_use_cached_price(self):
+        """Test que les tokens servis par le cache sont facturés au tarif cached_input."""
+        cost = usage_cost("gpt-4o-mini", 1000, 0, 600, PRICES)
+
+        assert cost == pytest.approx((400 * 0.15 + 600 * 0.075) / 1_000_000)
+
+    def test_cached_price_defaults_to_input(self):
+        """Test qu'à défaut de tarif cached_input, le tarif input s'applique."""
+        assert usage_cost("gpt-4o", 1000, 0, 1000, PRICES) == pytest.approx(1000 * 2.50 / 1_000_000)
+
+    def test_dated_model_matches_longest_prefix(self):
+        """Test qu'un modèle daté prend le prix du plus long préfixe connu."""
+        assert usage_cost("gpt-4o-mini-2024-07-18", 1_000_000, 0, 0, PRICES) == pytest.approx(0.15)
+
+    def test_unknown_model(self):
+        """Test qu'un modèle absent de la table n'a pas de coût."""
+        assert usage_cost("o1-preview", 1000, 1000, 0, PRICES) is None
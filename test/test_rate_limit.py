@@ -0,0 +1,206 @@
+"""
+Tests unitaires pour la limitation de débit côté client (rate_limit.py).
+"""
+
+import asyncio
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import httpx
+import pytest
+from openai import RateLimitError
+
+from app.services.llm_client import extract_invoice_from_image_async
+from app.services.rate_limit import (
+    AdaptiveConcurrency,
+    ModelRateLimiter,
+    RateLimitQueueTimeout,
+    TokenBucket,
+    estimate_request_tokens,
+    parse_duration,
+    reset_rate_limiters,
+    retry_after_s,
+)
+
+
+@pytest.fixture(autouse=True)
+def clean_limiters():
+    """Limiteurs neufs pour chaque test."""
+    reset_rate_limiters()
+    yield
+    reset_rate_limiters()
+
+
+def _rate_limit_error(headers: dict, code=None) -> RateLimitError:
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(429, headers=headers, request=request)
+    body = {"code": code} if code else None
+    return RateLimitError("Rate limit reached", response=response, body=body)
+
+
+@pytest.mark.unit
+class TestHeaders:
+    """Tests pour la lecture des en-têtes de limitation."""
+
+    def test_parse_duration(self):
+        """Test des formats de durée renvoyés par l'API."""
+        assert parse_duration("20ms") == pytest.approx(0.02)
+        assert parse_duration("6m0s") == pytest.approx(360.0)
+        assert parse_duration("1.5") == pytest.approx(1.5)
+        assert parse_duration("") is None
+
+    def test_retry_after_prefers_milliseconds(self):
+        """Test que retry-after-ms l'emporte sur les autres en-têtes."""
+        headers = httpx.Headers({"retry-after-ms": "250", "retry-after": "3"})
+
+        assert retry_after_s(headers) == pytest.approx(0.25)
+        assert retry_after_s(httpx.Headers({"x-ratelimit-reset-tokens": "2s"})) == pytest.approx(2.0)
+
+
+@pytest.mark.unit
+class TestEstimateTokens:
+    """Tests pour estimate_request_tokens()."""
+
+    def test_images_count_tiles(self, settings):
+        """Test qu'une image est estimée au nombre de tuiles de la taille maximale (2048x768 : 8 tuiles)."""
+        messages = [{"role": "user", "content": [{"type": "image_url", "image_url": {"url": "data:..."}}]}]
+
+        assert estimate_request_tokens(messages, settings) == settings.rate_limit_completion_tokens + 85 + 170 * 8
+
+    def test_text_counts_characters(self, settings):
+        """Test de l'estimation du texte (~4 caractères par token)."""
+        messages = [{"role": "system", "content": "x" * 400}]
+
+        assert estimate_request_tokens(messages, settings) == settings.rate_limit_completion_tokens + 100
+
+
+@pytest.mark.unit
+class TestTokenBucket:
+    """Tests pour TokenBucket."""
+
+    def test_burst_then_wait(self):
+        """Test que la rafale est servie sans attente puis que l'excédent attend au débit."""
+        bucket = TokenBucket(per_minute=60)  # 1/s, rafale de 10
+
+        waits = [bucket.reserve(1, max_wait_s=10) for _ in range(12)]
+
+        assert waits[:10] == [0.0] * 10
+        assert waits[11] == pytest.approx(2.0, abs=0.05)
+
+    def test_wait_beyond_budget_raises_and_refunds(self):
+        """Test qu'une attente au-delà du budget lève sans consommer le seau."""
+        bucket = TokenBucket(per_minute=60)
+        bucket.reserve(10, max_wait_s=0)
+
+        with pytest.raises(RateLimitQueueTimeout):
+            bucket.reserve(5, max_wait_s=1)
+        assert bucket.reserve(1, max_wait_s=2) == pytest.approx(1.0, abs=0.05)
+
+
+@pytest.mark.unit
+class TestAdaptiveConcurrency:
+    """Tests pour la concurrence AIMD."""
+
+    def test_additive_increase_multiplicative_decrease(self):
+        """Test +1/limite par succès et division par 2 (une fois par rafale) sur 429."""
+        concurrency = AdaptiveConcurrency(initial=4, maximum=8)
+        for _ in range(5):
+            concurrency.increase()
+        assert int(concurrency.limit) == 5
+
+        assert concurrency.decrease() is True
+        assert concurrency.decrease() is False
+        assert int(concurrency.limit) == 2
+
+    def test_acquire_waits_for_release(self):
+        """Test qu'un appel au-delà de la limite attend une libération, ou abandonne au délai."""
+
+        async def scenario():
+            concurrency = AdaptiveConcurrency(initial=1, maximum=1)
+            await concurrency.acquire(1.0)
+            with pytest.raises(RateLimitQueueTimeout):
+                await concurrency.acquire(0.05)
+            asyncio.get_running_loop().call_later(0.05, lambda: asyncio.ensure_future(concurrency.release()))
+            await concurrency.acquire(1.0)
+            return concurrency.in_flight
+
+        assert asyncio.run(scenario()) == 1
+
+
+@pytest.mark.unit
+class TestModelRateLimiter:
+    """Tests pour ModelRateLimiter."""
+
+    def test_headers_resync_limits(self, settings):
+        """Test que les limites et restes annoncés par l'API recalent les seaux."""
+        limiter = ModelRateLimiter("gpt-4o", settings)
+        limiter.on_headers(
+            httpx.Headers(
+                {
+                    "x-ratelimit-limit-tokens": "60000",
+                    "x-ratelimit-remaining-tokens": "10000",
+                    "x-ratelimit-limit-requests": "600",
+                    "x-ratelimit-remaining-requests": "0",
+                    "x-ratelimit-reset-requests": "2s",
+                }
+            )
+        )
+
+        assert limiter.stats()["tpm"] == 54000
+        assert limiter.tokens.level == pytest.approx(10000 - 6000)
+        assert limiter.paused_until > time.monotonic() + 1.5
+
+    def test_unknown_model_only_adaptive(self, settings):
+        """Test qu'un modèle sans limites configurées n'a que la concurrence adaptative."""
+        limiter = ModelRateLimiter("o1-preview", settings)
+
+        assert limiter.requests is None and limiter.tokens is None
+
+
+@pytest.mark.unit
+@pytest.mark.mock_llm
+class TestRateLimitedCall:
+    """Tests de l'appel LLM régulé (llm_client._chat_completion_async)."""
+
+    @patch('app.services.llm_client.get_async_openai_client')
+    def test_429_is_requeued_not_raised(self, mock_get_client, mock_llm_response_valid, settings, test_image_base64):
+        """Test qu'un 429 remet l'appel en file (après le délai demandé) au lieu d'échouer."""
+        mock_client = MagicMock()
+        mock_get_client.return_value = mock_client
+        mock_client.chat.completions.create = AsyncMock(
+            side_effect=[_rate_limit_error({"retry-after-ms": "50"}), mock_llm_response_valid]
+        )
+
+        async def scenario():
+            started = time.monotonic()
+            result = await extract_invoice_from_image_async(test_image_base64, model="gpt-4o-mini", settings=settings)
+            return result, time.monotonic() - started
+
+        result, elapsed = asyncio.run(scenario())
+
+        assert result.montant_ttc == 1200.0
+        assert mock_client.chat.completions.create.await_count == 2
+        assert elapsed >= 0.05
+
+    @patch('app.services.llm_client.get_async_openai_client')
+    def test_insufficient_quota_raised(self, mock_get_client, settings, test_image_base64):
+        """Test qu'un quota épuisé n'est pas réessayé."""
+        mock_client = MagicMock()
+        mock_get_client.return_value = mock_client
+        mock_client.chat.completions.create = AsyncMock(side_effect=_rate_limit_error({}, code="insufficient_quota"))
+
+        with pytest.raises(RateLimitError):
+            asyncio.run(extract_invoice_from_image_async(test_image_base64, model="gpt-4o-mini", settings=settings))
+        assert mock_client.chat.completions.create.await_count == 1
+
+    @patch('app.services.llm_client.get_async_openai_client')
+    def test_queue_budget_exhausted(self, mock_get_client, settings, test_image_base64):
+        """Test qu'au-delà de rate_limit_max_queue_s, l'appel abandonne."""
+        settings.rate_limit_max_queue_s = 0.5
+        mock_client = MagicMock()
+        mock_get_client.return_value = mock_client
+        mock_client.chat.completions.create = AsyncMock(side_effect=_rate_limit_error({"retry-after": "5"}))
+
+        with pytest.raises(RateLimitQueueTimeout):
+            asyncio.run(extract_invoice_from_image_async(test_image_base64, model="gpt-4o-mini", settings=settings))
+        assert mock_client.chat.completions.create.await_count == 1
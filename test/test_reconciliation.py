@@ -0,0 +1,107 @@
+"""
+Tests unitaires pour la réconciliation arithmétique locale (reconciliation.py).
+"""
+
+import json
+
+import pytest
+
+from app.services.reconciliation import reconcile_amounts, reconcile_raw_json
+
+
+def _invoice(ht, tva, ttc, lines=None):
+    """Réponse LLM minimale avec les montants donnés."""
+    return {
+        "fournisseur": "Entreprise Test SARL",
+        "numero_facture": "FAC-001",
+        "date": "2025-02-26",
+        "montant_ht": ht,
+        "montant_tva": tva,
+        "montant_ttc": ttc,
+        "devise": "XOF",
+        "lignes_detail": [
+            {"description": f"Ligne {index}", "quantite": 1.0, "prix_unitaire": amount, "montant_ligne": amount}
+            for index, amount in enumerate(lines or [])
+        ],
+    }
+
+
+@pytest.mark.unit
+class TestReconcileAmounts:
+    """Tests pour reconcile_amounts()."""
+
+    def test_thousands_separator_misread(self, settings):
+        """Test d'un TTC lu 118.0 au lieu de 118.000 (séparateur de milliers pris pour une décimale)."""
+        result = reconcile_amounts(_invoice(100000.0, 18000.0, 118.0, lines=[60000.0, 40000.0]), settings)
+
+        assert result is not None
+        assert result.data.montant_ttc == 118000.0
+        assert "montant_ttc x1000" in result.corrections
+
+    def test_ht_ttc_swapped(self, settings):
+        """Test de HT et TTC inversés."""
+        result = reconcile_amounts(_invoice(118000.0, 18000.0, 100000.0), settings)
+
+        assert result is not None
+        assert (result.data.montant_ht, result.data.montant_ttc) == (100000.0, 118000.0)
+
+    def test_cameroon_vat_rate(self, settings):
+        """Test d'une TVA camerounaise (19,25 %) mal lue, recalculée depuis HT et TTC."""
+        result = reconcile_amounts(_invoice(200000.0, 3850.0, 238500.0), settings)
+
+        assert result is not None
+        assert result.data.montant_tva == 38500.0
+
+    def test_ht_from_line_total(self, settings):
+        """Test d'un HT incohérent corrigé par le total des lignes de détail."""
+        result = reconcile_amounts(_invoice(150000.0, 18000.0, 118000.0, lines=[100000.0]), settings)
+
+        assert result is not None
+        assert result.data.montant_ht == 100000.0
+
+    def test_rejects_correction_inconsistent_with_lines(self, settings):
+        """Test qu'une correction contredite par les lignes de détail est refusée."""
+        result = reconcile_amounts(_invoice(100000.0, 18000.0, 118.0, lines=[50000.0]), settings)
+
+        assert result is None
+
+    def test_rejects_unusual_vat_rate(self, settings):
+        """Test qu'une correction aboutissant à un taux de TVA non usuel est refusée."""
+        result = reconcile_amounts(_invoice(100.0, 20.0, 150.0), settings)
+
+        assert result is None
+
+    def test_ttc_recomputed_only_with_line_evidence(self, settings):
+        """Test qu'un TTC recalculé (HT + TVA) n'est retenu que si les lignes de détail le confirment."""
+        assert reconcile_amounts(_invoice(100000.0, 18000.0, 117500.0), settings) is None
+
+        result = reconcile_amounts(_invoice(100000.0, 18000.0, 117500.0, lines=[100000.0]), settings)
+
+        assert result is not None
+        assert result.data.montant_ttc == 118000.0
+        assert result.corrections == ["montant_ttc = HT + TVA"]
+
+    def test_rounding_tolerance_setting(self, settings):
+        """Test que RECONCILIATION_ROUNDING_TOLERANCE borne l'arrondi admis sur le taux de TVA."""
+        raw = _invoice(1183.0, 183.0, 1000.0)  # HT / TTC inversés, TVA à 3 unités de 18 %
+
+        assert reconcile_amounts(raw, settings) is None
+        settings.reconciliation_rounding_tolerance = 3.0
+        result = reconcile_amounts(raw, settings)
+
+        assert result is not None
+        assert result.data.montant_ttc == 1183.0
+
+    def test_missing_amount_returns_none(self, settings):
+        """Test qu'un montant absent ne permet aucune réconciliation."""
+        raw = _invoice(100000.0, 18000.0, 118.0)
+        raw["montant_ht"] = None
+
+        assert reconcile_amounts(raw, settings) is None
+
+    def test_from_raw_json(self, settings):
+        """Test de la réconciliation depuis le JSON brut (MathValidationError.raw_json)."""
+        raw_json = json.dumps(_invoice(118000.0, 18000.0, 100000.0))
+
+        assert reconcile_raw_json(raw_json, settings) is not None
+        assert reconcile_raw_json("pas du json", settings) is None
@@ -0,0 +1,142 @@
+"""
+Tests unitaires pour la résilience des appels LLM (resilience.py).
+"""
+
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import httpx
+import openai
+import pytest
+
+from app.models.constants import MathValidationError
+from app.services.resilience import (
+    CIRCUIT_CLOSED,
+    CIRCUIT_HALF_OPEN,
+    CIRCUIT_OPEN,
+    ERROR_PERMANENT,
+    ERROR_TRANSIENT,
+    ERROR_VALIDATION,
+    CircuitBreaker,
+    CircuitOpenError,
+    backoff_delay,
+    call_with_retries,
+    classify_error,
+)
+
+_REQUEST = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+
+def _status_error(status: int, headers: dict = None) -> openai.APIStatusError:
+    response = httpx.Response(status, headers=headers or {}, request=_REQUEST)
+    error_class = {500: openai.InternalServerError, 503: openai.InternalServerError, 401: openai.AuthenticationError}
+    return error_class.get(status, openai.APIStatusError)("erreur", response=response, body=None)
+
+
+@pytest.mark.unit
+class TestClassifyError:
+    """Tests pour classify_error()."""
+
+    def test_transient_errors(self):
+        """Test que réseau, timeout et 5xx sont transitoires."""
+        assert classify_error(openai.APITimeoutError(request=_REQUEST)) == ERROR_TRANSIENT
+        assert classify_error(openai.APIConnectionError(request=_REQUEST)) == ERROR_TRANSIENT
+        assert classify_error(_status_error(503)) == ERROR_TRANSIENT
+        assert classify_error(TimeoutError("timeout")) == ERROR_TRANSIENT
+
+    def test_validation_errors(self):
+        """Test que les réponses invalides relèvent de la validation."""
+        assert classify_error(MathValidationError("écart", 100, 20, 150)) == ERROR_VALIDATION
+        assert classify_error(ValueError("JSON invalide")) == ERROR_VALIDATION
+
+    def test_permanent_errors(self):
+        """Test que les refus du fournisseur (authentification, requête invalide) sont permanents."""
+        assert classify_error(_status_error(401)) == ERROR_PERMANENT
+        assert classify_error(_status_error(400)) == ERROR_PERMANENT
+
+
+@pytest.mark.unit
+class TestBackoff:
+    """Tests pour backoff_delay()."""
+
+    def test_exponential_ceiling(self, settings):
+        """Test que le délai reste sous le plafond exponentiel, lui-même borné."""
+        for retry in range(6):
+            delay = backoff_delay(retry, settings)
+            assert 0 <= delay <= min(settings.llm_backoff_max_s, settings.llm_backoff_base_s * 2**retry)
+
+    def test_retry_after_honoured(self, settings):
+        """Test que le Retry-After demandé est respecté (dans la limite de llm_backoff_max_s)."""
+        assert backoff_delay(0, settings, retry_after=3.0) >= 3.0
+        assert backoff_delay(0, settings, retry_after=60.0) == settings.llm_backoff_max_s
+
+
+@pytest.mark.unit
+class TestCircuitBreaker:
+    """Tests pour CircuitBreaker."""
+
+    def test_opens_after_threshold_and_fails_fast(self):
+        """Test de l'ouverture après N erreurs transitoires consécutives."""
+        breaker = CircuitBreaker("gpt-4o", failure_threshold=3, open_s=30)
+        for _ in range(3):
+            breaker.before_call()
+            breaker.record_failure()
+
+        assert breaker.state()["state"] == CIRCUIT_OPEN
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+
+    def test_half_open_single_probe(self):
+        """Test qu'après la période d'ouverture, un seul appel de test passe ; son succès referme."""
+        breaker = CircuitBreaker("gpt-4o", failure_threshold=1, open_s=0)
+        breaker.record_failure()
+
+        assert breaker.state()["state"] == CIRCUIT_HALF_OPEN
+        breaker.before_call()
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+        breaker.record_success()
+        assert breaker.state()["state"] == CIRCUIT_CLOSED
+
+    def test_failed_probe_reopens(self):
+        """Test qu'un appel de test en échec rouvre le disjoncteur."""
+        breaker = CircuitBreaker("gpt-4o", failure_threshold=1, open_s=0)
+        breaker.record_failure()
+        breaker.before_call()
+        breaker.open_s = 30
+
+        breaker.record_failure()
+
+        assert breaker.state()["state"] == CIRCUIT_OPEN
+        assert breaker.open_count == 2
+
+
+@pytest.mark.unit
+class TestCallWithRetries:
+    """Tests pour call_with_retries()."""
+
+    @patch('app.services.resilience.asyncio.sleep', new_callable=AsyncMock)
+    def test_transient_retried_with_backoff(self, mock_sleep, settings):
+        """Test qu'une erreur transitoire est retentée après un délai, puis réussit."""
+        call = AsyncMock(side_effect=[_status_error(503, {"retry-after": "2"}), "ok"])
+
+        assert asyncio.run(call_with_retries(call, "gpt-4o-mini", settings)) == "ok"
+        assert call.await_count == 2
+        assert mock_sleep.await_args.args[0] >= 2.0
+
+    @patch('app.services.resilience.asyncio.sleep', new_callable=AsyncMock)
+    def test_retries_exhausted(self, mock_sleep, settings):
+        """Test que l'erreur est propagée après llm_transient_retries nouveaux essais."""
+        call = AsyncMock(side_effect=openai.APITimeoutError(request=_REQUEST))
+
+        with pytest.raises(openai.APITimeoutError):
+            asyncio.run(call_with_retries(call, "gpt-4o-mini", settings))
+        assert call.await_count == settings.llm_transient_retries + 1
+
+    def test_validation_and_permanent_not_retried(self, settings):
+        """Test que validation et erreurs permanentes ne sont pas retentées."""
+        for error in (ValueError("JSON invalide"), _status_error(401)):
+            call = AsyncMock(side_effect=error)
+            with pytest.raises(type(error)):
+                asyncio.run(call_with_retries(call, "gpt-4o-mini", settings))
+            assert call.await_count == 1
@@ -0,0 +1,258 @@
+"""
+Tests unitaires pour la base des résultats d'extraction (results.py) et GET /api/v1/extractions.
+"""
+
+import csv
+import json
+from io import BytesIO, StringIO
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.services.ocr_pipeline import ExtractionResult
+from app.services.preprocessing import PreparedDocument
+from app.services.results import ResultStore
+
+
+def _invoice(numero: str, date: str = "2025-02-26", ifu: str = "1234567890123", lines: int = 1) -> dict:
+    return {
+        "fournisseur": "Entreprise Test SARL",
+        "numero_facture": numero,
+        "date": date,
+        "montant_ht": 1000.0,
+        "montant_tva": 180.0,
+        "montant_ttc": 1180.0,
+        "devise": "XOF",
+        "ifu_fournisseur": ifu,
+        "code_mecef": None,
+        "confiance": 0.9,
+        "lignes_detail": [
+            {"description": f"Ligne {i}", "quantite": 1.0, "prix_unitaire": 1000.0, "montant_ligne": 1000.0}
+            for i in range(lines)
+        ],
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    """Base des résultats à insertions synchrones."""
+    store = ResultStore(tmp_path / "results.sqlite3", background=False)
+    yield store
+    store.close()
+
+
+@pytest.mark.unit
+class TestResultStore:
+    """Tests pour l'enregistrement et la recherche des résultats."""
+
+    def test_full_invoice_kept(self, store):
+        """Test que les données complètes, lignes de détail comprises, sont conservées."""
+        store.save("facture.pdf", _invoice("F001", lines=3), False, content_hash="abc", trace_id="t1")
+
+        (item,), _ = store.query()
+        record = store.get(item["id"])
+
+        assert item["numero_facture"] == "F001"
+        assert item["nombre_lignes"] == 3
+        assert item["status"] == "success"
+        assert "data" not in item
+        assert len(record["data"]["lignes_detail"]) == 3
+        assert record["content_hash"] == "abc"
+        assert record["trace_id"] == "t1"
+
+    def test_failed_extraction_kept(self, store):
+        """Test qu'un échec est enregistré avec son message et sans données."""
+        store.save("illisible.pdf", None, True, error_message="JSON invalide")
+
+        (item,), _ = store.query()
+
+        assert item["status"] == "error"
+        assert item["needs_human_review"] is True
+        assert item["error_message"] == "JSON invalide"
+        assert store.get(item["id"])["data"] is None
+
+    def test_filters(self, store):
+        """Test des filtres indexés (IFU, numéro, empreinte) et du filtre de revue."""
+        store.save("a.pdf", _invoice("F001", ifu="111"), False, content_hash="h1")
+        store.save("b.pdf", _invoice("F002", ifu="222"), True, content_hash="h2")
+        store.save("c.pdf", _invoice("F003", ifu="111"), False, content_hash="h3")
+
+        def numeros(**filters):
+            items, _ = store.query(**filters)
+            return [item["numero_facture"] for item in items]
+
+        assert numeros(ifu_fournisseur="111") == ["F003", "F001"]
+        assert numeros(numero_facture="F002") == ["F002"]
+        assert numeros(content_hash="h3") == ["F003"]
+        assert numeros(needs_human_review=True) == ["F002"]
+        assert numeros(ifu_fournisseur="999") == []
+
+    def test_cursor_pagination(self, store):
+        """Test que les pages se suivent sans doublon ni trou, la dernière sans curseur."""
+        for i in range(7):
+            store.save(f"{i}.pdf", _invoice(f"F{i:03d}"), False)
+
+        seen, cursor = [], None
+        while True:
+            items, cursor = store.query(limit=3, cursor=cursor)
+            seen.extend(item["numero_facture"] for item in items)
+            if cursor is None:
+                break
+
+        assert seen == [f"F{i:03d}" for i in reversed(range(7))]
+
+    def test_date_range_ordered_by_invoice_date(self, store):
+        """Test qu'un filtre de date seul trie par date de facture, pagination comprise."""
+        for numero, date in (("F1", "2025-01-10"), ("F2", "2025-03-01"), ("F3", "2025-02-15"), ("F4", "2024-12-31")):
+            store.save(f"{numero}.pdf", _invoice(numero, date=date), False)
+
+        first, cursor = store.query(date_from="2025-01-01", date_to="2025-12-31", limit=2)
+        second, end = store.query(date_from="2025-01-01", date_to="2025-12-31", limit=2, cursor=cursor)
+
+        assert [item["date"] for item in first + second] == ["2025-03-01", "2025-02-15", "2025-01-10"]
+        assert end is None
+
+    def test_invalid_cursor_rejected(self, store):
+        """Test qu'un curseur malformé lève ValueError."""
+        with pytest.raises(ValueError):
+            store.query(cursor="pas-un-id")
+
+    @pytest.mark.parametrize(
+        "filters",
+        [
+            {},
+            {"ifu_fournisseur": "111"},
+            {"numero_facture": "F001"},
+            {"content_hash": "h1"},
+            {"date_from": "2025-01-01", "date_to": "2025-06-30"},
+            {"ifu_fournisseur": "111", "cursor": "500"},
+            {"date_from": "2025-01-01", "cursor": "2025-03-01|500"},
+        ],
+    )
+    def test_pages_read_from_index_without_sort(self, store, filters):
+        """Test que chaque recherche parcourt un index dans l'ordre du tri (pas de tri temporaire)."""
+        sql, params, _ = store.build_query(limit=51, **filters)
+
+        plan = " ".join(row["detail"] for row in store._connect().execute(f"EXPLAIN QUERY PLAN {sql}", params))
+
+        assert "TEMP B-TREE" not in plan
+        if filters.keys() - {"cursor"}:
+            assert "USING INDEX" in plan or "USING COVERING INDEX" in plan
+
+    def test_iter_export_pages_with_row_cursors(self, store):
+        """Test que l'export parcourt toutes les pages, chaque ligne portant le curseur de reprise."""
+        for i in range(5):
+            store.save(f"{i}.pdf", _invoice(f"F{i}"), i == 1)
+        store.save("illisible.pdf", None, True, error_message="JSON invalide")
+
+        pages = list(store.iter_export(page_size=2, status="success"))
+        rows = [item for page in pages for item in page]
+        resumed = [item for page in store.iter_export(page_size=2, cursor=rows[1]["cursor"]) for item in page]
+
+        assert [len(page) for page in pages] == [2, 2, 1]
+        assert [item["numero_facture"] for item in rows] == ["F4", "F3", "F2", "F1", "F0"]
+        assert [item["numero_facture"] for item in resumed] == ["F2", "F1", "F0"]
+
+    def test_background_inserts_batched(self, tmp_path):
+        """Test que les résultats déposés sont insérés par lots par le thread d'arrière-plan."""
+        store = ResultStore(tmp_path / "results.sqlite3", batch_size=100, flush_interval_s=60)
+        try:
+            for i in range(10):
+                store.save(f"{i}.pdf", _invoice(f"F{i}"), False)
+            assert store.flush()
+
+            items, _ = store.query(limit=100)
+            assert len(items) == 10
+            assert store.stats()["batches"] == 1
+        finally:
+            store.close()
+
+
+@pytest.mark.integration
+class TestExtractionsEndpoints:
+    """Tests pour GET /api/v1/extractions et GET /api/v1/extractions/{id}."""
+
+    @patch("app.services.extraction_service.prepare_document")
+    @patch("app.services.extraction_service.run_extraction_pipeline", new_callable=AsyncMock)
+    def test_extraction_saved_and_queryable(self, mock_pipeline, mock_prepare, prepared_image, sample_invoice_data):
+        """Test qu'une extraction via /extract est retrouvée par son IFU puis consultée en entier."""
+        mock_prepare.return_value = PreparedDocument(images=[prepared_image])
+        mock_pipeline.return_value = ExtractionResult(data=sample_invoice_data, needs_human_review=False)
+        client = TestClient(app)
+        files = {"file": ("facture.png", BytesIO(b"\x89PNG fake"), "image/png")}
+        assert client.post("/api/v1/extract", files=files).status_code == 200
+
+        page = client.get("/api/v1/extractions", params={"ifu_fournisseur": "1234567890123"}).json()
+        (item,) = page["items"]
+        record = client.get(f"/api/v1/extractions/{item['id']}").json()
+
+        assert page["next_cursor"] is None
+        assert item["filename"] == "facture.png"
+        assert item["content_hash"]
+        assert record["data"]["lignes_detail"][0]["description"] == "Consultation 1 jour"
+
+    def test_pagination_through_api(self, result_store):
+        """Test que next_cursor permet de parcourir toutes les pages."""
+        for i in range(5):
+            result_store.save(f"{i}.pdf", _invoice(f"F{i}"), False)
+        client = TestClient(app)
+
+        first = client.get("/api/v1/extractions", params={"limit": 3}).json()
+        second = client.get("/api/v1/extractions", params={"limit": 3, "cursor": first["next_cursor"]}).json()
+
+        assert len(first["items"]) == 3
+        assert len(second["items"]) == 2
+        assert second["next_cursor"] is None
+
+    def test_invalid_parameters(self):
+        """Test des erreurs : curseur invalide (400), date mal formée (422), extraction absente (404)."""
+        client = TestClient(app)
+
+        assert client.get("/api/v1/extractions", params={"cursor": "abc"}).status_code == 400
+        assert client.get("/api/v1/extractions", params={"date_from": "26/02/2025"}).status_code == 422
+        assert client.get("/api/v1/extractions/999").status_code == 404
+
+    def test_export_csv_and_resume(self, result_store):
+        """Test de l'export CSV filtré puis de sa reprise au curseur de la dernière ligne reçue."""
+        for i in range(4):
+            result_store.save(f"{i}.pdf", _invoice(f"F{i}", ifu="111" if i % 2 else "222"), False)
+        result_store.save("illisible.pdf", None, True, error_message="JSON invalide")
+        client = TestClient(app)
+
+        response = client.get("/api/v1/extractions/export", params={"status": "success"})
+        rows = list(csv.DictReader(StringIO(response.text.lstrip("\ufeff"))))
+        resumed = client.get("/api/v1/extractions/export", params={"status": "success", "cursor": rows[1]["cursor"]})
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+        assert response.text.startswith("\ufeffid,")
+        assert [row["numero_facture"] for row in rows] == ["F3", "F2", "F1", "F0"]
+        assert not resumed.text.startswith("\ufeff")
+        # Reprise sans en-tête : concaténée au fichier interrompu, elle le complète
+        combined = response.text.splitlines(keepends=True)[:3] + resumed.text.splitlines(keepends=True)
+        combined_rows = list(csv.DictReader(StringIO("".join(combined).lstrip("\ufeff"))))
+        assert [row["numero_facture"] for row in combined_rows] == ["F3", "F2", "F1", "F0"]
+
+    def test_export_ndjson_filtered(self, result_store):
+        """Test de l'export NDJSON filtré par IFU et revue manuelle."""
+        result_store.save("a.pdf", _invoice("F1", ifu="111"), True)
+        result_store.save("b.pdf", _invoice("F2", ifu="111"), False)
+        result_store.save("c.pdf", _invoice("F3", ifu="222"), True)
+
+        response = TestClient(app).get(
+            "/api/v1/extractions/export",
+            params={"format": "ndjson", "ifu_fournisseur": "111", "needs_human_review": "true"},
+        )
+        (item,) = [json.loads(line) for line in response.text.splitlines()]
+
+        assert response.headers["content-type"] == "application/x-ndjson"
+        assert item["numero_facture"] == "F1"
+        assert item["cursor"] == str(item["id"])
+
+    def test_export_invalid_cursor(self):
+        """Test qu'un curseur invalide est refusé avant le début du flux."""
+        response = TestClient(app).get("/api/v1/extractions/export", params={"cursor": "abc"})
+
+        assert response.status_code == 400
@@ -4,14 +4,18 @@ Tests d'intégration pour l'API Routes (routes.py).
 Teste les endpoints HTTP avec TestClient FastAPI.
 """
 
+import json
+import zipfile
 from io import BytesIO
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, patch
 
 import pytest
 from fastapi.testclient import TestClient
 
 from app.main import app
 from app.models.schemas import InvoiceData
+from app.services.ocr_pipeline import ExtractionResult
+from app.services.preprocessing import PreparedDocument
 
 
 @pytest.fixture
@@ -28,21 +32,34 @@ class TestHealthEndpoint:
         """Test que /health retourne status ok."""
         response = client.get("/health")
         assert response.status_code == 200
-        assert response.json() == {"status": "ok"}
+        assert response.json() == {"status": "ok", "circuit_breakers": {}}
+
+    def test_health_reports_open_breaker(self, client, settings):
+        """Test que /health signale un disjoncteur ouvert (service dégradé)."""
+        from app.services.resilience import get_circuit_breaker
+
+        breaker = get_circuit_breaker("gpt-4o", settings)
+        for _ in range(settings.circuit_failure_threshold):
+            breaker.record_failure()
+
+        body = client.get("/health").json()
+
+        assert body["status"] == "degraded"
+        assert body["circuit_breakers"]["gpt-4o"]["state"] == "open"
 
 
 @pytest.mark.integration
 class TestExtractEndpoint:
     """Tests pour l'endpoint POST /api/v1/extract."""
 
-    @patch('app.api.routes._file_to_image_base64')
-    @patch('app.api.routes.run_extraction_pipeline')
-    def test_extract_with_valid_pdf(self, mock_pipeline, mock_file_to_image, client, sample_invoice_data):
+    @patch('app.services.extraction_service.prepare_document')
+    @patch('app.services.extraction_service.run_extraction_pipeline', new_callable=AsyncMock)
+    def test_extract_with_valid_pdf(self, mock_pipeline, mock_file_to_image, client, prepared_image, sample_invoice_data):
         """Test extraction avec PDF valide."""
         # Mock la conversion fichier -> image
-        mock_file_to_image.return_value = "base64imagedata"
+        mock_file_to_image.return_value = PreparedDocument(images=[prepared_image])
         # Mock le pipeline
-        mock_pipeline.return_value = MagicMock(
+        mock_pipeline.return_value = ExtractionResult(
             data=sample_invoice_data,
             needs_human_review=False,
             error_message=None,
@@ -78,14 +95,36 @@ class TestExtractEndpoint:
         # Peut être 400 car fichier vide ou parce que pdf2image échoue
         assert response.status_code in [400, 422]
 
-    @patch('app.api.routes._file_to_image_base64')
-    @patch('app.api.routes.run_extraction_pipeline')
-    def test_extract_with_human_review_needed(self, mock_pipeline, mock_file_to_image, client):
+    def test_extract_rejects_invalid_request_timeout(self, client):
+        """Test qu'un en-tête X-Request-Timeout invalide est refusé (400)."""
+        files = {"file": ("facture.pdf", BytesIO(b"%PDF-1.4\n%test"), "application/pdf")}
+
+        response = client.post("/api/v1/extract", files=files, headers={"X-Request-Timeout": "soon"})
+
+        assert response.status_code == 400
+        assert "X-Request-Timeout" in response.json()["detail"]
+
+    @patch('app.services.extraction_service.prepare_document')
+    @patch('app.services.extraction_service.run_extraction_pipeline', new_callable=AsyncMock)
+    def test_extract_passes_request_deadline(self, mock_pipeline, mock_file_to_image, client, prepared_image, sample_invoice_data):
+        """Test que le budget de l'en-tête X-Request-Timeout est propagé au pipeline."""
+        mock_file_to_image.return_value = PreparedDocument(images=[prepared_image])
+        mock_pipeline.return_value = ExtractionResult(data=sample_invoice_data)
+        files = {"file": ("facture.pdf", BytesIO(b"%PDF-1.4\n%deadline"), "application/pdf")}
+
+        response = client.post("/api/v1/extract", files=files, headers={"X-Request-Timeout": "30"})
+
+        assert response.status_code == 200
+        assert mock_pipeline.call_args.kwargs["deadline"].budget_s == 30
+
+    @patch('app.services.extraction_service.prepare_document')
+    @patch('app.services.extraction_service.run_extraction_pipeline', new_callable=AsyncMock)
+    def test_extract_with_human_review_needed(self, mock_pipeline, mock_file_to_image, client, prepared_image):
         """Test extraction nécessitant revue manuelle."""
         # Mock la conversion fichier -> image
-        mock_file_to_image.return_value = "base64imagedata"
+        mock_file_to_image.return_value = PreparedDocument(images=[prepared_image])
         # Mock le pipeline
-        mock_pipeline.return_value = MagicMock(
+        mock_pipeline.return_value = ExtractionResult(
             data=None,
             needs_human_review=True,
             error_message="HT + TVA != TTC",
@@ -101,3 +140,134 @@ class TestExtractEndpoint:
         assert data["needs_human_review"] is True
         assert data["data"] is None
         assert "HT + TVA != TTC" in data["error_message"]
+
+    @patch('app.services.extraction_service.prepare_document')
+    @patch('app.services.extraction_service.run_extraction_pipeline', new_callable=AsyncMock)
+    def test_extract_same_file_served_from_cache(self, mock_pipeline, mock_file_to_image, client, prepared_image, sample_invoice_data):
+        """Test qu'un fichier déjà traité est servi depuis le cache sans rappeler le pipeline."""
+        mock_file_to_image.return_value = PreparedDocument(images=[prepared_image])
+        mock_pipeline.return_value = ExtractionResult(data=sample_invoice_data)
+
+        pdf_content = b"%PDF-1.4\n%cached pdf content"
+        for _ in range(2):
+            files = {"file": ("facture.pdf", BytesIO(pdf_content), "application/pdf")}
+            response = client.post("/api/v1/extract", files=files)
+            assert response.status_code == 200
+            assert response.json()["data"]["fournisseur"] == "Entreprise Test SARL"
+
+        assert mock_pipeline.call_count == 1
+        assert mock_file_to_image.call_count == 1
+
+
+def _parse_ndjson(response) -> list[dict]:
+    """Décode une réponse NDJSON en liste d'objets triés par index."""
+    items = [json.loads(line) for line in response.text.splitlines() if line.strip()]
+    return sorted(items, key=lambda item: item["index"])
+
+
+@pytest.mark.integration
+class TestExtractBatchEndpoint:
+    """Tests pour l'endpoint POST /api/v1/extract/batch."""
+
+    @patch('app.services.extraction_service.prepare_document')
+    @patch('app.services.extraction_service.run_extraction_pipeline', new_callable=AsyncMock)
+    def test_batch_streams_one_line_per_file(self, mock_pipeline, mock_prepare, client, sample_invoice_data, prepared_image):
+        """Test qu'un lot renvoie une ligne NDJSON par fichier avec son statut."""
+        mock_prepare.return_value = PreparedDocument(images=[prepared_image])
+        mock_pipeline.side_effect = [
+            ExtractionResult(data=sample_invoice_data),
+            ExtractionResult(data=None, needs_human_review=True, error_message="HT + TVA != TTC"),
+        ]
+        files = [
+            ("files", ("f1.pdf", BytesIO(b"%PDF-1.4 one"), "application/pdf")),
+            ("files", ("f2.pdf", BytesIO(b"%PDF-1.4 two"), "application/pdf")),
+            ("files", ("notes.txt", BytesIO(b"texte"), "text/plain")),
+        ]
+
+        response = client.post("/api/v1/extract/batch", files=files)
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        items = _parse_ndjson(response)
+        assert [item["filename"] for item in items] == ["f1.pdf", "f2.pdf", "notes.txt"]
+        assert sorted(item["status"] for item in items[:2]) == ["ok", "review"]
+        assert items[2]["status"] == "error"
+        assert "non supporté" in items[2]["error_message"]
+
+    @patch('app.services.extraction_service.prepare_document')
+    @patch('app.services.extraction_service.run_extraction_pipeline', new_callable=AsyncMock)
+    def test_batch_expands_zip(self, mock_pipeline, mock_prepare, client, sample_invoice_data, prepared_image):
+        """Test qu'une archive zip est développée (fichiers cachés ignorés)."""
+        mock_prepare.return_value = PreparedDocument(images=[prepared_image])
+        mock_pipeline.return_value = ExtractionResult(data=sample_invoice_data)
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, "w") as zf:
+            zf.writestr("mars/facture1.pdf", b"%PDF-1.4 a")
+            zf.writestr("mars/facture2.png", b"\x89PNG b")
+            zf.writestr("__MACOSX/._facture1.pdf", b"meta")
+        archive.seek(0)
+
+        response = client.post(
+            "/api/v1/extract/batch",
+            files=[("files", ("lot.zip", archive, "application/zip"))],
+        )
+
+        items = _parse_ndjson(response)
+        assert [item["filename"] for item in items] == ["mars/facture1.pdf", "mars/facture2.png"]
+        assert all(item["status"] == "ok" for item in items)
+        assert mock_pipeline.call_count == 2
+
+    def test_batch_rejects_invalid_zip(self, client):
+        """Test rejet d'une archive zip corrompue avant tout traitement."""
+        response = client.post(
+            "/api/v1/extract/batch",
+            files=[("files", ("lot.zip", BytesIO(b"pas un zip"), "application/zip"))],
+        )
+
+        assert response.status_code == 400
+
+
+@pytest.mark.integration
+class TestJobsEndpoint:
+    """Tests pour l'API asynchrone POST /api/v1/jobs et GET /api/v1/jobs/{job_id}."""
+
+    def test_submit_job_returns_queued_job(self, client, job_store):
+        """Test que la soumission répond 202 avec un job en file, sans lancer l'extraction."""
+        files = {"file": ("facture.pdf", BytesIO(b"%PDF-1.4 test"), "application/pdf")}
+
+        response = client.post("/api/v1/jobs", files=files)
+
+        assert response.status_code == 202
+        body = response.json()
+        assert body["status"] == "queued"
+        assert body["filename"] == "facture.pdf"
+        assert job_store.stats()["queue_depth"] == 1
+
+    def test_get_job_returns_result_when_done(self, client, job_store):
+        """Test que GET /jobs/{id} renvoie le résultat une fois le job terminé."""
+        job = job_store.submit(b"%PDF-1.4 test", "application/pdf", "facture.pdf")
+        job_store.lease("worker-1", lease_s=60)
+        job_store.complete(job.id, "worker-1", {"data": None, "needs_human_review": True, "error_message": "Échec"})
+
+        response = client.get(f"/api/v1/jobs/{job.id}")
+
+        assert response.status_code == 200
+        body = response.json()
+        assert body["status"] == "done"
+        assert body["result"]["needs_human_review"] is True
+        assert body["wait_ms"] is not None
+        assert body["service_ms"] is not None
+
+    def test_get_unknown_job_returns_404(self, client):
+        """Test qu'un identifiant inconnu renvoie 404."""
+        response = client.get("/api/v1/jobs/inconnu")
+
+        assert response.status_code == 404
+
+    def test_submit_job_rejects_invalid_file_type(self, client):
+        """Test rejection d'un type de fichier invalide à la soumission."""
+        files = {"file": ("document.txt", BytesIO(b"text content"), "text/plain")}
+
+        response = client.post("/api/v1/jobs", files=files)
+
+        assert response.status_code == 400
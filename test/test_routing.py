@@ -0,0 +1,165 @@
+"""
+Tests unitaires pour le routage prédictif du modèle de départ (routing.py).
+"""
+
+import json
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from app.services.routing import ModelRouter, RouteFeatures, supplier_hash, text_supplier_candidates
+
+
+def _record(final_model, *, success=True, supplier=None, input_mode="vision", page_count=1, bytes_in=50_000):
+    """Enregistrement KPI minimal d'une extraction démarrée sur le modèle light."""
+    return {
+        "llm_call_count": 1 if final_model == "gpt-4o-mini" else 3,
+        "final_model_used": final_model,
+        "success": success,
+        "input_mode": input_mode,
+        "page_count": page_count,
+        "image_bytes_in": bytes_in,
+        "supplier_hash": supplier_hash(supplier) if supplier else None,
+    }
+
+
+@pytest.mark.unit
+class TestSupplierFeatures:
+    """Tests pour les empreintes fournisseur."""
+
+    def test_supplier_hash_is_normalized(self):
+        """Test que casse et ponctuation n'influencent pas l'empreinte."""
+        assert supplier_hash("NSIA Assurances") == supplier_hash("nsia  assurances.")
+        assert supplier_hash("") is None
+
+    def test_text_candidates_include_header_column(self):
+        """Test que le nom du fournisseur, colonne de l'en-tête pdftotext, est reconnu."""
+        text = "--- Page 1 ---\nNSIA Assurances          FACTURE N° 12\nCotonou, Bénin\n"
+
+        assert supplier_hash("NSIA ASSURANCES") in text_supplier_candidates(text)
+        assert text_supplier_candidates(None) == []
+
+
+@pytest.mark.unit
+class TestModelRouter:
+    """Tests pour ModelRouter (apprentissage et décision)."""
+
+    def test_no_history_starts_light(self, settings, tmp_path):
+        """Test qu'un historique vide ne détourne rien vers le modèle lourd."""
+        router = ModelRouter(tmp_path / "kpi.jsonl", settings)
+
+        decision = router.decide(RouteFeatures(input_mode="vision", page_count=1, bytes_in=50_000))
+
+        assert decision.start_model == settings.llm_model_light
+        assert decision.p_hard is None
+
+    def test_hard_supplier_starts_heavy(self, settings, tmp_path):
+        """Test qu'un fournisseur toujours escaladé démarre directement sur le modèle lourd."""
+        settings.routing_min_samples = 5
+        settings.routing_exploration_rate = 0.0
+        router = ModelRouter(tmp_path / "kpi.jsonl", settings)
+        router.fit(
+            [_record("gpt-4o", supplier="NSIA Assurances", input_mode="text") for _ in range(8)]
+            + [_record("gpt-4o-mini", input_mode="text") for _ in range(30)]
+        )
+        text = "NSIA Assurances          FACTURE\n"
+
+        decision = router.decide(
+            RouteFeatures(input_mode="text", page_count=1, bytes_in=50_000, supplier_hashes=text_supplier_candidates(text))
+        )
+        easy = router.decide(RouteFeatures(input_mode="text", page_count=1, bytes_in=50_000))
+
+        assert decision.start_heavy is True
+        assert decision.basis == "supplier"
+        assert easy.start_heavy is False
+
+    def test_hard_document_shape_starts_heavy(self, settings, tmp_path):
+        """Test que les scans multi-pages volumineux, souvent escaladés, démarrent sur le modèle lourd."""
+        settings.routing_min_samples = 5
+        settings.routing_exploration_rate = 0.0
+        router = ModelRouter(tmp_path / "kpi.jsonl", settings)
+        router.fit([_record("gpt-4o", page_count=8, bytes_in=3_000_000) for _ in range(10)])
+
+        decision = router.decide(RouteFeatures(input_mode="vision", page_count=12, bytes_in=2_500_000))
+
+        assert decision.start_model == settings.llm_model_heavy
+        assert decision.basis == "mode_pages_size"
+
+    def test_exploration_keeps_light(self, settings, tmp_path):
+        """Test que l'exploration envoie un document prédit difficile au modèle light."""
+        settings.routing_min_samples = 5
+        settings.routing_exploration_rate = 1.0
+        router = ModelRouter(tmp_path / "kpi.jsonl", settings)
+        router.fit([_record("gpt-4o") for _ in range(10)])
+
+        decision = router.decide(RouteFeatures(input_mode="vision", page_count=1, bytes_in=50_000))
+
+        assert decision.predicted_hard is True
+        assert decision.explored is True
+        assert decision.start_model == settings.llm_model_light
+
+    def test_heavy_routed_records_ignored(self, settings, tmp_path):
+        """Test que les extractions démarrées sur le modèle lourd n'alimentent pas l'apprentissage."""
+        router = ModelRouter(tmp_path / "kpi.jsonl", settings)
+        record = dict(_record("gpt-4o"), route_start_model=settings.llm_model_heavy)
+
+        router.fit([record, dict(_record("gpt-4o-mini"), cache_hit=True)])
+
+        assert router.stats()["samples"] == 0
+
+    def test_learns_from_kpi_file(self, settings, tmp_path):
+        """Test de l'apprentissage à partir du fichier kpi.jsonl."""
+        settings.routing_min_samples = 3
+        kpi_file = tmp_path / "kpi.jsonl"
+        kpi_file.write_text("".join(json.dumps(_record("gpt-4o-mini")) + "\n" for _ in range(4)))
+        router = ModelRouter(kpi_file, settings)
+
+        with patch("app.services.routing.random.random", return_value=1.0):
+            decision = router.decide(RouteFeatures(input_mode="vision", page_count=1, bytes_in=50_000))
+
+        assert router.stats()["samples"] == 4
+        assert decision.p_hard == pytest.approx(1 / 6, abs=1e-3)
+        assert decision.start_heavy is False
+
+    def test_refresh_reads_only_appended_lines(self, settings, tmp_path):
+        """Test que le réapprentissage n'analyse que les lignes ajoutées, dans une fenêtre glissante."""
+        settings.routing_refresh_s = 0.0
+        settings.routing_history_max = 5
+        kpi_file = tmp_path / "kpi.jsonl"
+        kpi_file.write_text("".join(json.dumps(_record("gpt-4o-mini")) + "\n" for _ in range(3)))
+        router = ModelRouter(kpi_file, settings)
+        router.refresh_if_stale()
+
+        with open(kpi_file, "a") as f:
+            f.write("".join(json.dumps(_record("gpt-4o")) + "\n" for _ in range(4)))
+            f.write(json.dumps(_record("gpt-4o"))[:20])  # ligne en cours d'écriture
+        with patch("app.services.routing.json.loads", wraps=json.loads) as loads:
+            router.refresh_if_stale()
+
+        assert loads.call_count == 4
+        assert router.stats()["samples"] == 5
+        assert router._counts[("mode", "vision")] == [5, 4]
+
+    def test_concurrent_refresh_is_single_flight(self, settings, tmp_path):
+        """Test qu'un seul thread relit l'historique quand plusieurs requêtes le trouvent périmé."""
+        settings.routing_refresh_s = 0.0
+        router = ModelRouter(tmp_path / "kpi.jsonl", settings)
+        started, release = threading.Event(), threading.Event()
+        reads = []
+
+        def slow_read():
+            reads.append(1)
+            started.set()
+            release.wait(5)
+            return []
+
+        with patch.object(router, "_read_new_records", side_effect=slow_read):
+            refresher = threading.Thread(target=router.refresh_if_stale)
+            refresher.start()
+            started.wait(5)
+            router.refresh_if_stale()
+            release.set()
+            refresher.join(5)
+
+        assert reads == [1]
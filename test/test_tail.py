@@ -0,0 +1,45 @@
+"""
+Tests unitaires pour le suivi incrémental des fichiers JSON Lines (tail.py).
+"""
+
+import os
+
+import pytest
+
+from app.monitoring.tail import JsonlTail
+
+
+@pytest.mark.unit
+class TestJsonlTail:
+    """Tests pour JsonlTail (offset, ligne partielle, rotation)."""
+
+    def test_only_new_complete_lines_returned(self, tmp_path):
+        """Test que chaque lecture ne renvoie que les lignes complètes ajoutées depuis la précédente."""
+        path = tmp_path / "kpi.jsonl"
+        tail = JsonlTail(path)
+        assert list(tail.read_new()) == []
+
+        path.write_bytes(b'{"a": 1}\n\n{"a": 2')
+        assert list(tail.read_new()) == [b'{"a": 1}\n']
+
+        with open(path, "ab") as f:
+            f.write(b'}\n{"a": 3}\n')
+        assert list(tail.read_new()) == [b'{"a": 2}\n', b'{"a": 3}\n']
+        assert list(tail.read_new()) == []
+
+    def test_replaced_or_truncated_file_reread(self, tmp_path):
+        """Test qu'un fichier tronqué ou remplacé est relu depuis le début, après on_reset."""
+        path = tmp_path / "kpi.jsonl"
+        resets = []
+        tail = JsonlTail(path, on_reset=lambda: resets.append(True))
+        path.write_bytes(b'{"a": 1}\n{"a": 2}\n')
+        list(tail.read_new())
+
+        path.write_bytes(b'{"b": 1}\n')
+        assert list(tail.read_new()) == [b'{"b": 1}\n']
+
+        rotated = tmp_path / "kpi.jsonl.new"
+        rotated.write_bytes(b'{"c": 1}\n{"c": 2}\n{"c": 3}\n')
+        os.replace(rotated, path)
+        assert len(list(tail.read_new())) == 3
+        assert len(resets) == 2
@@ -0,0 +1,221 @@
+"""
+Tests unitaires pour le traçage des extractions (tracing.py) et le rendu waterfall (analyze_traces.py).
+"""
+
+import asyncio
+import json
+import time
+from io import BytesIO
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+import analyze_traces
+from app.main import app
+from app.monitoring.tracing import Tracer, current_trace_id, parse_traceparent
+from app.services.ocr_pipeline import ExtractionResult
+from app.services.preprocessing import PreparedDocument
+
+REMOTE_TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+REMOTE_TRACEPARENT = f"00-{REMOTE_TRACE_ID}-00f067aa0ba902b7-01"
+
+
+def _exported_spans(trace_file):
+    """Spans de chaque trace exportée (une ligne OTLP/JSON par trace)."""
+    lines = trace_file.read_text().splitlines() if trace_file.exists() else []
+    return [json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"] for line in lines]
+
+
+@pytest.mark.unit
+class TestTracer:
+    """Tests pour les spans, l'échantillonnage et l'export."""
+
+    def test_nested_spans_exported_as_one_trace(self, tmp_path):
+        """Test que les spans imbriqués sont exportés ensemble, reliés à leur parent."""
+        tracer = Tracer(trace_file=tmp_path / "traces.jsonl")
+
+        with tracer.start_span("root", request_id="req-1") as root:
+            with tracer.start_span("child", model="gpt-4o-mini"):
+                assert current_trace_id() == root.trace_id
+
+        (spans,) = _exported_spans(tmp_path / "traces.jsonl")
+        by_name = {span["name"]: span for span in spans}
+        assert by_name["child"]["parentSpanId"] == by_name["root"]["spanId"]
+        assert by_name["root"]["parentSpanId"] == ""
+        assert {"key": "request.id", "value": {"stringValue": "req-1"}} in by_name["root"]["attributes"]
+        assert {"key": "model", "value": {"stringValue": "gpt-4o-mini"}} in by_name["child"]["attributes"]
+        assert current_trace_id() is None
+
+    def test_incoming_traceparent_is_continued(self, tmp_path):
+        """Test que le traceparent entrant impose trace_id, parent et décision d'échantillonnage."""
+        tracer = Tracer(sample_rate=0.0, trace_file=tmp_path / "traces.jsonl")
+
+        with tracer.start_span("root", traceparent=REMOTE_TRACEPARENT) as root:
+            pass
+
+        assert root.trace_id == REMOTE_TRACE_ID
+        assert root.traceparent.startswith(f"00-{REMOTE_TRACE_ID}-")
+        (spans,) = _exported_spans(tmp_path / "traces.jsonl")
+        assert spans[0]["parentSpanId"] == "00f067aa0ba902b7"
+
+    def test_invalid_traceparent_ignored(self):
+        """Test qu'un traceparent malformé ou nul est ignoré."""
+        assert parse_traceparent("n'importe quoi") is None
+        assert parse_traceparent(f"00-{'0' * 32}-00f067aa0ba902b7-01") is None
+        assert parse_traceparent(REMOTE_TRACEPARENT) == (REMOTE_TRACE_ID, "00f067aa0ba902b7", True)
+
+    def test_unsampled_trace_dropped_unless_slow_or_failed(self, tmp_path):
+        """Test qu'une trace non échantillonnée n'est exportée que si elle est lente ou en erreur."""
+        trace_file = tmp_path / "traces.jsonl"
+        tracer = Tracer(sample_rate=0.0, slow_ms=50, trace_file=trace_file)
+
+        with tracer.start_span("fast"):
+            pass
+        with tracer.start_span("slow"):
+            time.sleep(0.06)
+        with pytest.raises(ValueError):
+            with tracer.start_span("failed"):
+                raise ValueError("JSON invalide")
+
+        names = [spans[0]["name"] for spans in _exported_spans(trace_file)]
+        assert names == ["slow", "failed"]
+        assert tracer.stats()["dropped"] == 1
+        failed = _exported_spans(trace_file)[1][0]
+        assert failed["status"] == {"code": 2, "message": "ValueError: JSON invalide"}
+
+    def test_disabled_tracer_exports_nothing(self, tmp_path):
+        """Test que le traçage désactivé ne produit ni span ni fichier."""
+        tracer = Tracer(enabled=False, trace_file=tmp_path / "traces.jsonl")
+
+        with tracer.start_span("root") as span:
+            span.set_attribute("model", "gpt-4o")
+            assert current_trace_id() is None
+
+        assert not (tmp_path / "traces.jsonl").exists()
+
+    def test_rotation_by_size(self, tmp_path):
+        """Test que le fichier de traces tourne une fois max_bytes atteint, en gardant backup_count fichiers."""
+        trace_file = tmp_path / "traces.jsonl"
+        tracer = Tracer(trace_file=trace_file, max_bytes=1, backup_count=2)
+
+        for index in range(4):
+            with tracer.start_span(f"trace-{index}"):
+                pass
+
+        assert [spans[0]["name"] for spans in _exported_spans(trace_file)] == ["trace-3"]
+        assert json.loads((tmp_path / "traces.jsonl.1").read_text())  # trace-2
+        assert (tmp_path / "traces.jsonl.2").exists()
+        assert not (tmp_path / "traces.jsonl.3").exists()
+        assert tracer.stats()["rotations"] == 3
+
+    def test_child_tasks_share_the_trace(self, tmp_path):
+        """Test que les tâches asyncio lancées dans un span (hedging) y rattachent leurs spans."""
+        tracer = Tracer(trace_file=tmp_path / "traces.jsonl")
+
+        async def call(model):
+            with tracer.start_span("llm", model=model):
+                await asyncio.sleep(0)
+
+        async def scenario():
+            with tracer.start_span("pipeline") as root:
+                await asyncio.gather(call("gpt-4o-mini"), call("gpt-4o"))
+            return root
+
+        root = asyncio.run(scenario())
+
+        (spans,) = _exported_spans(tmp_path / "traces.jsonl")
+        assert [span["parentSpanId"] for span in spans if span["name"] == "llm"] == [root.span_id] * 2
+
+
+@pytest.mark.integration
+class TestRequestTracing:
+    """Tests pour la propagation des identifiants par l'API."""
+
+    def test_request_id_echoed_and_trace_exported(self, tracer):
+        """Test que X-Request-ID est renvoyé avec un traceparent de la même trace."""
+        response = TestClient(app).get("/api/v1/kpi", headers={"X-Request-ID": "client-42"})
+
+        assert response.headers["X-Request-ID"] == "client-42"
+        (spans,) = _exported_spans(tracer.trace_file)
+        assert spans[0]["name"] == "GET /api/v1/kpi"
+        assert response.headers["traceparent"] == f"00-{spans[0]['traceId']}-{spans[0]['spanId']}-01"
+
+    @patch("app.services.extraction_service.prepare_document")
+    @patch("app.services.extraction_service.run_extraction_pipeline", new_callable=AsyncMock)
+    def test_extraction_spans(self, mock_pipeline, mock_prepare, tracer, prepared_image, sample_invoice_data):
+        """Test que l'extraction produit les spans conversion et cascade sous la requête entrante."""
+        mock_prepare.return_value = PreparedDocument(images=[prepared_image])
+        mock_pipeline.return_value = ExtractionResult(data=sample_invoice_data, needs_human_review=False)
+        files = {"file": ("facture.png", BytesIO(b"\x89PNG fake"), "image/png")}
+
+        response = TestClient(app).post("/api/v1/extract", files=files, headers={"traceparent": REMOTE_TRACEPARENT})
+
+        assert response.status_code == 200
+        (spans,) = _exported_spans(tracer.trace_file)
+        parents = {span["name"]: span["parentSpanId"] for span in spans}
+        ids = {span["name"]: span["spanId"] for span in spans}
+        assert {span["traceId"] for span in spans} == {REMOTE_TRACE_ID}
+        assert parents["extract_document"] == ids["POST /api/v1/extract"]
+        assert parents["convert"] == ids["extract_document"]
+        assert parents["run_extraction_pipeline"] == ids["extract_document"]
+
+    @patch("app.services.extraction_service.prepare_document")
+    @patch("app.services.extraction_service.run_extraction_pipeline", new_callable=AsyncMock)
+    def test_streamed_batch_spans_exported(self, mock_pipeline, mock_prepare, tracer, prepared_image, sample_invoice_data):
+        """Test que les spans ouverts pendant le flux /extract/batch sont exportés avec la trace de la requête."""
+        mock_prepare.return_value = PreparedDocument(images=[prepared_image])
+        mock_pipeline.return_value = ExtractionResult(data=sample_invoice_data, needs_human_review=False)
+        files = [
+            ("files", ("f1.png", BytesIO(b"\x89PNG one"), "image/png")),
+            ("files", ("f2.png", BytesIO(b"\x89PNG two"), "image/png")),
+        ]
+
+        response = TestClient(app).post("/api/v1/extract/batch", files=files)
+
+        assert response.status_code == 200
+        (spans,) = _exported_spans(tracer.trace_file)
+        names = [span["name"] for span in spans]
+        root = next(span for span in spans if span["name"] == "POST /api/v1/extract/batch")
+        assert names.count("extract_document") == 2
+        assert names.count("run_extraction_pipeline") == 2
+        assert response.headers["traceparent"] == f"00-{root['traceId']}-{root['spanId']}-01"
+        assert max(int(span["endTimeUnixNano"]) for span in spans) <= int(root["endTimeUnixNano"])
+
+
+@pytest.mark.unit
+class TestWaterfall:
+    """Tests pour analyze_traces.py (traces les plus lentes, rendu en cascade)."""
+
+    def test_slowest_traces_across_rotated_files(self, tmp_path):
+        """Test que les traces les plus lentes sont trouvées dans le fichier courant et les fichiers tournés."""
+        trace_file = tmp_path / "traces.jsonl"
+        tracer = Tracer(trace_file=trace_file, max_bytes=1, backup_count=5)
+        for delay in (0.0, 0.03, 0.0, 0.01):
+            with tracer.start_span(f"trace-{delay}"):
+                time.sleep(delay)
+
+        files = analyze_traces.trace_files(trace_file)
+        slowest = analyze_traces.slowest_traces(files, top=2)
+
+        assert len(files) == 4
+        assert [spans[0]["name"] for _, spans in slowest] == ["trace-0.03", "trace-0.01"]
+
+    def test_render_waterfall(self, tmp_path):
+        """Test que le rendu indente les enfants sous leur parent avec une barre par span."""
+        tracer = Tracer(trace_file=tmp_path / "traces.jsonl")
+        with tracer.start_span("POST /api/v1/extract", request_id="req-7"):
+            with tracer.start_span("convert"):
+                time.sleep(0.01)
+            with tracer.start_span("extract_invoice_from_image", model="gpt-4o"):
+                time.sleep(0.02)
+
+        (spans,) = _exported_spans(tmp_path / "traces.jsonl")
+        text = analyze_traces.render_waterfall(spans, width=20)
+
+        lines = text.splitlines()
+        assert "request_id=req-7" in lines[0]
+        assert lines[1].strip().startswith("POST /api/v1/extract")
+        assert lines[2].startswith("    convert")
+        assert "model=gpt-4o" in lines[3]
+        assert "|####################|" in lines[1]
@@ -0,0 +1,120 @@
+"""
+Tests unitaires pour l'écrivain des journaux en arrière-plan (writer.py).
+"""
+
+import threading
+import time
+
+import pytest
+
+from app.monitoring.writer import FSYNC_ALWAYS, BatchingWriter, RecordWriter
+
+
+@pytest.mark.unit
+class TestRecordWriter:
+    """Tests pour RecordWriter."""
+
+    def test_background_lines_written_on_flush(self, tmp_path):
+        """Test que les lignes déposées sont écrites par lot au flush."""
+        path = tmp_path / "kpi.jsonl"
+        writer = RecordWriter(batch_size=1000, flush_interval_s=60)
+        try:
+            for i in range(10):
+                writer.write(path, f'{{"i": {i}}}')
+            assert writer.flush() is True
+            assert path.read_text().splitlines() == [f'{{"i": {i}}}' for i in range(10)]
+            assert writer.stats()["batches"] == 1
+        finally:
+            writer.close()
+
+    def test_batch_written_after_interval(self, tmp_path):
+        """Test qu'un lot incomplet est écrit une fois l'intervalle de flush écoulé."""
+        path = tmp_path / "kpi.jsonl"
+        writer = RecordWriter(batch_size=1000, flush_interval_s=0.01)
+        try:
+            writer.write(path, "ligne")
+            time.sleep(0.2)
+            assert path.read_text() == "ligne\n"
+        finally:
+            writer.close()
+
+    def test_close_drains_queue(self, tmp_path):
+        """Test que l'arrêt écrit toutes les lignes encore en file."""
+        path = tmp_path / "extractions.csv"
+        writer = RecordWriter(batch_size=1000, flush_interval_s=60, fsync=FSYNC_ALWAYS)
+        for i in range(100):
+            writer.write(path, str(i), header="i")
+
+        writer.close()
+
+        assert path.read_text().splitlines() == ["i"] + [str(i) for i in range(100)]
+
+    def test_header_written_once(self, tmp_path):
+        """Test que l'en-tête n'est écrit que dans un fichier vide."""
+        path = tmp_path / "extractions.csv"
+        writer = RecordWriter(background=False)
+        writer.write(path, "1,a", header="id,nom")
+        writer.write(path, "2,b", header="id,nom")
+        writer.close()
+
+        assert path.read_text().splitlines() == ["id,nom", "1,a", "2,b"]
+
+    def test_full_queue_falls_back_to_direct_write(self, tmp_path):
+        """Test qu'une file pleine n'entraîne aucune perte : la ligne est écrite par l'appelant."""
+        path = tmp_path / "kpi.jsonl"
+        writer = RecordWriter(queue_size=1, batch_size=1000, flush_interval_s=60)
+        try:
+            for i in range(20):
+                writer.write(path, str(i))
+        finally:
+            writer.close()
+
+        assert sorted(int(line) for line in path.read_text().splitlines()) == list(range(20))
+        assert writer.stats()["overflow_writes"] > 0
+
+    def test_concurrent_writers_do_not_interleave(self, tmp_path):
+        """Test que deux écrivains (deux workers) sur le même fichier n'entrelacent pas leurs lignes."""
+        path = tmp_path / "kpi.jsonl"
+        writers = [RecordWriter(batch_size=50, flush_interval_s=0.01) for _ in range(2)]
+        payload = "x" * 5000
+
+        def produce(writer: RecordWriter, worker: int):
+            for i in range(200):
+                writer.write(path, f"{worker}:{i}:{payload}")
+
+        threads = [threading.Thread(target=produce, args=(w, n)) for n, w in enumerate(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for writer in writers:
+            writer.close()
+
+        lines = path.read_text().splitlines()
+        assert len(lines) == 400
+        assert all(line.endswith(payload) and line.count(":") == 2 for line in lines)
+
+    def test_file_reopened_after_removal(self, tmp_path):
+        """Test qu'un journal supprimé (rotation) est recréé à l'écriture suivante."""
+        path = tmp_path / "kpi.jsonl"
+        writer = RecordWriter(background=False)
+        writer.write(path, "avant")
+        path.unlink()
+        writer.write(path, "après")
+        writer.close()
+
+        assert path.read_text() == "après\n"
+
+    def test_unknown_fsync_policy_rejected(self):
+        """Test qu'une politique de fsync inconnue est refusée."""
+        with pytest.raises(ValueError):
+            RecordWriter(background=False, fsync="sometimes")
+
+    def test_subclass_without_write_batch_rejected(self):
+        """Test qu'un écrivain par lots sans _write_batch échoue dès son instanciation."""
+
+        class IncompleteWriter(BatchingWriter):
+            pass
+
+        with pytest.raises(TypeError):
+            IncompleteWriter(background=False, queue_size=1, batch_size=1, flush_interval_s=1)